@@ -21,12 +21,24 @@ This includes:
 * a circuit drawing engine (which can be used anywhere within the compilation
   chain)
 * a simulator with emulation capabilities
+* a stabilizer simulator for (large) Clifford circuits
+* a matrix-product-state simulator for (wide) circuits with low entanglement
+* a density-matrix simulator which evaluates noise channels exactly
+* a sparse simulator for (wide) circuits with few nonzero amplitudes
+* a simulator which computes gradients of expectation values (adjoint method)
+* a simulator which runs a compiled, parameterized circuit for many parameter
+  values
+* a simulator which simulates a batch of circuit instances at once
+* a runner which distributes trajectories of noisy circuits over processes
 * a resource counter (counts gates and keeps track of the maximal width of the
   circuit)
 * an interface to the IBM Quantum Experience chip (and simulator).
 """
 from ._printer import CommandPrinter
 from ._circuits import CircuitDrawer
-from ._sim import Simulator, ClassicalSimulator
+from ._sim import (Simulator, ClassicalSimulator, StabilizerSimulator,
+                   MPSSimulator, DensityMatrixSimulator, SparseSimulator,
+                   AdjointSimulator, ParametricSimulator, BatchedSimulator,
+                   run_trajectories, TrajectoryResult)
 from ._resource import ResourceCounter
 from ._ibm import IBMBackend
@@ -14,3 +14,11 @@
 
 from ._simulator import Simulator
 from ._classical_simulator import ClassicalSimulator
+from ._stabilizer_simulator import StabilizerSimulator
+from ._mps_simulator import MPSSimulator
+from ._density_matrix_simulator import DensityMatrixSimulator
+from ._sparse_simulator import SparseSimulator
+from ._adjoint_simulator import AdjointSimulator
+from ._parametric_simulator import ParametricSimulator
+from ._batched_simulator import BatchedSimulator
+from ._trajectories import run_trajectories, TrajectoryResult
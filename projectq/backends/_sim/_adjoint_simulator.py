@@ -0,0 +1,316 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Contains a simulator which computes the gradient of an expectation value
+w.r.t. the angles of all rotation gates (and the times of all TimeEvolution
+gates) of a circuit using the adjoint method.
+"""
+
+import random
+
+import numpy
+
+from projectq.ops import (AllocateQubitGate, DeallocateQubitGate, FlushGate,
+                          Ph, QubitOperator, R, Rx, Ry, Rz, TimeEvolution)
+from ._simulator import Simulator
+
+
+def _get_generator(gate):
+    """
+    Return the generator G of a parameterized gate U(theta) = exp(-i theta G)
+    as a QubitOperator acting on qubit 0, or None if the gate has no
+    parameter.
+    """
+    if isinstance(gate, Rx):
+        return QubitOperator('X0', .5)
+    if isinstance(gate, Ry):
+        return QubitOperator('Y0', .5)
+    if isinstance(gate, Rz):
+        return QubitOperator('Z0', .5)
+    if isinstance(gate, R):
+        return QubitOperator('Z0', .5) - QubitOperator((), .5)
+    if isinstance(gate, Ph):
+        return QubitOperator((), -1.)
+    return None
+
+
+def _controlled_generator(generator, num_targets, num_controls):
+    """
+    Return the generator of the controlled gate, i.e., the generator (which
+    acts on the qubits 0, ..., num_targets - 1) times the projectors
+    (I - Z) / 2 onto the control qubits num_targets, num_targets + 1, ...
+
+    Returns:
+        List of (term, coefficient) pairs.
+    """
+    for k in range(num_targets, num_targets + num_controls):
+        generator = generator * (QubitOperator((), .5) -
+                                 QubitOperator(((k, 'Z'),), .5))
+    return list(generator.terms.items())
+
+
+def _pauli_matrix_element(bra, ket, term, positions, indices):
+    """
+    Return <bra|P|ket> for the Pauli string P given by term (as in
+    QubitOperator.terms), where the qubit k of the term is located at the bit
+    positions[k] of the state vectors, and indices = arange(len(ket)).
+    """
+    flip = 0
+    parity = numpy.zeros(len(ket), dtype=numpy.uint8)
+    phase = 1.
+    for k, pauli in term:
+        pos = positions[k]
+        if pauli != 'Z':
+            flip |= 1 << pos
+        if pauli != 'X':
+            parity ^= ((indices >> pos) & 1).astype(numpy.uint8)
+        if pauli == 'Y':
+            phase *= 1j
+    # (P ket)[i] = phase * (-1)^parity(j) * ket[j], where j = i ^ flip
+    if flip != 0:
+        source = indices ^ flip
+        image = ket[source] * (1. - 2. * parity[source])
+    else:
+        image = ket * (1. - 2. * parity)
+    return phase * numpy.vdot(bra, image)
+
+
+class AdjointSimulator(Simulator):
+    """
+    Simulator which records the circuit it simulates in order to compute the
+    gradient of the expectation value of an observable w.r.t. all parameters
+    of the circuit, using one backward pass over the recorded gates (the
+    adjoint method) instead of two additional simulations per parameter (as
+    the parameter-shift rule).
+
+    The parameters are the angles of all (controlled) Rx, Ry, Rz, R and Ph
+    gates and the times of all (controlled) TimeEvolution gates, in the
+    order in which the simulator received the gates, see get_gradients. All
+    other gates which are given by their matrix are recorded in order to
+    undo them during the backward pass.
+
+    Example:
+        .. code-block:: python
+
+            sim = AdjointSimulator()
+            eng = MainEngine(sim, [])
+            qureg = eng.allocate_qureg(2)
+            Ry(0.3) | qureg[0]
+            CNOT | (qureg[0], qureg[1])
+            Rz(0.5) | qureg[1]
+            eng.flush()
+            gradients = sim.get_gradients(QubitOperator('X1'), qureg)
+            # [d<X1>/d0.3, d<X1>/d0.5]
+
+    Note:
+        The gradient belongs to the gates which reach the simulator, i.e.,
+        after compilation. Compiler engines may merge or decompose rotation
+        gates (e.g., the LocalOptimizer and the decomposition of controlled
+        rotations), use an empty engine list (or only a mapper) to
+        keep one gradient per gate of the circuit.
+    """
+    def __init__(self, *args, **kwargs):
+        """
+        Construct the simulator (with the arguments of Simulator) and an empty
+        tape of recorded gates.
+        """
+        Simulator.__init__(self, *args, **kwargs)
+        # recorded gates: (gate, matrix, ids, ctrlids, generator), where the
+        # matrix is None for TimeEvolution gates and for gates which cannot
+        # be undone, and generator is None for gates without a parameter
+        self._tape = []
+        self._num_allocated = 0
+
+    def clear_tape(self):
+        """
+        Forget all recorded gates, i.e., the parameters of the gates which
+        follow belong to the next call of get_gradients.
+
+        The tape is cleared automatically once all qubits are deallocated.
+        """
+        self._tape = []
+
+    def get_parameterized_gates(self):
+        """
+        Return the recorded parameterized gates, in the order of the
+        gradients returned by get_gradients.
+        """
+        return [gate for gate, _, _, _, generator in self._tape
+                if generator is not None]
+
+    def _record(self, cmd):
+        """
+        Add the command to the tape (see get_gradients).
+        """
+        gate = cmd.gate
+        if isinstance(gate, FlushGate):
+            return
+        if isinstance(gate, AllocateQubitGate):
+            self._num_allocated += 1
+            return
+        ids = [qb.id for qr in cmd.qubits for qb in qr]
+        ctrlids = [qb.id for qb in cmd.control_qubits]
+        if isinstance(gate, DeallocateQubitGate):
+            self._num_allocated -= 1
+            if self._num_allocated == 0:
+                self._tape = []
+            else:
+                self._tape.append((gate, None, ids, ctrlids, None))
+        elif isinstance(gate, TimeEvolution):
+            generator = _controlled_generator(gate.hamiltonian, len(ids),
+                                              len(ctrlids))
+            self._tape.append((gate, None, ids, ctrlids, generator))
+        else:
+            # (emulated gates, e.g., Swap, are undone using their matrix if
+            # they have one)
+            try:
+                matrix = numpy.asarray(gate.matrix, dtype=complex)
+            except AttributeError:
+                self._tape.append((gate, None, ids, ctrlids, None))
+                return
+            generator = _get_generator(gate)
+            if generator is not None:
+                generator = _controlled_generator(generator, len(ids),
+                                                  len(ctrlids))
+            self._tape.append((gate, matrix, ids, ctrlids, generator))
+
+    def receive(self, command_list):
+        """
+        Record the commands (see get_gradients) and simulate them (see
+        Simulator.receive).
+
+        Args:
+            command_list (list<Command>): List of commands to execute on the
+                simulator.
+        """
+        for cmd in command_list:
+            self._record(cmd)
+        Simulator.receive(self, command_list)
+
+    def _copy_backend(self, state, ordering):
+        """
+        Return a new backend (of the same type as the one of the simulator)
+        in the given state.
+        """
+        backend = type(self._simulator)(random.randint(0, 4294967295))
+        backend.allocate_qubits(ordering)
+        backend.set_wavefunction(state, ordering)
+        return backend
+
+    def get_gradients(self, observable, qureg):
+        """
+        Return the derivatives of the expectation value <observable> of the
+        current state w.r.t. the parameters of all recorded parameterized
+        gates (see get_parameterized_gates).
+
+        The state after the last gate, |phi>, and |lambda> = observable|phi>
+        are evolved backwards through the recorded gates. Before a gate
+        U = exp(-i theta G) (with the generator G, times the projector onto
+        the 1-states of the control qubits) is undone, the derivative
+        d<observable>/d theta = 2 Im <lambda|G|phi> is evaluated. Hence, the
+        cost is about two simulations of the circuit (with two copies of the
+        state vector), independent of the number of parameters.
+
+        Args:
+            observable (QubitOperator): Hermitian operator, where the index
+                of a qubit refers to its position in qureg.
+            qureg (list[Qubit],Qureg): Quantum bits to which the indices of
+                the observable refer.
+
+        Returns:
+            List of the derivatives (float) w.r.t. the angles of the Rx, Ry,
+            Rz, R and Ph gates and the times of the TimeEvolution gates, in
+            the order in which the gates were received since the tape was
+            last cleared (see clear_tape).
+
+        Note:
+            Make sure all previous commands have passed through the
+            compilation chain (call main_engine.flush() to make sure).
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            automatically converts from logical qubits to mapped qubits for
+            the qureg argument.
+
+        Raises:
+            Exception: If the observable acts on more qubits than present in
+                the `qureg` argument.
+            RuntimeError: If a gate which cannot be undone was recorded,
+                e.g., a measurement, a deallocation (of some of the qubits)
+                or a gate without a matrix (other than TimeEvolution).
+        """
+        qureg = self._convert_logical_to_mapped_qureg(qureg)
+        for term in observable.terms:
+            if not term == () and term[-1][0] >= len(qureg):
+                raise Exception("qubit_operator acts on more qubits than "
+                                "contained in the qureg.")
+        for gate, matrix, _, _, generator in self._tape:
+            if matrix is None and generator is None:
+                raise RuntimeError("get_gradients: The recorded gate {} "
+                                   "cannot be undone. Call clear_tape() "
+                                   "before the parameterized part of the "
+                                   "circuit.".format(gate))
+        mapping, state = self.cheat()
+        ordering = sorted(mapping, key=mapping.get)
+        phi = self._copy_backend(state, ordering)
+        lam = self._copy_backend(state, ordering)
+        lam.apply_qubit_operator([(list(term), coeff) for term, coeff
+                                  in observable.terms.items()],
+                                 [qb.id for qb in qureg])
+        indices = numpy.arange(len(state), dtype=numpy.int64)
+        gradients = []
+        # inverses of the gates which have not been applied yet
+        matrices = []
+        stream = []
+
+        def undo_gates():
+            if len(matrices) > 0:
+                stream_array = numpy.array(stream, dtype=numpy.uint32)
+                for backend in (phi, lam):
+                    backend.apply_gates(matrices, stream_array,
+                                        self._gate_fusion)
+                del matrices[:]
+                del stream[:]
+            for backend in (phi, lam):
+                backend.run()
+
+        for gate, matrix, ids, ctrlids, generator in reversed(self._tape):
+            if generator is not None:
+                undo_gates()
+                positions = [mapping[ID] for ID in ids + ctrlids]
+                bra = lam.cheat()[1]
+                ket = phi.cheat()[1]
+                value = sum(coeff * _pauli_matrix_element(
+                    bra, ket, term, positions, indices)
+                    for term, coeff in generator)
+                gradients.append(2. * complex(value).imag)
+            if matrix is not None:
+                matrices.append(numpy.conj(matrix).T.tolist())
+                stream += [len(matrices) - 1, len(ids), len(ctrlids)]
+                stream += ids + ctrlids
+            else:
+                undo_gates()
+                terms = [(list(term), coeff) for term, coeff
+                         in gate.hamiltonian.terms.items()]
+                for backend in (phi, lam):
+                    if self._time_evolution == 'krylov':
+                        backend.emulate_time_evolution_krylov(
+                            terms, -gate.time, ids, ctrlids,
+                            self._krylov_tol, self._krylov_dim)
+                    else:
+                        backend.emulate_time_evolution(terms, -gate.time,
+                                                       ids, ctrlids)
+        gradients.reverse()
+        return gradients
@@ -0,0 +1,138 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import math
+
+import pytest
+
+from projectq import MainEngine
+from projectq.meta import Control
+from projectq.ops import (All, C, CNOT, H, Measure, Ph, QFT, QubitOperator, R,
+                          Rx, Ry, Rz, Swap, TimeEvolution)
+from ._simulator_test import get_available_simulators, mapper
+
+from ._simulator import Simulator
+from ._adjoint_simulator import AdjointSimulator
+
+
+@pytest.fixture(params=get_available_simulators())
+def backend(request):
+    if request.param == "cpp_simulator":
+        from projectq.backends._sim._cppsim import Simulator as CppSim
+        return CppSim
+    if request.param == "py_simulator":
+        from projectq.backends._sim._pysim import Simulator as PySim
+        return PySim
+
+
+def _circuit(eng, qureg, params):
+    hamiltonian = (QubitOperator('X0 X1', 0.7) + QubitOperator('Z1', -0.4) +
+                   QubitOperator((), 0.2))
+    Ry(params[0]) | qureg[0]
+    Rx(params[1]) | qureg[1]
+    H | qureg[2]
+    CNOT | (qureg[0], qureg[1])
+    C(Rz(params[2])) | (qureg[1], qureg[2])
+    R(params[3]) | qureg[2]
+    TimeEvolution(params[4], hamiltonian) | qureg[1:]
+    Swap | (qureg[0], qureg[2])
+    with Control(eng, qureg[2]):
+        Ph(params[5]) | qureg[0]
+        TimeEvolution(params[6], hamiltonian) | qureg[:2]
+    C(Ry(params[7]), 2) | (qureg[0], qureg[2], qureg[1])
+    Rz(params[8]) | qureg[0]
+    Ph(params[9]) | qureg[1]
+
+
+def _expectation_value(observable, params):
+    eng = MainEngine(Simulator(), [])
+    qureg = eng.allocate_qureg(3)
+    _circuit(eng, qureg, params)
+    eng.flush()
+    value = eng.backend.get_expectation_value(observable, qureg)
+    All(Measure) | qureg
+    return value
+
+
+@pytest.mark.parametrize("time_evolution", ['taylor', 'krylov'])
+def test_adjoint_simulator_gradients(backend, mapper, time_evolution):
+    engine_list = []
+    if mapper is not None:
+        engine_list.append(mapper)
+    sim = AdjointSimulator(time_evolution=time_evolution)
+    sim._simulator = backend(1)
+    eng = MainEngine(sim, engine_list)
+    qureg = eng.allocate_qureg(3)
+    params = [0.3, -1.2, 0.8, 2.1, 0.6, 1.3, -0.9, 0.5, 1.7, -0.4]
+    _circuit(eng, qureg, params)
+    eng.flush()
+    observable = (QubitOperator('Z0 X2', 0.8) + QubitOperator('Y1', -0.5) +
+                  QubitOperator('X0 Y1 Z2', 0.3) + QubitOperator((), 1.5))
+    gates = sim.get_parameterized_gates()
+    assert [type(gate) for gate in gates] == [
+        Ry, Rx, Rz, R, TimeEvolution, Ph, TimeEvolution, Ry, Rz, Ph]
+    gradients = sim.get_gradients(observable, qureg)
+    assert len(gradients) == len(params)
+    eps = 1.e-5
+    for k in range(len(params)):
+        shifted = list(params)
+        shifted[k] += eps
+        value = _expectation_value(observable, shifted)
+        shifted[k] -= 2 * eps
+        value -= _expectation_value(observable, shifted)
+        assert gradients[k] == pytest.approx(value / (2 * eps), abs=1.e-7)
+    # an uncontrolled global phase does not change the expectation value
+    assert gradients[9] == pytest.approx(0., abs=1.e-12)
+    # the state of the simulator is unchanged
+    assert (sim.get_expectation_value(observable, qureg) ==
+            pytest.approx(_expectation_value(observable, params)))
+    All(Measure) | qureg
+
+
+def test_adjoint_simulator_tape(backend):
+    sim = AdjointSimulator()
+    sim._simulator = backend(1)
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(2)
+    H | qureg[0]
+    Measure | qureg[0]
+    Rx(0.4) | qureg[1]
+    eng.flush()
+    with pytest.raises(RuntimeError):
+        sim.get_gradients(QubitOperator('Z1'), qureg)
+    with pytest.raises(Exception):
+        sim.get_gradients(QubitOperator('Z2'), qureg)
+    sim.clear_tape()
+    assert sim.get_gradients(QubitOperator('Z1'), qureg) == []
+    Rx(0.7) | qureg[1]
+    eng.flush()
+    assert len(sim.get_parameterized_gates()) == 1
+    gradient, = sim.get_gradients(QubitOperator('Z1'), qureg)
+    assert gradient == pytest.approx(-math.sin(1.1))
+    QFT | qureg
+    eng.flush()
+    with pytest.raises(RuntimeError):
+        sim.get_gradients(QubitOperator('Z1'), qureg)
+    # deallocating all qubits clears the tape
+    All(Measure) | qureg
+    del qureg
+    eng.flush()
+    assert sim.get_parameterized_gates() == []
+    qubit = eng.allocate_qubit()
+    Rx(0.5) | qubit
+    eng.flush()
+    gradient, = sim.get_gradients(QubitOperator('Z0'), qubit)
+    assert gradient == pytest.approx(-math.sin(0.5))
+    Measure | qubit
+
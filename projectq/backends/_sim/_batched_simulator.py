@@ -0,0 +1,524 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+A simulator which simulates a batch of instances of the same circuit (with
+different input states or parameter values) at once.
+"""
+
+import random
+
+import numpy
+
+from projectq.cengines import BasicEngine
+from projectq.meta import LogicalQubitIDTag
+from projectq.ops import (AllocateQubitGate,
+                          DeallocateQubitGate,
+                          FlushGate,
+                          MeasureGate,
+                          Parameter)
+from projectq.types import WeakQubitRef
+from ._parametric_simulator import _bound_matrices
+from ._simulator import _is_parameterized
+
+
+class BatchedSimulator(BasicEngine):
+    """
+    Simulator whose state is a batch of state vectors, stored as an array of
+    shape (batch_size, 2^n), where bit i of the index corresponds to the i-th
+    allocated qubit (see cheat).
+
+    Each gate is applied to all instances at once: gates which are given by
+    their matrix in one contraction of the whole batch, and gates with
+    parameterized angles (see projectq.ops.Parameter) with one matrix per
+    instance, using the values of the parameters of the instances (see
+    set_parameter_values) in one batched matrix multiplication. Hence, for
+    few qubits and large batches, the cost of a gate is bound by the memory
+    bandwidth instead of the per-gate overhead in Python.
+
+    The instances start in the same state |0...0> (see set_wavefunction for
+    different input states), and all results (e.g., expectation values) are
+    returned as arrays with one entry per instance.
+
+    Example:
+        .. code-block:: python
+
+            sim = BatchedSimulator(batch_size=1000)
+            eng = MainEngine(sim, [])
+            theta = Parameter('theta')
+            sim.set_parameter_values([theta], numpy.random.rand(1000, 1))
+            qureg = eng.allocate_qureg(2)
+            Ry(theta) | qureg[0]
+            CNOT | (qureg[0], qureg[1])
+            eng.flush()
+            sim.get_expectation_value(QubitOperator('Z0 Z1'), qureg)
+    """
+    def __init__(self, batch_size, rnd_seed=None):
+        """
+        Construct the batched simulator.
+
+        Args:
+            batch_size (int): Number of instances.
+            rnd_seed (int): Random seed (uses random.randint(0, 4294967295) by
+                default).
+
+        Raises:
+            ValueError: If batch_size is not positive.
+        """
+        BasicEngine.__init__(self)
+        if batch_size < 1:
+            raise ValueError("BatchedSimulator: batch_size must be "
+                             "positive.")
+        if rnd_seed is None:
+            rnd_seed = random.randint(0, 4294967295)
+        self._rng = numpy.random.RandomState(rnd_seed)
+        self._batch_size = batch_size
+        self._state = numpy.ones((batch_size, 1), dtype=complex)
+        self._ids = []  # position -> qubit ID
+        self._parameter_values = dict()  # name -> value per instance
+        self._measurement_results = dict()  # ID -> outcome per instance
+
+    @property
+    def batch_size(self):
+        """ Number of instances. """
+        return self._batch_size
+
+    def is_available(self, cmd):
+        """
+        Return True if the command is a measurement, an allocation, a
+        deallocation, or a gate which provides a gate-matrix or has a
+        parameterized angle.
+
+        Args:
+            cmd (Command): Command for which to check availability.
+        """
+        if isinstance(cmd.gate, (MeasureGate, AllocateQubitGate,
+                                 DeallocateQubitGate, FlushGate)):
+            return True
+        if _is_parameterized(cmd.gate):
+            return True
+        try:
+            cmd.gate.matrix
+            return True
+        except:
+            return False
+
+    def set_parameter_values(self, parameters, values):
+        """
+        Set the values of the parameters of each instance, which are used for
+        the parameterized gates the simulator receives from now on.
+
+        Args:
+            parameters (list[Parameter|str]): Parameters (or their names),
+                which correspond to the columns of values.
+            values (numpy.ndarray): Array of shape
+                (batch_size, len(parameters)), where the i-th row contains
+                the values of the parameters of the i-th instance.
+
+        Raises:
+            ValueError: If values does not have one row per instance and one
+                column per parameter.
+        """
+        values = numpy.asarray(values, dtype=float)
+        if values.shape != (self._batch_size, len(parameters)):
+            raise ValueError("BatchedSimulator: values must have one row per "
+                             "instance and one column per parameter.")
+        for k, param in enumerate(parameters):
+            name = param.name if isinstance(param, Parameter) else param
+            self._parameter_values[name] = values[:, k]
+
+    def _convert_logical_to_mapped_qureg(self, qureg):
+        """
+        Converts a qureg from logical to mapped qubits if there is a mapper.
+
+        Args:
+            qureg (list[Qubit],Qureg): Logical quantum bits
+        """
+        mapper = self.main_engine.mapper
+        if mapper is not None:
+            mapped_qureg = []
+            for qubit in qureg:
+                if qubit.id not in mapper.current_mapping:
+                    raise RuntimeError("Unknown qubit id. "
+                                       "Please make sure you have called "
+                                       "eng.flush().")
+                new_qubit = WeakQubitRef(qubit.engine,
+                                         mapper.current_mapping[qubit.id])
+                mapped_qureg.append(new_qubit)
+            return mapped_qureg
+        else:
+            return qureg
+
+    def _get_positions(self, qureg):
+        try:
+            return [self._ids.index(qb.id) for qb in qureg]
+        except ValueError:
+            raise RuntimeError("Unknown qubit id. Please make sure you have "
+                               "called eng.flush().")
+
+    def _tensor(self):
+        """
+        Return a view of the state as a tensor with the instances along axis
+        0 and one axis of length 2 per qubit, where the qubit at position pos
+        corresponds to the axis n - pos (for n qubits).
+        """
+        return self._state.reshape((self._batch_size,) +
+                                   (2,) * len(self._ids))
+
+    def cheat(self):
+        """
+        Access the ordering of the qubits and the state vectors directly.
+
+        Returns:
+            A tuple where the first entry is a dictionary mapping qubit
+            indices to bit-locations and the second entry is the array of
+            shape (batch_size, 2^n) of the state vectors (not a copy).
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            DOES NOT automatically convert from logical qubits to mapped
+            qubits.
+        """
+        return ({ID: pos for pos, ID in enumerate(self._ids)}, self._state)
+
+    def set_wavefunction(self, wavefunctions, qureg):
+        """
+        Set the state vectors of the instances and the qubit ordering of the
+        simulator.
+
+        Args:
+            wavefunctions (numpy.ndarray): Array of shape (batch_size, 2^n)
+                of the (normalized) state vectors of the instances, where bit
+                i of the index corresponds to qureg[i], or one state vector
+                of length 2^n for all instances.
+            qureg (Qureg|list[Qubit]): Quantum register determining the
+                ordering. Must contain all allocated qubits.
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            automatically converts from logical qubits to mapped qubits for
+            the qureg argument.
+
+        Raises:
+            RuntimeError: If qureg does not consist of the allocated qubits.
+            ValueError: If the shape of wavefunctions does not match.
+        """
+        qureg = self._convert_logical_to_mapped_qureg(qureg)
+        ids = [qb.id for qb in qureg]
+        if sorted(ids) != sorted(self._ids):
+            raise RuntimeError("set_wavefunction(): Invalid mapping provided."
+                               " Please make sure all qubits have been "
+                               "allocated previously (call eng.flush()).")
+        wavefunctions = numpy.asarray(wavefunctions, dtype=complex)
+        shape = (self._batch_size, 2 ** len(ids))
+        if wavefunctions.shape not in (shape, shape[1:]):
+            raise ValueError("set_wavefunction(): The wavefunctions must be "
+                             "an array of shape {}.".format(shape))
+        self._state = numpy.array(numpy.broadcast_to(wavefunctions, shape))
+        self._ids = ids
+
+    def get_probability(self, bit_string, qureg):
+        """
+        Return the probability of the outcome `bit_string` when measuring
+        the quantum register `qureg`, for each instance.
+
+        Args:
+            bit_string (list[bool|int]|string[0|1]): Measurement outcome.
+            qureg (Qureg|list[Qubit]): Quantum register.
+
+        Returns:
+            Array of the probabilities (one per instance).
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            automatically converts from logical qubits to mapped qubits for
+            the qureg argument.
+        """
+        qureg = self._convert_logical_to_mapped_qureg(qureg)
+        num_qubits = len(self._ids)
+        index = [slice(None)] * (num_qubits + 1)
+        for pos, bit in zip(self._get_positions(qureg), bit_string):
+            index[num_qubits - pos] = int(bit)
+        amplitudes = self._tensor()[tuple(index)]
+        return (numpy.abs(amplitudes) ** 2).reshape(self._batch_size,
+                                                    -1).sum(axis=1)
+
+    def get_amplitude(self, bit_string, qureg):
+        """
+        Return the amplitude of the basis state `bit_string` of each
+        instance.
+
+        Args:
+            bit_string (list[bool|int]|string[0|1]): Computational basis
+                state.
+            qureg (Qureg|list[Qubit]): Quantum register determining the
+                ordering. Must contain all allocated qubits.
+
+        Returns:
+            Array of the amplitudes (one per instance).
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            automatically converts from logical qubits to mapped qubits for
+            the qureg argument.
+
+        Raises:
+            RuntimeError: If qureg does not contain all allocated qubits.
+        """
+        qureg = self._convert_logical_to_mapped_qureg(qureg)
+        if sorted(qb.id for qb in qureg) != sorted(self._ids):
+            raise RuntimeError("The second argument to get_amplitude() must"
+                               " be a permutation of all allocated qubits. "
+                               "Please make sure you have called "
+                               "eng.flush().")
+        index = sum(int(bit) << pos for pos, bit
+                    in zip(self._get_positions(qureg), bit_string))
+        return self._state[:, index].copy()
+
+    def get_expectation_value(self, qubit_operator, qureg):
+        """
+        Get the expectation value of qubit_operator w.r.t. the current state
+        of each instance, represented by the supplied quantum register.
+
+        Args:
+            qubit_operator (projectq.ops.QubitOperator): Operator to measure.
+            qureg (list[Qubit],Qureg): Quantum bits to measure.
+
+        Returns:
+            Array of the expectation values (one per instance).
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            automatically converts from logical qubits to mapped qubits for
+            the qureg argument.
+
+        Raises:
+            Exception: If `qubit_operator` acts on more qubits than present in
+                the `qureg` argument.
+        """
+        qureg = self._convert_logical_to_mapped_qureg(qureg)
+        positions = self._get_positions(qureg)
+        indices = numpy.arange(self._state.shape[1])
+        expectation = numpy.zeros(self._batch_size)
+        for term, coefficient in qubit_operator.terms.items():
+            if not term == () and term[-1][0] >= len(qureg):
+                raise Exception("qubit_operator acts on more qubits than "
+                                "contained in the qureg.")
+            flip = 0
+            parity = numpy.zeros(len(indices), dtype=numpy.int64)
+            phase = 1.
+            for index, pauli in term:
+                pos = positions[index]
+                if pauli != 'Z':
+                    flip |= 1 << pos
+                if pauli != 'X':
+                    parity ^= (indices >> pos) & 1
+                if pauli == 'Y':
+                    phase *= 1j
+            # (P psi)[j ^ flip] = phase * (-1)^parity(j) * psi[j]
+            image = self._state * (1. - 2. * parity)
+            values = numpy.einsum('bi,bi->b', self._state[:, indices ^ flip]
+                                  .conj(), image)
+            expectation += (coefficient * phase * values).real
+        return expectation
+
+    def get_measurement_results(self, qureg):
+        """
+        Return the outcomes of the last measurement of the qubits of qureg,
+        for each instance (the MainEngine only keeps the outcomes of the
+        first instance).
+
+        Args:
+            qureg (Qureg|list[Qubit]): Measured quantum bits.
+
+        Returns:
+            Array of shape (batch_size, len(qureg)), where entry [i, j] is
+            the outcome of qureg[j] in the i-th instance.
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            automatically converts from logical qubits to mapped qubits for
+            the qureg argument.
+
+        Raises:
+            RuntimeError: If a qubit has not been measured.
+        """
+        qureg = self._convert_logical_to_mapped_qureg(qureg)
+        try:
+            return numpy.stack([self._measurement_results[qb.id]
+                                for qb in qureg], axis=1)
+        except KeyError:
+            raise RuntimeError("get_measurement_results(): The qubit has "
+                               "not been measured.")
+
+    def _apply_matrix(self, matrix, positions, ctrl_positions):
+        """
+        Apply the gate matrix to the qubits at `positions` (of which the
+        first corresponds to the least significant bit of the matrix) where
+        the qubits at ctrl_positions are 1, in all instances.
+
+        Args:
+            matrix (numpy.ndarray): Matrix of shape (2^k, 2^k) (for all
+                instances) or (batch_size, 2^k, 2^k) (one per instance).
+            positions (list[int]): Positions of the k target qubits.
+            ctrl_positions (list[int]): Positions of the control qubits.
+        """
+        num_qubits = len(self._ids)
+        k = len(positions)
+        index = [slice(None)] * (num_qubits + 1)
+        for pos in ctrl_positions:
+            index[num_qubits - pos] = 1
+        # view of the subspace where all controls are 1, in which the axes
+        # of the controls are dropped
+        psi = self._tensor()[tuple(index)]
+        axes = [num_qubits - pos - sum(1 for c in ctrl_positions if c > pos)
+                for pos in reversed(positions)]
+        if matrix.ndim == 2:
+            matrix = matrix.reshape((2,) * (2 * k))
+            result = numpy.tensordot(matrix, psi,
+                                     axes=(list(range(k, 2 * k)), axes))
+            psi[...] = numpy.moveaxis(result, list(range(k)), axes)
+        else:
+            last = list(range(psi.ndim - k, psi.ndim))
+            moved = numpy.moveaxis(psi, axes, last)
+            shape = moved.shape
+            result = numpy.matmul(moved.reshape(self._batch_size, -1, 2 ** k),
+                                  numpy.swapaxes(matrix, 1, 2))
+            psi[...] = numpy.moveaxis(result.reshape(shape), last, axes)
+
+    def _allocate(self, qubit_id):
+        if qubit_id in self._ids:
+            raise RuntimeError("AllocateQubit: ID already exists. Qubit IDs "
+                               "should be unique.")
+        # the new qubit is the most significant one
+        self._state = numpy.concatenate([self._state,
+                                         numpy.zeros_like(self._state)],
+                                        axis=1)
+        self._ids.append(qubit_id)
+
+    def _probabilities_of_one(self, pos):
+        """
+        Return the probability that the qubit at position `pos` is 1 and the
+        norm of the state (squared), for each instance.
+        """
+        psi = numpy.moveaxis(self._tensor(), len(self._ids) - pos, 1)
+        weights = (numpy.abs(psi) ** 2).reshape(self._batch_size, 2, -1)
+        return weights[:, 1].sum(axis=1), weights.sum(axis=(1, 2))
+
+    def _measure(self, pos):
+        """
+        Measure the qubit at position `pos` in each instance and return the
+        outcomes (0 or 1).
+        """
+        p1, norm = self._probabilities_of_one(pos)
+        outcomes = (self._rng.random_sample(self._batch_size) * norm <
+                    p1).astype(int)
+        # psi is a view, i.e., this projects self._state
+        psi = numpy.moveaxis(self._tensor(), len(self._ids) - pos, 1)
+        instances = numpy.arange(self._batch_size)
+        psi[instances, 1 - outcomes] = 0.
+        probabilities = numpy.where(outcomes == 1, p1, norm - p1)
+        self._state /= numpy.sqrt(probabilities)[:, None]
+        return outcomes
+
+    def _deallocate(self, qubit_id):
+        pos = self._ids.index(qubit_id)
+        p1, norm = self._probabilities_of_one(pos)
+        ones = p1 > .5 * norm
+        if not numpy.allclose(numpy.where(ones, norm - p1, p1), 0.,
+                              atol=1.e-12):
+            raise RuntimeError("Qubit has not been measured / uncomputed. "
+                               "Cannot deallocate a qubit in superposition "
+                               "(in all instances)!")
+        psi = numpy.moveaxis(self._tensor(), len(self._ids) - pos, 1)
+        self._state = psi[numpy.arange(self._batch_size),
+                          ones.astype(int)].reshape(self._batch_size, -1)
+        del self._ids[pos]
+        self._measurement_results.pop(qubit_id, None)
+
+    def receive(self, command_list):
+        """
+        Receive a list of commands from the previous engine and handle them
+        prior to sending them on to the next engine.
+
+        Args:
+            command_list (list<Command>): List of commands to execute on the
+                simulator.
+        """
+        for cmd in command_list:
+            self._handle(cmd)
+        if not self.is_last_engine:
+            self.send(command_list)
+
+    def _handle(self, cmd):
+        """
+        Handle all commands.
+
+        A measurement collapses each instance separately, see
+        get_measurement_results.
+
+        Args:
+            cmd (Command): Command to handle.
+
+        Raises:
+            Exception: If the gate provides no gate-matrix matching its
+                number of qubits.
+            KeyError: If a parameter of a parameterized gate has no values
+                (see set_parameter_values).
+        """
+        if isinstance(cmd.gate, FlushGate):
+            return
+        if isinstance(cmd.gate, AllocateQubitGate):
+            self._allocate(cmd.qubits[0][0].id)
+        elif isinstance(cmd.gate, DeallocateQubitGate):
+            self._deallocate(cmd.qubits[0][0].id)
+        elif isinstance(cmd.gate, MeasureGate):
+            # Check if a mapper assigned a different logical id
+            logical_id_tag = None
+            for tag in cmd.tags:
+                if isinstance(tag, LogicalQubitIDTag):
+                    logical_id_tag = tag
+            for qr in cmd.qubits:
+                for qb in qr:
+                    outcomes = self._measure(self._ids.index(qb.id))
+                    self._measurement_results[qb.id] = outcomes
+                    if logical_id_tag is not None:
+                        qb = WeakQubitRef(qb.engine,
+                                          logical_id_tag.logical_qubit_id)
+                    self.main_engine.set_measurement_result(qb,
+                                                            outcomes[0])
+        else:
+            qubits = [qb for qr in cmd.qubits for qb in qr]
+            if _is_parameterized(cmd.gate):
+                angles = numpy.broadcast_to(
+                    cmd.gate.angle.evaluate(self._parameter_values),
+                    (self._batch_size,))
+                matrix = _bound_matrices(cmd.gate, angles)
+            else:
+                try:
+                    matrix = numpy.asarray(cmd.gate.matrix, dtype=complex)
+                except AttributeError:
+                    matrix = None
+            if matrix is None:
+                raise Exception("BatchedSimulator: The gate {} provides no "
+                                "gate-matrix. Please add an auto-replacer "
+                                "engine to your list of compiler "
+                                "engines.".format(str(cmd.gate)))
+            if matrix.shape[-1] != 2 ** len(qubits):
+                raise Exception("BatchedSimulator: Error applying {} gate: "
+                                "{}-qubit gate applied to {} qubits.".format(
+                                    cmd.gate, matrix.shape[-1].bit_length() -
+                                    1, len(qubits)))
+            self._apply_matrix(matrix, self._get_positions(qubits),
+                               self._get_positions(cmd.control_qubits))
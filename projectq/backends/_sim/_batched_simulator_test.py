@@ -0,0 +1,168 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import numpy
+import pytest
+
+from projectq import MainEngine
+from projectq.libs.math import AddConstant
+from projectq.ops import (All, BasicGate, C, CNOT, H, Measure, Parameter, Ph,
+                          QubitOperator, R, Rx, Ry, Rz, Swap, Toffoli, X)
+from projectq.types import WeakQubitRef
+from ._simulator_test import mapper
+
+from ._simulator import Simulator
+from ._batched_simulator import BatchedSimulator
+
+
+def _circuit(eng, qureg, theta, phi):
+    H | qureg[0]
+    Rx(theta) | qureg[1]
+    Ry(2 * theta - phi) | qureg[2]
+    C(Rz(phi)) | (qureg[0], qureg[2])
+    CNOT | (qureg[2], qureg[1])
+    C(Ph(0.5 * phi + 1.)) | (qureg[1], qureg[0])
+    Toffoli | (qureg[0], qureg[2], qureg[1])
+    R(theta) | qureg[0]
+    Swap | (qureg[0], qureg[2])
+    C(Ry(theta), 2) | (qureg[1], qureg[2], qureg[0])
+
+
+def _observables():
+    return [QubitOperator('Z0 Z2'), QubitOperator('X1', 0.5) +
+            QubitOperator('Y0 Y2', -1.), QubitOperator('X0 Y1 Z2', 2.)]
+
+
+def test_batched_simulator_matches_simulator(mapper):
+    batch_size = 5
+    sim = BatchedSimulator(batch_size, rnd_seed=3)
+    engine_list = [] if mapper is None else [mapper]
+    eng = MainEngine(sim, engine_list)
+    qureg = eng.allocate_qureg(3)
+    theta, phi = Parameter('theta'), Parameter('phi')
+    values = numpy.random.RandomState(1).uniform(-4, 4, size=(batch_size, 2))
+    sim.set_parameter_values([theta, 'phi'], values)
+    _circuit(eng, qureg, theta, phi)
+    eng.flush()
+    results = numpy.array([sim.get_expectation_value(op, qureg)
+                           for op in _observables()]).T
+    probabilities = sim.get_probability('101', qureg)
+    amplitudes = sim.get_amplitude([0, 1, 1], qureg)
+    assert results.shape == (batch_size, 3)
+    assert amplitudes.shape == (batch_size,)
+    for i, (theta_value, phi_value) in enumerate(values):
+        ref_eng = MainEngine(Simulator(), [])
+        ref_qureg = ref_eng.allocate_qureg(3)
+        _circuit(ref_eng, ref_qureg, theta_value, phi_value)
+        ref_eng.flush()
+        expected = [ref_eng.backend.get_expectation_value(op, ref_qureg)
+                    for op in _observables()]
+        assert numpy.allclose(results[i], expected)
+        assert probabilities[i] == pytest.approx(
+            ref_eng.backend.get_probability('101', ref_qureg))
+        assert amplitudes[i] == pytest.approx(
+            ref_eng.backend.get_amplitude([0, 1, 1], ref_qureg))
+        All(Measure) | ref_qureg
+    All(Measure) | qureg
+    eng.flush()
+    outcomes = sim.get_measurement_results(qureg)
+    assert outcomes.shape == (batch_size, 3)
+    # the main engine knows the outcomes of the first instance
+    assert [int(qb) for qb in qureg] == list(outcomes[0])
+    for i, bits in enumerate(outcomes):
+        assert sim.get_probability(bits, qureg)[i] == pytest.approx(1.)
+
+
+def test_batched_simulator_wavefunction():
+    sim = BatchedSimulator(3)
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(2)
+    eng.flush()
+    states = numpy.array([[1., 0., 0., 0.], [0., 0., 1., 0.],
+                          [0., .6, .8j, 0.]])
+    # (ordering [qureg[1], qureg[0]])
+    sim.set_wavefunction(states, qureg[::-1])
+    X | qureg[1]
+    eng.flush()
+    assert numpy.allclose(sim.get_probability('11', qureg),
+                          [0., 1., .64])
+    assert numpy.allclose(sim.get_expectation_value(QubitOperator('Z0'),
+                                                    qureg),
+                          [1., -1., -.28])
+    mapping, state = sim.cheat()
+    assert mapping == {qureg[1].id: 0, qureg[0].id: 1}
+    assert numpy.allclose(state[2], [.6, 0., 0., .8j])
+    # one wavefunction for all instances
+    sim.set_wavefunction([0., 0., 0., 1.], qureg)
+    assert numpy.allclose(sim.get_amplitude('11', qureg), [1.] * 3)
+    with pytest.raises(ValueError):
+        sim.set_wavefunction(numpy.ones((2, 4)) / 2., qureg)
+    with pytest.raises(RuntimeError):
+        sim.set_wavefunction([1., 0.], qureg[:1])
+    with pytest.raises(RuntimeError):
+        sim.get_amplitude('1', qureg[:1])
+
+
+def test_batched_simulator_deallocation():
+    sim = BatchedSimulator(4, rnd_seed=5)
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(3)
+    sim.set_parameter_values(['theta'], [[0.], [numpy.pi], [0.], [numpy.pi]])
+    Rx(Parameter('theta')) | qureg[1]
+    H | qureg[0]
+    CNOT | (qureg[0], qureg[2])
+    eng.flush()
+    # qureg[1] is in a basis state in each instance (0 or 1)
+    qureg[1].__del__()
+    eng.flush()
+    assert numpy.allclose(sim.get_probability('11', [qureg[0], qureg[2]]),
+                          [.5] * 4)
+    Measure | qureg[0]
+    eng.flush()
+    outcomes = sim.get_measurement_results([qureg[0]])[:, 0]
+    assert numpy.allclose(sim.get_expectation_value(QubitOperator('Z1'),
+                                                    [qureg[0], qureg[2]]),
+                          1. - 2. * outcomes)
+    qureg[0].__del__()
+    eng.flush()
+    with pytest.raises(RuntimeError):
+        sim.get_measurement_results([qureg[0]])
+    H | qureg[2]
+    with pytest.raises(RuntimeError):
+        qureg[2].__del__()
+        eng.flush()
+
+
+def test_batched_simulator_errors():
+    with pytest.raises(ValueError):
+        BatchedSimulator(0)
+    sim = BatchedSimulator(2)
+    assert sim.batch_size == 2
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(2)
+    with pytest.raises(ValueError):
+        sim.set_parameter_values(['theta'], [0.1, 0.2])
+    with pytest.raises(KeyError):
+        Ry(Parameter('phi')) | qureg[0]
+        eng.flush()
+    wrong_gate = BasicGate()
+    wrong_gate.matrix = numpy.eye(4)
+    with pytest.raises(Exception):
+        wrong_gate | qureg[0]
+        eng.flush()
+    assert not sim.is_available(AddConstant(1).generate_command(qureg))
+    with pytest.raises(Exception):
+        sim.get_expectation_value(QubitOperator('Z2'), qureg)
+    with pytest.raises(RuntimeError):
+        sim.get_probability('1', [WeakQubitRef(eng, 42)])
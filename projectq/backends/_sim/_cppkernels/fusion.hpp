@@ -22,13 +22,14 @@
 #include <iostream>
 #include "intrin/alignedallocator.hpp"
 
-class Item{
+template <class T>
+class BasicItem{
 public:
     using Index = unsigned;
     using IndexVector = std::vector<Index>;
-    using Complex = std::complex<double>;
+    using Complex = std::complex<T>;
     using Matrix = std::vector<std::vector<Complex, aligned_allocator<Complex, 64>>>;
-    Item(Matrix mat, IndexVector idx) : mat_(mat), idx_(idx) {}
+    BasicItem(Matrix mat, IndexVector idx) : mat_(mat), idx_(idx) {}
     Matrix& get_matrix() { return mat_; }
     IndexVector& get_indices() { return idx_; }
 private:
@@ -36,13 +37,15 @@ private:
     IndexVector idx_;
 };
 
-class Fusion{
+template <class T>
+class BasicFusion{
 public:
     using Index = unsigned;
     using IndexSet = std::set<Index>;
     using IndexVector = std::vector<Index>;
-    using Complex = std::complex<double>;
+    using Complex = std::complex<T>;
     using Matrix = std::vector<std::vector<Complex, aligned_allocator<Complex, 64>>>;
+    using Item = BasicItem<T>;
     using ItemVector = std::vector<Item>;
 
     unsigned num_qubits() {
@@ -73,33 +76,40 @@ public:
         for (std::size_t i = 0; i < (1UL<<N); ++i)
             M[i][i] = 1.;
 
+        // apply the items one after the other to the columns of M, as (small) k-qubit gates
+        std::vector<Complex> v, w;
         for (auto& item : items_){
             auto const& idx = item.get_indices();
+            auto const& G = item.get_matrix();
+            std::size_t K = 1UL << idx.size();
             IndexVector idx2mat(idx.size());
             for (std::size_t i = 0; i < idx.size(); ++i)
                 idx2mat[i] = ((std::equal_range(index_list.begin(), index_list.end(), idx[i])).first - index_list.begin());
-
-            for (std::size_t k = 0; k < (1UL<<N); ++k){ // loop over big matrix columns
-                // check if column index satisfies control-mask
-                // if not: leave it unchanged
-                std::vector<Complex> oldcol(1UL<<N);
-                for (std::size_t i = 0; i < (1UL<<N); ++i)
-                    oldcol[i] = M[i][k];
-
-                for (std::size_t i = 0; i < (1UL<<N); ++i){
-                    std::size_t local_i = 0;
-                    for (std::size_t l = 0; l < idx.size(); ++l)
-                        local_i |= ((i >> idx2mat[l])&1UL)<<l;
-
-                    Complex res = 0.;
-                    for (std::size_t j = 0; j < (1UL<<idx.size()); ++j){
-                        std::size_t locidx = i;
-                        for (std::size_t l = 0; l < idx.size(); ++l)
-                            if (((j >> l)&1UL) != ((i >> idx2mat[l])&1UL))
-                                locidx ^= (1UL << idx2mat[l]);
-                        res += oldcol[locidx] * item.get_matrix()[local_i][j];
+            IndexVector sorted_pos = idx2mat;
+            std::sort(sorted_pos.begin(), sorted_pos.end());
+            std::vector<std::size_t> off(K, 0);
+            for (std::size_t j = 0; j < K; ++j)
+                for (std::size_t l = 0; l < idx.size(); ++l)
+                    off[j] |= ((j >> l) & 1UL) << idx2mat[l];
+            v.resize(K);
+            w.resize(K);
+
+            for (std::size_t r = 0; r < ((1UL<<N) >> idx.size()); ++r){
+                // insert zeros at the positions of the item's qubits
+                std::size_t base = r;
+                for (auto p : sorted_pos)
+                    base = ((base >> p) << (p + 1)) | (base & ((1UL << p) - 1));
+                for (std::size_t k = 0; k < (1UL<<N); ++k){ // loop over big matrix columns
+                    for (std::size_t j = 0; j < K; ++j)
+                        v[j] = M[base + off[j]][k];
+                    for (std::size_t i = 0; i < K; ++i){
+                        Complex res = 0.;
+                        for (std::size_t j = 0; j < K; ++j)
+                            res += G[i][j] * v[j];
+                        w[i] = res;
                     }
-                    M[i][k] = res;
+                    for (std::size_t i = 0; i < K; ++i)
+                        M[base + off[i]][k] = w[i];
                 }
             }
         }
@@ -164,4 +174,7 @@ private:
     IndexSet ctrl_set_;
 };
 
+using Item = BasicItem<double>;
+using Fusion = BasicFusion<double>;
+
 #endif
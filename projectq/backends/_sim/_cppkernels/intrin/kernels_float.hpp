@@ -0,0 +1,139 @@
+// Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+// http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#ifndef KERNELS_FLOAT_HPP_
+#define KERNELS_FLOAT_HPP_
+
+#include <immintrin.h>
+#include <complex>
+#include <cstdlib>
+#include <algorithm>
+
+// AVX kernels for single-precision state vectors: one __m256 holds four
+// complex<float> entries of a matrix column, i.e., four rows of the output
+// are computed at once (K >= 2 qubits).
+namespace intrin_float{
+
+// |v> = M|v> for the 2^K amplitudes psi[I + off[j]]
+template <unsigned K, class V>
+inline void kernel_core(V &psi, std::size_t I, std::size_t const* off,
+                        __m256 const* mm, __m256 const* mmt)
+{
+    constexpr unsigned D = 1U << K;
+    __m256 acc[D / 4], acct[D / 4];
+    for (unsigned r = 0; r < D / 4; ++r){
+        acc[r] = _mm256_setzero_ps();
+        acct[r] = _mm256_setzero_ps();
+    }
+    for (unsigned j = 0; j < D; ++j){
+        auto re = _mm256_set1_ps(psi[I + off[j]].real());
+        auto im = _mm256_set1_ps(psi[I + off[j]].imag());
+        for (unsigned r = 0; r < D / 4; ++r){
+            acc[r] = _mm256_add_ps(acc[r], _mm256_mul_ps(re, mm[j * D / 4 + r]));
+            acct[r] = _mm256_add_ps(acct[r], _mm256_mul_ps(im, mmt[j * D / 4 + r]));
+        }
+    }
+    alignas(32) std::complex<float> res[D];
+    for (unsigned r = 0; r < D / 4; ++r)
+        _mm256_store_ps((float*)&res[4 * r], _mm256_addsub_ps(acc[r], acct[r]));
+    for (unsigned j = 0; j < D; ++j)
+        psi[I + off[j]] = res[j];
+}
+
+// bit indices ids[.] are given from low to high (i.e., ids[l] corresponds to
+// bit l of the matrix index)
+template <unsigned K, class V, class M>
+void kernel(V &psi, unsigned const* ids, M const& m, std::size_t ctrlmask)
+{
+    constexpr unsigned D = 1U << K;
+    std::size_t n = psi.size();
+
+    std::size_t off[D];
+    for (std::size_t j = 0; j < D; ++j){
+        off[j] = 0;
+        for (unsigned l = 0; l < K; ++l)
+            off[j] |= ((j >> l) & 1UL) << ids[l];
+    }
+    unsigned sorted_ids[K];
+    std::copy(ids, ids + K, sorted_ids);
+    std::sort(sorted_ids, sorted_ids + K);
+
+    // column j of rows 4r..4r+3, and the same with real & imaginary parts
+    // swapped (for the complex multiplication using addsub)
+    alignas(32) __m256 mm[D * D / 4], mmt[D * D / 4];
+    for (unsigned j = 0; j < D; ++j){
+        for (unsigned r = 0; r < D / 4; ++r){
+            alignas(32) float col[8], colt[8];
+            for (unsigned i = 0; i < 4; ++i){
+                col[2 * i] = m[4 * r + i][j].real();
+                col[2 * i + 1] = m[4 * r + i][j].imag();
+                colt[2 * i] = m[4 * r + i][j].imag();
+                colt[2 * i + 1] = m[4 * r + i][j].real();
+            }
+            mm[j * D / 4 + r] = _mm256_load_ps(col);
+            mmt[j * D / 4 + r] = _mm256_load_ps(colt);
+        }
+    }
+
+    #pragma omp for schedule(static)
+    for (std::size_t i = 0; i < (n >> K); ++i){
+        // insert zeros at the bit-locations of the qubits
+        std::size_t I = i;
+        for (unsigned l = 0; l < K; ++l){
+            std::size_t low = I & ((1UL << sorted_ids[l]) - 1);
+            I = ((I >> sorted_ids[l]) << (sorted_ids[l] + 1)) | low;
+        }
+        if ((I & ctrlmask) == ctrlmask)
+            kernel_core<K>(psi, I, off, mm, mmt);
+    }
+}
+
+template <class V, class M>
+void kernel(V &psi, unsigned id0, M const& m, std::size_t ctrlmask)
+{
+    // two rows only: memory-bound anyway, use the generic kernel
+    nointrin::kernel(psi, id0, m, ctrlmask);
+}
+
+template <class V, class M>
+void kernel(V &psi, unsigned id1, unsigned id0, M const& m, std::size_t ctrlmask)
+{
+    unsigned ids[] = {id0, id1};
+    kernel<2>(psi, ids, m, ctrlmask);
+}
+
+template <class V, class M>
+void kernel(V &psi, unsigned id2, unsigned id1, unsigned id0, M const& m, std::size_t ctrlmask)
+{
+    unsigned ids[] = {id0, id1, id2};
+    kernel<3>(psi, ids, m, ctrlmask);
+}
+
+template <class V, class M>
+void kernel(V &psi, unsigned id3, unsigned id2, unsigned id1, unsigned id0, M const& m, std::size_t ctrlmask)
+{
+    unsigned ids[] = {id0, id1, id2, id3};
+    kernel<4>(psi, ids, m, ctrlmask);
+}
+
+template <class V, class M>
+void kernel(V &psi, unsigned id4, unsigned id3, unsigned id2, unsigned id1, unsigned id0, M const& m, std::size_t ctrlmask)
+{
+    unsigned ids[] = {id0, id1, id2, id3, id4};
+    kernel<5>(psi, ids, m, ctrlmask);
+}
+
+} // namespace intrin_float
+
+#endif
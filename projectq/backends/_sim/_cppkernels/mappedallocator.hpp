@@ -0,0 +1,97 @@
+// Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+// http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#pragma once
+
+#include "intrin/alignedallocator.hpp"
+#include <string>
+#include <stdexcept>
+#include <type_traits>
+#ifndef _WIN32
+#include <sys/mman.h>
+#include <unistd.h>
+#endif
+
+
+// allocator for state vectors: without a directory, the memory is allocated
+// like by aligned_allocator; otherwise, it is mapped to a (deleted) temporary
+// file in that directory, such that a state vector may be larger than the RAM
+// and the operating system pages the amplitudes in and out as they are needed.
+// A container keeps its allocator on assignment, i.e., a state vector stays
+// in memory or in a file until it is swapped with another one.
+template <typename T, unsigned int Alignment>
+class mapped_allocator
+{
+ public:
+    typedef T value_type;
+    typedef T* pointer;
+    typedef std::size_t size_type;
+    typedef std::false_type propagate_on_container_copy_assignment;
+    typedef std::false_type propagate_on_container_move_assignment;
+    typedef std::true_type propagate_on_container_swap;
+
+    template <typename U>
+    struct rebind
+    {
+        typedef mapped_allocator<U, Alignment> other;
+    };
+
+    mapped_allocator() noexcept {}
+    explicit mapped_allocator(std::string const& dir) : dir_(dir) {}
+    template <typename U>
+    mapped_allocator(mapped_allocator<U, Alignment> const& other) : dir_(other.dir()) {}
+
+    pointer allocate(size_type n)
+    {
+        if (dir_.empty())
+            return aligned_allocator<T, Alignment>().allocate(n);
+#ifdef _WIN32
+        throw std::runtime_error("Memory-mapped state vectors are not supported on Windows.");
+#else
+        if (n == 0)
+            return nullptr;
+        std::string name = dir_ + "/projectq-state-XXXXXX";
+        int fd = mkstemp(&name[0]);
+        if (fd < 0)
+            throw std::runtime_error("Could not create a file for the state vector in " + dir_ + ".");
+        unlink(name.c_str());
+        void* p = MAP_FAILED;
+        if (ftruncate(fd, n * sizeof(T)) == 0)
+            p = mmap(nullptr, n * sizeof(T), PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+        close(fd);
+        if (p == MAP_FAILED)
+            throw std::runtime_error("Could not map a file of " + std::to_string(n * sizeof(T))
+                                     + " bytes for the state vector in " + dir_ + ".");
+        return reinterpret_cast<pointer>(p);
+#endif
+    }
+
+    void deallocate(pointer p, size_type n) noexcept
+    {
+        if (dir_.empty())
+            aligned_allocator<T, Alignment>().deallocate(p, n);
+#ifndef _WIN32
+        else if (p != nullptr)
+            munmap(p, n * sizeof(T));
+#endif
+    }
+
+    std::string const& dir() const noexcept { return dir_; }
+
+    bool operator==(mapped_allocator const& other) const noexcept { return dir_ == other.dir_; }
+    bool operator!=(mapped_allocator const& other) const noexcept { return dir_ != other.dir_; }
+
+ private:
+    std::string dir_;
+};
@@ -20,12 +20,24 @@
 #include <algorithm>
 #include "../intrin/alignedallocator.hpp"
 
+// generic kernels (any floating-point type); kept in their own namespace so
+// they can be used alongside the double-precision intrinsics kernels
+namespace nointrin{
+
 template <class T>
 inline T add(T a, T b){ return a+b; }
 
 template <class T>
 inline T mul(T a, T b){ return a*b; }
 
+// plain complex multiplication (std::complex's operator* adds inf/nan checks
+// which keep the compiler from vectorizing the kernels)
+template <class T>
+inline std::complex<T> mul(std::complex<T> a, std::complex<T> b){
+    return std::complex<T>(a.real() * b.real() - a.imag() * b.imag(),
+                           a.real() * b.imag() + a.imag() * b.real());
+}
+
 
 #define LOOP_COLLAPSE1 2
 #define LOOP_COLLAPSE2 3
@@ -38,3 +50,5 @@ inline T mul(T a, T b){ return a*b; }
 #include "kernel3.hpp"
 #include "kernel4.hpp"
 #include "kernel5.hpp"
+
+} // namespace nointrin
@@ -17,16 +17,19 @@
 
 #include <vector>
 #include <complex>
+#include <utility>
 
-#if defined(NOINTRIN) || !defined(INTRIN)
 #include "nointrin/kernels.hpp"
-#else
+#if defined(INTRIN) && !defined(NOINTRIN)
 #include "intrin/kernels.hpp"
+#include "intrin/kernels_float.hpp"
 #endif
 
 #include "intrin/alignedallocator.hpp"
 #include "fusion.hpp"
+#include "mappedallocator.hpp"
 #include <map>
+#include <set>
 #include <cassert>
 #include <algorithm>
 #include <tuple>
@@ -34,39 +37,91 @@
 #include <functional>
 
 
-class Simulator{
+// selects the gate kernels for a given floating-point type: the intrinsics
+// kernels (if enabled), the generic ones otherwise
+template <class T>
+struct Kernels{
+    template <class... Args>
+    static void apply(Args&&... args){ nointrin::kernel(std::forward<Args>(args)...); }
+};
+
+#if defined(INTRIN) && !defined(NOINTRIN)
+template <>
+struct Kernels<double>{
+    template <class... Args>
+    static void apply(Args&&... args){ ::kernel(std::forward<Args>(args)...); }
+};
+
+template <>
+struct Kernels<float>{
+    template <class... Args>
+    static void apply(Args&&... args){ intrin_float::kernel(std::forward<Args>(args)...); }
+};
+#endif
+
+
+template <class T>
+class BasicSimulator{
 public:
-    using calc_type = double;
+    using calc_type = T;
     using complex_type = std::complex<calc_type>;
-    using StateVector = std::vector<complex_type, aligned_allocator<complex_type,64>>;
+    using Fusion = BasicFusion<calc_type>;
+    using Matrix = typename Fusion::Matrix;
+    using IndexVector = typename Fusion::IndexVector;
+    using DiagonalVector = std::vector<complex_type>;
+    using QuRegs = std::vector<std::vector<unsigned>>;
+    using StateVector = std::vector<complex_type, mapped_allocator<complex_type,64>>;
     using Map = std::map<unsigned, unsigned>;
     using RndEngine = std::mt19937;
     using Term = std::vector<std::pair<unsigned, char>>;
     using TermsDict = std::vector<std::pair<Term, calc_type>>;
     using ComplexTermsDict = std::vector<std::pair<Term, complex_type>>;
 
-    Simulator(unsigned seed = 1) : N_(0), vec_(1,0.), fusion_qubits_min_(4),
-                                   fusion_qubits_max_(5), rnd_eng_(seed) {
+    struct PendingGate{
+        Matrix m;
+        std::vector<unsigned> ids, ctrl;
+        std::vector<std::size_t> perm; // for permutation gates (empty otherwise)
+    };
+
+    struct FusedGate{
+        Matrix m;
+        std::vector<unsigned> positions; // bit-locations (m acts on positions[0] as the lowest bit)
+        std::size_t ctrlmask;
+        std::vector<std::size_t> perm; // for single permutation gates (empty otherwise)
+        bool diagonal;
+    };
+
+    BasicSimulator(unsigned seed = 1) : N_(0), vec_(1,0.), fusion_qubits_max_(5),
+                                        fusion_window_(64), diag_qubits_max_(12),
+                                        rnd_eng_(seed) {
         vec_[0]=1.; // all-zero initial state
         std::uniform_real_distribution<double> dist(0., 1.);
         rng_ = std::bind(dist, std::ref(rnd_eng_));
     }
 
     void allocate_qubit(unsigned id){
-        if (map_.count(id) == 0){
+        allocate_qubits({id});
+    }
+
+    // allocate the qubits `ids` (in state 0) at the highest bit-locations, i.e., the zero
+    // amplitudes are appended to the state vector, which is resized (in place if its
+    // capacity suffices, which is kept when qubits are deallocated) only once
+    void allocate_qubits(std::vector<unsigned> const& ids){
+        for (unsigned i = 0; i < ids.size(); ++i)
+            if (map_.count(ids[i]) != 0 || std::count(ids.begin(), ids.begin() + i, ids[i]) != 0)
+                throw(std::runtime_error(
+                    "AllocateQubit: ID already exists. Qubit IDs should be unique."));
+        for (auto id : ids){
             map_[id] = N_++;
-            auto newvec = StateVector(1UL << N_);
-            #pragma omp parallel for schedule(static)
-            for (std::size_t i = 0; i < newvec.size(); ++i)
-                newvec[i] = (i < vec_.size())?vec_[i]:0.;
-            vec_ = std::move(newvec);
+            classical_[id] = false;
         }
-        else
-            throw(std::runtime_error(
-                "AllocateQubit: ID already exists. Qubit IDs should be unique."));
+        vec_.resize(1UL << N_, 0.);
     }
 
     bool get_classical_value(unsigned id, calc_type tol = 1.e-12){
+        auto it = classical_.find(id);
+        if (it != classical_.end())
+            return it->second;
         run();
         unsigned pos = map_[id];
         std::size_t delta = (1UL << pos);
@@ -84,6 +139,8 @@ public:
     }
 
     bool is_classical(unsigned id, calc_type tol = 1.e-12){
+        if (classical_.count(id) != 0)
+            return true;
         run();
         unsigned pos = map_[id];
         std::size_t delta = (1UL << pos);
@@ -111,20 +168,40 @@ public:
                 for (std::size_t j = 0; j < delta; ++j)
                     vec_[i+j+static_cast<std::size_t>(!value)*delta] = 0.;
             }
+            classical_[id] = value;
         }
         else{
-            StateVector newvec((1UL << (N_-1)));
-            #pragma omp parallel for schedule(static)
-            for (std::size_t i = 0; i < vec_.size(); i += 2*delta)
-                std::copy_n(&vec_[i + static_cast<std::size_t>(value)*delta],
-                            delta, &newvec[i/2]);
-            vec_ = std::move(newvec);
-
-            for (auto& p : map_){
-                if (p.second > pos)
-                    p.second--;
+            // the qubit at the highest bit-location takes the place of the deallocated one,
+            // such that the remaining amplitudes can be compacted into the lower half of
+            // the state vector in place
+            std::size_t half = vec_.size() / 2;
+            std::size_t offset = static_cast<std::size_t>(value) * delta;
+            unsigned top_id = id;
+            for (auto const& p : map_)
+                if (p.second == N_ - 1)
+                    top_id = p.first;
+            if (pos == N_ - 1){
+                if (value){
+                    #pragma omp parallel for schedule(static)
+                    for (std::size_t i = 0; i < half; ++i)
+                        vec_[i] = vec_[i + half];
+                }
             }
+            else{
+                #pragma omp parallel for schedule(static)
+                for (std::size_t i = 0; i < half; i += 2*delta){
+                    for (std::size_t j = i; j < i + delta; ++j){
+                        auto a0 = vec_[j + offset];
+                        auto a1 = vec_[j + offset + half];
+                        vec_[j] = a0;
+                        vec_[j + delta] = a1;
+                    }
+                }
+                map_[top_id] = pos;
+            }
+            vec_.resize(half);
             map_.erase(id);
+            classical_.erase(id);
             N_--;
         }
     }
@@ -136,8 +213,8 @@ public:
         for (unsigned i = 0; i < ids.size(); ++i)
             positions[i] = map_[ids[i]];
 
-        calc_type P = 0.;
-        calc_type rnd = rng_();
+        double P = 0.;
+        double rnd = rng_();
 
         // pick entry at random with probability |entry|^2
         std::size_t pick = 0;
@@ -153,11 +230,12 @@ public:
         for (unsigned i = 0; i < ids.size(); ++i){
             bool r = ((pick >> positions[i]) & 1) == 1;
             res[i] = r;
+            classical_[ids[i]] = r;
             mask |= (1UL << positions[i]);
             val |= (static_cast<std::size_t>(r&1) << positions[i]);
         }
         // set bad entries to 0
-        calc_type N = 0.;
+        double N = 0.;
         #pragma omp parallel for reduction(+:N) schedule(static)
         for (std::size_t i = 0; i < vec_.size(); ++i){
             if ((i & mask) != val)
@@ -178,8 +256,9 @@ public:
         return ret;
     }
 
+    // the value of a qubit which is known to be in a basis state (see classical_) is not
+    // looked up in the state vector
     void deallocate_qubit(unsigned id){
-        run();
         assert(map_.count(id) == 1);
         if (!is_classical(id))
             throw(std::runtime_error("Error: Qubit has not been measured / uncomputed! There is most likely a bug in your code."));
@@ -188,71 +267,271 @@ public:
         collapse_vector(id, value, true);
     }
 
+    void deallocate_qubits(std::vector<unsigned> const& ids){
+        for (auto id : ids)
+            deallocate_qubit(id);
+    }
+
+    // remove the qubits `ids`, which are known to be in the basis states `values` (e.g.,
+    // right after they have been measured), without checking that they are
+    void remove_qubits(std::vector<unsigned> const& ids, std::vector<bool> const& values){
+        run();
+        for (unsigned i = 0; i < ids.size(); ++i)
+            collapse_vector(ids[i], values[i], true);
+    }
+
+    // keep the state vector in a memory-mapped file in the directory `dir` (or in memory,
+    // if `dir` is empty), see mapped_allocator
+    void set_mmap_dir(std::string const& dir){
+        run();
+        StateVector newvec(vec_.begin(), vec_.end(), typename StateVector::allocator_type(dir));
+        vec_.swap(newvec);
+    }
+
+    // gate fusion: gates are collected in a window of pending gates, which is partitioned
+    // into fused gates (see plan_fusion) once it is full or the state is needed
+    void set_fusion_options(unsigned max_qubits, unsigned window){
+        if (max_qubits < 1 || window < 1)
+            throw(std::runtime_error("set_fusion_options(): max_qubits and window must be positive."));
+        run();
+        fusion_qubits_max_ = max_qubits;
+        fusion_window_ = window;
+    }
+
     template <class M>
     void apply_controlled_gate(M const& m, std::vector<unsigned> ids,
                                std::vector<unsigned> ctrl){
-        auto fused_gates = fused_gates_;
-        fused_gates.insert(m, ids, ctrl);
+        forget_classical(ids, ctrl);
+        if (diag_.size() > 0){
+            // pending diagonal gates go first: small ones join the window
+            if (diag_ids_.size() <= fusion_qubits_max_){
+                pending_.push_back({diagonal_matrix(diag_), diag_ids_, {}, {}});
+                diag_.clear();
+                diag_ids_.clear();
+            }
+            else
+                run();
+        }
+        pending_.push_back({Matrix(m.begin(), m.end()), ids, ctrl, {}});
+        if (pending_.size() >= fusion_window_)
+            run();
+    }
 
-        if (fused_gates.num_qubits() >= fusion_qubits_min_
-                && fused_gates.num_qubits() <= fusion_qubits_max_){
-            fused_gates_ = fused_gates;
+    // diagonal gates (of any size) are not fused into dense matrices, but are collected
+    // in a table of phases which is applied in one sweep over the state vector
+    void apply_diagonal_gate(DiagonalVector const& diag, std::vector<unsigned> const& ids,
+                             std::vector<unsigned> const& ctrl){
+        if (pending_.size() > 0){
+            // small ones join the window of pending dense gates
+            if (ids.size() + ctrl.size() <= fusion_qubits_max_){
+                pending_.push_back({diagonal_matrix(diag), ids, ctrl, {}});
+                if (pending_.size() >= fusion_window_)
+                    run();
+                return;
+            }
             run();
         }
-        else if (fused_gates.num_qubits() > fusion_qubits_max_
-                 || (fused_gates.num_qubits() - ids.size()) > fused_gates_.num_qubits()){
+
+        std::vector<unsigned> new_ids = diag_ids_;
+        new_ids.insert(new_ids.end(), ids.begin(), ids.end());
+        new_ids.insert(new_ids.end(), ctrl.begin(), ctrl.end());
+        std::sort(new_ids.begin(), new_ids.end());
+        new_ids.erase(std::unique(new_ids.begin(), new_ids.end()), new_ids.end());
+
+        if (diag_.size() > 0 && new_ids.size() > diag_qubits_max_){
             run();
-            fused_gates_.insert(m, ids, ctrl);
+            new_ids = ids;
+            new_ids.insert(new_ids.end(), ctrl.begin(), ctrl.end());
+            std::sort(new_ids.begin(), new_ids.end());
+        }
+
+        auto table = extend_diagonal(diag, ids, new_ids, ctrl);
+        if (diag_.size() > 0){
+            auto old_table = extend_diagonal(diag_, diag_ids_, new_ids, {});
+            for (std::size_t k = 0; k < table.size(); ++k)
+                table[k] *= old_table[k];
+        }
+        diag_ = std::move(table);
+        diag_ids_ = std::move(new_ids);
+    }
+
+    // permutation gates (X, CNOT, Toffoli, Swap, ...) map basis states to basis states:
+    // |j> -> |perm[j]> on the qubits `ids` (if all qubits in `ctrl` are 1)
+    void apply_permutation_gate(std::vector<std::size_t> const& perm,
+                                std::vector<unsigned> const& ids,
+                                std::vector<unsigned> const& ctrl){
+        update_classical(perm, ids, ctrl);
+        if (pending_.size() > 0 && ids.size() + ctrl.size() <= fusion_qubits_max_){
+            // small ones join the window of pending dense gates
+            Matrix m(perm.size(), typename Matrix::value_type(perm.size(), 0.));
+            for (std::size_t j = 0; j < perm.size(); ++j)
+                m[perm[j]][j] = 1.;
+            pending_.push_back({m, ids, ctrl, perm});
+            if (pending_.size() >= fusion_window_)
+                run();
+            return;
+        }
+        run();
+
+        std::vector<unsigned> positions(ids.size());
+        for (unsigned l = 0; l < ids.size(); ++l)
+            positions[l] = map_[ids[l]];
+        apply_permutation(perm, positions, get_control_mask(ctrl));
+    }
+
+    // apply a stream of (controlled) gates, where gate g is encoded as
+    //   matrix index, #qubits k, #controls c, k qubit ids, c control ids
+    // and the matrix index refers to the table `matrices`; diagonal and permutation matrices
+    // are detected once per table entry. If fuse is false, each gate is applied right away
+    void apply_gates(std::vector<Matrix> const& matrices, std::vector<unsigned> const& gates,
+                     bool fuse){
+        std::vector<DiagonalVector> diags(matrices.size());
+        std::vector<std::vector<std::size_t>> perms(matrices.size());
+        for (std::size_t t = 0; t < matrices.size(); ++t){
+            if (is_diagonal(matrices[t])){
+                diags[t].resize(matrices[t].size());
+                for (std::size_t i = 0; i < matrices[t].size(); ++i)
+                    diags[t][i] = matrices[t][i][i];
+            }
+            else
+                perms[t] = get_permutation(matrices[t]);
+        }
+
+        std::vector<unsigned> ids, ctrl;
+        std::size_t p = 0;
+        while (p + 3 <= gates.size()){
+            unsigned t = gates[p], k = gates[p + 1], c = gates[p + 2];
+            if (t >= matrices.size() || p + 3 + k + c > gates.size())
+                throw(std::runtime_error("apply_gates(): Invalid gate stream."));
+            ids.assign(gates.begin() + p + 3, gates.begin() + p + 3 + k);
+            ctrl.assign(gates.begin() + p + 3 + k, gates.begin() + p + 3 + k + c);
+            p += 3 + k + c;
+            if (diags[t].size() > 0)
+                apply_diagonal_gate(diags[t], ids, ctrl);
+            else if (perms[t].size() > 0)
+                apply_permutation_gate(perms[t], ids, ctrl);
+            else
+                apply_controlled_gate(matrices[t], ids, ctrl);
+            if (!fuse)
+                run();
         }
-        else
-            fused_gates_ = fused_gates;
     }
 
     template <class F, class QuReg>
-    void emulate_math(F const& f, QuReg quregs, std::vector<unsigned> ctrl,
-                      unsigned num_threads=1){
+    void emulate_math(F const& f, QuReg quregs, std::vector<unsigned> ctrl){
+        // evaluate f once for each state of the registers (not for each amplitude)
+        std::vector<unsigned> ids;
+        for (auto const& qureg : quregs)
+            ids.insert(ids.end(), qureg.begin(), qureg.end());
+        std::vector<std::size_t> table(1UL << ids.size());
+        std::vector<int> res(quregs.size());
+        for (std::size_t x = 0; x < table.size(); ++x){
+            unsigned offset = 0;
+            for (unsigned qr_i = 0; qr_i < quregs.size(); ++qr_i){
+                res[qr_i] = (x >> offset) & ((1UL << quregs[qr_i].size()) - 1);
+                offset += quregs[qr_i].size();
+            }
+            f(res);
+            std::size_t new_x = 0;
+            offset = 0;
+            for (unsigned qr_i = 0; qr_i < quregs.size(); ++qr_i){
+                new_x |= (static_cast<std::size_t>(res[qr_i])
+                          & ((1UL << quregs[qr_i].size()) - 1)) << offset;
+                offset += quregs[qr_i].size();
+            }
+            table[x] = new_x;
+        }
+        emulate_math_table(table, ids, ctrl);
+    }
+
+    void emulate_math_addConstant(int a, QuRegs const& quregs, std::vector<unsigned> const& ctrl){
+        emulate_math([a](std::vector<int> &res){ for (auto& x : res) x = x + a; },
+                     quregs, ctrl);
+    }
+
+    void emulate_math_addConstantModN(int a, int N, QuRegs const& quregs,
+                                      std::vector<unsigned> const& ctrl){
+        a = ((a % N) + N) % N;  // (% truncates, i.e., is negative for a < 0)
+        emulate_math([a, N](std::vector<int> &res){ for (auto& x : res) x = (x + a) % N; },
+                     quregs, ctrl);
+    }
+
+    void emulate_math_multiplyByConstantModN(int a, int N, QuRegs const& quregs,
+                                             std::vector<unsigned> const& ctrl){
+        a = ((a % N) + N) % N;
+        emulate_math([a, N](std::vector<int> &res){
+                         for (auto& x : res)
+                             x = static_cast<int>((static_cast<long long>(a) * x) % N);
+                     }, quregs, ctrl);
+    }
+
+    // map the basis state |x> of the qubits `ids` (with ids[0] as the lowest bit) to
+    // |table[x]> (if all qubits in `ctrl` are 1); amplitudes which are mapped to the same
+    // basis state are added up
+    void emulate_math_table(std::vector<std::size_t> const& table, std::vector<unsigned> const& ids,
+                            std::vector<unsigned> const& ctrl){
+        update_classical(table, ids, ctrl);
         run();
+        std::vector<unsigned> positions(ids.size());
+        for (unsigned l = 0; l < ids.size(); ++l)
+            positions[l] = map_[ids[l]];
         auto ctrlmask = get_control_mask(ctrl);
 
-        for (unsigned i = 0; i < quregs.size(); ++i)
-            for (unsigned j = 0; j < quregs[i].size(); ++j)
-                quregs[i][j] = map_[quregs[i][j]];
+        // collect the preimages of each basis state
+        std::vector<std::size_t> count(table.size() + 1, 0), preimages(table.size());
+        for (auto y : table)
+            count[(y & (table.size() - 1)) + 1]++;
+        bool permutation = true;
+        for (std::size_t y = 0; y < table.size(); ++y){
+            permutation = permutation && count[y + 1] == 1;
+            count[y + 1] += count[y];
+        }
+        if (permutation){
+            apply_permutation(table, positions, ctrlmask);
+            return;
+        }
+        {
+            auto next = count;
+            for (std::size_t x = 0; x < table.size(); ++x)
+                preimages[next[table[x] & (table.size() - 1)]++] = x;
+        }
 
-        StateVector newvec(vec_.size(), 0.);
-        std::vector<int> res(quregs.size());
+        std::vector<std::size_t> off(table.size(), 0);
+        for (std::size_t x = 0; x < table.size(); ++x)
+            for (unsigned l = 0; l < positions.size(); ++l)
+                off[x] |= ((x >> l) & 1UL) << positions[l];
+        auto lut = gather_lut(positions);
+        unsigned nbytes = (N_ + 7) / 8;
 
-        #pragma omp parallel for schedule(static) firstprivate(res) num_threads(num_threads)
+        StateVector newvec(vec_.size(), 0., vec_.get_allocator());
+        #pragma omp parallel for schedule(static)
         for (std::size_t i = 0; i < vec_.size(); ++i){
-            if ((ctrlmask&i) == ctrlmask){
-                for (unsigned qr_i = 0; qr_i < quregs.size(); ++qr_i){
-                    res[qr_i] = 0;
-                    for (unsigned qb_i = 0; qb_i < quregs[qr_i].size(); ++qb_i)
-                        res[qr_i] |= ((i >> quregs[qr_i][qb_i])&1) << qb_i;
-                }
-                f(res);
-                auto new_i = i;
-                for (unsigned qr_i = 0; qr_i < quregs.size(); ++qr_i){
-                    for (unsigned qb_i = 0; qb_i < quregs[qr_i].size(); ++qb_i){
-                        if (!(((new_i >> quregs[qr_i][qb_i])&1) == ((res[qr_i] >> qb_i)&1)))
-                            new_i ^= (1UL << quregs[qr_i][qb_i]);
-                    }
-                }
-                newvec[new_i] += vec_[i];
+            if ((i & ctrlmask) != ctrlmask){
+                newvec[i] = vec_[i];
+                continue;
             }
-            else
-                newvec[i] += vec_[i];
+            std::size_t y = 0;
+            for (unsigned b = 0; b < nbytes; ++b)
+                y |= lut[256 * b + ((i >> (8 * b)) & 255)];
+            std::size_t base = i & ~off.back();
+            complex_type sum = 0.;
+            for (std::size_t j = count[y]; j < count[y + 1]; ++j)
+                sum += vec_[base | off[preimages[j]]];
+            newvec[i] = sum;
         }
         vec_ = std::move(newvec);
     }
 
-    calc_type get_expectation_value(TermsDict const& td, std::vector<unsigned> const& ids){
+    double get_expectation_value(TermsDict const& td, std::vector<unsigned> const& ids){
         run();
-        calc_type expectation = 0.;
+        // accumulate in double precision, independent of the type of the state vector
+        double expectation = 0.;
         auto current_state = vec_;
+        auto classical = classical_;
         for (auto const& term : td){
             auto const& coefficient = term.second;
             apply_term(term.first, ids, {});
-            calc_type delta = 0.;
+            double delta = 0.;
             #pragma omp parallel for reduction(+:delta) schedule(static)
             for (std::size_t i = 0; i < vec_.size(); ++i){
                 auto const a1 = std::real(current_state[i]);
@@ -264,12 +543,60 @@ public:
             expectation += coefficient * delta;
             vec_ = current_state;
         }
+        classical_ = std::move(classical);
         return expectation;
     }
 
+    // expectation values of Pauli strings, given in groups of qubit-wise commuting ones:
+    // the qubits in the basis of a group (pairs of index into `ids` and 'X' or 'Y') are
+    // rotated to the Z basis, which turns each string of the group into a product of Z's,
+    // i.e., a parity given by the indices of its qubits. The values of all strings of a group
+    // are obtained in one sweep over the state vector, and the state is only copied if a
+    // group needs a rotation
+    std::vector<double> get_expectation_values(std::vector<std::pair<Term, QuRegs>> const& groups,
+                                               std::vector<unsigned> const& ids){
+        run();
+        complex_type const s = std::sqrt(calc_type(0.5));
+        complex_type const I(0., 1.);
+        Matrix const HX = {{s, s}, {s, -s}};
+        Matrix const HY = {{s, -I * s}, {s, I * s}}; // H S^dagger
+        std::vector<double> res;
+        StateVector saved(vec_.get_allocator());
+        auto classical = classical_;
+        bool rotated = false;
+        for (auto const& group : groups){
+            bool const rotate = group.first.size() > 0;
+            // restore the state if a previous group rotated it (in any order of the groups)
+            if (rotated){
+                vec_ = saved;
+                classical_ = classical;
+            }
+            else if (rotate)
+                saved = vec_;
+            if (rotate){
+                rotated = true;
+                for (auto const& op : group.first)
+                    apply_controlled_gate(op.second == 'X' ? HX : HY, {ids[op.first]}, {});
+                run();
+            }
+            std::vector<std::size_t> masks(group.second.size(), 0);
+            for (std::size_t t = 0; t < masks.size(); ++t)
+                for (auto k : group.second[t])
+                    masks[t] |= 1UL << map_[ids[k]];
+            auto values = get_parity_expectations(masks);
+            res.insert(res.end(), values.begin(), values.end());
+        }
+        if (rotated){
+            vec_.swap(saved);
+            classical_ = std::move(classical);
+        }
+        return res;
+    }
+
     void apply_qubit_operator(ComplexTermsDict const& td, std::vector<unsigned> const& ids){
+        forget_classical(ids, {});
         run();
-        auto new_state = StateVector(vec_.size(), 0.);
+        auto new_state = StateVector(vec_.size(), 0., vec_.get_allocator());
         auto current_state = vec_;
         for (auto const& term : td){
             auto const& coefficient = term.second;
@@ -283,8 +610,8 @@ public:
         vec_ = std::move(new_state);
     }
 
-    calc_type get_probability(std::vector<bool> const& bit_string,
-                              std::vector<unsigned> const& ids){
+    double get_probability(std::vector<bool> const& bit_string,
+                           std::vector<unsigned> const& ids){
         run();
         if (!check_ids(ids))
             throw(std::runtime_error("get_probability(): Unknown qubit id. Please make sure you have called eng.flush()."));
@@ -293,7 +620,7 @@ public:
             mask |= 1UL << map_[ids[i]];
             bit_str |= (bit_string[i]?1UL:0UL) << map_[ids[i]];
         }
-        calc_type probability = 0.;
+        double probability = 0.;
         #pragma omp parallel for reduction(+:probability) schedule(static)
         for (std::size_t i = 0; i < vec_.size(); ++i)
             if ((i & mask) == bit_str)
@@ -301,6 +628,18 @@ public:
         return probability;
     }
 
+    std::vector<std::size_t> sample(std::vector<unsigned> const& ids, std::size_t shots){
+        return sample_from(ids, shots, rng_);
+    }
+
+    std::vector<std::size_t> sample(std::vector<unsigned> const& ids, std::size_t shots,
+                                    unsigned seed){
+        RndEngine rnd_eng(seed);
+        std::uniform_real_distribution<double> dist(0., 1.);
+        std::function<double()> rng = std::bind(dist, std::ref(rnd_eng));
+        return sample_from(ids, shots, rng);
+    }
+
     complex_type const& get_amplitude(std::vector<bool> const& bit_string,
                                       std::vector<unsigned> const& ids){
         run();
@@ -320,6 +659,7 @@ public:
     void emulate_time_evolution(TermsDict const& tdict, calc_type const& time,
                                 std::vector<unsigned> const& ids,
                                 std::vector<unsigned> const& ctrl){
+        forget_classical(ids, ctrl);
         run();
         complex_type I(0., 1.);
         calc_type tr = 0., op_nrm = 0.;
@@ -333,15 +673,15 @@ public:
             }
         }
         unsigned s = std::abs(time) * op_nrm + 1.;
-        complex_type correction = std::exp(-time * I * tr / (double)s);
+        complex_type correction = std::exp(-time * I * tr / calc_type(s));
         auto output_state = vec_;
         auto ctrlmask = get_control_mask(ctrl);
         for (unsigned i = 0; i < s; ++i){
             calc_type nrm_change = 1.;
             for (unsigned k = 0; nrm_change > 1.e-12; ++k){
-                auto coeff = (-time * I) / double(s * (k + 1));
+                auto coeff = (-time * I) / calc_type(s * (k + 1));
                 auto current_state = vec_;
-                auto update = StateVector(vec_.size(), 0.);
+                auto update = StateVector(vec_.size(), 0., vec_.get_allocator());
                 for (auto const& tup : td){
                     apply_term(tup.first, ids, {});
                     #pragma omp parallel for schedule(static)
@@ -371,6 +711,216 @@ public:
         }
     }
 
+    // applies exp(-i*time*H) by a Lanczos (Krylov-subspace) method: the state is propagated
+    // in steps, each of which projects H onto the Krylov subspace spanned by v, Hv, ...,
+    // H^(m-1)v (m <= max_dim) and exponentiates the resulting tridiagonal matrix. Each step
+    // is as long as the a-posteriori error estimate allows (tol * step / time), and H is
+    // applied as a sum of Pauli strings (see PauliSum) in one pass over the state vector.
+    // Returns the number of steps and the number of applications of H
+    std::pair<unsigned, unsigned> emulate_time_evolution_krylov(TermsDict const& tdict,
+                                                               calc_type const& time,
+                                                               std::vector<unsigned> const& ids,
+                                                               std::vector<unsigned> const& ctrl,
+                                                               double tol, unsigned max_dim){
+        if (max_dim < 1 || !(tol > 0.))
+            throw(std::runtime_error("emulate_time_evolution_krylov(): max_dim and tol must be positive."));
+        forget_classical(ids, ctrl);
+        run();
+        auto op = compile_pauli_sum(tdict, ids);
+        auto ctrlmask = get_control_mask(ctrl);
+        double op_nrm = 0.;
+        for (auto const& term : tdict)
+            op_nrm += std::abs(term.second);
+        std::size_t n = vec_.size();
+        double total = std::abs(static_cast<double>(time)), done = 0.;
+        double sign = time < 0 ? -1. : 1.;
+        unsigned steps = 0, matvecs = 0;
+
+        // (the amplitudes outside of the control subspace are left as they are)
+        StateVector v(n, 0., vec_.get_allocator()), w(n, 0., vec_.get_allocator());
+        #pragma omp parallel for schedule(static)
+        for (std::size_t i = 0; i < n; ++i)
+            if ((i & ctrlmask) == ctrlmask)
+                v[i] = vec_[i];
+        std::vector<StateVector> V;
+        while (done < total && total > 0.){
+            double beta = std::sqrt(norm2(v));
+            if (beta == 0.)
+                break;
+            V.assign(1, v);
+            scale(V[0], 1. / beta);
+            std::vector<double> alpha, betas;
+            bool breakdown = false;
+            for (unsigned j = 0; j < max_dim; ++j){
+                apply_pauli_sum(op, V[j], w, ctrlmask);
+                ++matvecs;
+                alpha.push_back(std::real(dot(V[j], w)));
+                // (full re-orthogonalization)
+                for (unsigned k = 0; k <= j; ++k)
+                    axpy(-dot(V[k], w), V[k], w);
+                double b = std::sqrt(norm2(w));
+                betas.push_back(b);
+                if (b <= 1.e-14 * std::max(op_nrm, 1.)){
+                    breakdown = true;
+                    break;
+                }
+                if (j + 1 < max_dim){
+                    V.push_back(w);
+                    scale(V.back(), 1. / b);
+                }
+            }
+            std::size_t m = alpha.size();
+            std::vector<std::vector<double>> tridiag(m, std::vector<double>(m, 0.)), Q;
+            for (std::size_t k = 0; k < m; ++k){
+                tridiag[k][k] = alpha[k];
+                if (k + 1 < m)
+                    tridiag[k][k + 1] = tridiag[k + 1][k] = betas[k];
+            }
+            auto lambda = symmetric_eigen(tridiag, Q);
+
+            // coefficients of exp(-i T dt) e_1, shortening the step until it is accurate enough
+            double dt = total - done;
+            std::vector<std::complex<double>> c(m);
+            while (true){
+                for (std::size_t k = 0; k < m; ++k){
+                    c[k] = 0.;
+                    for (std::size_t l = 0; l < m; ++l)
+                        c[k] += Q[k][l] * Q[0][l] * std::exp(std::complex<double>(0., -sign * lambda[l] * dt));
+                }
+                double err = breakdown ? 0. : beta * betas[m - 1] * std::abs(c[m - 1]);
+                double allowed = tol * dt / total;
+                if (err <= allowed || dt <= 1.e-12 * total)
+                    break;
+                dt *= std::max(0.1, std::min(0.5, 0.9 * std::pow(allowed / err, 1. / m)));
+            }
+            #pragma omp parallel for schedule(static)
+            for (std::size_t i = 0; i < n; ++i){
+                std::complex<double> a = 0.;
+                for (std::size_t k = 0; k < m; ++k)
+                    a += c[k] * std::complex<double>(V[k][i]);
+                v[i] = complex_type(beta * a);
+            }
+            done += dt;
+            ++steps;
+        }
+        #pragma omp parallel for schedule(static)
+        for (std::size_t i = 0; i < n; ++i)
+            if ((i & ctrlmask) == ctrlmask)
+                vec_[i] = v[i];
+        return std::make_pair(steps, matvecs);
+    }
+
+    // quantum Fourier transform of the qubits `ids` (with ids[0] as the lowest bit), without
+    // the final swaps, i.e., |x> -> sum_y exp(2 pi i x rev(y) / 2^k) |y> / 2^(k/2), using an
+    // in-place radix-2 FFT (decimation in frequency, which yields the bit-reversed order)
+    void emulate_qft(std::vector<unsigned> const& ids, std::vector<unsigned> const& ctrl,
+                     bool inverse){
+        forget_classical(ids, ctrl);
+        run();
+        unsigned k = ids.size();
+        std::vector<unsigned> positions(k);
+        for (unsigned l = 0; l < k; ++l)
+            positions[l] = map_[ids[l]];
+        auto ctrlmask = get_control_mask(ctrl);
+        unsigned nbytes = (N_ + 7) / 8;
+        calc_type const s = std::sqrt(calc_type(0.5));
+        double const pi = 3.14159265358979323846;
+
+        for (unsigned t = 0; t < k; ++t){
+            // the QFT runs through the qubits from the highest to the lowest, its inverse in
+            // reverse order
+            unsigned stage = inverse ? t : k - 1 - t;
+            std::size_t d = 1UL << positions[stage];
+            // twiddle factors exp(+-i pi j / 2^stage), where j are the lower qubits
+            std::vector<unsigned> lower(positions.begin(), positions.begin() + stage);
+            auto lut = gather_lut(lower);
+            DiagonalVector twiddle(1UL << stage);
+            for (std::size_t j = 0; j < twiddle.size(); ++j)
+                twiddle[j] = complex_type(std::polar(1., (inverse ? -pi : pi) * j / twiddle.size())) * s;
+
+            #pragma omp parallel for schedule(static)
+            for (std::size_t r = 0; r < (vec_.size() >> 1); ++r){
+                std::size_t i = ((r & ~(d - 1)) << 1) | (r & (d - 1));
+                if ((i & ctrlmask) != ctrlmask)
+                    continue;
+                std::size_t j = 0;
+                for (unsigned b = 0; b < nbytes; ++b)
+                    j |= lut[256 * b + ((i >> (8 * b)) & 255)];
+                auto a = vec_[i], c = vec_[i + d];
+                if (inverse){
+                    c = nointrin::mul(c, twiddle[j]);
+                    a *= s;
+                    vec_[i] = a + c;
+                    vec_[i + d] = a - c;
+                }
+                else{
+                    vec_[i] = (a + c) * s;
+                    vec_[i + d] = nointrin::mul(a - c, twiddle[j]);
+                }
+            }
+        }
+    }
+
+    // uniformly controlled single-qubit gate: apply matrices[k] to the qubit `target` where
+    // the qubits `uctrl` are in state k (with uctrl[0] as the lowest bit), i.e., a
+    // block-diagonal matrix (and only where all qubits in `ctrl` are 1)
+    void apply_uniformly_controlled_gate(std::vector<Matrix> const& matrices, unsigned target,
+                                         std::vector<unsigned> const& uctrl,
+                                         std::vector<unsigned> const& ctrl){
+        forget_classical({target}, ctrl);
+        run();
+        std::vector<unsigned> positions(uctrl.size());
+        for (unsigned l = 0; l < uctrl.size(); ++l)
+            positions[l] = map_[uctrl[l]];
+        auto lut = gather_lut(positions);
+        unsigned nbytes = (N_ + 7) / 8;
+        auto ctrlmask = get_control_mask(ctrl);
+        std::size_t d = 1UL << map_[target];
+
+        #pragma omp parallel for schedule(static)
+        for (std::size_t r = 0; r < (vec_.size() >> 1); ++r){
+            std::size_t i = ((r & ~(d - 1)) << 1) | (r & (d - 1));
+            if ((i & ctrlmask) != ctrlmask)
+                continue;
+            std::size_t k = 0;
+            for (unsigned b = 0; b < nbytes; ++b)
+                k |= lut[256 * b + ((i >> (8 * b)) & 255)];
+            auto const& m = matrices[k];
+            auto a = vec_[i], c = vec_[i + d];
+            vec_[i] = nointrin::add(nointrin::mul(a, m[0][0]), nointrin::mul(c, m[0][1]));
+            vec_[i + d] = nointrin::add(nointrin::mul(a, m[1][0]), nointrin::mul(c, m[1][1]));
+        }
+    }
+
+    // load `state` onto the qubits `ids` (with ids[0] as the lowest bit), which must all be
+    // in state 0, i.e., |rest>|0> -> |rest>|state>
+    void emulate_state_preparation(StateVector const& state, std::vector<unsigned> const& ids){
+        forget_classical(ids, {});
+        run();
+        unsigned k = ids.size();
+        std::vector<std::size_t> off(state.size(), 0);
+        for (std::size_t j = 0; j < state.size(); ++j)
+            for (unsigned l = 0; l < k; ++l)
+                off[j] |= ((j >> l) & 1UL) << map_[ids[l]];
+        std::vector<unsigned> sorted_pos(k);
+        for (unsigned l = 0; l < k; ++l)
+            sorted_pos[l] = map_[ids[l]];
+        std::sort(sorted_pos.begin(), sorted_pos.end());
+
+        #pragma omp parallel for schedule(static)
+        for (std::size_t i = 0; i < (vec_.size() >> k); ++i){
+            // insert zeros at the positions of the qubits
+            std::size_t I = i;
+            for (auto p : sorted_pos)
+                I = ((I >> p) << (p + 1)) | (I & ((1UL << p) - 1));
+            auto const a = vec_[I];
+            if (a == complex_type(0.))
+                continue;
+            for (std::size_t j = 0; j < state.size(); ++j)
+                vec_[I + off[j]] = nointrin::mul(a, state[j]);
+        }
+    }
+
     void set_wavefunction(StateVector const& wavefunction, std::vector<unsigned> const& ordering){
         run();
         // make sure there are 2^n amplitudes for n qubits
@@ -382,6 +932,7 @@ public:
         // set mapping and wavefunction
         for (unsigned i = 0; i < ordering.size(); ++i)
             map_[ordering[i]] = i;
+        classical_.clear();
         #pragma omp parallel for schedule(static)
         for (std::size_t i = 0; i < wavefunction.size(); ++i)
             vec_[i] = wavefunction[i];
@@ -398,7 +949,7 @@ public:
             val |= ((values[i]?1UL:0UL) << map_[ids[i]]);
         }
         // set bad entries to 0 and compute probability of outcome to renormalize
-        calc_type N = 0.;
+        double N = 0.;
         #pragma omp parallel for reduction(+:N) schedule(static)
         for (std::size_t i = 0; i < vec_.size(); ++i){
             if ((i & mask) == val)
@@ -415,70 +966,674 @@ public:
             else
                 vec_[i] *= N;
         }
+        for (unsigned i = 0; i < ids.size(); ++i)
+            classical_[ids[i]] = values[i];
     }
 
     void run(){
-        if (fused_gates_.size() < 1)
+        if (diag_.size() > 0){
+            std::vector<unsigned> positions(diag_ids_.size());
+            for (unsigned i = 0; i < diag_ids_.size(); ++i)
+                positions[i] = map_[diag_ids_[i]];
+            apply_phase_table(diag_, positions, 0);
+            diag_.clear();
+            diag_ids_.clear();
+        }
+        if (pending_.size() < 1)
             return;
 
-        Fusion::Matrix m;
-        Fusion::IndexVector ids, ctrls;
+        auto gates = std::move(pending_);
+        pending_.clear();
+        std::vector<FusedGate> fused;
+        for (auto const& block : plan_fusion(gates))
+            fused.push_back(fuse(gates, block));
+
+        for (auto const& gate : fused)
+            apply_fused_gate(gate);
+    }
+
+    std::tuple<Map, StateVector&> cheat(){
+        run();
+        return make_tuple(map_, std::ref(vec_));
+    }
 
-        fused_gates_.perform_fusion(m, ids, ctrls);
+    ~BasicSimulator(){
+    }
 
-        for (auto& id : ids)
-            id = map_[id];
+private:
+    // partition the window of pending gates into blocks, which are fused into one gate each:
+    // a block is extended by gates further down the window if these commute with the gates
+    // skipped so far (i.e., act on other qubits) and if the extra flops of the wider fused
+    // gate cost less than a separate pass over the state vector
+    std::vector<std::vector<std::size_t>> plan_fusion(std::vector<PendingGate> const& gates){
+        // (relative) cost of a pass with a k-qubit gate: the pass is memory-bound for gates
+        // on fewer than 3 qubits, and the flops double with every qubit beyond
+        auto cost = [](std::size_t k){ return std::max<std::size_t>(1UL << k, 6); };
+        std::vector<std::vector<std::size_t>> blocks;
+        std::vector<char> done(gates.size(), 0);
+        for (std::size_t first = 0; first < gates.size(); ++first){
+            if (done[first])
+                continue;
+            done[first] = 1;
+            std::vector<std::size_t> block = {first};
+            // qubits of the fused gate (as in BasicFusion: the controls which are common to
+            // all gates of the block are kept as controls)
+            std::set<unsigned> targets(gates[first].ids.begin(), gates[first].ids.end());
+            std::set<unsigned> ctrls(gates[first].ctrl.begin(), gates[first].ctrl.end());
+            std::set<unsigned> blocked; // qubits of the skipped gates
+            for (std::size_t g = first + 1; g < gates.size(); ++g){
+                if (done[g])
+                    continue;
+                auto const& gate = gates[g];
+                bool commutes = true;
+                for (auto q : gate.ids)
+                    commutes = commutes && blocked.count(q) == 0;
+                for (auto q : gate.ctrl)
+                    commutes = commutes && blocked.count(q) == 0;
+                if (commutes){
+                    auto new_targets = targets;
+                    new_targets.insert(gate.ids.begin(), gate.ids.end());
+                    std::set<unsigned> new_ctrls;
+                    for (auto c : gate.ctrl){
+                        if (ctrls.count(c))
+                            new_ctrls.insert(c);
+                        else
+                            new_targets.insert(c);
+                    }
+                    for (auto c : ctrls)
+                        if (new_ctrls.count(c) == 0)
+                            new_targets.insert(c);
+                    if (new_targets.size() <= fusion_qubits_max_
+                            && cost(new_targets.size()) <= cost(targets.size()) + cost(gate.ids.size())){
+                        block.push_back(g);
+                        done[g] = 1;
+                        targets = std::move(new_targets);
+                        ctrls = std::move(new_ctrls);
+                        continue;
+                    }
+                }
+                blocked.insert(gate.ids.begin(), gate.ids.end());
+                blocked.insert(gate.ctrl.begin(), gate.ctrl.end());
+            }
+            blocks.push_back(std::move(block));
+        }
+        return blocks;
+    }
 
-        auto ctrlmask = get_control_mask(ctrls);
+    FusedGate fuse(std::vector<PendingGate> const& gates, std::vector<std::size_t> const& block){
+        FusedGate res;
+        IndexVector ids, ctrls;
+        if (block.size() == 1){
+            auto const& gate = gates[block[0]];
+            res.m = gate.m;
+            ids = gate.ids;
+            ctrls = gate.ctrl;
+            res.perm = gate.perm;
+        }
+        else{
+            Fusion fusion;
+            for (auto g : block)
+                fusion.insert(gates[g].m, gates[g].ids, gates[g].ctrl);
+            fusion.perform_fusion(res.m, ids, ctrls);
+        }
+        for (auto id : ids)
+            res.positions.push_back(map_[id]);
+        res.ctrlmask = get_control_mask(ctrls);
+        res.diagonal = is_diagonal(res.m);
+        return res;
+    }
 
+    void apply_fused_gate(FusedGate const& gate){
+        if (gate.perm.size() > 0){
+            apply_permutation(gate.perm, gate.positions, gate.ctrlmask);
+            return;
+        }
+        if (gate.diagonal){
+            DiagonalVector diag(gate.m.size());
+            for (std::size_t i = 0; i < gate.m.size(); ++i)
+                diag[i] = gate.m[i][i];
+            apply_phase_table(diag, gate.positions, gate.ctrlmask);
+            return;
+        }
+        auto const& ids = gate.positions;
+        auto const& m = gate.m;
+        auto ctrlmask = gate.ctrlmask;
         switch (ids.size()){
             case 1:
                 #pragma omp parallel
-                kernel(vec_, ids[0], m, ctrlmask);
+                Kernels<calc_type>::apply(vec_, ids[0], m, ctrlmask);
                 break;
             case 2:
                 #pragma omp parallel
-                kernel(vec_, ids[1], ids[0], m, ctrlmask);
+                Kernels<calc_type>::apply(vec_, ids[1], ids[0], m, ctrlmask);
                 break;
             case 3:
                 #pragma omp parallel
-                kernel(vec_, ids[2], ids[1], ids[0], m, ctrlmask);
+                Kernels<calc_type>::apply(vec_, ids[2], ids[1], ids[0], m, ctrlmask);
                 break;
             case 4:
                 #pragma omp parallel
-                kernel(vec_, ids[3], ids[2], ids[1], ids[0], m, ctrlmask);
+                Kernels<calc_type>::apply(vec_, ids[3], ids[2], ids[1], ids[0], m, ctrlmask);
                 break;
             case 5:
                 #pragma omp parallel
-                kernel(vec_, ids[4], ids[3], ids[2], ids[1], ids[0], m, ctrlmask);
+                Kernels<calc_type>::apply(vec_, ids[4], ids[3], ids[2], ids[1], ids[0], m, ctrlmask);
                 break;
+            default:
+                apply_large_gate(gate);
         }
+    }
 
-        fused_gates_ = Fusion();
+    // apply a dense (fused) gate on more than 5 qubits
+    void apply_large_gate(FusedGate const& gate){
+        auto const& ids = gate.positions;
+        auto const& m = gate.m;
+        auto ctrlmask = gate.ctrlmask;
+        std::size_t K = m.size();
+        std::vector<std::size_t> off(K, 0);
+        for (std::size_t j = 0; j < K; ++j)
+            for (unsigned l = 0; l < ids.size(); ++l)
+                off[j] |= ((j >> l) & 1UL) << ids[l];
+        auto sorted_pos = ids;
+        std::sort(sorted_pos.begin(), sorted_pos.end());
+        #pragma omp parallel
+        {
+            std::vector<complex_type> v(K);
+            #pragma omp for schedule(static)
+            for (std::size_t r = 0; r < (vec_.size() >> ids.size()); ++r){
+                std::size_t base = r;
+                for (auto p : sorted_pos)
+                    base = ((base >> p) << (p + 1)) | (base & ((1UL << p) - 1));
+                if ((base & ctrlmask) != ctrlmask)
+                    continue;
+                for (std::size_t j = 0; j < K; ++j)
+                    v[j] = vec_[base + off[j]];
+                for (std::size_t i = 0; i < K; ++i){
+                    complex_type res = 0.;
+                    for (std::size_t j = 0; j < K; ++j)
+                        res = nointrin::add(res, nointrin::mul(m[i][j], v[j]));
+                    vec_[base + off[i]] = res;
+                }
+            }
+        }
     }
 
-    std::tuple<Map, StateVector&> cheat(){
+    // return the diagonal `diag` acting on the qubits `ids`, extended to the qubits `new_ids`
+    // (which include ids and ctrl) and acting trivially unless all qubits in `ctrl` are 1
+    DiagonalVector extend_diagonal(DiagonalVector const& diag, std::vector<unsigned> const& ids,
+                                   std::vector<unsigned> const& new_ids,
+                                   std::vector<unsigned> const& ctrl){
+        auto index_of = [&](unsigned id){
+            return std::lower_bound(new_ids.begin(), new_ids.end(), id) - new_ids.begin();
+        };
+        std::size_t ctrlmask = 0;
+        for (auto c : ctrl)
+            ctrlmask |= 1UL << index_of(c);
+        std::vector<unsigned> loc(ids.size());
+        for (unsigned l = 0; l < ids.size(); ++l)
+            loc[l] = index_of(ids[l]);
+
+        DiagonalVector res(1UL << new_ids.size(), 1.);
+        for (std::size_t t = 0; t < res.size(); ++t){
+            if ((t & ctrlmask) != ctrlmask)
+                continue;
+            std::size_t k = 0;
+            for (unsigned l = 0; l < loc.size(); ++l)
+                k |= ((t >> loc[l]) & 1UL) << l;
+            res[t] = diag[k];
+        }
+        return res;
+    }
+
+    // multiply each amplitude by table[k], where bit l of k is the bit at position positions[l]
+    // of the amplitude's index (and only where all bits in ctrlmask are set)
+    void apply_phase_table(DiagonalVector const& table, std::vector<unsigned> const& positions,
+                           std::size_t ctrlmask){
+        // fold the controls into the table, with (sorted) positions
+        std::vector<unsigned> ctrl_pos, pos = positions;
+        for (unsigned p = 0; p < N_; ++p)
+            if ((ctrlmask >> p) & 1UL)
+                ctrl_pos.push_back(p);
+        pos.insert(pos.end(), ctrl_pos.begin(), ctrl_pos.end());
+        std::sort(pos.begin(), pos.end());
+        auto phases = extend_diagonal(table, positions, pos, ctrl_pos);
+
+        // the amplitudes are processed in chunks of 2^lowbits, in which the phases only
+        // depend on the (nlow) positions below lowbits
+        unsigned lowbits = std::min(8U, N_);
+        std::size_t chunk = 1UL << lowbits;
+        unsigned nlow = std::lower_bound(pos.begin(), pos.end(), lowbits) - pos.begin();
+
+        auto lut = gather_lut(pos);
+        unsigned nbytes = (N_ + 7) / 8;
+
+        if (nlow == 0){
+            // the phase is constant within blocks below the lowest position
+            std::size_t block = 1UL << pos[0];
+            #pragma omp parallel for schedule(static)
+            for (std::size_t i = 0; i < vec_.size(); i += block){
+                std::size_t k = 0;
+                for (unsigned b = 0; b < nbytes; ++b)
+                    k |= lut[256 * b + ((i >> (8 * b)) & 255)];
+                auto const phase = phases[k];
+                if (phase == complex_type(1.))
+                    continue; // e.g., the controls are not all 1
+                for (std::size_t j = 0; j < block; ++j)
+                    vec_[i + j] = nointrin::mul(vec_[i + j], phase);
+            }
+        }
+        else if ((phases.size() >> nlow) * chunk <= (1UL << 16)){
+            // precompute the phases of a chunk for each value of the higher positions
+            DiagonalVector rows((phases.size() >> nlow) * chunk);
+            std::vector<char> trivial(phases.size() >> nlow, 1);
+            for (std::size_t h = 0; h < (phases.size() >> nlow); ++h){
+                for (std::size_t j = 0; j < chunk; ++j){
+                    rows[h * chunk + j] = phases[(h << nlow) | lut[j]];
+                    if (rows[h * chunk + j] != complex_type(1.))
+                        trivial[h] = 0;
+                }
+            }
+            #pragma omp parallel for schedule(static)
+            for (std::size_t i = 0; i < vec_.size(); i += chunk){
+                std::size_t h = 0;
+                for (unsigned b = 1; b < nbytes; ++b)
+                    h |= lut[256 * b + ((i >> (8 * b)) & 255)];
+                if (trivial[h >> nlow])
+                    continue;
+                auto const* row = &rows[(h >> nlow) * chunk];
+                for (std::size_t j = 0; j < chunk; ++j)
+                    vec_[i + j] = nointrin::mul(vec_[i + j], row[j]);
+            }
+        }
+        else{
+            #pragma omp parallel for schedule(static)
+            for (std::size_t i = 0; i < vec_.size(); ++i){
+                std::size_t k = 0;
+                for (unsigned b = 0; b < nbytes; ++b)
+                    k |= lut[256 * b + ((i >> (8 * b)) & 255)];
+                vec_[i] = nointrin::mul(vec_[i], phases[k]);
+            }
+        }
+    }
+
+    // look-up tables for gathering the bits at the given positions of an index: the bits of
+    // byte b of the index contribute lut[256 * b + byte] (bit l is the bit at positions[l])
+    std::vector<std::size_t> gather_lut(std::vector<unsigned> const& positions){
+        std::vector<std::size_t> lut(256 * ((N_ + 7) / 8), 0);
+        for (unsigned l = 0; l < positions.size(); ++l)
+            for (std::size_t v = 0; v < 256; ++v)
+                lut[256 * (positions[l] / 8) + v] |= ((v >> (positions[l] % 8)) & 1UL) << l;
+        return lut;
+    }
+
+    // move amplitudes according to a permutation of the basis states of the qubits at the
+    // given positions (only where all bits in ctrlmask are set); no arithmetic involved
+    void apply_permutation(std::vector<std::size_t> const& perm,
+                           std::vector<unsigned> const& positions, std::size_t ctrlmask){
+        if (positions.size() == 1 && perm[0] == 1){
+            // (controlled) NOT: swap the two halves of each block
+            std::size_t d = 1UL << positions[0];
+            if ((ctrlmask & (d - 1)) == 0){
+                // the controls are constant within each half
+                #pragma omp parallel for schedule(static)
+                for (std::size_t i = 0; i < vec_.size(); i += 2 * d)
+                    if ((i & ctrlmask) == ctrlmask)
+                        std::swap_ranges(&vec_[i], &vec_[i] + d, &vec_[i + d]);
+            }
+            else{
+                #pragma omp parallel for schedule(static)
+                for (std::size_t i = 0; i < vec_.size(); ++i)
+                    if ((i & d) == 0 && (i & ctrlmask) == ctrlmask)
+                        std::swap(vec_[i], vec_[i + d]);
+            }
+            return;
+        }
+
+        std::size_t k = positions.size();
+        std::vector<std::size_t> off(perm.size(), 0);
+        for (std::size_t j = 0; j < perm.size(); ++j)
+            for (unsigned l = 0; l < k; ++l)
+                off[j] |= ((j >> l) & 1UL) << positions[l];
+        std::vector<std::size_t> moved; // basis states which are not fixed points
+        for (std::size_t j = 0; j < perm.size(); ++j)
+            if (perm[j] != j)
+                moved.push_back(j);
+        auto sorted_pos = positions;
+        std::sort(sorted_pos.begin(), sorted_pos.end());
+
+        #pragma omp parallel
+        {
+            std::vector<complex_type> tmp(moved.size());
+            #pragma omp for schedule(static)
+            for (std::size_t i = 0; i < (vec_.size() >> k); ++i){
+                // insert zeros at the positions of the qubits
+                std::size_t I = i;
+                for (auto p : sorted_pos)
+                    I = ((I >> p) << (p + 1)) | (I & ((1UL << p) - 1));
+                if ((I & ctrlmask) != ctrlmask)
+                    continue;
+                for (std::size_t m = 0; m < moved.size(); ++m)
+                    tmp[m] = vec_[I + off[moved[m]]];
+                for (std::size_t m = 0; m < moved.size(); ++m)
+                    vec_[I + off[perm[moved[m]]]] = tmp[m];
+            }
+        }
+    }
+
+    static Matrix diagonal_matrix(DiagonalVector const& diag){
+        Matrix m(diag.size(), typename Matrix::value_type(diag.size(), 0.));
+        for (std::size_t i = 0; i < diag.size(); ++i)
+            m[i][i] = diag[i];
+        return m;
+    }
+
+    static bool is_diagonal(Matrix const& m){
+        for (std::size_t i = 0; i < m.size(); ++i)
+            for (std::size_t j = 0; j < m.size(); ++j)
+                if (i != j && m[i][j] != complex_type(0.))
+                    return false;
+        return true;
+    }
+
+    // return perm if m maps the basis state j to perm[j] (i.e., m is a permutation matrix),
+    // and an empty vector otherwise
+    static std::vector<std::size_t> get_permutation(Matrix const& m){
+        std::vector<std::size_t> perm(m.size(), m.size());
+        std::vector<char> hit(m.size(), 0);
+        for (std::size_t i = 0; i < m.size(); ++i)
+            for (std::size_t j = 0; j < m.size(); ++j){
+                if (m[i][j] == complex_type(0.))
+                    continue;
+                if (m[i][j] != complex_type(1.) || perm[j] != m.size() || hit[i])
+                    return {};
+                perm[j] = i;
+                hit[i] = 1;
+            }
+        for (auto i : perm)
+            if (i == m.size())
+                return {};
+        return perm;
+    }
+
+    std::vector<std::size_t> sample_from(std::vector<unsigned> const& ids, std::size_t shots,
+                                         std::function<double()>& rng){
         run();
-        return make_tuple(map_, std::ref(vec_));
+        if (!check_ids(ids))
+            throw(std::runtime_error("sample(): Unknown qubit id. Please make sure you have called eng.flush()."));
+        std::vector<unsigned> positions(ids.size());
+        for (unsigned i = 0; i < ids.size(); ++i)
+            positions[i] = map_[ids[i]];
+
+        // marginal distribution over the qubits, as a cumulative sum
+        auto cumulative = get_marginal_probabilities(positions);
+        for (std::size_t x = 1; x < cumulative.size(); ++x)
+            cumulative[x] += cumulative[x-1];
+        double total = cumulative.back();
+
+        std::vector<std::size_t> res(shots);
+        for (std::size_t s = 0; s < shots; ++s){
+            auto it = std::upper_bound(cumulative.begin(), cumulative.end(),
+                                       rng() * total);
+            res[s] = std::min<std::size_t>(it - cumulative.begin(), cumulative.size() - 1);
+        }
+        return res;
     }
 
-    ~Simulator(){
+    // expectation values of the parities of the bits in `masks`, i.e., of the products of Z's:
+    // if there are more masks than bits involved, the parities of all subsets of these bits
+    // are obtained at once by a Walsh-Hadamard transform of their marginal distribution
+    std::vector<double> get_parity_expectations(std::vector<std::size_t> const& masks){
+        std::vector<double> res(masks.size(), 0.);
+        std::size_t all = 0;
+        for (auto mask : masks)
+            all |= mask;
+        std::vector<unsigned> positions;
+        for (unsigned pos = 0; pos < N_; ++pos)
+            if ((all >> pos) & 1)
+                positions.push_back(pos);
+        if (masks.size() > positions.size()){
+            auto probs = get_marginal_probabilities(positions);
+            for (std::size_t h = 1; h < probs.size(); h <<= 1){
+                #pragma omp parallel for schedule(static)
+                for (std::size_t i = 0; i < probs.size(); i += 2 * h){
+                    for (std::size_t j = i; j < i + h; ++j){
+                        double a = probs[j], b = probs[j + h];
+                        probs[j] = a + b;
+                        probs[j + h] = a - b;
+                    }
+                }
+            }
+            for (std::size_t t = 0; t < masks.size(); ++t){
+                std::size_t x = 0;
+                for (unsigned k = 0; k < positions.size(); ++k)
+                    x |= ((masks[t] >> positions[k]) & 1UL) << k;
+                res[t] = probs[x];
+            }
+            return res;
+        }
+        #pragma omp parallel
+        {
+            std::vector<double> local(masks.size(), 0.);
+            #pragma omp for schedule(static)
+            for (std::size_t i = 0; i < vec_.size(); ++i){
+                double p = std::norm(vec_[i]);
+                if (p == 0.)
+                    continue;
+                for (std::size_t t = 0; t < masks.size(); ++t)
+                    local[t] += parity(i & masks[t]) ? -p : p;
+            }
+            #pragma omp critical
+            for (std::size_t t = 0; t < masks.size(); ++t)
+                res[t] += local[t];
+        }
+        return res;
+    }
+
+    static bool parity(std::size_t x){
+#if defined(__GNUC__)
+        return __builtin_parityll(x) == 1;
+#else
+        x ^= x >> 32;
+        x ^= x >> 16;
+        x ^= x >> 8;
+        x ^= x >> 4;
+        x ^= x >> 2;
+        x ^= x >> 1;
+        return (x & 1) == 1;
+#endif
+    }
+
+    std::vector<double> get_marginal_probabilities(std::vector<unsigned> const& positions){
+        std::vector<double> probs(1UL << positions.size(), 0.);
+        std::size_t mask = 0;
+        for (auto pos : positions)
+            mask |= 1UL << pos;
+
+        if (probs.size() <= 1UL << 16){
+            // few outcomes: accumulate per-thread histograms
+            #pragma omp parallel
+            {
+                std::vector<double> local(probs.size(), 0.);
+                #pragma omp for schedule(static)
+                for (std::size_t i = 0; i < vec_.size(); ++i){
+                    std::size_t x = 0;
+                    for (unsigned k = 0; k < positions.size(); ++k)
+                        x |= ((i >> positions[k]) & 1UL) << k;
+                    local[x] += std::norm(vec_[i]);
+                }
+                #pragma omp critical
+                for (std::size_t x = 0; x < probs.size(); ++x)
+                    probs[x] += local[x];
+            }
+        }
+        else{
+            // many outcomes: sum over all states of the remaining qubits
+            std::size_t rest = (vec_.size() - 1) & ~mask;
+            #pragma omp parallel for schedule(static)
+            for (std::size_t x = 0; x < probs.size(); ++x){
+                std::size_t base = 0;
+                for (unsigned k = 0; k < positions.size(); ++k)
+                    base |= ((x >> k) & 1UL) << positions[k];
+                double p = 0.;
+                std::size_t r = 0;
+                do{
+                    p += std::norm(vec_[base | r]);
+                    r = (r - rest) & rest; // next subset of the remaining bits
+                } while (r != 0);
+                probs[x] = p;
+            }
+        }
+        return probs;
     }
 
-private:
     void apply_term(Term const& term, std::vector<unsigned> const& ids,
                     std::vector<unsigned> const& ctrl){
         complex_type I(0., 1.);
-        Fusion::Matrix X = {{0., 1.}, {1., 0.}};
-        Fusion::Matrix Y = {{0., -I}, {I, 0.}};
-        Fusion::Matrix Z = {{1., 0.}, {0., -1.}};
-        std::vector<Fusion::Matrix> gates = {X, Y, Z};
+        Matrix X = {{0., 1.}, {1., 0.}};
+        Matrix Y = {{0., -I}, {I, 0.}};
+        Matrix Z = {{1., 0.}, {0., -1.}};
+        std::vector<Matrix> gates = {X, Y, Z};
         for (auto const& local_op : term){
             unsigned id = ids[local_op.first];
             apply_controlled_gate(gates[local_op.second - 'X'], {id}, ctrl);
         }
         run();
     }
+    // a sum of Pauli strings, grouped by the bits they flip (the positions of their X's and
+    // Y's): the string P maps |j> to coeff * (-1)^parity(j & zymask) |j ^ flip>, where zymask
+    // holds the positions of its Y's and Z's (and coeff contains the factor i of each Y)
+    struct PauliSum{
+        std::vector<std::size_t> flips;
+        std::vector<std::vector<std::pair<std::size_t, complex_type>>> phases;
+    };
+
+    PauliSum compile_pauli_sum(TermsDict const& tdict, std::vector<unsigned> const& ids){
+        PauliSum op;
+        std::map<std::size_t, std::size_t> index;
+        for (auto const& term : tdict){
+            std::size_t flip = 0, zymask = 0;
+            complex_type coeff = term.second;
+            for (auto const& local_op : term.first){
+                std::size_t bit = 1UL << map_[ids[local_op.first]];
+                if (local_op.second != 'Z')
+                    flip |= bit;
+                if (local_op.second != 'X')
+                    zymask |= bit;
+                if (local_op.second == 'Y')
+                    coeff *= complex_type(0., 1.);
+            }
+            if (index.count(flip) == 0){
+                index[flip] = op.flips.size();
+                op.flips.push_back(flip);
+                op.phases.emplace_back();
+            }
+            op.phases[index[flip]].push_back(std::make_pair(zymask, coeff));
+        }
+        return op;
+    }
+
+    // w = H v on the subspace where all bits in ctrlmask are set (and 0 elsewhere)
+    void apply_pauli_sum(PauliSum const& op, StateVector const& v, StateVector& w,
+                         std::size_t ctrlmask){
+        #pragma omp parallel for schedule(static)
+        for (std::size_t i = 0; i < v.size(); ++i){
+            complex_type res = 0.;
+            if ((i & ctrlmask) == ctrlmask){
+                for (std::size_t f = 0; f < op.flips.size(); ++f){
+                    std::size_t j = i ^ op.flips[f];
+                    complex_type sum = 0.;
+                    for (auto const& phase : op.phases[f])
+                        sum += parity(j & phase.first) ? -phase.second : phase.second;
+                    res += sum * v[j];
+                }
+            }
+            w[i] = res;
+        }
+    }
+
+    static std::complex<double> dot(StateVector const& a, StateVector const& b){
+        double re = 0., im = 0.;
+        #pragma omp parallel for reduction(+:re,im) schedule(static)
+        for (std::size_t i = 0; i < a.size(); ++i){
+            auto x = std::conj(a[i]) * b[i];
+            re += std::real(x);
+            im += std::imag(x);
+        }
+        return std::complex<double>(re, im);
+    }
+
+    static double norm2(StateVector const& a){
+        double res = 0.;
+        #pragma omp parallel for reduction(+:res) schedule(static)
+        for (std::size_t i = 0; i < a.size(); ++i)
+            res += std::norm(a[i]);
+        return res;
+    }
+
+    // b += x * a
+    static void axpy(std::complex<double> x, StateVector const& a, StateVector& b){
+        complex_type y(x);
+        #pragma omp parallel for schedule(static)
+        for (std::size_t i = 0; i < a.size(); ++i)
+            b[i] += y * a[i];
+    }
+
+    static void scale(StateVector& a, double x){
+        calc_type y = static_cast<calc_type>(x);
+        #pragma omp parallel for schedule(static)
+        for (std::size_t i = 0; i < a.size(); ++i)
+            a[i] *= y;
+    }
+
+    // eigen-decomposition A = Q diag(lambda) Q^T of a small symmetric matrix by cyclic Jacobi
+    // rotations (A is overwritten); returns lambda
+    static std::vector<double> symmetric_eigen(std::vector<std::vector<double>>& A,
+                                               std::vector<std::vector<double>>& Q){
+        std::size_t m = A.size();
+        Q.assign(m, std::vector<double>(m, 0.));
+        for (std::size_t k = 0; k < m; ++k)
+            Q[k][k] = 1.;
+        for (unsigned sweep = 0; sweep < 64; ++sweep){
+            double off = 0., all = 0.;
+            for (std::size_t p = 0; p < m; ++p)
+                for (std::size_t q = 0; q < m; ++q){
+                    all += A[p][q] * A[p][q];
+                    if (p != q)
+                        off += A[p][q] * A[p][q];
+                }
+            if (off <= 1.e-32 * all)
+                break;
+            for (std::size_t p = 0; p < m; ++p){
+                for (std::size_t q = p + 1; q < m; ++q){
+                    if (A[p][q] == 0.)
+                        continue;
+                    double theta = (A[q][q] - A[p][p]) / (2. * A[p][q]);
+                    double t = (theta >= 0. ? 1. : -1.) / (std::abs(theta) + std::sqrt(theta * theta + 1.));
+                    double c = 1. / std::sqrt(t * t + 1.), s = t * c;
+                    for (std::size_t k = 0; k < m; ++k){
+                        double akp = A[k][p], akq = A[k][q];
+                        A[k][p] = c * akp - s * akq;
+                        A[k][q] = s * akp + c * akq;
+                    }
+                    for (std::size_t k = 0; k < m; ++k){
+                        double apk = A[p][k], aqk = A[q][k];
+                        A[p][k] = c * apk - s * aqk;
+                        A[q][k] = s * apk + c * aqk;
+                    }
+                    for (std::size_t k = 0; k < m; ++k){
+                        double qkp = Q[k][p], qkq = Q[k][q];
+                        Q[k][p] = c * qkp - s * qkq;
+                        Q[k][q] = s * qkp + c * qkq;
+                    }
+                }
+            }
+        }
+        std::vector<double> lambda(m);
+        for (std::size_t k = 0; k < m; ++k)
+            lambda[k] = A[k][k];
+        return lambda;
+    }
+
     std::size_t get_control_mask(std::vector<unsigned> const& ctrls){
         std::size_t ctrlmask = 0;
         for (auto c : ctrls)
@@ -486,6 +1641,50 @@ private:
         return ctrlmask;
     }
 
+    // returns true if one of the qubits in `ctrl` is known to be 0, i.e., a gate with these
+    // controls acts trivially
+    bool is_disabled(std::vector<unsigned> const& ctrl){
+        for (auto c : ctrl){
+            auto it = classical_.find(c);
+            if (it != classical_.end() && !it->second)
+                return true;
+        }
+        return false;
+    }
+
+    // the qubits `ids` may leave their basis states under a gate with controls `ctrl`
+    void forget_classical(std::vector<unsigned> const& ids, std::vector<unsigned> const& ctrl){
+        if (is_disabled(ctrl))
+            return;
+        for (auto id : ids)
+            classical_.erase(id);
+    }
+
+    // update the known values of the qubits `ids` under the map |x> -> |table[x]> (if all
+    // qubits in `ctrl` are 1), which is possible if the values of all of them are known
+    void update_classical(std::vector<std::size_t> const& table, std::vector<unsigned> const& ids,
+                          std::vector<unsigned> const& ctrl){
+        if (is_disabled(ctrl))
+            return;
+        bool known = true;
+        for (auto c : ctrl)
+            known = known && classical_.count(c) != 0;
+        std::size_t x = 0;
+        for (unsigned l = 0; l < ids.size() && known; ++l){
+            auto it = classical_.find(ids[l]);
+            known = it != classical_.end();
+            if (known)
+                x |= static_cast<std::size_t>(it->second) << l;
+        }
+        if (!known){
+            forget_classical(ids, {});
+            return;
+        }
+        std::size_t y = table[x];
+        for (unsigned l = 0; l < ids.size(); ++l)
+            classical_[ids[l]] = ((y >> l) & 1) == 1;
+    }
+
     bool check_ids(std::vector<unsigned> const& ids){
         for (auto id : ids)
             if (!map_.count(id))
@@ -496,10 +1695,17 @@ private:
     unsigned N_; // #qubits
     StateVector vec_;
     Map map_;
-    Fusion fused_gates_;
-    unsigned fusion_qubits_min_, fusion_qubits_max_;
+    std::map<unsigned, bool> classical_; // values of the qubits known to be in a basis state
+    std::vector<PendingGate> pending_; // window of gates which have not been applied yet
+    unsigned fusion_qubits_max_, fusion_window_;
+    DiagonalVector diag_; // pending diagonal gates (as a table of phases)
+    std::vector<unsigned> diag_ids_; // (sorted) qubits the pending diagonal acts on
+    unsigned diag_qubits_max_;
     RndEngine rnd_eng_;
     std::function<double()> rng_;
 };
 
+using Simulator = BasicSimulator<double>;
+using SinglePrecisionSimulator = BasicSimulator<float>;
+
 #endif
@@ -25,40 +25,98 @@
 
 namespace py = pybind11;
 
-using c_type = std::complex<double>;
-using ArrayType = std::vector<c_type, aligned_allocator<c_type,64>>;
-using MatrixType = std::vector<ArrayType>;
 using QuRegs = std::vector<std::vector<unsigned>>;
 
-template <class QR>
-void emulate_math_wrapper(Simulator &sim, py::function const& pyfunc, QR const& qr, std::vector<unsigned> const& ctrls){
+template <class Sim, class QR>
+void emulate_math_wrapper(Sim &sim, py::function const& pyfunc, QR const& qr, std::vector<unsigned> const& ctrls){
+    // (the function is called once per state of the registers, from this thread)
     auto f = [&](std::vector<int>& x) {
-        pybind11::gil_scoped_acquire acquire;
         x = std::move(pyfunc(x).cast<std::vector<int>>());
     };
-    pybind11::gil_scoped_release release;
     sim.emulate_math(f, qr, ctrls);
 }
-PYBIND11_PLUGIN(_cppsim) {
-    py::module m("_cppsim", "_cppsim");
-    py::class_<Simulator>(m, "Simulator")
+
+template <class Sim>
+py::tuple cheat_wrapper(py::object const& pysim){
+    auto& sim = pysim.cast<Sim&>();
+    auto res = sim.cheat();
+    auto& vec = std::get<1>(res);
+    // expose the state vector as a (writable) numpy array without copying;
+    // the array holds a reference to the simulator to keep the memory alive
+    py::array_t<typename Sim::complex_type> wavefunction(vec.size(), vec.data(), pysim);
+    return py::make_tuple(std::get<0>(res), wavefunction);
+}
+
+template <class Sim>
+py::array_t<std::size_t> sample_wrapper(Sim &sim, std::vector<unsigned> const& ids,
+                                        std::size_t shots, py::object const& seed){
+    std::vector<std::size_t> res;
+    if (seed.is_none())
+        res = sim.sample(ids, shots);
+    else
+        res = sim.sample(ids, shots, seed.cast<unsigned>());
+    return py::array_t<std::size_t>(res.size(), res.data());
+}
+
+template <class Sim>
+void apply_gates_wrapper(Sim &sim, std::vector<typename Sim::Matrix> const& matrices,
+                         py::array_t<unsigned, py::array::c_style | py::array::forcecast> gates,
+                         bool fuse){
+    std::vector<unsigned> stream(gates.data(), gates.data() + gates.size());
+    // the gate stream is self-contained, so other Python threads may run meanwhile
+    py::gil_scoped_release release;
+    sim.apply_gates(matrices, stream, fuse);
+}
+
+template <class Sim>
+void export_simulator(py::module &m, char const* name){
+    using MatrixType = typename Sim::Matrix;
+
+    py::class_<Sim>(m, name)
         .def(py::init<unsigned>())
-        .def("allocate_qubit", &Simulator::allocate_qubit)
-        .def("deallocate_qubit", &Simulator::deallocate_qubit)
-        .def("get_classical_value", &Simulator::get_classical_value)
-        .def("is_classical", &Simulator::is_classical)
-        .def("measure_qubits", &Simulator::measure_qubits_return)
-        .def("apply_controlled_gate", &Simulator::apply_controlled_gate<MatrixType>)
-        .def("emulate_math", &emulate_math_wrapper<QuRegs>)
-        .def("get_expectation_value", &Simulator::get_expectation_value)
-        .def("apply_qubit_operator", &Simulator::apply_qubit_operator)
-        .def("emulate_time_evolution", &Simulator::emulate_time_evolution)
-        .def("get_probability", &Simulator::get_probability)
-        .def("get_amplitude", &Simulator::get_amplitude)
-        .def("set_wavefunction", &Simulator::set_wavefunction)
-        .def("collapse_wavefunction", &Simulator::collapse_wavefunction)
-        .def("run", &Simulator::run)
-        .def("cheat", &Simulator::cheat)
+        .def("allocate_qubit", &Sim::allocate_qubit)
+        .def("allocate_qubits", &Sim::allocate_qubits)
+        .def("deallocate_qubit", &Sim::deallocate_qubit)
+        .def("deallocate_qubits", &Sim::deallocate_qubits)
+        .def("remove_qubits", &Sim::remove_qubits)
+        .def("get_classical_value", &Sim::get_classical_value, py::arg("id"),
+             py::arg("tol") = 1.e-12)
+        .def("is_classical", &Sim::is_classical, py::arg("id"), py::arg("tol") = 1.e-12)
+        .def("measure_qubits", &Sim::measure_qubits_return)
+        .def("apply_controlled_gate", &Sim::template apply_controlled_gate<MatrixType>)
+        .def("apply_diagonal_gate", &Sim::apply_diagonal_gate)
+        .def("apply_permutation_gate", &Sim::apply_permutation_gate)
+        .def("apply_gates", &apply_gates_wrapper<Sim>)
+        .def("set_fusion_options", &Sim::set_fusion_options)
+        .def("set_mmap_dir", &Sim::set_mmap_dir)
+        .def("emulate_math", &emulate_math_wrapper<Sim, QuRegs>)
+        .def("emulate_math_table", &Sim::emulate_math_table)
+        .def("emulate_math_addConstant", &Sim::emulate_math_addConstant)
+        .def("emulate_math_addConstantModN", &Sim::emulate_math_addConstantModN)
+        .def("emulate_math_multiplyByConstantModN",
+             &Sim::emulate_math_multiplyByConstantModN)
+        .def("get_expectation_value", &Sim::get_expectation_value)
+        .def("get_expectation_values", &Sim::get_expectation_values)
+        .def("apply_qubit_operator", &Sim::apply_qubit_operator)
+        .def("emulate_time_evolution", &Sim::emulate_time_evolution)
+        .def("emulate_time_evolution_krylov", &Sim::emulate_time_evolution_krylov)
+        .def("emulate_qft", &Sim::emulate_qft)
+        .def("apply_uniformly_controlled_gate", &Sim::apply_uniformly_controlled_gate)
+        .def("emulate_state_preparation", &Sim::emulate_state_preparation)
+        .def("get_probability", &Sim::get_probability)
+        .def("get_amplitude", &Sim::get_amplitude)
+        .def("sample", &sample_wrapper<Sim>, py::arg("ids"), py::arg("shots"),
+             py::arg("seed") = py::none())
+        .def("set_wavefunction", &Sim::set_wavefunction)
+        .def("collapse_wavefunction", &Sim::collapse_wavefunction)
+        .def("run", &Sim::run)
+        .def("cheat", &cheat_wrapper<Sim>)
         ;
+}
+
+PYBIND11_PLUGIN(_cppsim) {
+    py::module m("_cppsim", "_cppsim");
+    export_simulator<Simulator>(m, "Simulator");
+    export_simulator<SinglePrecisionSimulator>(m, "SinglePrecisionSimulator");
     return m.ptr();
 }
@@ -0,0 +1,390 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+A simulator which represents the state as a density matrix, such that noise
+channels are evaluated exactly (instead of sampling them).
+"""
+
+import random
+
+import numpy
+
+from projectq.cengines import BasicEngine
+from projectq.meta import get_control_count, LogicalQubitIDTag
+from projectq.ops import (AllocateQubitGate,
+                          DeallocateQubitGate,
+                          FlushGate,
+                          MeasureGate)
+from projectq.types import WeakQubitRef
+
+
+_PAULIS = {'X': numpy.array([[0., 1.], [1., 0.]], dtype=complex),
+           'Y': numpy.array([[0., -1j], [1j, 0.]], dtype=complex),
+           'Z': numpy.array([[1., 0.], [0., -1.]], dtype=complex)}
+
+
+def _controlled(matrix, num_controls):
+    """
+    Return the matrix of `matrix` controlled by num_controls qubits, which
+    correspond to the most significant bits.
+    """
+    if num_controls == 0:
+        return matrix
+    size = len(matrix)
+    controlled = numpy.identity(size << num_controls, dtype=complex)
+    controlled[-size:, -size:] = matrix
+    return controlled
+
+
+def _get_kraus_operators(cmd):
+    """
+    Return the channel of the command as a list of Kraus operators (a single
+    one for a unitary gate), where the first target qubit corresponds to the
+    least significant bit and the control qubits to the most significant
+    bits, or None if the gate provides neither a channel nor a gate-matrix.
+
+    Noisy gates (see projectq.ops._noise) provide their channel via
+    get_kraus_operators or, if they are controlled, via twirl. Their channel
+    may be sampled (e.g., for a joint distribution), hence it is cached on
+    the command (for its number of controls, which engines may change),
+    such that is_available and the application of the command share one
+    evaluation.
+    """
+    gate = cmd.gate
+    num_controls = get_control_count(cmd)
+    if hasattr(gate, 'get_kraus_operators') or hasattr(gate, 'twirl'):
+        cached = getattr(cmd, '_kraus_operators', None)
+        if cached is None or cached[0] != num_controls:
+            cached = (num_controls, _get_channel(gate, num_controls))
+            cmd._kraus_operators = cached
+        if cached[1] is not None:
+            return cached[1]
+    try:
+        matrix = numpy.asarray(gate.matrix, dtype=complex)
+    except AttributeError:
+        return None
+    return [_controlled(matrix, num_controls)]
+
+
+def _get_channel(gate, num_controls):
+    """
+    Return the Kraus operators of a noisy gate with num_controls control
+    qubits (see _get_kraus_operators), or None if it provides no channel.
+    """
+    try:
+        if num_controls == 0 and hasattr(gate, 'get_kraus_operators'):
+            return [numpy.asarray(k, dtype=complex)
+                    for k in gate.get_kraus_operators()]
+        if hasattr(gate, 'twirl'):
+            return [numpy.sqrt(p) *
+                    _controlled(numpy.asarray(m, dtype=complex), num_controls)
+                    for p, m in gate.twirl() if p > 0.]
+    except NotImplementedError:
+        pass
+    return None
+
+
+class DensityMatrixSimulator(BasicEngine):
+    """
+    Simulator which represents the state as a density matrix rho, stored as a
+    tensor with one row (ket) and one column (bra) axis per qubit, in the
+    order of allocation.
+
+    Besides all gates which provide a gate-matrix, the simulator applies
+    noise channels: gates which provide get_kraus_operators (or twirl, see
+    projectq.ops._noise) are applied as the superoperator
+    sum_i K_i (x) conj(K_i), i.e., the noise is averaged over exactly in a
+    single run instead of being sampled. Noisy gates which are built from
+    other gates (e.g., the noisy angle gates and the noisy CNOT) are sent as
+    a whole to the simulator instead of sampling their noise.
+
+    The memory (and the cost of a gate) scales as 4^n for n qubits, which
+    replaces repeated runs of the (state-vector) Simulator with sampled noise
+    for small to medium numbers of qubits.
+    """
+    #: Noisy gates are sent to the simulator as a whole (see
+    #: projectq.ops._noise), instead of sampling their noise.
+    applies_noise_channels = True
+
+    def __init__(self, rnd_seed=None):
+        """
+        Construct the density-matrix simulator.
+
+        Args:
+            rnd_seed (int): Random seed (uses random.randint(0, 4294967295) by
+                default).
+        """
+        BasicEngine.__init__(self)
+        if rnd_seed is None:
+            rnd_seed = random.randint(0, 4294967295)
+        self._rng = random.Random(rnd_seed)
+        self._rho = numpy.ones((), dtype=complex)
+        self._ids = []  # position -> qubit ID
+
+    def is_available(self, cmd):
+        """
+        Return True if the command is a measurement, an allocation, a
+        deallocation, or a gate which provides a gate-matrix or a channel
+        (Kraus operators or a twirled distribution) matching its number of
+        qubits (including its control qubits).
+
+        Args:
+            cmd (Command): Command for which to check availability.
+        """
+        if isinstance(cmd.gate, (MeasureGate, AllocateQubitGate,
+                                 DeallocateQubitGate, FlushGate)):
+            return True
+        kraus = _get_kraus_operators(cmd)
+        num_qubits = sum(len(qr) for qr in cmd.qubits)
+        return (bool(kraus) and
+                len(kraus[0]) == 2 ** (num_qubits + get_control_count(cmd)))
+
+    def _convert_logical_to_mapped_qureg(self, qureg):
+        """
+        Converts a qureg from logical to mapped qubits if there is a mapper.
+
+        Args:
+            qureg (list[Qubit],Qureg): Logical quantum bits
+        """
+        mapper = self.main_engine.mapper
+        if mapper is not None:
+            mapped_qureg = []
+            for qubit in qureg:
+                if qubit.id not in mapper.current_mapping:
+                    raise RuntimeError("Unknown qubit id. "
+                                       "Please make sure you have called "
+                                       "eng.flush().")
+                new_qubit = WeakQubitRef(qubit.engine,
+                                         mapper.current_mapping[qubit.id])
+                mapped_qureg.append(new_qubit)
+            return mapped_qureg
+        else:
+            return qureg
+
+    def _get_positions(self, qureg):
+        try:
+            return [self._ids.index(qb.id) for qb in qureg]
+        except ValueError:
+            raise RuntimeError("Unknown qubit id. Please make sure you have "
+                               "called eng.flush().")
+
+    def get_density_matrix(self, qureg):
+        """
+        Return the reduced density matrix of the quantum register `qureg`,
+        where qureg[0] corresponds to the least significant bit.
+
+        Args:
+            qureg (Qureg|list[Qubit]): Quantum register.
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            automatically converts from logical qubits to mapped qubits for
+            the qureg argument.
+        """
+        qureg = self._convert_logical_to_mapped_qureg(qureg)
+        positions = self._get_positions(qureg)
+        rho = self._rho
+        num_qubits = len(self._ids)
+        # trace out the other qubits, starting with the last one
+        for pos in reversed(range(num_qubits)):
+            if pos not in positions:
+                num_qubits -= 1
+                rho = numpy.trace(rho, axis1=pos, axis2=pos + num_qubits + 1)
+        remaining = sorted(positions)
+        order = [remaining.index(pos) for pos in reversed(positions)]
+        rho = rho.transpose(order + [num_qubits + i for i in order])
+        return rho.reshape(2 ** num_qubits, 2 ** num_qubits)
+
+    def get_probability(self, bit_string, qureg):
+        """
+        Return the probability of the outcome `bit_string` when measuring
+        the quantum register `qureg`.
+
+        Args:
+            bit_string (list[bool|int]|string[0|1]): Measurement outcome.
+            qureg (Qureg|list[Qubit]): Quantum register.
+
+        Returns:
+            Probability of measuring the provided bit string.
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            automatically converts from logical qubits to mapped qubits for
+            the qureg argument.
+        """
+        rho = self.get_density_matrix(qureg)
+        index = sum(int(bit) << i for i, bit in enumerate(bit_string))
+        return rho[index, index].real
+
+    def get_expectation_value(self, qubit_operator, qureg):
+        """
+        Get the expectation value of qubit_operator w.r.t. the current state
+        represented by the supplied quantum register.
+
+        Args:
+            qubit_operator (projectq.ops.QubitOperator): Operator to measure.
+            qureg (list[Qubit],Qureg): Quantum bits to measure.
+
+        Returns:
+            Expectation value
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            automatically converts from logical qubits to mapped qubits for
+            the qureg argument.
+
+        Raises:
+            Exception: If `qubit_operator` acts on more qubits than present in
+                the `qureg` argument.
+        """
+        rho = self.get_density_matrix(qureg)
+        num_qubits = len(qureg)
+        rho = rho.reshape((2,) * (2 * num_qubits))
+        expectation = 0.
+        for term, coefficient in qubit_operator.terms.items():
+            if not term == () and term[-1][0] >= num_qubits:
+                raise Exception("qubit_operator acts on more qubits than "
+                                "contained in the qureg.")
+            product = rho
+            for index, pauli in term:
+                # qureg[0] is the last (i.e., least significant) ket axis
+                axis = num_qubits - 1 - index
+                product = numpy.moveaxis(
+                    numpy.tensordot(_PAULIS[pauli], product,
+                                    axes=([1], [axis])), 0, axis)
+            product = product.reshape(2 ** num_qubits, 2 ** num_qubits)
+            expectation += coefficient * numpy.trace(product)
+        return expectation.real
+
+    def _apply_kraus(self, kraus, positions):
+        """
+        Apply the channel with Kraus operators `kraus` to the qubits at
+        `positions` (of which the first corresponds to the least significant
+        bit of the operators).
+
+        A single (unitary) operator U is applied as U rho U^dagger, any other
+        channel as its superoperator sum_i K_i (x) conj(K_i) in one
+        contraction.
+        """
+        num_qubits = len(self._ids)
+        k = len(positions)
+        ket = [positions[i] for i in reversed(range(k))]
+        bra = [num_qubits + pos for pos in ket]
+        if len(kraus) == 1:
+            matrix = kraus[0].reshape((2,) * (2 * k))
+            rho = numpy.tensordot(matrix, self._rho,
+                                  axes=(list(range(k, 2 * k)), ket))
+            rho = numpy.moveaxis(rho, list(range(k)), ket)
+            rho = numpy.tensordot(matrix.conj(), rho,
+                                  axes=(list(range(k, 2 * k)), bra))
+            self._rho = numpy.moveaxis(rho, list(range(k)), bra)
+            return
+        kraus = numpy.asarray(kraus)
+        superoperator = numpy.einsum('iac,ibd->abcd', kraus, kraus.conj())
+        superoperator = superoperator.reshape((2,) * (4 * k))
+        rho = numpy.tensordot(superoperator, self._rho,
+                              axes=(list(range(2 * k, 4 * k)), ket + bra))
+        self._rho = numpy.moveaxis(rho, list(range(2 * k)), ket + bra)
+
+    def _allocate(self, qubit_id):
+        if qubit_id in self._ids:
+            raise RuntimeError("AllocateQubit: ID already exists. Qubit IDs "
+                               "should be unique.")
+        zero = numpy.array([[1., 0.], [0., 0.]], dtype=complex)
+        num_qubits = len(self._ids)
+        rho = numpy.multiply.outer(self._rho, zero)
+        self._rho = numpy.moveaxis(rho, 2 * num_qubits, num_qubits)
+        self._ids.append(qubit_id)
+
+    def _measure(self, pos):
+        """
+        Measure the qubit at position `pos` and return the outcome (0 or 1).
+        """
+        num_qubits = len(self._ids)
+        rho = numpy.moveaxis(self._rho, [pos, num_qubits + pos], [0, 1])
+        p0 = numpy.trace(rho[0, 0].reshape(2 ** (num_qubits - 1),
+                                           2 ** (num_qubits - 1))).real
+        p1 = numpy.trace(rho[1, 1].reshape(2 ** (num_qubits - 1),
+                                           2 ** (num_qubits - 1))).real
+        outcome = int(self._rng.random() * (p0 + p1) < p1)
+        # rho is a view, i.e., this projects self._rho
+        rho[1 - outcome] = 0.
+        rho[:, 1 - outcome] = 0.
+        self._rho /= p1 if outcome else p0
+        return outcome
+
+    def _deallocate(self, qubit_id):
+        pos = self._ids.index(qubit_id)
+        self._rho = numpy.trace(self._rho, axis1=pos,
+                                axis2=len(self._ids) + pos)
+        del self._ids[pos]
+
+    def receive(self, command_list):
+        """
+        Receive a list of commands from the previous engine and handle them
+        prior to sending them on to the next engine.
+
+        Args:
+            command_list (list<Command>): List of commands to execute on the
+                simulator.
+        """
+        for cmd in command_list:
+            self._handle(cmd)
+        if not self.is_last_engine:
+            self.send(command_list)
+
+    def _handle(self, cmd):
+        """
+        Handle all commands.
+
+        Deallocating a qubit traces it out, i.e., it does not need to be
+        uncomputed (which noise would prevent in general).
+
+        Args:
+            cmd (Command): Command to handle.
+
+        Raises:
+            Exception: If the gate provides neither a gate-matrix nor a
+                channel matching its number of qubits.
+        """
+        if isinstance(cmd.gate, FlushGate):
+            return
+        if isinstance(cmd.gate, AllocateQubitGate):
+            self._allocate(cmd.qubits[0][0].id)
+        elif isinstance(cmd.gate, DeallocateQubitGate):
+            self._deallocate(cmd.qubits[0][0].id)
+        elif isinstance(cmd.gate, MeasureGate):
+            # Check if a mapper assigned a different logical id
+            logical_id_tag = None
+            for tag in cmd.tags:
+                if isinstance(tag, LogicalQubitIDTag):
+                    logical_id_tag = tag
+            for qr in cmd.qubits:
+                for qb in qr:
+                    outcome = self._measure(self._ids.index(qb.id))
+                    if logical_id_tag is not None:
+                        qb = WeakQubitRef(qb.engine,
+                                          logical_id_tag.logical_qubit_id)
+                    self.main_engine.set_measurement_result(qb, outcome)
+        else:
+            ids = [qb.id for qr in cmd.qubits for qb in qr]
+            ids += [qb.id for qb in cmd.control_qubits]
+            kraus = _get_kraus_operators(cmd)
+            if not kraus or len(kraus[0]) != 2 ** len(ids):
+                raise Exception("DensityMatrixSimulator: The gate {} provides "
+                                "neither a gate-matrix nor a channel. Please "
+                                "add an auto-replacer engine to your list of "
+                                "compiler engines.".format(str(cmd.gate)))
+            self._apply_kraus(kraus, [self._ids.index(i) for i in ids])
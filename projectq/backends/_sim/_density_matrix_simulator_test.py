@@ -0,0 +1,245 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import itertools
+import math
+import random
+
+import numpy
+import pytest
+
+from projectq import MainEngine
+from projectq.cengines import DummyEngine
+from projectq.ops import (All, BasicGate, C, CNOT, Command, H, Measure,
+                          QubitOperator, Rx, Ry, Rz, Swap, Toffoli, X)
+from projectq.ops._noise import (NoisyAngleGateFactory, NoisyCNOTGate,
+                                 XNoiseGate)
+from projectq.types import WeakQubitRef
+from ._simulator_test import mapper
+
+from ._simulator import Simulator
+from ._density_matrix_simulator import DensityMatrixSimulator
+
+
+@pytest.fixture(autouse=True)
+def restore_cnot():
+    # NoisyCNOTGate replaces the gate underlying the global CNOT
+    gate = CNOT._gate
+    yield
+    CNOT._gate = gate
+
+
+def _gauss2(mu0, sigma0, mu1, sigma1):
+    return random.gauss(mu0, sigma0), random.gauss(mu1, sigma1)
+
+
+def test_density_matrix_simulator_is_available():
+    sim = DensityMatrixSimulator()
+    eng = MainEngine(DummyEngine(), [])
+    qb0 = WeakQubitRef(engine=eng, idx=0)
+    qb1 = WeakQubitRef(engine=eng, idx=1)
+    qb2 = WeakQubitRef(engine=eng, idx=2)
+    for gate in [H, Rx(0.3), Measure, XNoiseGate(random.gauss, 0, 0., 0.1)]:
+        assert sim.is_available(Command(eng, gate, ([qb0],)))
+    assert sim.is_available(Command(eng, X, ([qb0],), controls=[qb1, qb2]))
+    noisy_rx = NoisyAngleGateFactory(Rx, random.gauss, 0, 0., 0.1)(0.3)
+    assert sim.is_available(Command(eng, noisy_rx, ([qb0],)))
+    assert not sim.is_available(Command(eng, noisy_rx, ([qb0, qb1],)))
+    noisy_cnot = NoisyCNOTGate(_gauss2, 0.1, 0., 0.1, 0., 0.1)
+    assert sim.is_available(Command(eng, noisy_cnot, ([qb0], [qb1])))
+    assert not sim.is_available(Command(eng, BasicGate(), ([qb0],)))
+    # the state-vector simulator samples the noise of the compound gates
+    assert not Simulator().is_available(Command(eng, noisy_rx, ([qb0],)))
+
+
+def test_density_matrix_simulator_pure_state(mapper):
+    engine_list = []
+    if mapper is not None:
+        engine_list.append(mapper)
+    sim = DensityMatrixSimulator()
+    eng = MainEngine(sim, engine_list)
+    ref_eng = MainEngine(Simulator(), [])
+    qureg = eng.allocate_qureg(4)
+    ref_qureg = ref_eng.allocate_qureg(4)
+    for qubits in (qureg, ref_qureg):
+        rng = random.Random(1)
+        for _ in range(20):
+            a, b, c = rng.sample(range(4), 3)
+            Rx(rng.random() * 6) | qubits[a]
+            Rz(rng.random() * 6) | qubits[b]
+            C(Ry(rng.random() * 6)) | (qubits[a], qubits[b])
+            Toffoli | (qubits[a], qubits[b], qubits[c])
+            Swap | (qubits[c], qubits[a])
+    eng.flush()
+    ref_eng.flush()
+    for bits in itertools.product([0, 1], repeat=4):
+        assert (sim.get_probability(bits, qureg) == pytest.approx(
+            ref_eng.backend.get_probability(bits, ref_qureg)))
+    _, state = ref_eng.backend.cheat()
+    rho = sim.get_density_matrix(qureg)
+    assert numpy.allclose(rho, numpy.outer(state, numpy.conj(state)))
+    assert (sim.get_probability('10', qureg[3:0:-2]) == pytest.approx(
+        ref_eng.backend.get_probability('10', ref_qureg[3:0:-2])))
+    op = (QubitOperator('X0 Z3', 0.5) + QubitOperator('Y1 Y2', -1.2) +
+          QubitOperator((), 0.7))
+    assert (sim.get_expectation_value(op, qureg) == pytest.approx(
+        ref_eng.backend.get_expectation_value(op, ref_qureg)))
+    with pytest.raises(Exception):
+        sim.get_expectation_value(QubitOperator('Z4'), qureg)
+    All(Measure) | qureg
+    eng.flush()
+    bits = [int(qb) for qb in qureg]
+    assert ref_eng.backend.get_probability(bits, ref_qureg) > 1e-12
+    assert sim.get_probability(bits, qureg) == pytest.approx(1.)
+    All(Measure) | ref_qureg
+
+
+def test_density_matrix_simulator_x_noise():
+    sim = DensityMatrixSimulator()
+    eng = MainEngine(sim, [])
+    qubit = eng.allocate_qubit()
+    mu, sigma = 0.4, 0.3
+    XNoiseGate(random.gauss, 0, mu, sigma) | qubit
+    eng.flush()
+    # E[cos(theta)] for theta ~ N(mu, sigma^2)
+    expected = math.cos(mu) * math.exp(-sigma ** 2 / 2.)
+    assert (sim.get_expectation_value(QubitOperator('Z0'), qubit) ==
+            pytest.approx(expected, abs=1e-12))
+    # a controlled noise gate is applied via its twirled distribution
+    control = eng.allocate_qubit()
+    X | control
+    C(XNoiseGate(random.gauss, 0, mu, sigma)) | (control, qubit)
+    eng.flush()
+    expected = math.cos(2 * mu) * math.exp(-sigma ** 2)
+    assert (sim.get_expectation_value(QubitOperator('Z0'), qubit) ==
+            pytest.approx(expected, abs=1e-12))
+    All(Measure) | qubit + control
+
+
+def test_density_matrix_simulator_noisy_angle_gate():
+    sim = DensityMatrixSimulator()
+    eng = MainEngine(sim, [])
+    qubit = eng.allocate_qubit()
+    noisy_ry = NoisyAngleGateFactory(Ry, random.uniform, 0, -0.5, 0.5)
+    noisy_ry(1.) | qubit
+    eng.flush()
+    # E[cos(1 + theta)] for theta uniform in [-0.5, 0.5]
+    expected = math.cos(1.) * math.sin(0.5) / 0.5
+    assert (sim.get_expectation_value(QubitOperator('Z0'), qubit) ==
+            pytest.approx(expected, abs=1e-12))
+    # the state-vector simulator samples the angle
+    ref_eng = MainEngine(Simulator(), [])
+    ref_qubit = ref_eng.allocate_qubit()
+    noisy_ry(1.) | ref_qubit
+    ref_eng.flush()
+    value = ref_eng.backend.get_expectation_value(QubitOperator('Z0'),
+                                                  ref_qubit)
+    assert math.cos(1.5) - 1e-12 <= value <= math.cos(0.5) + 1e-12
+    Measure | qubit
+    Measure | ref_qubit
+
+
+def test_density_matrix_simulator_noisy_cnot():
+    sim = DensityMatrixSimulator()
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(2)
+    H | qureg[0]
+    NoisyCNOTGate(lambda: (0., 0.), 0.25) | (qureg[0], qureg[1])
+    eng.flush()
+    # a (noiseless) CNOT which fails with probability 0.25
+    assert sim.get_probability([1, 1], qureg) == pytest.approx(0.375)
+    assert sim.get_probability([1, 0], qureg) == pytest.approx(0.125)
+    All(Measure) | qureg
+
+
+def test_density_matrix_simulator_samples_channel_once():
+    noisy_cnot = NoisyCNOTGate(_gauss2, 0.1, 0., 0.4, 0., 0.6)
+    twirl = noisy_cnot.twirl
+    calls = []
+
+    def counting_twirl():
+        calls.append(1)
+        return twirl()
+    noisy_cnot.twirl = counting_twirl
+    eng = MainEngine(DensityMatrixSimulator(), [])
+    qureg = eng.allocate_qureg(2)
+    noisy_cnot | (qureg[0], qureg[1])
+    eng.flush()
+    # (is_available and the application share the sampled channel)
+    assert len(calls) == 1
+    All(Measure) | qureg
+
+
+def test_noisy_gates_sampled_for_other_backends():
+    # back-ends which accept any gate (e.g., a ResourceCounter) receive the
+    # sampled gates instead of the channel
+    backend = DummyEngine(save_commands=True)
+    eng = MainEngine(backend, [])
+    qubit = eng.allocate_qubit()
+    NoisyAngleGateFactory(Rx, random.gauss, 0, 0., 0.1)(0.3) | qubit
+    eng.flush()
+    assert type(backend.received_commands[1].gate) is Rx
+
+
+def test_density_matrix_simulator_noisy_cnot_matches_sampling():
+    random.seed(7)
+    noisy_cnot = NoisyCNOTGate(_gauss2, 0.1, 0., 0.4, 0., 0.6)
+    sim = DensityMatrixSimulator()
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(2)
+    H | qureg[0]
+    noisy_cnot | (qureg[0], qureg[1])
+    eng.flush()
+    rho = sim.get_density_matrix(qureg)
+    # average the sampled pure states of the state-vector simulator
+    runs = 2000
+    average = numpy.zeros((4, 4), dtype=complex)
+    ref_eng = MainEngine(Simulator(), [])
+    for _ in range(runs):
+        ref_qureg = ref_eng.allocate_qureg(2)
+        H | ref_qureg[0]
+        noisy_cnot | (ref_qureg[0], ref_qureg[1])
+        ref_eng.flush()
+        state = numpy.copy(ref_eng.backend.cheat()[1])
+        average += numpy.outer(state, state.conj()) / runs
+        All(Measure) | ref_qureg
+        del ref_qureg
+    assert numpy.allclose(rho, average, atol=0.05)
+    assert numpy.trace(rho) == pytest.approx(1.)
+    All(Measure) | qureg
+
+
+def test_density_matrix_simulator_measure_and_deallocate():
+    sim = DensityMatrixSimulator(rnd_seed=3)
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(3)
+    H | qureg[0]
+    CNOT | (qureg[0], qureg[1])
+    CNOT | (qureg[0], qureg[2])
+    eng.flush()
+    # deallocating a qubit traces it out, leaving a mixed state
+    del qureg[1]
+    eng.flush()
+    rho = sim.get_density_matrix(qureg)
+    assert numpy.allclose(rho, numpy.diag([0.5, 0., 0., 0.5]))
+    Measure | qureg[0]
+    eng.flush()
+    outcome = int(qureg[0])
+    assert sim.get_probability([outcome, outcome], qureg) == pytest.approx(1.)
+    with pytest.raises(RuntimeError):
+        sim.get_probability([0], [WeakQubitRef(eng, 10)])
+    with pytest.raises(Exception):
+        BasicGate() | qureg[0]
+        eng.flush()
+    Measure | qureg[1]
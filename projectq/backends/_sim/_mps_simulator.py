@@ -0,0 +1,427 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+A simulator which represents the state as a matrix product state (MPS), for
+wide circuits which create little entanglement.
+"""
+
+import random
+
+import numpy
+
+from projectq.cengines import BasicEngine
+from projectq.meta import get_control_count, LogicalQubitIDTag
+from projectq.ops import (AllocateQubitGate,
+                          DeallocateQubitGate,
+                          FlushGate,
+                          MeasureGate)
+from projectq.types import WeakQubitRef
+
+
+_PAULIS = {'X': numpy.array([[0., 1.], [1., 0.]], dtype=complex),
+           'Y': numpy.array([[0., -1j], [1j, 0.]], dtype=complex),
+           'Z': numpy.array([[1., 0.], [0., -1.]], dtype=complex)}
+
+_SWAP = numpy.array([[1., 0., 0., 0.],
+                     [0., 0., 1., 0.],
+                     [0., 1., 0., 0.],
+                     [0., 0., 0., 1.]], dtype=complex)
+
+
+class MPSSimulator(BasicEngine):
+    """
+    Simulator which represents the state as a matrix product state (MPS), with
+    one site (a tensor of shape (left bond, 2, right bond)) per qubit, in the
+    order of allocation.
+
+    The simulator supports all 1- and 2-qubit gates which provide a
+    gate-matrix, where controls count as qubits (e.g., CNOT), such that larger
+    gates are decomposed by the compiler. Gates on non-adjacent qubits move
+    one of them next to the other using swaps (the qubits are not moved
+    back). After each 2-qubit gate, the bond between the two sites is
+    truncated using a singular value decomposition: singular values whose
+    squares are below `cutoff` (relative to their sum) are discarded, as well
+    as all but the `max_bond_dimension` largest ones. The sum of the
+    discarded weights is reported by get_truncation_error.
+
+    The cost of a gate is O(chi^3), where chi is the bond dimension, such
+    that circuits on many qubits (e.g., after a LinearMapper) can be
+    simulated as long as the entanglement (and hence chi) stays low.
+    """
+    def __init__(self, max_bond_dimension=64, cutoff=1e-12, rnd_seed=None):
+        """
+        Construct the MPS simulator.
+
+        Args:
+            max_bond_dimension (int): Maximal bond dimension.
+            cutoff (float): Singular values whose relative weight is below
+                cutoff are discarded.
+            rnd_seed (int): Random seed (uses random.randint(0, 4294967295) by
+                default).
+
+        Raises:
+            ValueError: If max_bond_dimension is not positive or cutoff is
+                negative.
+        """
+        BasicEngine.__init__(self)
+        if max_bond_dimension < 1 or cutoff < 0:
+            raise ValueError("MPSSimulator: max_bond_dimension must be "
+                             "positive and cutoff must not be negative.")
+        if rnd_seed is None:
+            rnd_seed = random.randint(0, 4294967295)
+        self._rng = random.Random(rnd_seed)
+        self._max_bond_dimension = max_bond_dimension
+        self._cutoff = cutoff
+        self._tensors = []
+        self._ids = []  # site -> qubit ID
+        # orthogonality center: the sites to its left (right) are left-
+        # (right-) orthonormal, such that the state is normalized iff the
+        # center is
+        self._center = 0
+        self._truncation_error = 0.
+
+    def is_available(self, cmd):
+        """
+        Return True if the command is a measurement, an allocation, a
+        deallocation, or a gate which provides a gate-matrix and acts on at
+        most 2 qubits (including its control qubits).
+
+        Args:
+            cmd (Command): Command for which to check availability.
+        """
+        if isinstance(cmd.gate, (MeasureGate, AllocateQubitGate,
+                                 DeallocateQubitGate, FlushGate)):
+            return True
+        num_qubits = sum(len(qr) for qr in cmd.qubits)
+        if num_qubits + get_control_count(cmd) > 2:
+            return False
+        try:
+            return len(cmd.gate.matrix) == 2 ** num_qubits
+        except AttributeError:
+            return False
+
+    def get_truncation_error(self):
+        """
+        Return the sum of the (relative) weights of all singular values which
+        have been discarded so far, which bounds the infidelity of the state
+        (to first order).
+        """
+        return self._truncation_error
+
+    def get_bond_dimensions(self):
+        """
+        Return the list of bond dimensions between neighboring sites.
+        """
+        return [tensor.shape[2] for tensor in self._tensors[:-1]]
+
+    def _convert_logical_to_mapped_qureg(self, qureg):
+        """
+        Converts a qureg from logical to mapped qubits if there is a mapper.
+
+        Args:
+            qureg (list[Qubit],Qureg): Logical quantum bits
+        """
+        mapper = self.main_engine.mapper
+        if mapper is not None:
+            mapped_qureg = []
+            for qubit in qureg:
+                if qubit.id not in mapper.current_mapping:
+                    raise RuntimeError("Unknown qubit id. "
+                                       "Please make sure you have called "
+                                       "eng.flush().")
+                new_qubit = WeakQubitRef(qubit.engine,
+                                         mapper.current_mapping[qubit.id])
+                mapped_qureg.append(new_qubit)
+            return mapped_qureg
+        else:
+            return qureg
+
+    def _get_sites(self, qureg):
+        try:
+            return [self._ids.index(qb.id) for qb in qureg]
+        except ValueError:
+            raise RuntimeError("Unknown qubit id. Please make sure you have "
+                               "called eng.flush().")
+
+    def get_probability(self, bit_string, qureg):
+        """
+        Return the probability of the outcome `bit_string` when measuring
+        the quantum register `qureg`.
+
+        Args:
+            bit_string (list[bool|int]|string[0|1]): Measurement outcome.
+            qureg (Qureg|list[Qubit]): Quantum register.
+
+        Returns:
+            Probability of measuring the provided bit string.
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            automatically converts from logical qubits to mapped qubits for
+            the qureg argument.
+        """
+        qureg = self._convert_logical_to_mapped_qureg(qureg)
+        operators = dict()
+        for bit, site in zip(bit_string, self._get_sites(qureg)):
+            projector = numpy.zeros((2, 2), dtype=complex)
+            projector[int(bit), int(bit)] = 1.
+            operators[site] = projector
+        return self._expectation(operators).real
+
+    def get_expectation_value(self, qubit_operator, qureg):
+        """
+        Get the expectation value of qubit_operator w.r.t. the current state
+        represented by the supplied quantum register.
+
+        Args:
+            qubit_operator (projectq.ops.QubitOperator): Operator to measure.
+            qureg (list[Qubit],Qureg): Quantum bits to measure.
+
+        Returns:
+            Expectation value
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            automatically converts from logical qubits to mapped qubits for
+            the qureg argument.
+
+        Raises:
+            Exception: If `qubit_operator` acts on more qubits than present in
+                the `qureg` argument.
+        """
+        qureg = self._convert_logical_to_mapped_qureg(qureg)
+        sites = self._get_sites(qureg)
+        expectation = 0.
+        for term, coefficient in qubit_operator.terms.items():
+            if not term == () and term[-1][0] >= len(qureg):
+                raise Exception("qubit_operator acts on more qubits than "
+                                "contained in the qureg.")
+            operators = {sites[index]: _PAULIS[pauli]
+                         for index, pauli in term}
+            expectation += coefficient * self._expectation(operators)
+        return expectation.real
+
+    def _expectation(self, operators):
+        """
+        Return the expectation value of a product of single-site operators.
+
+        Only the sites between the orthogonality center and the operators are
+        contracted (the others are orthonormal).
+
+        Args:
+            operators (dict): Maps sites to 2x2 matrices.
+        """
+        if len(self._tensors) == 0:
+            return complex(1.)
+        first = min(list(operators) + [self._center])
+        last = max(list(operators) + [self._center])
+        env = numpy.identity(self._tensors[first].shape[0], dtype=complex)
+        for site in range(first, last + 1):
+            tensor = self._tensors[site]
+            if site in operators:
+                op_tensor = numpy.einsum('st,atb->asb', operators[site],
+                                         tensor)
+            else:
+                op_tensor = tensor
+            env = numpy.einsum('asc,ab,bsd->cd', tensor.conj(), env,
+                               op_tensor)
+        return numpy.trace(env)
+
+    def _move_center(self, site):
+        """
+        Move the orthogonality center to `site` using QR decompositions.
+        """
+        while self._center < site:
+            c = self._center
+            left, _, right = self._tensors[c].shape
+            q, r = numpy.linalg.qr(self._tensors[c].reshape(left * 2, right))
+            self._tensors[c] = q.reshape(left, 2, q.shape[1])
+            self._tensors[c + 1] = numpy.einsum('ab,bsc->asc', r,
+                                                self._tensors[c + 1])
+            self._center += 1
+        while self._center > site:
+            c = self._center
+            left, _, right = self._tensors[c].shape
+            q, r = numpy.linalg.qr(self._tensors[c].reshape(left,
+                                                            2 * right).T)
+            self._tensors[c] = q.T.reshape(q.shape[1], 2, right)
+            self._tensors[c - 1] = numpy.einsum('asb,bc->asc',
+                                                self._tensors[c - 1], r.T)
+            self._center -= 1
+
+    def _apply_two_site(self, matrix, site):
+        """
+        Apply a 2-qubit gate to the sites `site` and `site` + 1, where the
+        qubit at `site` corresponds to the least significant bit of the gate
+        matrix, and truncate the bond between them.
+        """
+        self._move_center(site)
+        a, b = self._tensors[site], self._tensors[site + 1]
+        theta = numpy.einsum('asb,btc->astc', a, b)
+        gate = matrix.reshape(2, 2, 2, 2)  # (out 1, out 0, in 1, in 0)
+        theta = numpy.einsum('yxvu,auvc->axyc', gate, theta)
+        left, right = a.shape[0], b.shape[2]
+        u, s, vh = numpy.linalg.svd(theta.reshape(left * 2, 2 * right),
+                                    full_matrices=False)
+        weights = s ** 2
+        total = weights.sum()
+        keep = min(self._max_bond_dimension,
+                   max(1, int(numpy.count_nonzero(
+                       weights > self._cutoff * total))))
+        self._truncation_error += weights[keep:].sum() / total
+        s = s[:keep] / numpy.sqrt(weights[:keep].sum())
+        self._tensors[site] = u[:, :keep].reshape(left, 2, keep)
+        self._tensors[site + 1] = (s[:, None] * vh[:keep]).reshape(keep, 2,
+                                                                   right)
+        self._center = site + 1
+
+    def _apply_gate(self, matrix, ids):
+        """
+        Apply the gate `matrix` to the qubits `ids` (of which the first
+        corresponds to the least significant bit of the matrix).
+        """
+        if len(ids) == 1:
+            site = self._ids.index(ids[0])
+            self._tensors[site] = numpy.einsum('st,atb->asb', matrix,
+                                               self._tensors[site])
+            return
+        first, second = [self._ids.index(i) for i in ids]
+        # swap the second qubit until it is next to the first one
+        step = 1 if second < first else -1
+        while abs(second - first) > 1:
+            left = min(second, second + step)
+            self._apply_two_site(_SWAP, left)
+            self._ids[left], self._ids[left + 1] = (self._ids[left + 1],
+                                                    self._ids[left])
+            second += step
+        if second < first:
+            # the first qubit is on the right: exchange the roles of the bits
+            matrix = matrix.reshape(2, 2, 2, 2).transpose(1, 0, 3, 2)
+            self._apply_two_site(matrix.reshape(4, 4), second)
+        else:
+            self._apply_two_site(matrix, first)
+
+    def _allocate(self, qubit_id):
+        if qubit_id in self._ids:
+            raise RuntimeError("AllocateQubit: ID already exists. Qubit IDs "
+                               "should be unique.")
+        tensor = numpy.zeros((1, 2, 1), dtype=complex)
+        tensor[0, 0, 0] = 1.
+        self._tensors.append(tensor)
+        self._ids.append(qubit_id)
+
+    def _measure(self, site, tol=None):
+        """
+        Measure the qubit at `site` and return the outcome (0 or 1).
+
+        Args:
+            site (int): Site of the qubit.
+            tol (float): If given, raise unless the outcome is deterministic
+                up to tol.
+
+        Raises:
+            RuntimeError: If tol is given and the outcome is random.
+        """
+        self._move_center(site)
+        tensor = self._tensors[site]
+        p1 = numpy.vdot(tensor[:, 1, :], tensor[:, 1, :]).real
+        p0 = numpy.vdot(tensor[:, 0, :], tensor[:, 0, :]).real
+        p1 /= p0 + p1
+        if tol is not None and tol < p1 < 1. - tol:
+            raise RuntimeError("Qubit has not been measured / uncomputed. "
+                               "Cannot deallocate a qubit in "
+                               "superposition!")
+        outcome = int(self._rng.random() < p1)
+        tensor[:, 1 - outcome, :] = 0.
+        tensor /= numpy.sqrt(numpy.vdot(tensor, tensor).real)
+        return outcome
+
+    def _deallocate(self, qubit_id):
+        site = self._ids.index(qubit_id)
+        outcome = self._measure(site, tol=1e-10)
+        matrix = self._tensors[site][:, outcome, :]
+        del self._tensors[site]
+        del self._ids[site]
+        if site < len(self._tensors):
+            self._tensors[site] = numpy.einsum('ab,bsc->asc', matrix,
+                                               self._tensors[site])
+        elif site > 0:
+            self._tensors[site - 1] = numpy.einsum('asb,bc->asc',
+                                                   self._tensors[site - 1],
+                                                   matrix)
+            self._center = site - 1
+        else:
+            self._center = 0
+
+    def receive(self, command_list):
+        """
+        Receive a list of commands from the previous engine and handle them
+        prior to sending them on to the next engine.
+
+        Args:
+            command_list (list<Command>): List of commands to execute on the
+                simulator.
+        """
+        for cmd in command_list:
+            self._handle(cmd)
+        if not self.is_last_engine:
+            self.send(command_list)
+
+    def _handle(self, cmd):
+        """
+        Handle all commands.
+
+        Args:
+            cmd (Command): Command to handle.
+
+        Raises:
+            Exception: If the gate acts on more than 2 qubits (including
+                controls) or its matrix does not match the number of qubits.
+            RuntimeError: If a qubit in superposition is deallocated.
+        """
+        if isinstance(cmd.gate, FlushGate):
+            return
+        if isinstance(cmd.gate, AllocateQubitGate):
+            self._allocate(cmd.qubits[0][0].id)
+        elif isinstance(cmd.gate, DeallocateQubitGate):
+            self._deallocate(cmd.qubits[0][0].id)
+        elif isinstance(cmd.gate, MeasureGate):
+            # Check if a mapper assigned a different logical id
+            logical_id_tag = None
+            for tag in cmd.tags:
+                if isinstance(tag, LogicalQubitIDTag):
+                    logical_id_tag = tag
+            for qr in cmd.qubits:
+                for qb in qr:
+                    outcome = self._measure(self._ids.index(qb.id))
+                    if logical_id_tag is not None:
+                        qb = WeakQubitRef(qb.engine,
+                                          logical_id_tag.logical_qubit_id)
+                    self.main_engine.set_measurement_result(qb, outcome)
+        else:
+            if not self.is_available(cmd):
+                raise Exception("MPSSimulator: Only 1- and 2-qubit gates "
+                                "(including controls) are supported. Please "
+                                "add an auto-replacer engine to your list of "
+                                "compiler engines.")
+            matrix = numpy.asarray(cmd.gate.matrix, dtype=complex)
+            ids = [qb.id for qr in cmd.qubits for qb in qr]
+            if len(cmd.control_qubits) == 1:
+                # the control is the most significant bit
+                controlled = numpy.identity(4, dtype=complex)
+                controlled[2:, 2:] = matrix
+                matrix = controlled
+                ids.append(cmd.control_qubits[0].id)
+            self._apply_gate(matrix, ids)
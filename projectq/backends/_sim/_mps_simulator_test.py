@@ -0,0 +1,173 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import itertools
+import random
+
+import pytest
+import scipy.stats
+
+from projectq import MainEngine
+from projectq.cengines import DummyEngine
+from projectq.ops import (All, BasicGate, C, CNOT, Command, H, Measure,
+                          QubitOperator, Rx, Ry, Rz, Swap, T, Toffoli, X)
+from projectq.types import WeakQubitRef
+from ._simulator_test import mapper
+
+from ._simulator import Simulator
+from ._mps_simulator import MPSSimulator
+
+
+class Random2QubitGate(BasicGate):
+    def __init__(self, seed):
+        BasicGate.__init__(self)
+        self.matrix = scipy.stats.unitary_group.rvs(4, random_state=seed)
+
+
+def test_mps_simulator_is_available():
+    sim = MPSSimulator()
+    eng = MainEngine(DummyEngine(), [])
+    qb0 = WeakQubitRef(engine=eng, idx=0)
+    qb1 = WeakQubitRef(engine=eng, idx=1)
+    qb2 = WeakQubitRef(engine=eng, idx=2)
+    for gate in [H, T, Rx(0.3), Measure]:
+        assert sim.is_available(Command(eng, gate, ([qb0],)))
+    assert sim.is_available(Command(eng, Rz(0.3), ([qb0],), controls=[qb1]))
+    assert sim.is_available(Command(eng, Swap, ([qb0], [qb1])))
+    assert not sim.is_available(Command(eng, X, ([qb0],),
+                                        controls=[qb1, qb2]))
+    assert not sim.is_available(Command(eng, Swap, ([qb0], [qb1]),
+                                        controls=[qb2]))
+
+
+def test_mps_simulator_invalid_arguments():
+    with pytest.raises(ValueError):
+        MPSSimulator(max_bond_dimension=0)
+    with pytest.raises(ValueError):
+        MPSSimulator(cutoff=-1.)
+
+
+def _random_circuit(qureg, rng, num_gates):
+    for i in range(num_gates):
+        a, b = rng.sample(range(len(qureg)), 2)
+        kind = rng.randint(0, 4)
+        if kind == 0:
+            Rx(rng.random() * 6) | qureg[a]
+            Rz(rng.random() * 6) | qureg[a]
+        elif kind == 1:
+            CNOT | (qureg[a], qureg[b])
+        elif kind == 2:
+            C(Ry(rng.random() * 6)) | (qureg[a], qureg[b])
+        elif kind == 3:
+            Swap | (qureg[a], qureg[b])
+        else:
+            Random2QubitGate(i) | (qureg[a], qureg[b])
+
+
+@pytest.mark.parametrize("circuit_seed", [1, 2, 3])
+def test_mps_simulator_exact(mapper, circuit_seed):
+    engine_list = []
+    if mapper is not None:
+        engine_list.append(mapper)
+    sim = MPSSimulator(max_bond_dimension=64, cutoff=0.)
+    eng = MainEngine(sim, engine_list)
+    ref_eng = MainEngine(Simulator(), [])
+    qureg = eng.allocate_qureg(6)
+    ref_qureg = ref_eng.allocate_qureg(6)
+    for engine, qubits in ((eng, qureg), (ref_eng, ref_qureg)):
+        _random_circuit(qubits, random.Random(circuit_seed), 40)
+        engine.flush()
+    assert sim.get_truncation_error() == pytest.approx(0., abs=1e-12)
+    for bits in itertools.product([0, 1], repeat=6):
+        assert (sim.get_probability(bits, qureg) == pytest.approx(
+            ref_eng.backend.get_probability(bits, ref_qureg), abs=1e-10))
+    assert (sim.get_probability('10', qureg[4:1:-2]) == pytest.approx(
+        ref_eng.backend.get_probability('10', ref_qureg[4:1:-2])))
+    op = (QubitOperator('X0 Z3', 0.5) + QubitOperator('Y1 Y5', -1.2) +
+          QubitOperator('Z2', 0.3) + QubitOperator((), 0.7))
+    assert (sim.get_expectation_value(op, qureg) == pytest.approx(
+        ref_eng.backend.get_expectation_value(op, ref_qureg)))
+    with pytest.raises(Exception):
+        sim.get_expectation_value(QubitOperator('Z6'), qureg)
+    All(Measure) | qureg
+    eng.flush()
+    bits = [int(qb) for qb in qureg]
+    assert ref_eng.backend.get_probability(bits, ref_qureg) > 1e-12
+    All(Measure) | ref_qureg
+
+
+def test_mps_simulator_wide_ghz():
+    sim = MPSSimulator(max_bond_dimension=2)
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(100)
+    H | qureg[0]
+    for i in range(99):
+        CNOT | (qureg[i], qureg[i + 1])
+    eng.flush()
+    assert max(sim.get_bond_dimensions()) == 2
+    assert sim.get_truncation_error() == pytest.approx(0., abs=1e-12)
+    assert sim.get_probability([1] * 100, qureg) == pytest.approx(0.5)
+    assert (sim.get_expectation_value(QubitOperator('Z0 Z99'), qureg) ==
+            pytest.approx(1.))
+    All(Measure) | qureg
+    eng.flush()
+    assert len(set(int(qb) for qb in qureg)) == 1
+
+
+def test_mps_simulator_truncation():
+    sim = MPSSimulator(max_bond_dimension=2)
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(8)
+    _random_circuit(qureg, random.Random(5), 80)
+    eng.flush()
+    assert max(sim.get_bond_dimensions()) == 2
+    assert 0. < sim.get_truncation_error()
+    total = sum(sim.get_probability(bits, qureg[:3])
+                for bits in itertools.product([0, 1], repeat=3))
+    assert total == pytest.approx(1.)
+    All(Measure) | qureg
+
+
+def test_mps_simulator_deallocate():
+    sim = MPSSimulator()
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(3)
+    H | qureg[0]
+    CNOT | (qureg[0], qureg[2])
+    X | qureg[1]
+    eng.flush()
+    # deallocate the qubit in the middle
+    del qureg[1]
+    eng.flush()
+    assert sim.get_probability([1, 1], qureg) == pytest.approx(0.5)
+    CNOT | (qureg[0], qureg[1])
+    eng.flush()
+    assert sim.get_probability([1, 0], qureg) == pytest.approx(0.5)
+    # deallocate the last qubit
+    del qureg[1]
+    eng.flush()
+    assert sim.get_probability([1], qureg) == pytest.approx(0.5)
+    with pytest.raises(RuntimeError):
+        qureg[0].__del__()
+    with pytest.raises(RuntimeError):
+        sim.get_probability([0], [WeakQubitRef(eng, 10)])
+
+
+def test_mps_simulator_large_gate():
+    sim = MPSSimulator()
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(3)
+    with pytest.raises(Exception):
+        Toffoli | (qureg[0], qureg[1], qureg[2])
+        eng.flush()
@@ -0,0 +1,304 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Contains a simulator which records a compiled circuit with parameterized
+gates (see projectq.ops.Parameter) and simulates it for many bindings of the
+parameters.
+"""
+
+import copy
+
+import numpy
+
+from projectq.ops import (AllocateQubitGate, DeallocateQubitGate, FlushGate,
+                          Parameter, Ph, R, Rx, Ry, Rz)
+from ._simulator import Simulator, _is_emulated, _is_parameterized
+
+
+def _bound_matrices(gate, angles):
+    """
+    Return the matrices of the gate for each of the angles (as an array of
+    shape (len(angles), 2^k, 2^k)).
+
+    The matrices of Rx, Ry, Rz, R and Ph are computed for all angles at once,
+    those of other gates by constructing one gate per angle.
+    """
+    half = .5 * angles
+    zeros = numpy.zeros(len(angles))
+    if type(gate) is Rx:
+        rows = [[numpy.cos(half), -1j * numpy.sin(half)],
+                [-1j * numpy.sin(half), numpy.cos(half)]]
+    elif type(gate) is Ry:
+        rows = [[numpy.cos(half), -numpy.sin(half)],
+                [numpy.sin(half), numpy.cos(half)]]
+    elif type(gate) is Rz:
+        rows = [[numpy.exp(-1j * half), zeros], [zeros, numpy.exp(1j * half)]]
+    elif type(gate) is R:
+        rows = [[zeros + 1., zeros], [zeros, numpy.exp(1j * angles)]]
+    elif type(gate) is Ph:
+        rows = [[numpy.exp(1j * angles), zeros],
+                [zeros, numpy.exp(1j * angles)]]
+    else:
+        return numpy.array([numpy.asarray(type(gate)(angle).matrix,
+                                          dtype=complex)
+                            for angle in angles])
+    return numpy.moveaxis(numpy.array(rows, dtype=complex), -1, 0)
+
+
+class ParametricSimulator(Simulator):
+    """
+    Simulator which records the (compiled) commands it receives instead of
+    simulating them, and simulates the recorded circuit once per set of
+    values of its parameters (see run).
+
+    The rotation and phase gates of the circuit may have parameterized angles
+    (see projectq.ops.Parameter), which pass through the compiler engines
+    (decompositions, mappers and optimizers) as affine expressions of the
+    parameters. Hence, a parameter sweep compiles the circuit only once.
+
+    Example:
+        .. code-block:: python
+
+            sim = ParametricSimulator()
+            eng = MainEngine(sim)
+            theta = Parameter('theta')
+            qureg = eng.allocate_qureg(2)
+            Ry(theta) | qureg[0]
+            CNOT | (qureg[0], qureg[1])
+            Rz(0.5 * theta) | qureg[1]
+            eng.flush()
+            values = sim.run([theta], numpy.linspace(0, 1, 10000)[:, None],
+                             [QubitOperator('X1')], qureg)
+
+    Note:
+        The simulator has to be the back-end (last engine) of the MainEngine.
+        Once all qubits are deallocated, the recorded circuit is discarded.
+    """
+    def __init__(self, *args, **kwargs):
+        """
+        Construct the simulator (with the arguments of Simulator) and an empty
+        circuit.
+        """
+        Simulator.__init__(self, *args, **kwargs)
+        self._program = []
+        self._num_allocated = 0
+
+    def is_available(self, cmd):
+        """
+        Specialized implementation of is_available: The simulator can deal
+        with parameterized gates (and all gates which are available in the
+        Simulator).
+
+        Args:
+            cmd (Command): Command for which to check availability (single-
+                qubit gate, arbitrary controls)
+
+        Returns:
+            True if it can be simulated and False otherwise.
+        """
+        return _is_parameterized(cmd.gate) or Simulator.is_available(self,
+                                                                     cmd)
+
+    def receive(self, command_list):
+        """
+        Record the commands (without simulating them, see run).
+
+        Args:
+            command_list (list<Command>): List of commands of the circuit.
+        """
+        for cmd in command_list:
+            if isinstance(cmd.gate, FlushGate):
+                continue
+            self._program.append(cmd)
+            if isinstance(cmd.gate, AllocateQubitGate):
+                self._num_allocated += 1
+            elif isinstance(cmd.gate, DeallocateQubitGate):
+                self._num_allocated -= 1
+                if self._num_allocated == 0:
+                    self._program = []
+
+    def get_parameters(self):
+        """
+        Return the sorted list of the names of the parameters of the recorded
+        circuit.
+        """
+        names = set()
+        for cmd in self._program:
+            if _is_parameterized(cmd.gate):
+                names.update(cmd.gate.angle.terms)
+        return sorted(names)
+
+    def _reset(self):
+        """
+        Deallocate all qubits of the backend (after resetting its state to
+        |0...0>) and clear the batches of gates, allocations and
+        deallocations.
+        """
+        self._factors = dict()
+        self._allocation_batch = []
+        self._deallocation_batch = []
+        self._clear_gate_batch()
+        mapping, state = self._simulator.cheat()
+        if len(mapping) > 0:
+            ordering = sorted(mapping, key=mapping.get)
+            zero_state = numpy.zeros(len(state), dtype=state.dtype)
+            zero_state[0] = 1.
+            self._simulator.set_wavefunction(zero_state, ordering)
+            self._simulator.deallocate_qubits(ordering)
+
+    def _is_batchable(self):
+        """
+        Return True if the recorded circuit consists of allocations and
+        gates which are given by their matrices only.
+        """
+        return all(isinstance(cmd.gate, AllocateQubitGate) or
+                   not _is_emulated(cmd.gate) for cmd in self._program)
+
+    def run(self, parameters, values, observables=(), qureg=None):
+        """
+        Simulate the recorded circuit once for each set of values of the
+        parameters and return the expectation values of the observables at
+        the end of each run.
+
+        If the circuit consists of allocations and gates with a matrix only,
+        the gate batch of the backend is built once and the matrices of
+        the parameterized gates are computed for all sets of values at once,
+        such that a run costs one call to the backend. Otherwise (e.g., for
+        measurements or math gates), the recorded commands with bound
+        parameters are simulated one by one.
+
+        After the call, the state of the simulator is the final state of the
+        last run (e.g., to access it using cheat).
+
+        Args:
+            parameters (list[Parameter|str]): Parameters (or their names),
+                which correspond to the columns of values.
+            values (numpy.ndarray): Array of shape
+                (number of runs, len(parameters)), where each row is a set of
+                values of the parameters.
+            observables (list[QubitOperator]): Operators whose expectation
+                values w.r.t. the qureg are evaluated after each run.
+            qureg (list[Qubit],Qureg): Quantum bits to which the indices of
+                the observables refer.
+
+        Returns:
+            Array of shape (number of runs, len(observables)) with the
+            expectation values.
+
+        Raises:
+            ValueError: If values does not have one column per parameter, or
+                if a parameter of the circuit is missing.
+        """
+        names = [param.name if isinstance(param, Parameter) else param
+                 for param in parameters]
+        values = numpy.asarray(values, dtype=float)
+        if values.ndim != 2 or values.shape[1] != len(names):
+            raise ValueError("ParametricSimulator.run: values must have one "
+                             "column per parameter.")
+        missing = set(self.get_parameters()) - set(names)
+        if len(missing) > 0:
+            raise ValueError("ParametricSimulator.run: No values for the "
+                             "parameters {}.".format(sorted(missing)))
+        observables = list(observables)
+        num_runs = len(values)
+        results = numpy.zeros((num_runs, len(observables)))
+        self._reset()
+        batchable = self._is_batchable()
+        if batchable:
+            run_batch = self._compile_batch({name: values[:, k] for k, name
+                                             in enumerate(names)}, num_runs)
+        for i in range(num_runs):
+            if batchable:
+                run_batch(i)
+            else:
+                if i > 0:
+                    self._reset()
+                bound = dict(zip(names, values[i]))
+                Simulator.receive(self, [self._bind(cmd, bound)
+                                         for cmd in self._program])
+            if len(observables) > 0:
+                results[i] = self.get_expectation_values(observables, qureg)
+        return results
+
+    @staticmethod
+    def _bind(cmd, values):
+        """
+        Return the command with the parameters of its gate bound to values.
+        """
+        if not _is_parameterized(cmd.gate):
+            return cmd
+        bound = copy.copy(cmd)
+        bound.gate = cmd.gate.bind(values)
+        return bound
+
+    def _compile_batch(self, values, num_runs):
+        """
+        Build the gate batch of the (batchable) recorded circuit.
+
+        Args:
+            values (dict): Values of each parameter (name -> array of length
+                num_runs).
+            num_runs (int): Number of runs.
+
+        Returns:
+            Function which applies the circuit for the i-th set of values
+            (starting from |0...0>) given i.
+        """
+        ids = []
+        matrices = []
+        stream = []
+        bound_matrices = []  # (index in matrices, array of matrices)
+        for cmd in self._program:
+            if isinstance(cmd.gate, AllocateQubitGate):
+                ids.append(cmd.qubits[0][0].id)
+                continue
+            targets = [qb.id for qr in cmd.qubits for qb in qr]
+            controls = [qb.id for qb in cmd.control_qubits]
+            if _is_parameterized(cmd.gate):
+                angles = numpy.broadcast_to(cmd.gate.angle.evaluate(values),
+                                            (num_runs,))
+                bound = _bound_matrices(cmd.gate, angles)
+                size = bound.shape[-1]
+                bound_matrices.append((len(matrices), bound))
+                matrices.append(None)
+            else:
+                matrix = numpy.asarray(cmd.gate.matrix, dtype=complex)
+                size = len(matrix)
+                matrices.append(matrix.tolist())
+            if size != 2 ** len(targets):
+                raise Exception("Simulator: Error applying {} gate: "
+                                "{}-qubit gate applied to {} qubits.".format(
+                                    cmd.gate, size.bit_length() - 1,
+                                    len(targets)))
+            stream += [len(matrices) - 1, len(targets), len(controls)]
+            stream += targets + controls
+        stream = numpy.array(stream, dtype=numpy.uint32)
+        self._simulator.allocate_qubits(ids)
+        mapping, state = self._simulator.cheat()
+        ordering = sorted(mapping, key=mapping.get)
+        zero_state = numpy.zeros(len(state), dtype=state.dtype)
+        zero_state[0] = 1.
+
+        def run_batch(i):
+            if i > 0:
+                self._simulator.set_wavefunction(zero_state, ordering)
+            for index, bound in bound_matrices:
+                matrices[index] = bound[i].tolist()
+            if len(matrices) > 0:
+                self._simulator.apply_gates(matrices, stream,
+                                            self._gate_fusion)
+            self._simulator.run()
+
+        return run_batch
@@ -0,0 +1,216 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import numpy
+import pytest
+
+import projectq.setups.decompositions
+from projectq import MainEngine
+from projectq.cengines import (AutoReplacer, DecompositionRuleSet,
+                               InstructionFilter, LocalOptimizer)
+from projectq.libs.math import AddConstant
+from projectq.meta import get_control_count
+from projectq.ops import (All, BasicGate, C, ClassicalInstructionGate, CNOT,
+                          H, Measure, Parameter, Ph, QubitOperator, R, Rx,
+                          Ry, Rz, Swap, X)
+from ._simulator_test import get_available_simulators, mapper
+
+from ._simulator import Simulator
+from ._parametric_simulator import ParametricSimulator
+
+
+@pytest.fixture(params=get_available_simulators())
+def parametric_sim(request):
+    sim = ParametricSimulator()
+    if request.param == "cpp_simulator":
+        from projectq.backends._sim._cppsim import Simulator as CppSim
+        sim._simulator = CppSim(1)
+    if request.param == "py_simulator":
+        from projectq.backends._sim._pysim import Simulator as PySim
+        sim._simulator = PySim(1)
+    return sim
+
+
+def _low_level_gates(eng, cmd):
+    gate = cmd.gate
+    if isinstance(gate, ClassicalInstructionGate):
+        return True
+    if isinstance(gate, Rz) or gate == H:
+        return get_control_count(cmd) == 0
+    return gate == X and get_control_count(cmd) <= 1
+
+
+def _circuit(eng, qureg, theta, phi):
+    Rx(theta) | qureg[0]
+    Ry(2 * theta - phi) | qureg[1]
+    C(Rz(phi)) | (qureg[0], qureg[2])
+    Rz(theta) | qureg[2]
+    Rz(-theta) | qureg[2]
+    C(Ph(0.5 * phi + 1.)) | (qureg[1], qureg[2])
+    R(theta) | qureg[0]
+    CNOT | (qureg[1], qureg[2])
+    H | qureg[1]
+
+
+def _observables():
+    return [QubitOperator('Z0 Z2'), QubitOperator('X1', 0.5) +
+            QubitOperator('Y0 Y2', -1.)]
+
+
+def test_parametric_simulator_matches_simulator(parametric_sim, mapper):
+    rule_set = DecompositionRuleSet(modules=[projectq.setups.decompositions])
+    engine_list = [LocalOptimizer(), AutoReplacer(rule_set),
+                   InstructionFilter(_low_level_gates), LocalOptimizer()]
+    if mapper is not None:
+        engine_list.append(mapper)
+    eng = MainEngine(parametric_sim, engine_list)
+    qureg = eng.allocate_qureg(3)
+    theta, phi = Parameter('theta'), Parameter('phi')
+    _circuit(eng, qureg, theta, phi)
+    eng.flush()
+    # the circuit was decomposed (with parameterized angles)
+    gates = [cmd.gate for cmd in parametric_sim._program]
+    assert not any(isinstance(gate, (Rx, Ry, R, Ph)) for gate in gates)
+    assert any(isinstance(gate, Rz) and gate.is_parameterized()
+               for gate in gates)
+    assert parametric_sim.get_parameters() == ['phi', 'theta']
+    values = numpy.random.RandomState(1).uniform(-4, 4, size=(6, 2))
+    results = parametric_sim.run(['phi', theta], values, _observables(),
+                                 qureg)
+    assert results.shape == (6, 2)
+    for (phi_value, theta_value), result in zip(values, results):
+        ref_eng = MainEngine(Simulator(), [])
+        ref_qureg = ref_eng.allocate_qureg(3)
+        _circuit(ref_eng, ref_qureg, theta_value, phi_value)
+        ref_eng.flush()
+        expected = ref_eng.backend.get_expectation_values(_observables(),
+                                                          ref_qureg)
+        assert numpy.allclose(result, expected)
+        All(Measure) | ref_qureg
+    # the final state is the one of the last run
+    assert (parametric_sim.get_expectation_value(_observables()[0], qureg) ==
+            pytest.approx(results[-1, 0]))
+    # runs without observables
+    assert parametric_sim.run([theta, phi], values).shape == (6, 0)
+
+
+def _controlled_circuit(eng, qureg, theta, phi):
+    H | qureg[0]
+    C(Rx(theta)) | (qureg[0], qureg[1])
+    C(Ry(2 * theta - phi)) | (qureg[1], qureg[2])
+    C(Ph(phi), 2) | (qureg[0], qureg[2], qureg[1])
+
+
+def test_parametric_simulator_controlled_rotations(parametric_sim):
+    # controlled rotations with parameterized angles are decomposed into
+    # gates which the filter accepts (instead of being dropped)
+    rule_set = DecompositionRuleSet(modules=[projectq.setups.decompositions])
+    eng = MainEngine(parametric_sim, [AutoReplacer(rule_set),
+                                      InstructionFilter(_low_level_gates)])
+    qureg = eng.allocate_qureg(3)
+    _controlled_circuit(eng, qureg, Parameter('theta'), Parameter('phi'))
+    eng.flush()
+    for cmd in parametric_sim._program:
+        assert _low_level_gates(eng, cmd)
+    values = numpy.array([[0.7, -1.3], [2.1, 0.4]])
+    amplitudes = []
+    for theta_value, phi_value in values:
+        parametric_sim.run(['theta', 'phi'], [[theta_value, phi_value]])
+        amplitudes.append(numpy.array(parametric_sim.cheat()[1]))
+    for (theta_value, phi_value), amplitude in zip(values, amplitudes):
+        ref_eng = MainEngine(Simulator(), [])
+        ref_qureg = ref_eng.allocate_qureg(3)
+        _controlled_circuit(ref_eng, ref_qureg, theta_value, phi_value)
+        ref_eng.flush()
+        # (the decomposition drops global phases)
+        overlap = numpy.vdot(ref_eng.backend.cheat()[1], amplitude)
+        assert abs(overlap) == pytest.approx(1.)
+        All(Measure) | ref_qureg
+
+
+def test_simulator_rejects_parameterized_gates():
+    eng = MainEngine(Simulator())
+    qubit = eng.allocate_qubit()
+    Rx(Parameter('theta')) | qubit
+    with pytest.raises(TypeError):
+        eng.flush()
+
+
+def test_parametric_simulator_swap_batchable(parametric_sim):
+    eng = MainEngine(parametric_sim, [])
+    qureg = eng.allocate_qureg(2)
+    theta = Parameter('theta')
+    Ry(theta) | qureg[0]
+    Swap | (qureg[0], qureg[1])
+    eng.flush()
+    # the Swap is applied via its matrix in the gate batch
+    assert parametric_sim._is_batchable()
+    values = numpy.array([[0.], [1.], [2.]])
+    results = parametric_sim.run([theta], values, [QubitOperator('Z0'),
+                                                   QubitOperator('Z1')],
+                                 qureg)
+    assert numpy.allclose(results[:, 0], 1.)
+    assert numpy.allclose(results[:, 1], numpy.cos(values[:, 0]))
+
+
+def test_parametric_simulator_emulated_gates(parametric_sim):
+    eng = MainEngine(parametric_sim, [])
+    qureg = eng.allocate_qureg(3)
+    theta = Parameter('theta')
+    X | qureg[0]
+    AddConstant(3) | qureg[:2]
+    Ry(theta) | qureg[2]
+    eng.flush()
+    assert not parametric_sim._is_batchable()
+    values = numpy.array([[0.], [1.], [numpy.pi]])
+    results = parametric_sim.run([theta], values,
+                                 [QubitOperator('Z0'), QubitOperator('Z1'),
+                                  QubitOperator('Z2')], qureg)
+    assert numpy.allclose(results[:, :2], [[1., 1.]] * 3)
+    assert numpy.allclose(results[:, 2], numpy.cos(values[:, 0]))
+    Measure | qureg[2]
+    eng.flush()
+    results = parametric_sim.run([theta], [[numpy.pi]], [QubitOperator('Z2')],
+                                 qureg)
+    assert results[0, 0] == pytest.approx(-1.)
+    assert int(qureg[2]) == 1
+
+
+def test_parametric_simulator_program(parametric_sim):
+    eng = MainEngine(parametric_sim, [])
+    qureg = eng.allocate_qureg(2)
+    theta = Parameter('theta')
+    Rx(theta) | qureg[0]
+    # nothing is simulated until run is called
+    assert parametric_sim.cheat()[0] == dict()
+    assert parametric_sim.get_parameters() == ['theta']
+    with pytest.raises(ValueError):
+        parametric_sim.run([theta], [0.1, 0.2])
+    with pytest.raises(ValueError):
+        parametric_sim.run([Parameter('phi')], [[0.1]])
+    wrong_gate = BasicGate()
+    wrong_gate.matrix = numpy.eye(4)
+    wrong_gate | qureg[0]
+    with pytest.raises(Exception):
+        parametric_sim.run([theta], [[0.1]])
+    # deallocating all qubits discards the circuit
+    del qureg
+    eng.flush()
+    assert parametric_sim._program == []
+    assert parametric_sim.get_parameters() == []
+    qubit = eng.allocate_qubit()
+    Ry(Parameter('phi')) | qubit
+    results = parametric_sim.run(['phi'], [[0.], [numpy.pi / 2]],
+                                 [QubitOperator('X0')], qubit)
+    assert numpy.allclose(results, [[0.], [1.]])
@@ -30,6 +30,8 @@ class Simulator(object):
     not an option (for some reason). It has the same features but is much
     slower, so please consider building the c++ version for larger experiments.
     """
+    _dtype = _np.complex128
+
     def __init__(self, rnd_seed, *args, **kwargs):
         """
         Initialize the simulator.
@@ -41,8 +43,10 @@ class Simulator(object):
             kwargs: Same as args.
         """
         random.seed(rnd_seed)
-        self._state = _np.ones(1, dtype=_np.complex128)
+        self._state = _np.ones(1, dtype=self._dtype)
         self._map = dict()
+        # values of the qubits which are known to be in a basis state
+        self._classical = dict()
         self._num_qubits = 0
         print("(Note: This is the (slow) Python simulator.)")
 
@@ -57,10 +61,46 @@ class Simulator(object):
         Returns:
             A tuple where the first entry is a dictionary mapping qubit indices
             to bit-locations and the second entry is the corresponding state
-            vector
+            vector (not a copy)
         """
         return (self._map, self._state)
 
+    def _tensor(self, state=None):
+        """
+        Return a view of a state vector as a tensor with one axis of length 2
+        per qubit.
+
+        The qubit at bit-location `pos` corresponds to the tensor axis
+        `self._num_qubits - 1 - pos` (see _axis).
+
+        Args:
+            state (numpy.ndarray): State vector to reshape (default: the
+                current state vector of the simulator).
+        """
+        if state is None:
+            state = self._state
+        return state.reshape((2,) * self._num_qubits)
+
+    def _axis(self, pos):
+        """
+        Return the tensor axis which corresponds to the bit-location `pos`.
+        """
+        return self._num_qubits - 1 - pos
+
+    def _subspace(self, positions, values):
+        """
+        Return an index (to be used on the tensor returned by _tensor) which
+        selects the subspace where the qubits at bit-locations `positions`
+        are in the (classical) state given by `values`.
+
+        Indexing with it yields a view, i.e., the selected amplitudes can be
+        modified in-place.
+        """
+        index = [slice(None)] * self._num_qubits
+        for pos, value in zip(positions, values):
+            index[self._axis(pos)] = int(value)
+        return tuple(index)
+
     def measure_qubits(self, ids):
         """
         Measure the qubits with IDs ids and return a list of measurement
@@ -73,32 +113,20 @@ class Simulator(object):
             List of measurement results (containing either True or False).
         """
         P = random.random()
-        val = 0.
-        i_picked = 0
-        while val < P and i_picked < len(self._state):
-            val += _np.abs(self._state[i_picked]) ** 2
-            i_picked += 1
-
-        i_picked -= 1
+        cumulative = _np.cumsum(_np.abs(self._state) ** 2, dtype=_np.float64)
+        i_picked = min(int(_np.searchsorted(cumulative, P)),
+                       len(self._state) - 1)
 
         pos = [self._map[ID] for ID in ids]
-        res = [False] * len(pos)
-
-        mask = 0
-        val = 0
-        for i in range(len(pos)):
-            res[i] = (((i_picked >> pos[i]) & 1) == 1)
-            mask |= (1 << pos[i])
-            val |= ((res[i] & 1) << pos[i])
-
-        nrm = 0.
-        for i in range(len(self._state)):
-            if (mask & i) != val:
-                self._state[i] = 0.
-            else:
-                nrm += _np.abs(self._state[i]) ** 2
-
-        self._state *= 1. / _np.sqrt(nrm)
+        res = [((i_picked >> p) & 1) == 1 for p in pos]
+        self._classical.update(zip(ids, res))
+
+        psi = self._tensor()
+        subspace = self._subspace(pos, res)
+        amplitudes = psi[subspace].copy()
+        nrm = _np.vdot(amplitudes, amplitudes).real
+        self._state[:] = 0.
+        psi[subspace] = amplitudes / _np.sqrt(nrm)
         return res
 
     def allocate_qubit(self, ID):
@@ -108,15 +136,56 @@ class Simulator(object):
         Args:
             ID (int): ID of the qubit which is being allocated.
         """
-        self._map[ID] = self._num_qubits
-        self._num_qubits += 1
-        self._state.resize(1 << self._num_qubits)
+        self.allocate_qubits([ID])
+
+    def allocate_qubits(self, IDs):
+        """
+        Allocate several qubits at once (which resizes the state only once).
+
+        Args:
+            IDs (list[int]): IDs of the qubits which are being allocated.
+
+        Raises:
+            RuntimeError: If one of the IDs already exists.
+        """
+        if (len(set(IDs)) != len(IDs) or
+                any(ID in self._map for ID in IDs)):
+            raise RuntimeError("AllocateQubit: ID already exists. Qubit IDs "
+                               "should be unique.")
+        for ID in IDs:
+            self._map[ID] = self._num_qubits
+            self._classical[ID] = False
+            self._num_qubits += 1
+        # (no in-place resize: views of the old state may still be alive)
+        new_state = _np.zeros(1 << self._num_qubits, dtype=self._dtype)
+        new_state[:len(self._state)] = self._state
+        self._state = new_state
+
+    def is_classical(self, ID, tol=1.e-10):
+        """
+        Return True if the qubit is in a basis state (i.e., has been measured
+        / uncomputed).
+
+        Args:
+            ID (int): ID of the qubit.
+            tol (float): Tolerance for numerical errors.
+        """
+        if ID in self._classical:
+            return True
+        pos = self._map[ID]
+        psi = self._state.reshape(-1, 2, 1 << pos)
+        return not (_np.any(_np.abs(psi[:, 0, :]) > tol) and
+                    _np.any(_np.abs(psi[:, 1, :]) > tol))
 
     def get_classical_value(self, ID, tol=1.e-10):
         """
         Return the classical value of a classical bit (i.e., a qubit which has
         been measured / uncomputed).
 
+        The state is only scanned if the qubit is not known to be in a basis
+        state, i.e., if a gate which is neither diagonal nor a permutation has
+        acted on it since it was allocated, measured or collapsed.
+
         Args:
             ID (int): ID of the qubit of which to get the classical value.
             tol (float): Tolerance for numerical errors when determining
@@ -126,21 +195,18 @@ class Simulator(object):
             RuntimeError: If the qubit is in a superposition, i.e., has not
                 been measured / uncomputed.
         """
+        if ID in self._classical:
+            return self._classical[ID]
         pos = self._map[ID]
-        up = down = False
-
-        for i in range(0, len(self._state), (1 << (pos + 1))):
-            for j in range(0, (1 << pos)):
-                if _np.abs(self._state[i + j]) > tol:
-                    up = True
-                if _np.abs(self._state[i + j + (1 << pos)]) > tol:
-                    down = True
-                if up and down:
-                    raise RuntimeError("Qubit has not been measured / "
-                                       "uncomputed. Cannot access its "
-                                       "classical value and/or deallocate a "
-                                       "qubit in superposition!")
-        return down
+        psi = self._state.reshape(-1, 2, 1 << pos)
+        up = _np.any(_np.abs(psi[:, 0, :]) > tol)
+        down = _np.any(_np.abs(psi[:, 1, :]) > tol)
+        if up and down:
+            raise RuntimeError("Qubit has not been measured / "
+                               "uncomputed. Cannot access its "
+                               "classical value and/or deallocate a "
+                               "qubit in superposition!")
+        return bool(down)
 
     def deallocate_qubit(self, ID):
         """
@@ -153,27 +219,80 @@ class Simulator(object):
             RuntimeError: If the qubit is in a superposition, i.e., has not
                 been measured / uncomputed.
         """
-        pos = self._map[ID]
+        self.deallocate_qubits([ID])
 
-        cv = self.get_classical_value(ID)
-
-        newstate = _np.zeros((1 << (self._num_qubits - 1)),
-                             dtype=_np.complex128)
-        k = 0
-        for i in range((1 << pos) * int(cv), len(self._state),
-                       (1 << (pos + 1))):
-            newstate[k:k + (1 << pos)] = self._state[i:i + (1 << pos)]
-            k += (1 << pos)
-
-        newmap = dict()
-        for key, value in self._map.items():
-            if value > pos:
-                newmap[key] = value - 1
-            elif key != ID:
-                newmap[key] = value
-        self._map = newmap
-        self._state = newstate
-        self._num_qubits -= 1
+    def deallocate_qubits(self, IDs):
+        """
+        Deallocate several qubits at once (if they have been measured /
+        uncomputed), which copies the state only once.
+
+        Args:
+            IDs (list[int]): IDs of the qubits to deallocate.
+
+        Raises:
+            RuntimeError: If one of the qubits is in a superposition, i.e., has
+                not been measured / uncomputed.
+        """
+        self.remove_qubits(IDs, [self.get_classical_value(ID) for ID in IDs])
+
+    def remove_qubits(self, IDs, values):
+        """
+        Remove qubits which are known to be in the basis states `values`
+        (e.g., right after they have been measured), without checking that
+        they are.
+
+        Args:
+            IDs (list[int]): IDs of the qubits to remove.
+            values (list[bool]): Values of the qubits.
+        """
+        index = [slice(None)] * self._num_qubits
+        for ID, value in zip(IDs, values):
+            # (axis 0 of the reshaped state is the most significant bit)
+            index[self._num_qubits - 1 - self._map[ID]] = int(value)
+        psi = self._state.reshape([2] * self._num_qubits)
+        self._state = psi[tuple(index)].flatten()
+
+        positions = sorted(pos for ID, pos in self._map.items()
+                           if ID not in IDs)
+        new_pos = {pos: i for i, pos in enumerate(positions)}
+        self._map = {ID: new_pos[pos] for ID, pos in self._map.items()
+                     if ID not in IDs}
+        for ID in IDs:
+            self._classical.pop(ID, None)
+        self._num_qubits -= len(IDs)
+
+    def _is_disabled(self, ctrlids):
+        """
+        Return True if one of the control qubits is known to be 0, i.e., if a
+        gate with these controls acts trivially.
+        """
+        return any(ID in self._classical and not self._classical[ID]
+                   for ID in ctrlids)
+
+    def _forget_classical(self, ids, ctrlids):
+        """
+        Mark the qubits ids as (possibly) not being in a basis state anymore,
+        unless the controls disable the gate.
+        """
+        if not self._is_disabled(ctrlids):
+            for ID in ids:
+                self._classical.pop(ID, None)
+
+    def _update_classical(self, table, ids, ctrlids):
+        """
+        Update the known values of the qubits ids under the map
+        |x> -> |table[x]> (if all control qubits are 1), which is possible if
+        the values of all of these qubits are known.
+        """
+        if self._is_disabled(ctrlids):
+            return
+        if not all(ID in self._classical for ID in list(ids) + list(ctrlids)):
+            self._forget_classical(ids, [])
+            return
+        x = sum(int(self._classical[ID]) << l for l, ID in enumerate(ids))
+        y = int(table[x])
+        for l, ID in enumerate(ids):
+            self._classical[ID] = ((y >> l) & 1) == 1
 
     def _get_control_mask(self, ctrlids):
         """
@@ -188,6 +307,28 @@ class Simulator(object):
             mask |= (1 << ctrlpos)
         return mask
 
+    @staticmethod
+    def _gather_bits(indices, positions):
+        """
+        Return the integers whose k-th bit is the bit at location
+        positions[k] of the corresponding entry in `indices`.
+        """
+        values = _np.zeros_like(indices)
+        for k, pos in enumerate(positions):
+            values |= ((indices >> pos) & 1) << k
+        return values
+
+    @staticmethod
+    def _scatter_bits(values, positions):
+        """
+        Inverse of _gather_bits: Move the k-th bit of each entry in `values`
+        to the bit location positions[k].
+        """
+        indices = _np.zeros_like(values)
+        for k, pos in enumerate(positions):
+            indices |= ((values >> k) & 1) << pos
+        return indices
+
     def emulate_math(self, f, qubit_ids, ctrlqubit_ids):
         """
         Emulate a math function (e.g., BasicMathGate).
@@ -206,29 +347,126 @@ class Simulator(object):
             qb_locs.append([])
             for qubit_id in qureg:
                 qb_locs[-1].append(self._map[qubit_id])
+        all_locs = [loc for qureg_locs in qb_locs for loc in qureg_locs]
+
+        # evaluate f once for each state of the registers it acts upon
+        table = _np.empty(1 << len(all_locs), dtype=_np.int64)
+        for x in range(len(table)):
+            arg_list = []
+            offset = 0
+            for qureg_locs in qb_locs:
+                arg_list.append((x >> offset) & ((1 << len(qureg_locs)) - 1))
+                offset += len(qureg_locs)
+            res = f(arg_list)
+            new_x = 0
+            offset = 0
+            for qr_i, qureg_locs in enumerate(qb_locs):
+                new_x |= ((res[qr_i] & ((1 << len(qureg_locs)) - 1)) <<
+                          offset)
+                offset += len(qureg_locs)
+            table[x] = new_x
+
+        self._update_classical(table, [ID for qureg in qubit_ids
+                                       for ID in qureg], ctrlqubit_ids)
+        self._apply_index_map(table, all_locs, mask)
+
+    def emulate_math_table(self, table, ids, ctrlqubit_ids):
+        """
+        Emulate a math function given by its table of values, i.e., map the
+        basis state |x> of the qubits ids (with ids[0] as the lowest bit) to
+        |table[x]>.
 
-        newstate = _np.zeros_like(self._state)
-        for i in range(0, len(self._state)):
-            if (mask & i) == mask:
-                arg_list = [0] * len(qb_locs)
-                for qr_i in range(len(qb_locs)):
-                    for qb_i in range(len(qb_locs[qr_i])):
-                        arg_list[qr_i] |= (((i >> qb_locs[qr_i][qb_i]) & 1) <<
-                                           qb_i)
-
-                res = f(arg_list)
-                new_i = i
-                for qr_i in range(len(qb_locs)):
-                    for qb_i in range(len(qb_locs[qr_i])):
-                        if not (((new_i >> qb_locs[qr_i][qb_i]) & 1) ==
-                                ((res[qr_i] >> qb_i) & 1)):
-                            new_i ^= (1 << qb_locs[qr_i][qb_i])
-                newstate[new_i] = self._state[i]
-            else:
-                newstate[i] = self._state[i]
+        Args:
+            table (list<int>): Integers of length 2^len(ids).
+            ids (list<int>): List of qubit IDs to which the function is
+                applied.
+            ctrlqubit_ids (list<int>): List of control qubit ids.
+        """
+        self._update_classical(table, ids, ctrlqubit_ids)
+        self._apply_index_map(_np.asarray(table, dtype=_np.int64),
+                              [self._map[ID] for ID in ids],
+                              self._get_control_mask(ctrlqubit_ids))
+
+    def emulate_math_addConstant(self, a, qubit_ids, ctrlqubit_ids):
+        """
+        Emulate the addition of the constant a (see AddConstant).
+
+        Args:
+            a (int): Constant to add.
+            qubit_ids (list<list<int>>): Quantum register (as a list of one
+                list of qubit IDs) to which the constant is added.
+            ctrlqubit_ids (list<int>): List of control qubit ids.
+        """
+        x = _np.arange(1 << len(qubit_ids[0]), dtype=_np.int64)
+        self.emulate_math_table((x + a) & (len(x) - 1), qubit_ids[0],
+                                ctrlqubit_ids)
+
+    def emulate_math_addConstantModN(self, a, N, qubit_ids, ctrlqubit_ids):
+        """
+        Emulate the addition of the constant a modulo N (see
+        AddConstantModN).
+
+        Args:
+            a (int): Constant to add.
+            N (int): Number modulo which the addition is carried out.
+            qubit_ids (list<list<int>>): Quantum register (as a list of one
+                list of qubit IDs) to which the constant is added.
+            ctrlqubit_ids (list<int>): List of control qubit ids.
+        """
+        x = _np.arange(1 << len(qubit_ids[0]), dtype=_np.int64)
+        self.emulate_math_table(((x + a) % N) & (len(x) - 1), qubit_ids[0],
+                                ctrlqubit_ids)
+
+    def emulate_math_multiplyByConstantModN(self, a, N, qubit_ids,
+                                            ctrlqubit_ids):
+        """
+        Emulate the multiplication by the constant a modulo N (see
+        MultiplyByConstantModN).
+
+        Args:
+            a (int): Constant to multiply with.
+            N (int): Number modulo which the multiplication is carried out.
+            qubit_ids (list<list<int>>): Quantum register (as a list of one
+                list of qubit IDs) which is multiplied by a.
+            ctrlqubit_ids (list<int>): List of control qubit ids.
+        """
+        x = _np.arange(1 << len(qubit_ids[0]), dtype=_np.int64)
+        self.emulate_math_table(((a * x) % N) & (len(x) - 1), qubit_ids[0],
+                                ctrlqubit_ids)
+
+    def _apply_index_map(self, table, positions, mask):
+        """
+        Move the amplitude of each basis state whose control bits (`mask`) are
+        all set to the basis state obtained by replacing the bits at
+        `positions` (read as an integer x) by table[x].
 
+        Args:
+            table (numpy.ndarray): Integer array of length 2^len(positions).
+            positions (list<int>): Bit-locations of the qubits to act upon.
+            mask (int): Bit-mask where set bits indicate control qubits.
+        """
+        indices = _np.arange(len(self._state), dtype=_np.int64)
+        active = indices[(indices & mask) == mask]
+        pos_mask = self._get_position_mask(positions)
+        new_indices = ((active & ~pos_mask) |
+                       self._scatter_bits(
+                           table[self._gather_bits(active, positions)],
+                           positions))
+        newstate = self._state.copy()
+        newstate[active] = 0.
+        _np.add.at(newstate, new_indices, self._state[active])
         self._state = newstate
 
+    @staticmethod
+    def _get_position_mask(positions):
+        """
+        Return a mask which represents the bit-locations `positions`.
+        """
+        mask = 0
+        for pos in positions:
+            mask |= (1 << pos)
+        return mask
+
     def get_expectation_value(self, terms_dict, ids):
         """
         Return the expectation value of a qubit operator w.r.t. qubit ids.
@@ -240,15 +478,50 @@ class Simulator(object):
         Returns:
             Expectation value
         """
+        # accumulate in double precision (also for single-precision states)
+        state = self._state.astype(_np.complex128, copy=False)
         expectation = 0.
-        current_state = _np.copy(self._state)
         for (term, coefficient) in terms_dict:
-            self._apply_term(term, ids)
-            delta = coefficient * _np.vdot(current_state, self._state).real
-            expectation += delta
-            self._state = _np.copy(current_state)
+            delta = _np.vdot(state, self._apply_term(term, ids, state)).real
+            expectation += coefficient * delta
         return expectation
 
+    def get_expectation_values(self, groups, ids):
+        """
+        Return the expectation values of Pauli strings, given in groups of
+        qubit-wise commuting ones.
+
+        The qubits in the basis of a group are rotated to the Z basis, which
+        turns each string of the group into a parity of the bits of its
+        qubits.
+
+        Args:
+            groups (list[tuple]): Pairs of the basis of a group, as a list of
+                (index into ids, 'X' or 'Y'), and the strings of the group,
+                each given as the list of the indices of its qubits.
+            ids (list[int]): List of qubit IDs.
+
+        Returns:
+            List of the expectation values of all strings, group by group.
+        """
+        hadamard = _np.array([[1., 1.], [1., -1.]]) / _np.sqrt(2.)
+        rotations = {'X': hadamard, 'Y': hadamard.dot(_np.diag([1., -1j]))}
+        state, classical = self._state, dict(self._classical)
+        indices = _np.arange(len(state), dtype=_np.int64)
+        res = []
+        for basis, strings in groups:
+            self._state = state.copy() if len(basis) > 0 else state
+            for k, pauli in basis:
+                self.apply_controlled_gate(rotations[pauli], [ids[k]], [])
+            probabilities = _np.abs(self._state) ** 2
+            for string in strings:
+                parity = _np.zeros_like(indices)
+                for k in string:
+                    parity ^= (indices >> self._map[ids[k]]) & 1
+                res.append(float(_np.dot(probabilities, 1 - 2 * parity)))
+        self._state, self._classical = state, classical
+        return res
+
     def apply_qubit_operator(self, terms_dict, ids):
         """
         Apply a (possibly non-unitary) qubit operator to qubits.
@@ -257,13 +530,11 @@ class Simulator(object):
             terms_dict (dict): Operator dictionary (see QubitOperator.terms)
             ids (list[int]): List of qubit ids upon which the operator acts.
         """
+        self._forget_classical(ids, [])
         new_state = _np.zeros_like(self._state)
-        current_state = _np.copy(self._state)
         for (term, coefficient) in terms_dict:
-            self._apply_term(term, ids)
-            self._state *= coefficient
-            new_state += self._state
-            self._state = _np.copy(current_state)
+            new_state += coefficient * self._apply_term(term, ids,
+                                                        self._state)
         self._state = new_state
 
     def get_probability(self, bit_string, ids):
@@ -286,17 +557,51 @@ class Simulator(object):
                 raise RuntimeError("get_probability(): Unknown qubit id. "
                                    "Please make sure you have called "
                                    "eng.flush().")
-        mask = 0
-        bit_str = 0
-        for i in range(len(ids)):
-            mask |= (1 << self._map[ids[i]])
-            bit_str |= (bit_string[i] << self._map[ids[i]])
-        probability = 0.
-        for i in range(len(self._state)):
-            if (i & mask) == bit_str:
-                e = self._state[i]
-                probability += e.real**2 + e.imag**2
-        return probability
+        pos = [self._map[ID] for ID in ids]
+        amplitudes = self._tensor()[self._subspace(pos, bit_string)]
+        return float(_np.sum(_np.abs(amplitudes) ** 2, dtype=_np.float64))
+
+    def sample(self, ids, shots, seed=None):
+        """
+        Draw samples from the distribution of measurement outcomes of the
+        qubits given by the list of ids (without collapsing the state).
+
+        Args:
+            ids (list[int]): List of qubit ids determining the ordering.
+            shots (int): Number of samples to draw.
+            seed (int): Seed for the random number generator (uses the
+                simulator's random number generator by default).
+
+        Returns:
+            numpy.ndarray of integers, where bit k of each entry is the
+            outcome for qubit ids[k].
+
+        Raises:
+            RuntimeError if an unknown qubit id was provided.
+        """
+        if not all([ID in self._map for ID in ids]):
+            raise RuntimeError("sample(): Unknown qubit id. "
+                               "Please make sure you have called "
+                               "eng.flush().")
+        if seed is None:
+            seed = random.randint(0, 4294967295)
+        rng = _np.random.RandomState(seed)
+
+        # marginal distribution, with ids[0] as the least significant bit
+        axes = [self._axis(self._map[ID]) for ID in reversed(ids)]
+        probabilities = (_np.abs(self._tensor()) ** 2).astype(_np.float64)
+        other_axes = tuple(ax for ax in range(self._num_qubits)
+                           if ax not in axes)
+        marginal = _np.sum(probabilities, axis=other_axes)
+        # sum keeps the axes in increasing order, reorder them
+        order = _np.argsort(_np.argsort(axes))
+        marginal = _np.transpose(marginal, order).reshape(-1)
+
+        cumulative = _np.cumsum(marginal)
+        samples = _np.searchsorted(cumulative,
+                                   rng.random_sample(shots) * cumulative[-1],
+                                   side='right')
+        return _np.minimum(samples, len(cumulative) - 1)
 
     def get_amplitude(self, bit_string, ids):
         """
@@ -342,6 +647,7 @@ class Simulator(object):
             ids (list): A list of qubit IDs to which to apply the evolution.
             ctrlids (list): A list of control qubit IDs.
         """
+        self._forget_classical(ids, ctrlids)
         # Determine the (normalized) trace, which is nonzero only for identity
         # terms:
         tr = sum([c for (t, c) in terms_dict if len(t) == 0])
@@ -351,31 +657,217 @@ class Simulator(object):
         s = int(op_nrm + 1.)
         correction = _np.exp(-1j * time * tr / float(s))
         output_state = _np.copy(self._state)
-        mask = self._get_control_mask(ctrlids)
+        ctrl_pos = [self._map[ID] for ID in ctrlids]
+        active = self._subspace(ctrl_pos, [1] * len(ctrl_pos))
         for i in range(s):
             j = 0
             nrm_change = 1.
             while nrm_change > 1.e-12:
                 coeff = (-time * 1j) / float(s * (j + 1))
-                current_state = _np.copy(self._state)
-                update = 0j
+                update = _np.zeros_like(self._state)
                 for t, c in terms_dict:
-                    self._apply_term(t, ids)
-                    self._state *= c
-                    update += self._state
-                    self._state = _np.copy(current_state)
+                    update += c * self._apply_term(t, ids, self._state)
                 update *= coeff
                 self._state = update
-                for i in range(len(update)):
-                    if (i & mask) == mask:
-                        output_state[i] += update[i]
+                self._tensor(output_state)[active] += self._tensor(
+                    update)[active]
                 nrm_change = _np.linalg.norm(update)
                 j += 1
-            for i in range(len(update)):
-                if (i & mask) == mask:
-                    output_state[i] *= correction
+            self._tensor(output_state)[active] *= correction
             self._state = _np.copy(output_state)
 
+    def emulate_time_evolution_krylov(self, terms_dict, time, ids, ctrlids,
+                                      tol, max_dim):
+        """
+        Applies exp(-i*time*H) to the wave function by a Lanczos
+        (Krylov-subspace) method: the state is propagated in steps, each of
+        which projects H onto the Krylov subspace spanned by v, Hv, ...,
+        H^(m-1)v (m <= max_dim) and exponentiates the resulting tridiagonal
+        matrix. Each step is as long as the a-posteriori error estimate
+        allows (tol * step / time).
+
+        Args:
+            terms_dict (dict): Operator dictionary (see QubitOperator.terms)
+                defining the Hamiltonian.
+            time (scalar): Time to evolve for
+            ids (list): A list of qubit IDs to which to apply the evolution.
+            ctrlids (list): A list of control qubit IDs.
+            tol (float): Tolerance for the error of the evolved state.
+            max_dim (int): Maximal dimension of the Krylov subspaces.
+
+        Returns:
+            Tuple of the number of steps and the number of applications of H.
+        """
+        if max_dim < 1 or not tol > 0.:
+            raise RuntimeError("emulate_time_evolution_krylov(): max_dim and "
+                               "tol must be positive.")
+        self._forget_classical(ids, ctrlids)
+        indices = _np.arange(len(self._state), dtype=_np.int64)
+        mask = self._get_control_mask(ctrlids)
+        active = (indices & mask) == mask
+        # each Pauli string maps |j> to coeff * (-1)^parity(j & zymask) times
+        # |j ^ flip>, where the Y's contribute to both masks (and a factor i)
+        terms = []
+        for term, coeff in terms_dict:
+            flip = _np.int64(0)
+            signs = _np.zeros_like(indices)
+            coeff = complex(coeff)
+            for k, pauli in term:
+                pos = self._map[ids[k]]
+                if pauli != 'Z':
+                    flip |= 1 << pos
+                if pauli != 'X':
+                    signs ^= (indices >> pos) & 1
+                if pauli == 'Y':
+                    coeff *= 1j
+            terms.append((indices ^ flip, coeff * (1 - 2 * signs)))
+
+        def apply_hamiltonian(v):
+            w = _np.zeros_like(v)
+            for source, factors in terms:
+                w += factors[source] * v[source]
+            w[~active] = 0.
+            return w
+
+        op_nrm = sum(abs(c) for _, c in terms_dict)
+        total, done = abs(float(time)), 0.
+        sign = -1. if time < 0 else 1.
+        steps = matvecs = 0
+        v = _np.where(active, self._state, 0.).astype(self._dtype)
+        while done < total:
+            beta = _np.linalg.norm(v)
+            if beta == 0.:
+                break
+            V = [v / beta]
+            alpha, betas = [], []
+            breakdown = False
+            for j in range(max_dim):
+                w = apply_hamiltonian(V[j])
+                matvecs += 1
+                alpha.append(_np.vdot(V[j], w).real)
+                # (full re-orthogonalization)
+                for vk in V:
+                    w -= _np.vdot(vk, w) * vk
+                b = _np.linalg.norm(w)
+                betas.append(b)
+                if b <= 1.e-14 * max(op_nrm, 1.):
+                    breakdown = True
+                    break
+                if j + 1 < max_dim:
+                    V.append(w / b)
+            m = len(alpha)
+            tridiag = (_np.diag(alpha) + _np.diag(betas[:m - 1], 1) +
+                       _np.diag(betas[:m - 1], -1))
+            lam, Q = _np.linalg.eigh(tridiag)
+            dt = total - done
+            while True:
+                c = Q.dot(_np.exp(-1j * sign * lam * dt) * Q[0])
+                err = 0. if breakdown else beta * betas[m - 1] * abs(c[-1])
+                allowed = tol * dt / total
+                if err <= allowed or dt <= 1.e-12 * total:
+                    break
+                dt *= max(0.1, min(0.5, 0.9 * (allowed / err) ** (1. / m)))
+            v = beta * sum(ck * vk for ck, vk in zip(c, V))
+            done += dt
+            steps += 1
+        self._state = _np.where(active, v, self._state).astype(self._dtype)
+        return steps, matvecs
+
+    def emulate_qft(self, ids, ctrlids, inverse):
+        """
+        Applies the quantum Fourier transform (or its inverse) to the qubits
+        with indices ids (with ids[0] as the least significant bit), using
+        ctrlids as control qubits.
+
+        As for the decomposition into Hadamard and controlled R gates, the
+        final swaps are not included, i.e., the output of the QFT is in
+        bit-reversed order.
+
+        Args:
+            ids (list): A list containing the qubit IDs to which to apply the
+                QFT.
+            ctrlids (list): A list of control qubit IDs (i.e., the QFT is
+                only applied where these qubits are 1).
+            inverse (bool): If True, the inverse QFT is applied.
+        """
+        self._forget_classical(ids, ctrlids)
+        psi, axes = self._controlled_subspace(ids, ctrlids)
+        k = len(ids)
+        # reversing the order of the axes reverses the bits of the index
+        in_axes, out_axes = (axes[::-1], axes) if inverse else (axes,
+                                                                axes[::-1])
+        moved = _np.moveaxis(psi, in_axes, list(range(k)))
+        shape = moved.shape
+        moved = moved.reshape((1 << k,) + shape[k:])
+        if inverse:
+            res = _np.fft.fft(moved, axis=0, norm="ortho")
+        else:
+            res = _np.fft.ifft(moved, axis=0, norm="ortho")
+        psi[...] = _np.moveaxis(res.reshape(shape), list(range(k)), out_axes)
+
+    def apply_uniformly_controlled_gate(self, matrices, target_id,
+                                        ucontrol_ids, ctrlids):
+        """
+        Applies the single-qubit gate matrices[k] to the qubit with index
+        target_id where the qubits with indices ucontrol_ids are in the state
+        k (with ucontrol_ids[0] as the least significant bit), using ctrlids
+        as control qubits.
+
+        Args:
+            matrices (list): A list of 2^len(ucontrol_ids) complex 2x2
+                matrices.
+            target_id (int): ID of the target qubit.
+            ucontrol_ids (list): A list containing the IDs of the qubits
+                which select the matrix.
+            ctrlids (list): A list of control qubit IDs (i.e., the gate is
+                only applied where these qubits are 1).
+        """
+        self._forget_classical([target_id], ctrlids)
+        psi, axes = self._controlled_subspace([target_id] + ucontrol_ids,
+                                              ctrlids)
+        k = len(axes)
+        # bring the selecting axes to the front, followed by the target axis
+        moved = _np.moveaxis(psi, axes, list(range(k)))
+        shape = moved.shape
+        moved = moved.reshape((1 << (k - 1), 2) + shape[k:])
+        mats = _np.asarray(matrices, dtype=self._dtype)
+        res = _np.einsum('kij,kj...->ki...', mats, moved)
+        psi[...] = _np.moveaxis(res.reshape(shape), list(range(k)), axes)
+
+    def emulate_state_preparation(self, state, ids):
+        """
+        Loads the state `state` onto the qubits with indices ids (with ids[0]
+        as the least significant bit), which must all be in state 0.
+
+        Args:
+            state (list[complex]): The 2^len(ids) amplitudes of the state to
+                prepare (must be normalized).
+            ids (list): A list containing the IDs of the qubits to prepare.
+        """
+        self._forget_classical(ids, [])
+        psi, axes = self._controlled_subspace(ids, [])
+        k = len(ids)
+        rest = _np.moveaxis(psi, axes, list(range(k)))[(0,) * k].copy()
+        amplitudes = _np.asarray(state, dtype=self._dtype).reshape((2,) * k)
+        res = _np.multiply.outer(amplitudes, rest)
+        psi[...] = _np.moveaxis(res, list(range(k)), axes)
+
+    def _controlled_subspace(self, ids, ctrlids):
+        """
+        Return a view of the state tensor restricted to the subspace in which
+        all control qubits are 1, together with the axes (of the view) of the
+        target qubits, starting with the most significant bit of the gate's
+        matrix index (i.e., the qubit with ID ids[-1]).
+        """
+        pos = [self._map[ID] for ID in ids]
+        ctrl_pos = [self._map[ID] for ID in ctrlids]
+        psi = self._tensor()[self._subspace(ctrl_pos, [1] * len(ctrl_pos))]
+        ctrl_axes = [self._axis(p) for p in ctrl_pos]
+        remaining = [ax for ax in range(self._num_qubits)
+                     if ax not in ctrl_axes]
+        axes = [remaining.index(self._axis(p)) for p in reversed(pos)]
+        return psi, axes
+
     def apply_controlled_gate(self, m, ids, ctrlids):
         """
         Applies the k-qubit gate matrix m to the qubits with indices ids,
@@ -389,72 +881,87 @@ class Simulator(object):
             ctrlids (list): A list of control qubit IDs (i.e., the gate is
                 only applied where these qubits are 1).
         """
-        mask = self._get_control_mask(ctrlids)
-        if len(m) == 2:
-            pos = self._map[ids[0]]
-            self._single_qubit_gate(m, pos, mask)
-        else:
-            pos = [self._map[ID] for ID in ids]
-            self._multi_qubit_gate(m, pos, mask)
-
-    def _single_qubit_gate(self, m, pos, mask):
+        self._forget_classical(ids, ctrlids)
+        psi, axes = self._controlled_subspace(ids, ctrlids)
+        k = len(ids)
+        matrix = _np.asarray(m, dtype=self._dtype).reshape((2,) * (2 * k))
+        res = _np.tensordot(matrix, psi, axes=(list(range(k, 2 * k)), axes))
+        psi[...] = _np.moveaxis(res, list(range(k)), axes)
+
+    def apply_diagonal_gate(self, diag, ids, ctrlids):
         """
-        Applies the single qubit gate matrix m to the qubit at position `pos`
-        using `mask` to identify control qubits.
+        Applies the diagonal k-qubit gate with diagonal entries diag to the
+        qubits with indices ids, using ctrlids as control qubits.
 
         Args:
-            m (list[list]): 2x2 complex matrix describing the single-qubit
+            diag (list[complex]): The 2^k diagonal entries of the gate matrix.
+            ids (list): A list containing the qubit IDs to which to apply the
                 gate.
-            pos (int): Bit-position of the qubit.
-            mask (int): Bit-mask where set bits indicate control qubits.
+            ctrlids (list): A list of control qubit IDs (i.e., the gate is
+                only applied where these qubits are 1).
         """
-        def kernel(u, d, m):
-            return u * m[0][0] + d * m[0][1], u * m[1][0] + d * m[1][1]
-
-        for i in range(0, len(self._state), (1 << (pos + 1))):
-            for j in range(1 << pos):
-                if ((i + j) & mask) == mask:
-                    id1 = i + j
-                    id2 = id1 + (1 << pos)
-                    self._state[id1], self._state[id2] = kernel(
-                        self._state[id1],
-                        self._state[id2],
-                        m)
-
-    def _multi_qubit_gate(self, m, pos, mask):
+        psi, axes = self._controlled_subspace(ids, ctrlids)
+        phases = _np.asarray(diag, dtype=self._dtype).reshape((2,) * len(ids))
+        # broadcast the phases over all other axes
+        shape = [1] * psi.ndim
+        for ax in axes:
+            shape[ax] = 2
+        psi *= phases.transpose(_np.argsort(axes)).reshape(shape)
+
+    def apply_permutation_gate(self, perm, ids, ctrlids):
         """
-        Applies the k-qubit gate matrix m to the qubits at `pos`
-        using `mask` to identify control qubits.
+        Applies the k-qubit permutation gate which maps the basis state |j>
+        to |perm[j]> to the qubits with indices ids, using ctrlids as control
+        qubits.
 
         Args:
-            m (list[list]): 2^k x 2^k complex matrix describing the k-qubit
+            perm (list[int]): Permutation of the 2^k basis states.
+            ids (list): A list containing the qubit IDs to which to apply the
                 gate.
-            pos (list[int]): List of bit-positions of the qubits.
-            mask (int): Bit-mask where set bits indicate control qubits.
+            ctrlids (list): A list of control qubit IDs (i.e., the gate is
+                only applied where these qubits are 1).
         """
-        # follows the description in https://arxiv.org/abs/1704.01127
-        inactive = [p for p in range(len(self._map)) if p not in pos]
-
-        matrix = _np.matrix(m)
-        subvec = _np.zeros(1 << len(pos), dtype=complex)
-        subvec_idx = [0] * len(subvec)
-        for c in range(1 << len(inactive)):
-            # determine base index (state of inactive qubits)
-            base = 0
-            for i in range(len(inactive)):
-                base |= ((c >> i) & 1) << inactive[i]
-            # check the control mask
-            if mask != (base & mask):
-                continue
-            # now gather all elements involved in mat-vec mul
-            for x in range(len(subvec_idx)):
-                offset = 0
-                for i in range(len(pos)):
-                    offset |= ((x >> i) & 1) << pos[i]
-                subvec_idx[x] = base | offset
-                subvec[x] = self._state[subvec_idx[x]]
-            # perform mat-vec mul
-            self._state[subvec_idx] = matrix.dot(subvec)
+        self._update_classical(perm, ids, ctrlids)
+        psi, axes = self._controlled_subspace(ids, ctrlids)
+        k = len(ids)
+        # bring the target axes to the front (most significant bit first)
+        moved = _np.moveaxis(psi, axes, list(range(k)))
+        moved = moved.reshape((1 << k,) + moved.shape[k:])
+        res = moved[_np.argsort(perm)].reshape((2,) * k + moved.shape[1:])
+        psi[...] = _np.moveaxis(res, list(range(k)), axes)
+
+    def apply_gates(self, matrices, gates, fuse):
+        """
+        Applies a stream of (controlled) gates.
+
+        Args:
+            matrices (list): Table of complex gate matrices.
+            gates (list[int]): The gates, each encoded as the index of its
+                matrix in `matrices`, the number of qubits k, the number of
+                controls c, followed by the k qubit IDs and the c control
+                qubit IDs.
+            fuse (bool): Unused (there is no gate fusion in the Python
+                simulator).
+        """
+        matrices = [_np.asarray(m, dtype=self._dtype) for m in matrices]
+        gates = [int(x) for x in gates]
+        p = 0
+        while p + 3 <= len(gates):
+            m = matrices[gates[p]]
+            k, c = gates[p + 1], gates[p + 2]
+            ids = gates[p + 3:p + 3 + k]
+            ctrlids = gates[p + 3 + k:p + 3 + k + c]
+            p += 3 + k + c
+            rows, cols = _np.nonzero(m)
+            if len(rows) == len(m) and _np.all(rows == cols):
+                self.apply_diagonal_gate(_np.diagonal(m), ids, ctrlids)
+            elif (len(rows) == len(m) and _np.all(m[rows, cols] == 1) and
+                    len(_np.unique(cols)) == len(m)):
+                perm = _np.empty(len(m), dtype=int)
+                perm[cols] = rows
+                self.apply_permutation_gate(perm, ids, ctrlids)
+            else:
+                self.apply_controlled_gate(m, ids, ctrlids)
 
     def set_wavefunction(self, wavefunction, ordering):
         """
@@ -475,8 +982,9 @@ class Simulator(object):
                                " Please make sure all qubits have been "
                                "allocated previously (call eng.flush()).")
 
-        self._state = _np.array(wavefunction, dtype=_np.complex128)
+        self._state = _np.array(wavefunction, dtype=self._dtype)
         self._map = {ordering[i]: i for i in range(len(ordering))}
+        self._classical = dict()
 
     def collapse_wavefunction(self, ids, values):
         """
@@ -496,25 +1004,16 @@ class Simulator(object):
             raise RuntimeError("collapse_wavefunction(): Unknown qubit id(s)"
                                " provided. Try calling eng.flush() before "
                                "invoking this function.")
-        mask = 0
-        val = 0
-        for i in range(len(ids)):
-            pos = self._map[ids[i]]
-            mask |= (1 << pos)
-            val |= (int(values[i]) << pos)
-        nrm = 0.
-        for i in range(len(self._state)):
-            if (mask & i) == val:
-                nrm += _np.abs(self._state[i]) ** 2
+        psi = self._tensor()
+        subspace = self._subspace([self._map[ID] for ID in ids], values)
+        amplitudes = psi[subspace].copy()
+        nrm = _np.vdot(amplitudes, amplitudes).real
         if nrm < 1.e-12:
             raise RuntimeError("collapse_wavefunction(): Invalid collapse! "
                                "Probability is ~0.")
-        inv_nrm = 1. / _np.sqrt(nrm)
-        for i in range(len(self._state)):
-            if (mask & i) != val:
-                self._state[i] = 0.
-            else:
-                self._state[i] *= inv_nrm
+        self._state[:] = 0.
+        psi[subspace] = amplitudes / _np.sqrt(nrm)
+        self._classical.update(zip(ids, (bool(v) for v in values)))
 
     def run(self):
         """
@@ -522,21 +1021,49 @@ class Simulator(object):
         """
         pass
 
-    def _apply_term(self, term, ids, ctrlids=[]):
+    def set_fusion_options(self, max_qubits, window):
+        """
+        Dummy function to implement the same interface as the c++ simulator.
+        """
+        pass
+
+    def set_mmap_dir(self, dir):
+        """
+        Dummy function to implement the same interface as the c++ simulator.
+        """
+        pass
+
+    def _apply_term(self, term, ids, state):
         """
-        Applies a QubitOperator term to the state vector.
+        Return the result of applying a QubitOperator term to a state vector.
         (Helper function for time evolution & expectation)
 
         Args:
             term: One term of QubitOperator.terms
             ids (list[int]): Term index to Qubit ID mapping
-            ctrlids (list[int]): Control qubit IDs
+            state (numpy.ndarray): State vector to which to apply the term
+                (is not modified).
         """
-        X = [[0., 1.], [1., 0.]]
-        Y = [[0., -1j], [1j, 0.]]
-        Z = [[1., 0.], [0., -1.]]
-        gates = [X, Y, Z]
+        # Y = i * X * Z, i.e., apply all Z's first, then flip the bits
+        phase = 1j ** len([op for (_, op) in term if op == 'Y'])
+        psi = self._tensor(state * phase)
         for local_op in term:
-            qb_id = ids[local_op[0]]
-            self.apply_controlled_gate(gates[ord(local_op[1]) - ord('X')],
-                                       [qb_id], ctrlids)
+            if local_op[1] in 'YZ':
+                pos = self._map[ids[local_op[0]]]
+                psi[self._subspace([pos], [1])] *= -1
+        flip_axes = [self._axis(self._map[ids[idx]]) for (idx, op) in term
+                     if op in 'XY']
+        if len(flip_axes) > 0:
+            psi = _np.flip(psi, flip_axes)
+        return psi.reshape(-1)
+
+
+class SinglePrecisionSimulator(Simulator):
+    """
+    Python implementation of a quantum computer simulator which stores the
+    state vector in single precision (complex64).
+
+    This halves the memory footprint of the state vector, at the cost of an
+    accuracy of roughly 1e-7 (instead of 1e-16) per amplitude.
+    """
+    _dtype = _np.complex64
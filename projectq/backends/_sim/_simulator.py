@@ -19,7 +19,9 @@ implementation is used as an alternative.
 """
 
 import math
+import os
 import random
+import numpy
 from projectq.cengines import BasicEngine
 from projectq.meta import get_control_count, LogicalQubitIDTag
 from projectq.ops import (NOT,
@@ -29,14 +31,148 @@ from projectq.ops import (NOT,
                           FlushGate,
                           Allocate,
                           Deallocate,
+                          MeasureGate,
+                          AllocateQubitGate,
+                          DeallocateQubitGate,
                           BasicMathGate,
-                          TimeEvolution)
+                          SwapGate,
+                          TimeEvolution,
+                          QFTGate,
+                          DaggeredGate,
+                          StatePreparation,
+                          UniformlyControlledRy,
+                          UniformlyControlledRz)
 from projectq.types import WeakQubitRef
 
 try:
     from ._cppsim import Simulator as SimulatorBackend
+    from ._cppsim import (SinglePrecisionSimulator as
+                          SinglePrecisionSimulatorBackend)
 except ImportError:
     from ._pysim import Simulator as SimulatorBackend
+    from ._pysim import (SinglePrecisionSimulator as
+                         SinglePrecisionSimulatorBackend)
+
+
+def _is_diagonal(matrix):
+    """
+    Return True if all off-diagonal entries of the (square) matrix are zero.
+    """
+    matrix = numpy.asarray(matrix)
+    return (numpy.count_nonzero(matrix) ==
+            numpy.count_nonzero(numpy.diagonal(matrix)))
+
+
+def _is_qft(gate):
+    """
+    Return True if the gate is a QFT or an inverse QFT.
+    """
+    return (isinstance(gate, QFTGate) or
+            (isinstance(gate, DaggeredGate) and
+             isinstance(gate._gate, QFTGate)))
+
+
+def _is_emulated(gate):
+    """
+    Return True if the simulator handles the gate without using its matrix
+    (e.g., measurement, allocation, math gates or time evolution).
+    """
+    # (isinstance is used instead of comparisons such as gate == Measure,
+    # which evaluate the gate's matrix)
+    if isinstance(gate, SwapGate):
+        # a math gate with a (permutation) matrix, which is applied in the
+        # gate batch
+        return False
+    return (isinstance(gate, (MeasureGate, AllocateQubitGate,
+                              DeallocateQubitGate, BasicMathGate,
+                              TimeEvolution, StatePreparation,
+                              UniformlyControlledRy, UniformlyControlledRz)) or
+            _is_qft(gate))
+
+
+def _is_parameterized(gate):
+    """
+    Return True if the gate has an angle which depends on parameters (see
+    projectq.ops.Parameter).
+    """
+    is_parameterized = getattr(gate, 'is_parameterized', None)
+    return is_parameterized is not None and is_parameterized()
+
+
+def _get_math_table(math_fun, sizes):
+    """
+    Evaluate a vectorized math function (see
+    BasicMathGate.get_vectorized_math_function) for all states of the
+    registers at once.
+
+    Args:
+        math_fun (function): Vectorized math function.
+        sizes (list<int>): Number of qubits of each register.
+
+    Returns:
+        numpy.ndarray of integers: Entry x is the joint state of the
+        registers (with the first register in the lowest bits) which the
+        joint state x is mapped to.
+    """
+    x = numpy.arange(1 << sum(sizes), dtype=numpy.int64)
+    offsets = numpy.cumsum([0] + list(sizes))
+    args = [(x >> int(offsets[i])) & ((1 << n) - 1)
+            for i, n in enumerate(sizes)]
+    res = math_fun(args)
+    table = numpy.zeros_like(x)
+    for i, n in enumerate(sizes):
+        table |= ((numpy.asarray(res[i], dtype=numpy.int64) & ((1 << n) - 1))
+                  << int(offsets[i]))
+    return table
+
+
+def _get_permutation(matrix):
+    """
+    Return the permutation perm (as a list) if the matrix is a permutation
+    matrix, i.e., if it maps the basis state j to perm[j], and None otherwise.
+    """
+    matrix = numpy.asarray(matrix)
+    rows, cols = numpy.nonzero(matrix)
+    if (len(rows) != len(matrix) or not numpy.all(matrix[rows, cols] == 1) or
+            len(numpy.unique(cols)) != len(matrix)):
+        return None
+    perm = [0] * len(matrix)
+    for row, col in zip(rows, cols):
+        perm[col] = int(row)
+    return perm
+
+
+def _group_pauli_terms(terms):
+    """
+    Partition Pauli strings into groups of qubit-wise commuting ones, i.e.,
+    on each qubit, all strings of a group act with the same Pauli operator (or
+    the identity).
+
+    The strings which only consist of Z's (including the identity) form the
+    first group, which needs no basis rotation. The others are assigned
+    greedily (longest first) to the first group they commute with.
+
+    Args:
+        terms (list[tuple]): Pauli strings (see QubitOperator.terms).
+
+    Returns:
+        List of pairs of the basis of a group (a dict from qubit index to 'X',
+        'Y' or 'Z') and the list of its strings.
+    """
+    z_terms = [term for term in terms if all(p == 'Z' for _, p in term)]
+    groups = [(dict(), z_terms)] if len(z_terms) > 0 else []
+    num_z_groups = len(groups)
+    for term in sorted((term for term in terms
+                        if any(p != 'Z' for _, p in term)),
+                       key=len, reverse=True):
+        for basis, group in groups[num_z_groups:]:
+            if all(basis.get(k, p) == p for k, p in term):
+                basis.update(term)
+                group.append(term)
+                break
+        else:
+            groups.append((dict(term), [term]))
+    return groups
 
 
 class Simulator(BasicEngine):
@@ -52,7 +188,10 @@ class Simulator(BasicEngine):
         export OMP_NUM_THREADS=4 # use 4 threads
         export OMP_PROC_BIND=spread # bind threads to processors by spreading
     """
-    def __init__(self, gate_fusion=False, rnd_seed=None):
+    def __init__(self, gate_fusion=False, rnd_seed=None, precision='double',
+                 fusion_max_qubits=5, fusion_window=64, mmap_dir=None,
+                 factorize_qubits=False, time_evolution='taylor',
+                 krylov_tol=1.e-12, krylov_dim=30):
         """
         Construct the C++/Python-simulator object and initialize it with a
         random seed.
@@ -63,6 +202,39 @@ class Simulator(BasicEngine):
                 for the c++ simulator).
             rnd_seed (int): Random seed (uses random.randint(0, 4294967295) by
                 default).
+            precision (str): Floating-point precision of the state vector,
+                either 'double' (complex128, default) or 'single'
+                (complex64). Single precision halves the memory footprint
+                (and roughly doubles the throughput) at the cost of an
+                accuracy of about 1e-7 per amplitude. Expectation values are
+                accumulated in double precision in both cases.
+            fusion_max_qubits (int): Maximal number of qubits of a fused gate
+                (only has an effect if gate_fusion is True).
+            fusion_window (int): Number of gates which are collected before
+                they are partitioned into fused gates (only has an effect if
+                gate_fusion is True).
+            mmap_dir (str): Directory (preferably on a local SSD) in which the
+                state vector is kept as a memory-mapped file, such that the
+                number of qubits is limited by the disk space instead of the
+                RAM (only has an effect for the c++ simulator). The file is
+                deleted when the simulator is. Defaults to None, i.e., the
+                state vector is kept in memory.
+            factorize_qubits (bool): If True, qubits which are not entangled
+                with the others (e.g., freshly allocated ancillas, to which
+                only single-qubit gates have been applied, and measured
+                qubits) are kept as separate 2-amplitude factors instead of
+                doubling the state vector, see _merge_factors.
+            time_evolution (str): Method to apply TimeEvolution gates, either
+                'taylor' (truncated Taylor series, default) or 'krylov'
+                (Lanczos method with adaptive steps, which needs far fewer
+                applications of the Hamiltonian for large norms or long
+                times, see get_time_evolution_report).
+            krylov_tol (float): Tolerance for the error (in the 2-norm) of
+                the state after a TimeEvolution gate (only has an effect if
+                time_evolution is 'krylov').
+            krylov_dim (int): Maximal dimension of the Krylov subspaces, i.e.,
+                number of copies of the state vector which are kept (only has
+                an effect if time_evolution is 'krylov').
 
         Example of gate_fusion: Instead of applying a Hadamard gate to 5
         qubits, the simulator calculates the kronecker product of the 1-qubit
@@ -71,6 +243,12 @@ class Simulator(BasicEngine):
         through the state vector multiple times. Depending on the system (and,
         especially, number of threads), this may or may not be beneficial.
 
+        The gates of a window of fusion_window gates are grouped into fused
+        gates of at most fusion_max_qubits qubits. Gates further down the
+        window are moved into a fused gate if they commute with the gates in
+        between, and if the additional work of a wider fused gate is cheaper
+        than an extra pass over the state vector.
+
         Note:
             If the C++ Simulator extension was not built or cannot be found,
             the Simulator defaults to a Python implementation of the kernels.
@@ -80,19 +258,75 @@ class Simulator(BasicEngine):
             If you need to run large simulations, check out the tutorial in
             the docs which gives futher hints on how to build the C++
             extension.
+
+        Raises:
+            ValueError: If precision is neither 'single' nor 'double', or if
+                fusion_max_qubits or fusion_window is not positive, or if
+                mmap_dir is not a directory, or if time_evolution is neither
+                'taylor' nor 'krylov', or if krylov_tol or krylov_dim is not
+                positive.
         """
         if rnd_seed is None:
             rnd_seed = random.randint(0, 4294967295)
         BasicEngine.__init__(self)
-        self._simulator = SimulatorBackend(rnd_seed)
+        if precision == 'double':
+            self._simulator = SimulatorBackend(rnd_seed)
+        elif precision == 'single':
+            self._simulator = SinglePrecisionSimulatorBackend(rnd_seed)
+        else:
+            raise ValueError("Simulator: precision must be either 'single' "
+                             "or 'double' (got {}).".format(precision))
+        if fusion_max_qubits < 1 or fusion_window < 1:
+            raise ValueError("Simulator: fusion_max_qubits and fusion_window "
+                             "must be positive.")
+        self._simulator.set_fusion_options(fusion_max_qubits, fusion_window)
+        if mmap_dir is not None:
+            if not os.path.isdir(mmap_dir):
+                raise ValueError("Simulator: mmap_dir must be an existing "
+                                 "directory (got {}).".format(mmap_dir))
+            self._simulator.set_mmap_dir(mmap_dir)
+        if time_evolution not in ('taylor', 'krylov'):
+            raise ValueError("Simulator: time_evolution must be either "
+                             "'taylor' or 'krylov' (got {}).".format(
+                                 time_evolution))
+        if not krylov_tol > 0. or krylov_dim < 1:
+            raise ValueError("Simulator: krylov_tol and krylov_dim must be "
+                             "positive.")
+        self._time_evolution = time_evolution
+        self._krylov_tol = krylov_tol
+        self._krylov_dim = krylov_dim
+        self._time_evolution_report = dict(gates=0, steps=0, matvecs=0)
         self._gate_fusion = gate_fusion
+        # gates which have not been passed to the backend yet, see
+        # _add_to_gate_batch
+        self._max_batch_size = 4096
+        self._clear_gate_batch()
+        # IDs of qubits which have not been allocated in the backend yet (they
+        # are allocated at once, before the next batch of gates is applied)
+        self._allocation_batch = []
+        # IDs and (classical) values of qubits which have not been removed
+        # from the backend yet (they are removed at once, before the next
+        # batch of allocations and gates is applied)
+        self._deallocation_batch = []
+        self._factorize_qubits = factorize_qubits
+        # qubits which are kept as separate factors: ID -> 2 amplitudes
+        self._factors = dict()
+        self._rng = random.Random(rnd_seed)
 
     def is_available(self, cmd):
         """
         Specialized implementation of is_available: The simulator can deal
         with all arbitrarily-controlled gates which provide a
         gate-matrix (via gate.matrix) and acts on 5 or less qubits (not
-        counting the control qubits).
+        counting the control qubits), or whose matrix is diagonal or a
+        permutation matrix (any number of qubits). The (inverse) QFT is
+        emulated using a fast Fourier transform, state preparation and
+        uniformly controlled rotations are applied directly (without
+        decomposing them into CNOTs and rotations).
+
+        Gates with unbound parameters are accepted such that they reach the
+        simulator (which raises an error, see receive) instead of being
+        decomposed.
 
         Args:
             cmd (Command): Command for which to check availability (single-
@@ -104,12 +338,17 @@ class Simulator(BasicEngine):
         if (cmd.gate == Measure or cmd.gate == Allocate or
                 cmd.gate == Deallocate or
                 isinstance(cmd.gate, BasicMathGate) or
-                isinstance(cmd.gate, TimeEvolution)):
+                isinstance(cmd.gate, TimeEvolution) or _is_qft(cmd.gate) or
+                isinstance(cmd.gate, (StatePreparation, UniformlyControlledRy,
+                                      UniformlyControlledRz)) or
+                _is_parameterized(cmd.gate)):
             return True
         try:
             m = cmd.gate.matrix
-            # Allow up to 5-qubit gates
-            if len(m) > 2 ** 5:
+            # Allow up to 5-qubit gates (and diagonal and permutation gates of
+            # any size)
+            if (len(m) > 2 ** 5 and not _is_diagonal(m) and
+                    _get_permutation(m) is None):
                 return False
             return True
         except:
@@ -137,6 +376,29 @@ class Simulator(BasicEngine):
         else:
             return qureg
 
+    def get_time_evolution_report(self, reset=False):
+        """
+        Return the statistics of the TimeEvolution gates which have been
+        applied using the Krylov method (see time_evolution in __init__).
+
+        Args:
+            reset (bool): If True, the statistics are reset.
+
+        Returns:
+            Dict with the number of gates, of (adaptive) steps, and of
+            applications of the Hamiltonian to the state vector ('gates',
+            'steps' and 'matvecs').
+
+        Note:
+            Make sure all previous commands have passed through the
+            compilation chain (call main_engine.flush() to make sure).
+        """
+        self._apply_gate_batch()
+        report = dict(self._time_evolution_report)
+        if reset:
+            self._time_evolution_report = dict(gates=0, steps=0, matvecs=0)
+        return report
+
     def get_expectation_value(self, qubit_operator, qureg):
         """
         Get the expectation value of qubit_operator w.r.t. the current wave
@@ -163,16 +425,61 @@ class Simulator(BasicEngine):
             Exception: If `qubit_operator` acts on more qubits than present in
                 the `qureg` argument.
         """
+        return self.get_expectation_values([qubit_operator], qureg)[0]
+
+    def get_expectation_values(self, qubit_operators, qureg):
+        """
+        Get the expectation values of several qubit_operators w.r.t. the
+        current wave function represented by the supplied quantum register.
+
+        The Pauli strings of all operators are evaluated together: the
+        strings which only consist of Z's in one sweep over the wave function,
+        and the others in groups of qubit-wise commuting strings, which share
+        a basis rotation and a sweep (see _group_pauli_terms).
+
+        Args:
+            qubit_operators (list[projectq.ops.QubitOperator]): Operators to
+                measure.
+            qureg (list[Qubit],Qureg): Quantum bits to measure.
+
+        Returns:
+            List of the expectation values.
+
+        Note:
+            Make sure all previous commands (especially allocations) have
+            passed through the compilation chain (call main_engine.flush() to
+            make sure).
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            automatically converts from logical qubits to mapped qubits for
+            the qureg argument.
+
+        Raises:
+            Exception: If one of the operators acts on more qubits than
+                present in the `qureg` argument.
+        """
         qureg = self._convert_logical_to_mapped_qureg(qureg)
         num_qubits = len(qureg)
-        for term, _ in qubit_operator.terms.items():
-            if not term == () and term[-1][0] >= num_qubits:
-                raise Exception("qubit_operator acts on more qubits than "
-                                "contained in the qureg.")
-        operator = [(list(term), coeff) for (term, coeff)
-                    in qubit_operator.terms.items()]
-        return self._simulator.get_expectation_value(operator,
-                                                     [qb.id for qb in qureg])
+        terms = dict()
+        for qubit_operator in qubit_operators:
+            for term in qubit_operator.terms:
+                if not term == () and term[-1][0] >= num_qubits:
+                    raise Exception("qubit_operator acts on more qubits than "
+                                    "contained in the qureg.")
+                terms[term] = None
+        groups = _group_pauli_terms(list(terms))
+        self._merge_factors([qb.id for qb in qureg])
+        self._apply_gate_batch()
+        values = self._simulator.get_expectation_values(
+            [([(k, p) for k, p in sorted(basis.items()) if p != 'Z'],
+              [[k for k, _ in term] for term in group])
+             for basis, group in groups], [qb.id for qb in qureg])
+        values = dict(zip([term for _, group in groups for term in group],
+                          values))
+        return [sum(coeff * values[term] for term, coeff in
+                    qubit_operator.terms.items())
+                for qubit_operator in qubit_operators]
 
     def apply_qubit_operator(self, qubit_operator, qureg):
         """
@@ -211,6 +518,8 @@ class Simulator(BasicEngine):
                                 "contained in the qureg.")
         operator = [(list(term), coeff) for (term, coeff)
                     in qubit_operator.terms.items()]
+        self._merge_factors([qb.id for qb in qureg])
+        self._apply_gate_batch()
         return self._simulator.apply_qubit_operator(operator,
                                                     [qb.id for qb in qureg])
 
@@ -238,9 +547,53 @@ class Simulator(BasicEngine):
         """
         qureg = self._convert_logical_to_mapped_qureg(qureg)
         bit_string = [bool(int(b)) for b in bit_string]
+        self._merge_factors([qb.id for qb in qureg])
+        self._apply_gate_batch()
         return self._simulator.get_probability(bit_string,
                                                [qb.id for qb in qureg])
 
+    def sample(self, qureg, shots, seed=None):
+        """
+        Sample the outcomes of measuring the quantum register `qureg`
+        `shots` times, without collapsing the wave function.
+
+        The distribution of outcomes is computed once, after which all shots
+        are drawn at once. This is much faster than re-running the circuit
+        for every shot.
+
+        Args:
+            qureg (Qureg|list[Qubit]): Quantum register to sample.
+            shots (int): Number of samples to draw.
+            seed (int): Seed for the random number generator (uses the
+                simulator's random number generator by default).
+
+        Returns:
+            counts (dict): Dictionary mapping bit strings to the number of
+            times they were drawn. The left-most bit in the string corresponds
+            to the first qubit in the supplied quantum register.
+
+        Note:
+            Make sure all previous commands (especially allocations) have
+            passed through the compilation chain (call main_engine.flush() to
+            make sure).
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            automatically converts from logical qubits to mapped qubits for
+            the qureg argument.
+        """
+        qureg = self._convert_logical_to_mapped_qureg(qureg)
+        self._merge_factors([qb.id for qb in qureg])
+        self._apply_gate_batch()
+        samples = self._simulator.sample([qb.id for qb in qureg], shots, seed)
+        outcomes, counts = numpy.unique(samples, return_counts=True)
+        counts_dict = dict()
+        for outcome, count in zip(outcomes, counts):
+            bit_string = "".join(str((int(outcome) >> i) & 1)
+                                 for i in range(len(qureg)))
+            counts_dict[bit_string] = int(count)
+        return counts_dict
+
     def get_amplitude(self, bit_string, qureg):
         """
         Return the probability amplitude of the supplied `bit_string`.
@@ -267,6 +620,8 @@ class Simulator(BasicEngine):
         """
         qureg = self._convert_logical_to_mapped_qureg(qureg)
         bit_string = [bool(int(b)) for b in bit_string]
+        self._merge_factors()
+        self._apply_gate_batch()
         return self._simulator.get_amplitude(bit_string,
                                              [qb.id for qb in qureg])
 
@@ -294,6 +649,8 @@ class Simulator(BasicEngine):
             the qureg argument.
         """
         qureg = self._convert_logical_to_mapped_qureg(qureg)
+        self._merge_factors()
+        self._apply_gate_batch()
         self._simulator.set_wavefunction(wavefunction,
                                          [qb.id for qb in qureg])
 
@@ -320,6 +677,8 @@ class Simulator(BasicEngine):
             the qureg argument.
         """
         qureg = self._convert_logical_to_mapped_qureg(qureg)
+        self._merge_factors([qb.id for qb in qureg])
+        self._apply_gate_batch()
         return self._simulator.collapse_wavefunction([qb.id for qb in qureg],
                                                      [bool(int(v)) for v in
                                                       values])
@@ -336,6 +695,13 @@ class Simulator(BasicEngine):
             indices to bit-locations and the second entry is the corresponding
             state vector.
 
+        Note:
+            The state vector is a (writable) numpy.ndarray (of dtype
+            complex64 if precision='single') which shares its memory with the
+            simulator, i.e., no copy is made. It is only valid until the
+            next command is executed, so copy it (e.g., using numpy.copy) if
+            it needs to be kept around.
+
         Note:
             Make sure all previous commands have passed through the
             compilation chain (call main_engine.flush() to make sure).
@@ -345,6 +711,8 @@ class Simulator(BasicEngine):
             DOES NOT automatically convert from logical qubits to mapped
             qubits.
         """
+        self._merge_factors()
+        self._apply_gate_batch()
         return self._simulator.cheat()
 
     def _handle(self, cmd):
@@ -363,7 +731,7 @@ class Simulator(BasicEngine):
         if cmd.gate == Measure:
             assert(get_control_count(cmd) == 0)
             ids = [qb.id for qr in cmd.qubits for qb in qr]
-            out = self._simulator.measure_qubits(ids)
+            out = self._measure_qubits(ids)
             i = 0
             for qr in cmd.qubits:
                 for qb in qr:
@@ -389,35 +757,338 @@ class Simulator(BasicEngine):
                 qubitids.append([])
                 for qb in qr:
                     qubitids[-1].append(qb.id)
-            math_fun = cmd.gate.get_math_function(cmd.qubits)
-            self._simulator.emulate_math(math_fun, qubitids,
-                                         [qb.id for qb in cmd.control_qubits])
+            ctrlids = [qb.id for qb in cmd.control_qubits]
+            # built-in implementations of common gates (no calls into Python)
+            from projectq.libs.math import (AddConstant,
+                                            AddConstantModN,
+                                            MultiplyByConstantModN)
+            if isinstance(cmd.gate, AddConstant):
+                self._simulator.emulate_math_addConstant(cmd.gate.a, qubitids,
+                                                         ctrlids)
+            elif isinstance(cmd.gate, AddConstantModN):
+                self._simulator.emulate_math_addConstantModN(cmd.gate.a,
+                                                             cmd.gate.N,
+                                                             qubitids,
+                                                             ctrlids)
+            elif isinstance(cmd.gate, MultiplyByConstantModN):
+                self._simulator.emulate_math_multiplyByConstantModN(
+                    cmd.gate.a, cmd.gate.N, qubitids, ctrlids)
+            elif cmd.gate.get_vectorized_math_function(cmd.qubits) is not None:
+                math_fun = cmd.gate.get_vectorized_math_function(cmd.qubits)
+                table = _get_math_table(math_fun,
+                                        [len(qr) for qr in qubitids])
+                self._simulator.emulate_math_table(
+                    table.tolist(), [ID for qr in qubitids for ID in qr],
+                    ctrlids)
+            else:
+                math_fun = cmd.gate.get_math_function(cmd.qubits)
+                self._simulator.emulate_math(math_fun, qubitids, ctrlids)
         elif isinstance(cmd.gate, TimeEvolution):
             op = [(list(term), coeff) for (term, coeff)
                   in cmd.gate.hamiltonian.terms.items()]
             t = cmd.gate.time
             qubitids = [qb.id for qb in cmd.qubits[0]]
             ctrlids = [qb.id for qb in cmd.control_qubits]
-            self._simulator.emulate_time_evolution(op, t, qubitids, ctrlids)
-        elif len(cmd.gate.matrix) <= 2 ** 5:
-            matrix = cmd.gate.matrix
-            ids = [qb.id for qr in cmd.qubits for qb in qr]
-            if not 2 ** len(ids) == len(cmd.gate.matrix):
-                raise Exception("Simulator: Error applying {} gate: "
-                                "{}-qubit gate applied to {} qubits.".format(
-                                    str(cmd.gate),
-                                    int(math.log(len(cmd.gate.matrix), 2)),
-                                    len(ids)))
-            self._simulator.apply_controlled_gate(matrix.tolist(),
-                                                  ids,
-                                                  [qb.id for qb in
-                                                   cmd.control_qubits])
+            if self._time_evolution == 'krylov':
+                steps, matvecs = self._simulator.emulate_time_evolution_krylov(
+                    op, t, qubitids, ctrlids, self._krylov_tol,
+                    self._krylov_dim)
+                self._time_evolution_report['gates'] += 1
+                self._time_evolution_report['steps'] += steps
+                self._time_evolution_report['matvecs'] += matvecs
+            else:
+                self._simulator.emulate_time_evolution(op, t, qubitids,
+                                                       ctrlids)
+        elif _is_qft(cmd.gate):
+            qubitids = [qb.id for qr in cmd.qubits for qb in qr]
+            ctrlids = [qb.id for qb in cmd.control_qubits]
+            self._simulator.emulate_qft(qubitids, ctrlids,
+                                        isinstance(cmd.gate, DaggeredGate))
+        elif isinstance(cmd.gate, StatePreparation):
+            self._apply_state_preparation(cmd)
+        elif isinstance(cmd.gate, (UniformlyControlledRy,
+                                   UniformlyControlledRz)):
+            if not (len(cmd.qubits) == 2 and len(cmd.qubits[1]) == 1):
+                raise TypeError("Wrong number of qubits ")
+            ucontrol_ids = [qb.id for qb in cmd.qubits[0]]
+            if not len(cmd.gate.angles) == 2 ** len(ucontrol_ids):
+                raise ValueError("Wrong len(angles).")
+            self._apply_uniformly_controlled_rotation(
+                type(cmd.gate), cmd.gate.angles, cmd.qubits[1][0].id,
+                ucontrol_ids, [qb.id for qb in cmd.control_qubits])
+        else:
+            self._add_to_gate_batch(cmd)
+            self._apply_gate_batch()
+
+    def _clear_gate_batch(self):
+        """
+        Start a new (empty) batch of gates.
+        """
+        self._gate_matrices = []
+        self._matrix_index = dict()  # matrix (as bytes) -> index
+        self._gate_stream = []
+        self._batch_size = 0
+
+    def _add_to_gate_batch(self, cmd):
+        """
+        Add a (controlled) gate which is given by its matrix to the current
+        batch of gates.
+
+        The batch is passed to the backend in one call (see
+        _apply_gate_batch), as a table of distinct matrices and a flat stream
+        of integers which contains, for each gate, the index of its matrix,
+        the number of qubits and controls, and their IDs.
+
+        Args:
+            cmd (Command): Command to add.
+
+        Raises:
+            Exception: If the gate acts on more than 5 qubits (and is neither
+                diagonal nor a permutation), or if its matrix does not match
+                the number of qubits.
+        """
+        self._add_matrix_to_gate_batch(
+            numpy.asarray(cmd.gate.matrix, dtype=complex),
+            [qb.id for qr in cmd.qubits for qb in qr],
+            [qb.id for qb in cmd.control_qubits], cmd.gate)
+
+    def _add_matrix_to_gate_batch(self, matrix, ids, ctrlids, gate):
+        """
+        Add the gate `matrix` on the qubits `ids`, controlled by the qubits
+        `ctrlids`, to the current batch of gates (see _add_to_gate_batch).
+        The gate (or its name) only appears in error messages.
+        """
+        key = (len(matrix), matrix.tobytes())
+        index = self._matrix_index.get(key)
+        if index is None:
+            if (len(matrix) > 2 ** 5 and not _is_diagonal(matrix) and
+                    _get_permutation(matrix) is None):
+                raise Exception("This simulator only supports controlled "
+                                "k-qubit gates with k < 6 (or diagonal and "
+                                "permutation gates)!\nPlease add an "
+                                "auto-replacer engine to your list of "
+                                "compiler engines.")
+            index = len(self._gate_matrices)
+            self._gate_matrices.append(matrix)
+            self._matrix_index[key] = index
+        size = len(matrix)
+        if not 2 ** len(ids) == size:
+            raise Exception("Simulator: Error applying {} gate: "
+                            "{}-qubit gate applied to {} qubits.".format(
+                                gate, int(math.log(size, 2)), len(ids)))
+        self._gate_stream += [index, len(ids), len(ctrlids)]
+        self._gate_stream += ids
+        self._gate_stream += ctrlids
+        self._batch_size += 1
+        if self._batch_size >= self._max_batch_size:
+            self._apply_gate_batch()
+
+    def _apply_gate_batch(self):
+        """
+        Pass the current batch of gates to the backend (in one call), after
+        deallocating and allocating the qubits of the current batches of
+        deallocations and allocations (in one call each).
+        """
+        if len(self._deallocation_batch) > 0:
+            ids, values = zip(*self._deallocation_batch)
+            self._deallocation_batch = []
+            self._simulator.remove_qubits(list(ids), list(values))
+        if len(self._allocation_batch) > 0:
+            ids = self._allocation_batch
+            self._allocation_batch = []
+            self._simulator.allocate_qubits(ids)
+        if self._batch_size == 0:
+            return
+        matrices = [m.tolist() for m in self._gate_matrices]
+        stream = numpy.array(self._gate_stream, dtype=numpy.uint32)
+        self._clear_gate_batch()
+        self._simulator.apply_gates(matrices, stream, self._gate_fusion)
+
+    def _merge_factors(self, ids=None):
+        """
+        Merge the factored qubits among `ids` (all of them by default) into
+        the state vector of the backend.
+
+        The qubits are added to the current batch of allocations, and a
+        1-qubit gate which maps |0> to the state of the factor is added to the
+        current batch of gates (unless the factor is exactly |0>, i.e.,
+        without a phase).
+
+        Args:
+            ids (list[int]): IDs of qubits which are about to be used
+                together with others (factored or not).
+        """
+        if ids is None:
+            ids = list(self._factors)
+        for ID in ids:
+            state = self._factors.pop(ID, None)
+            if state is None:
+                continue
+            self._allocation_batch.append(ID)
+            if not (state[0] == 1. and state[1] == 0.):
+                a0, a1 = state
+                matrix = numpy.array([[a0, -a1.conjugate()],
+                                      [a1, a0.conjugate()]])
+                self._add_matrix_to_gate_batch(matrix, [ID], [], "factor")
+
+    def _apply_to_factors(self, cmd, tol=1.e-12):
+        """
+        Apply a gate which is given by its matrix, taking its factored qubits
+        into account: the gate is skipped if a control qubit is factored and
+        in state |0>, controls which are factored and in state |1> are
+        dropped, and uncontrolled 1-qubit gates on factored qubits are applied
+        to the factor. Otherwise, the remaining factored qubits of the gate
+        are merged into the state vector and the gate is added to the current
+        batch of gates.
+
+        Args:
+            cmd (Command): Command to apply.
+            tol (float): Tolerance for the probability of the other basis
+                state of a factored control qubit.
+        """
+        ctrlids = []
+        for qb in cmd.control_qubits:
+            state = self._factors.get(qb.id)
+            if state is None:
+                ctrlids.append(qb.id)
+            elif abs(state[1]) ** 2 <= tol:
+                return
+            elif abs(state[0]) ** 2 > tol:
+                ctrlids.append(qb.id)
+        ids = [qb.id for qr in cmd.qubits for qb in qr]
+        matrix = numpy.asarray(cmd.gate.matrix, dtype=complex)
+        if (len(ids) == 1 and len(ctrlids) == 0 and ids[0] in self._factors and
+                len(matrix) == 2):
+            self._factors[ids[0]] = matrix.dot(self._factors[ids[0]])
+            return
+        self._merge_factors(ids + ctrlids)
+        self._add_matrix_to_gate_batch(matrix, ids, ctrlids, cmd.gate)
+
+    def _measure_qubits(self, ids):
+        """
+        Measure the qubits `ids` and return the outcomes.
+
+        Factored qubits are measured by sampling their 2 amplitudes. If
+        factorize_qubits is True, measured qubits are removed from the state
+        vector (which they are not entangled with anymore) and kept as factors
+        in their basis state.
+        """
+        factored = [ID for ID in ids if ID in self._factors]
+        outcomes = dict()
+        others = [ID for ID in ids if ID not in self._factors]
+        if len(others) > 0:
+            outcomes.update(zip(others,
+                                self._simulator.measure_qubits(others)))
+            if self._factorize_qubits:
+                self._simulator.remove_qubits(
+                    others, [outcomes[ID] for ID in others])
+        for ID in factored:
+            a0, a1 = self._factors[ID]
+            p1 = abs(a1) ** 2 / (abs(a0) ** 2 + abs(a1) ** 2)
+            outcomes[ID] = self._rng.random() < p1
+        for ID in factored + (others if self._factorize_qubits else []):
+            self._factors[ID] = (numpy.array([0., 1.], dtype=complex)
+                                 if outcomes[ID] else
+                                 numpy.array([1., 0.], dtype=complex))
+        return [outcomes[ID] for ID in ids]
+
+    def _deallocate_factor(self, ID, tol=1.e-12):
+        """
+        Deallocate a factored qubit.
+
+        Raises:
+            RuntimeError: If the qubit is in superposition.
+        """
+        a0, a1 = self._factors[ID]
+        if abs(a0) ** 2 > tol and abs(a1) ** 2 > tol:
+            raise RuntimeError("Error: Qubit has not been measured / "
+                               "uncomputed! There is most likely a bug in "
+                               "your code.")
+        del self._factors[ID]
+
+    def _apply_state_preparation(self, cmd):
+        """
+        Apply a (controlled) StatePreparation gate.
+
+        If it is uncontrolled and all target qubits are in state 0 (e.g.,
+        freshly allocated), the final state is loaded onto the qubits
+        directly. Otherwise, the uniformly controlled rotations of its
+        decomposition (see stateprep2cnot) are applied, which yields the same
+        result.
+
+        Args:
+            cmd (Command): Command to apply.
+
+        Raises:
+            ValueError: If the final state has the wrong length or is not
+                normalized.
+        """
+        from projectq.setups.decompositions.stateprep2cnot import (
+            _get_rotation_angles)
+        ids = [qb.id for qr in cmd.qubits for qb in qr]
+        final_state = cmd.gate.final_state
+        if len(final_state) != 2 ** len(ids):
+            raise ValueError("Length of final_state is invalid.")
+        norm = sum(abs(amplitude) ** 2 for amplitude in final_state)
+        if norm < 1 - 1e-10 or norm > 1 + 1e-10:
+            raise ValueError("final_state is not normalized.")
+        ctrlids = [qb.id for qb in cmd.control_qubits]
+        if (len(ctrlids) == 0 and
+                self._simulator.get_probability([False] * len(ids), ids) >
+                1. - 1e-12):
+            self._simulator.emulate_state_preparation(final_state, ids)
+            return
+        # apply the inverse of the rotations which map final_state to |0>
+        rz_angles, phase, ry_angles = _get_rotation_angles(final_state)
+        for target in reversed(range(len(ids))):
+            self._apply_uniformly_controlled_rotation(
+                UniformlyControlledRy,
+                UniformlyControlledRy(ry_angles[target]).get_inverse().angles,
+                ids[target], ids[target + 1:], ctrlids)
+        self._simulator.apply_diagonal_gate([numpy.exp(1j * phase)] * 2,
+                                            [ids[-1]], ctrlids)
+        for target in reversed(range(len(ids))):
+            self._apply_uniformly_controlled_rotation(
+                UniformlyControlledRz,
+                UniformlyControlledRz(rz_angles[target]).get_inverse().angles,
+                ids[target], ids[target + 1:], ctrlids)
+        self._simulator.run()
+
+    def _apply_uniformly_controlled_rotation(self, gate_class, angles,
+                                             target_id, ucontrol_ids,
+                                             ctrlids):
+        """
+        Apply a uniformly controlled Ry or Rz rotation as a block-diagonal
+        gate, i.e., the rotation with angle angles[k] is applied to the target
+        qubit where the qubits ucontrol_ids are in state k.
+
+        Uniformly controlled Rz rotations are diagonal and go through the
+        diagonal-gate kernel, Ry rotations through a dedicated kernel.
+
+        Args:
+            gate_class (type): UniformlyControlledRy or UniformlyControlledRz.
+            angles (list[float]): 2^len(ucontrol_ids) rotation angles.
+            target_id (int): ID of the target qubit.
+            ucontrol_ids (list[int]): IDs of the qubits which select the
+                angle (with ucontrol_ids[0] as the least significant bit).
+            ctrlids (list[int]): IDs of the control qubits.
+        """
+        angles = numpy.asarray(angles, dtype=float)
+        if gate_class is UniformlyControlledRz:
+            # entry 2 * k + t corresponds to target state t, angle k
+            diag = numpy.exp(numpy.outer(angles, [-.5j, .5j])).reshape(-1)
+            self._simulator.apply_diagonal_gate(diag.tolist(),
+                                                [target_id] + ucontrol_ids,
+                                                ctrlids)
             if not self._gate_fusion:
                 self._simulator.run()
         else:
-            raise Exception("This simulator only supports controlled k-qubit"
-                            " gates with k < 6!\nPlease add an auto-replacer"
-                            " engine to your list of compiler engines.")
+            cos, sin = numpy.cos(.5 * angles), numpy.sin(.5 * angles)
+            matrices = numpy.stack([numpy.stack([cos, -sin], axis=-1),
+                                    numpy.stack([sin, cos], axis=-1)],
+                                   axis=1).astype(complex)
+            self._simulator.apply_uniformly_controlled_gate(
+                matrices.tolist(), target_id, ucontrol_ids, ctrlids)
 
     def receive(self, command_list):
         """
@@ -425,14 +1096,69 @@ class Simulator(BasicEngine):
         (simulate them classically) prior to sending them on to the next
         engine.
 
+        Gates which are given by their matrix are collected and passed to the
+        backend in batches, which are applied before any other command (and
+        before the state is accessed, e.g., using cheat). The same holds for
+        allocations and deallocations, such that a register costs a single
+        resize of the state vector (also if its qubits are deallocated one
+        by one, e.g., when it goes out of scope).
+
+        If factorize_qubits is True, allocated (and measured) qubits are kept
+        as factors until a gate entangles them with other qubits (or the
+        state is accessed), see _apply_to_factors.
+
         Args:
             command_list (list<Command>): List of commands to execute on the
                 simulator.
+
+        Raises:
+            TypeError: If a gate has an angle with unbound parameters.
+            RuntimeError: If a qubit in superposition is deallocated.
         """
         for cmd in command_list:
-            if not cmd.gate == FlushGate():
+            if _is_parameterized(cmd.gate):
+                raise TypeError("Simulator: The gate {} has an angle with "
+                                "unbound parameters. Please bind them (see "
+                                "BasicRotationGate.bind) or use the "
+                                "ParametricSimulator or the "
+                                "BatchedSimulator.".format(cmd.gate))
+            if isinstance(cmd.gate, DeallocateQubitGate):
+                ID = cmd.qubits[0][0].id
+                if ID in self._factors:
+                    self._deallocate_factor(ID)
+                else:
+                    if (self._batch_size > 0 or
+                            len(self._allocation_batch) > 0):
+                        self._apply_gate_batch()
+                    if not self._simulator.is_classical(ID):
+                        raise RuntimeError("Error: Qubit has not been "
+                                           "measured / uncomputed! There is "
+                                           "most likely a bug in your code.")
+                    self._deallocation_batch.append(
+                        (ID, self._simulator.get_classical_value(ID)))
+            elif isinstance(cmd.gate, AllocateQubitGate):
+                ID = cmd.qubits[0][0].id
+                if not self._factorize_qubits:
+                    self._allocation_batch.append(ID)
+                elif ID in self._factors:
+                    raise RuntimeError("AllocateQubit: ID already exists. "
+                                       "Qubit IDs should be unique.")
+                else:
+                    self._factors[ID] = numpy.array([1., 0.], dtype=complex)
+            elif isinstance(cmd.gate, FlushGate):
+                # flush gate --> run all saved gates
+                self._apply_gate_batch()
+                self._simulator.run()
+            elif _is_emulated(cmd.gate):
+                if not isinstance(cmd.gate, MeasureGate):
+                    self._merge_factors(
+                        [qb.id for qr in cmd.qubits for qb in qr] +
+                        [qb.id for qb in cmd.control_qubits])
+                self._apply_gate_batch()
                 self._handle(cmd)
+            elif len(self._factors) > 0:
+                self._apply_to_factors(cmd)
             else:
-                self._simulator.run()  # flush gate --> run all saved gates
+                self._add_to_gate_batch(cmd)
             if not self.is_last_engine:
                 self.send([cmd])
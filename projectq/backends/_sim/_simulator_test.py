@@ -18,6 +18,7 @@ and the C++ simulator as backends.
 """
 
 import copy
+import itertools
 import math
 import numpy
 import pytest
@@ -27,15 +28,21 @@ import scipy.sparse
 import scipy.sparse.linalg
 
 from projectq import MainEngine
-from projectq.cengines import (BasicEngine, BasicMapperEngine, DummyEngine,
-                               LocalOptimizer, NotYetMeasuredError)
-from projectq.ops import (All, Allocate, BasicGate, BasicMathGate, CNOT,
-                          Command, H, Measure, QubitOperator, Rx, Ry, Rz, S,
-                          TimeEvolution, Toffoli, X, Y, Z)
+from projectq.cengines import (AutoReplacer, BasicEngine, BasicMapperEngine,
+                               DecompositionRuleSet, DummyEngine,
+                               InstructionFilter, LocalOptimizer,
+                               NotYetMeasuredError)
+from projectq.ops import (All, Allocate, BasicGate, BasicMathGate, C, CNOT,
+                          Command, get_inverse, H, Measure, Ph, QFT,
+                          QubitOperator, R, Rx, Ry, Rz, S, StatePreparation,
+                          Swap, T, TimeEvolution, Toffoli,
+                          UniformlyControlledRy, UniformlyControlledRz, X, Y,
+                          Z)
 from projectq.meta import Control, Dagger, LogicalQubitIDTag
 from projectq.types import WeakQubitRef
 
 from projectq.backends import Simulator
+from projectq.backends._sim._simulator import _group_pauli_terms
 
 
 def test_is_cpp_simulator_present():
@@ -116,7 +123,18 @@ class Mock6QubitGate(BasicGate):
         @property
         def matrix(self):
             self.cnt += 1
-            return numpy.eye(2 ** 6)
+            return numpy.kron(numpy.eye(2 ** 5), H.matrix)
+
+
+class Mock6QubitDiagonalGate(BasicGate):
+        def __init__(self):
+            BasicGate.__init__(self)
+            self.cnt = 0
+
+        @property
+        def matrix(self):
+            self.cnt += 1
+            return numpy.diag(numpy.exp(1j * numpy.arange(2 ** 6)))
 
 
 class MockNoMatrixGate(BasicGate):
@@ -153,10 +171,25 @@ def test_simulator_is_available(sim):
     assert not sim.is_available(new_cmd)
     assert new_cmd.gate.cnt == 4
 
+    new_cmd.gate = Mock6QubitDiagonalGate()
+    assert sim.is_available(new_cmd)
+    assert new_cmd.gate.cnt == 4
+
     new_cmd.gate = MockNoMatrixGate()
     assert not sim.is_available(new_cmd)
     assert new_cmd.gate.cnt == 7
 
+    new_cmd.gate = QFT
+    assert sim.is_available(new_cmd)
+    new_cmd.gate = get_inverse(QFT)
+    assert sim.is_available(new_cmd)
+    new_cmd.gate = StatePreparation([0.6, 0.8j])
+    assert sim.is_available(new_cmd)
+    new_cmd.gate = UniformlyControlledRy([0.1, 0.2])
+    assert sim.is_available(new_cmd)
+    new_cmd.gate = UniformlyControlledRz([0.1, 0.2])
+    assert sim.is_available(new_cmd)
+
 
 def test_simulator_cheat(sim):
     # cheat function should return a tuple
@@ -183,6 +216,21 @@ def test_simulator_cheat(sim):
     assert len(sim.cheat()[1]) == 1
 
 
+def test_simulator_cheat_no_copy(sim):
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(2)
+    eng.flush()
+    wavefunction = sim.cheat()[1]
+    assert isinstance(wavefunction, numpy.ndarray)
+    assert wavefunction.dtype == numpy.complex128
+    # the array is a view onto the simulator's state vector
+    wavefunction[0] = 0.
+    wavefunction[3] = 1.
+    assert sim.get_amplitude('11', qureg) == pytest.approx(1.)
+    All(Measure) | qureg
+    assert int(qureg[0]) == 1 and int(qureg[1]) == 1
+
+
 def test_simulator_functional_measurement(sim):
     eng = MainEngine(sim, [])
     qubits = eng.allocate_qureg(5)
@@ -240,6 +288,347 @@ def test_simulator_emulation(sim):
     All(Measure) | (qubit1 + qubit2 + qubit3)
 
 
+def test_simulator_emulation_builtin_and_vectorized(sim):
+    from projectq.libs.math import (AddConstant, AddConstantModN,
+                                    MultiplyByConstantModN, SubConstantModN)
+    # pairs of gates which are emulated natively / using a vectorized math
+    # function, and the same gates emulated by calling the math function
+    gates = [(AddConstant(5), BasicMathGate(lambda x: (x + 5,)), 1),
+             (AddConstant(-3), BasicMathGate(lambda x: (x - 3,)), 1),
+             (AddConstantModN(4, 13),
+              BasicMathGate(lambda x: ((x + 4) % 13,)), 1),
+             (MultiplyByConstantModN(5, 13),
+              BasicMathGate(lambda x: ((5 * x) % 13,)), 1),
+             # negative constants (reduced modulo N as in Python)
+             (AddConstantModN(-3, 13),
+              BasicMathGate(lambda x: ((x - 3) % 13,)), 1),
+             (SubConstantModN(15, 13),
+              BasicMathGate(lambda x: ((x - 15) % 13,)), 1),
+             (MultiplyByConstantModN(-5, 13),
+              BasicMathGate(lambda x: ((-5 * x) % 13,)), 1),
+             (BasicMathGate(lambda a, b: (a, a + b), vectorized=True),
+              BasicMathGate(lambda a, b: (a, a + b)), 2)]
+    for fast_gate, gate, num_registers in gates:
+        states = []
+        for g in [fast_gate, gate]:
+            backend = Simulator()
+            backend._simulator = type(sim._simulator)(1)
+            eng = MainEngine(backend, [])
+            qureg = eng.allocate_qureg(4)
+            ctrl = eng.allocate_qureg(2)
+            # superposition of all states (including register values >= N)
+            for i, qb in enumerate(qureg + ctrl):
+                Ry(0.3 + 0.4 * i) | qb
+            with Control(eng, ctrl):
+                if num_registers == 1:
+                    g | qureg
+                else:
+                    g | (qureg[:2], qureg[2:])
+            eng.flush()
+            states.append(numpy.copy(backend.cheat()[1]))
+            All(Measure) | qureg + ctrl
+        assert numpy.allclose(states[0], states[1])
+
+
+def test_simulator_qft(sim):
+    import projectq.setups.decompositions.qft2crandhadamard as qft_rules
+    states = []
+    for emulate in [True, False]:
+        backend = Simulator()
+        backend._simulator = type(sim._simulator)(1)
+        engine_list = []
+        if not emulate:
+            # decompose the QFT into Hadamard and controlled R gates
+            engine_list = [AutoReplacer(DecompositionRuleSet(
+                                            modules=[qft_rules])),
+                           InstructionFilter(lambda eng, cmd:
+                                             not isinstance(cmd.gate,
+                                                            type(QFT)))]
+        eng = MainEngine(backend, engine_list)
+        qureg = eng.allocate_qureg(6)
+        for i, qb in enumerate(qureg):
+            Ry(0.3 + 0.4 * i) | qb
+            Rz(0.1 + 0.7 * i) | qb
+        with Control(eng, qureg[5]):
+            QFT | qureg[1:5]
+        QFT | qureg[:3]
+        with Dagger(eng):
+            QFT | qureg[2:]
+        eng.flush()
+        states.append(numpy.copy(backend.cheat()[1]))
+        All(Measure) | qureg
+    assert numpy.allclose(states[0], states[1])
+
+
+def test_simulator_state_preparation(sim):
+    import projectq.setups.decompositions.stateprep2cnot as stateprep_rules
+    import projectq.setups.decompositions.uniformlycontrolledr2cnot as \
+        ucr_rules
+    f_state = numpy.array([0.2 + 0.1 * x * numpy.exp(0.1j + 0.2j * x)
+                           for x in range(8)])
+    f_state /= numpy.linalg.norm(f_state)
+    states = []
+    for emulate in [True, False]:
+        backend = Simulator()
+        backend._simulator = type(sim._simulator)(1)
+        engine_list = []
+        if not emulate:
+            # decompose into CNOTs and rotations
+            engine_list = [AutoReplacer(DecompositionRuleSet(
+                                            modules=[stateprep_rules,
+                                                     ucr_rules])),
+                           InstructionFilter(lambda eng, cmd:
+                                             not isinstance(
+                                                 cmd.gate,
+                                                 (StatePreparation,
+                                                  UniformlyControlledRy,
+                                                  UniformlyControlledRz)))]
+        eng = MainEngine(backend, engine_list)
+        qureg = eng.allocate_qureg(8)
+        H | qureg[0]
+        Ry(0.4) | qureg[7]
+        # fresh qubits
+        StatePreparation(f_state.tolist()) | qureg[1:4]
+        # qubits which are not in state 0
+        StatePreparation(f_state.tolist()) | qureg[5:8]
+        with Control(eng, qureg[0]):
+            StatePreparation(f_state[::-1].tolist()) | qureg[2:5]
+        UniformlyControlledRy([0.1, 0.5, 1.2, 2.]) | (qureg[1:3], qureg[4])
+        UniformlyControlledRz([0.3, 0.9, 1.4, 2.4]) | (qureg[5:7], qureg[0])
+        with Control(eng, qureg[7]):
+            UniformlyControlledRy([0.7, -0.2]) | ([qureg[3]], qureg[1])
+        eng.flush()
+        states.append(numpy.copy(backend.cheat()[1]))
+        All(Measure) | qureg
+    assert numpy.allclose(states[0], states[1])
+
+
+def test_simulator_state_preparation_fresh(sim):
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(2)
+    eng.flush()
+    StatePreparation([0.5, -0.5j, -0.5, 0.5]) | qureg
+    eng.flush()
+    assert numpy.allclose(sim.cheat()[1], [0.5, -0.5j, -0.5, 0.5])
+    with pytest.raises(ValueError):
+        StatePreparation([0.5, 0.5]) | qureg
+    with pytest.raises(ValueError):
+        StatePreparation([0, 0.999j]) | qureg[0]
+    All(Measure) | qureg
+
+
+def test_simulator_apply_gates(sim):
+    backend = sim._simulator
+    for i in range(3):
+        backend.allocate_qubit(i)
+    matrices = [H.matrix.tolist(), X.matrix.tolist(), Rz(0.3).matrix.tolist(),
+                Swap.matrix.tolist(), Ry(0.4).matrix.tolist()]
+    # H(0), CNOT(0, 1), Rz(2), Swap(1, 2), C-Ry(0 -> 2), Rz(0)
+    gates = [0, 1, 0, 0,
+             1, 1, 1, 1, 0,
+             2, 1, 0, 2,
+             3, 2, 0, 1, 2,
+             4, 1, 1, 2, 0,
+             2, 1, 0, 0]
+    backend.apply_gates(matrices, numpy.array(gates, dtype=numpy.uint32),
+                        True)
+    backend.run()
+    state = numpy.zeros(8, dtype=complex)
+    state[0] = 1.
+    state = _apply_reference(state, H.matrix, [0], [])
+    state = _apply_reference(state, X.matrix, [1], [0])
+    state = _apply_reference(state, Rz(0.3).matrix, [2], [])
+    state = _apply_reference(state, Swap.matrix, [1, 2], [])
+    state = _apply_reference(state, Ry(0.4).matrix, [2], [0])
+    state = _apply_reference(state, Rz(0.3).matrix, [0], [])
+    assert numpy.allclose(backend.cheat()[1], state)
+
+
+def test_simulator_gate_batches(sim):
+    eng = MainEngine(sim, [])
+    sim._max_batch_size = 5
+    qureg = eng.allocate_qureg(4)
+    state = numpy.zeros(16, dtype=complex)
+    state[0] = 1.
+    for i in range(12):
+        Ry(0.1 + 0.2 * i) | qureg[i % 4]
+        state = _apply_reference(state, Ry(0.1 + 0.2 * i).matrix, [i % 4], [])
+        CNOT | (qureg[i % 4], qureg[(i + 1) % 4])
+        state = _apply_reference(state, X.matrix, [(i + 1) % 4], [i % 4])
+    # the pending gates are applied before the state is accessed
+    assert 0 < sim._batch_size < 5
+    assert len(sim._gate_matrices) < sim._batch_size + 1
+    assert numpy.allclose(sim.cheat()[1], state)
+    assert sim._batch_size == 0
+    All(Measure) | qureg
+
+
+def test_simulator_swap_batched(sim):
+    # Swap is a math gate with a matrix, which is added to the gate batch
+    # (instead of applying the pending batch first)
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(3)
+    eng.flush()
+    Ry(0.3) | qureg[0]
+    Swap | (qureg[0], qureg[2])
+    C(Swap) | (qureg[2], qureg[0], qureg[1])
+    assert sim._batch_size == 3
+    state = numpy.zeros(8, dtype=complex)
+    state[0] = 1.
+    state = _apply_reference(state, Ry(0.3).matrix, [0], [])
+    state = _apply_reference(state, Swap.matrix, [0, 2], [])
+    state = _apply_reference(state, Swap.matrix, [0, 1], [2])
+    assert numpy.allclose(sim.cheat()[1], state)
+    All(Measure) | qureg
+
+
+@pytest.mark.parametrize("max_qubits, window",
+                         [(1, 1), (2, 5), (3, 17), (5, 64), (7, 300)])
+def test_simulator_fusion_options(max_qubits, window):
+    states = []
+    for fusion in [False, True]:
+        rng = numpy.random.RandomState(7)
+        sim = Simulator(gate_fusion=fusion, fusion_max_qubits=max_qubits,
+                        fusion_window=window)
+        eng = MainEngine(sim, [])
+        qureg = eng.allocate_qureg(9)
+        for _ in range(200):
+            q = [qureg[i] for i in rng.permutation(9)[:3]]
+            r = rng.randint(7)
+            if r == 0:
+                Rx(rng.rand()) | q[0]
+            elif r == 1:
+                Ry(rng.rand()) | q[0]
+            elif r == 2:
+                with Control(eng, q[1]):
+                    Rz(rng.rand()) | q[0]
+            elif r == 3:
+                CNOT | (q[0], q[1])
+            elif r == 4:
+                Toffoli | (q[:2], q[2])
+            elif r == 5:
+                with Control(eng, q[2]):
+                    H | q[0]
+            else:
+                Swap | (q[0], q[1])
+        eng.flush()
+        states.append(numpy.copy(sim.cheat()[1]))
+        All(Measure) | qureg
+    assert numpy.allclose(states[0], states[1])
+
+
+def test_simulator_fusion_options_invalid():
+    with pytest.raises(ValueError):
+        Simulator(fusion_max_qubits=0)
+    with pytest.raises(ValueError):
+        Simulator(fusion_window=0)
+
+
+def test_simulator_allocate_deallocate_qubits(sim):
+    backend = sim._simulator
+    backend.allocate_qubits([0, 1, 2, 3])
+    backend.allocate_qubit(4)
+    with pytest.raises(RuntimeError):
+        backend.allocate_qubits([5, 2])
+    for i in range(4):
+        backend.apply_controlled_gate(Ry(0.3 + i).matrix.tolist(), [i], [])
+    backend.run()
+    with pytest.raises(RuntimeError):
+        backend.deallocate_qubits([1])
+    # qubit 1 is in state 1 and qubit 4 in state 0 after uncomputing
+    backend.apply_controlled_gate(Ry(-1.3).matrix.tolist(), [1], [])
+    backend.apply_controlled_gate(X.matrix.tolist(), [1], [])
+    backend.run()
+
+    def amplitude(bits, ids):
+        return backend.get_amplitude([bool(b) for b in bits], ids)
+
+    amplitudes = {bits: amplitude(bits + (1, 0), [0, 2, 3, 1, 4])
+                  for bits in itertools.product([0, 1], repeat=3)}
+    backend.deallocate_qubits([1, 4])
+    for bits in amplitudes:
+        assert amplitude(bits, [0, 2, 3]) == pytest.approx(amplitudes[bits])
+    backend.allocate_qubits([5, 6])
+    for bits in amplitudes:
+        assert (amplitude(bits + (0, 0), [0, 2, 3, 5, 6]) ==
+                pytest.approx(amplitudes[bits]))
+    backend.apply_controlled_gate(Ry(-2.3).matrix.tolist(), [2], [])
+    backend.run()
+    backend.deallocate_qubit(2)
+    assert amplitude((0, 0, 0, 0), [0, 3, 5, 6]) == pytest.approx(
+        amplitudes[(0, 0, 0)] / math.cos(1.15))
+
+
+@pytest.mark.parametrize("engine_list", [None, []])
+def test_simulator_deallocate_qureg_one_call(sim, engine_list):
+    class CountingBackend(object):
+        def __init__(self, backend):
+            self.backend = backend
+            self.deallocations = []
+
+        def deallocate_qubits(self, ids):
+            self.deallocations.append(list(ids))
+            self.backend.deallocate_qubits(ids)
+
+        def remove_qubits(self, ids, values):
+            self.deallocations.append(list(ids))
+            self.backend.remove_qubits(ids, values)
+
+        def __getattr__(self, name):
+            return getattr(self.backend, name)
+
+    backend = CountingBackend(sim._simulator)
+    sim._simulator = backend
+    if engine_list is None:
+        eng = MainEngine(sim)
+    else:
+        eng = MainEngine(sim, engine_list)
+    qureg = eng.allocate_qureg(10)
+    All(H) | qureg
+    All(Measure) | qureg
+    eng.flush()
+    ids = [qb.id for qb in qureg]
+    del qureg
+    eng.flush()
+    assert len(backend.deallocations) == 1
+    assert sorted(backend.deallocations[0]) == ids
+    qubit = eng.allocate_qubit()
+    X | qubit
+    eng.flush()
+    assert sim.cheat()[0] == {qubit[0].id: 0}
+    Measure | qubit
+    eng.flush()
+    assert int(qubit) == 1
+
+
+def test_simulator_mmap_dir(sim, tmpdir):
+    def run_circuit(sim):
+        eng = MainEngine(sim, [])
+        qureg = eng.allocate_qureg(6)
+        All(H) | qureg
+        for i in range(5):
+            CNOT | (qureg[i], qureg[i + 1])
+            Rx(0.2 * i) | qureg[i]
+        Rz(0.7) | qureg[5]
+        Measure | qureg[0]
+        extra = eng.allocate_qubit()
+        Ry(0.3) | extra
+        eng.flush()
+        result = numpy.copy(sim.cheat()[1])
+        Measure | qureg
+        Measure | extra
+        eng.flush()
+        return result
+
+    reference = run_circuit(Simulator(rnd_seed=5))
+    sim._simulator = type(sim._simulator)(5)
+    sim._simulator.set_mmap_dir(str(tmpdir))
+    assert numpy.allclose(run_circuit(sim), reference)
+    sim._simulator.set_mmap_dir("")
+    with pytest.raises(ValueError):
+        Simulator(mmap_dir=str(tmpdir.join("missing")))
+
+
 def test_simulator_kqubit_gate(sim):
     m1 = Rx(0.3).matrix
     m2 = Rx(0.8).matrix
@@ -272,12 +661,159 @@ def test_simulator_kqubit_gate(sim):
     class LargerGate(BasicGate):
         @property
         def matrix(self):
-            return numpy.eye(2 ** 6)
+            return numpy.kron(numpy.eye(2 ** 5), H.matrix)
 
     with pytest.raises(Exception):
         LargerGate() | (qureg + qubit)
 
 
+def test_simulator_controlled_kqubit_gate_full_matrix(sim):
+    rng = numpy.random.RandomState(42)
+    m = rng.randn(4, 4) + 1j * rng.randn(4, 4)
+    m, _ = numpy.linalg.qr(m)
+
+    class TwoQubitGate(BasicGate):
+        @property
+        def matrix(self):
+            return numpy.matrix(m)
+
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(4)
+    for qb in qureg:
+        Ry(rng.rand()) | qb
+        Rz(rng.rand()) | qb
+    eng.flush()
+    init = numpy.copy(sim.cheat()[1])
+    with Control(eng, qureg[0]):
+        TwoQubitGate() | (qureg[3], qureg[1])
+    eng.flush()
+    mapping, final = sim.cheat()
+
+    # build the full 16x16 matrix explicitly
+    full = numpy.zeros((16, 16), dtype=complex)
+    pos = [mapping[qureg[3].id], mapping[qureg[1].id]]
+    ctrl = mapping[qureg[0].id]
+    for col in range(16):
+        if not (col >> ctrl) & 1:
+            full[col, col] = 1.
+            continue
+        x = ((col >> pos[0]) & 1) | (((col >> pos[1]) & 1) << 1)
+        for y in range(4):
+            row = col & ~((1 << pos[0]) | (1 << pos[1]))
+            row |= ((y & 1) << pos[0]) | (((y >> 1) & 1) << pos[1])
+            full[row, col] = m[y, x]
+    assert numpy.allclose(final, full.dot(init))
+    All(Measure) | qureg
+
+
+def _apply_reference(state, matrix, pos, ctrl_pos):
+    # apply a controlled gate to a state vector (bit p of the index is the
+    # qubit at position p)
+    matrix = numpy.asarray(matrix)
+    indices = numpy.arange(len(state))
+    mask = sum(1 << p for p in pos)
+    ctrlmask = sum(1 << p for p in ctrl_pos)
+    rows = sum(((indices >> p) & 1) << l for l, p in enumerate(pos))
+    new_state = numpy.zeros_like(state)
+    for col in range(len(matrix)):
+        j = (indices & ~mask) | sum(((col >> l) & 1) << p
+                                    for l, p in enumerate(pos))
+        new_state += matrix[rows, col] * state[j]
+    active = (indices & ctrlmask) == ctrlmask
+    return numpy.where(active, new_state, state)
+
+
+def test_simulator_diagonal_gates(sim):
+    rng = numpy.random.RandomState(3)
+
+    class DiagonalGate(BasicGate):
+        def __init__(self, num_qubits):
+            BasicGate.__init__(self)
+            self.phases = numpy.exp(2j * numpy.pi *
+                                    rng.rand(2 ** num_qubits))
+
+        @property
+        def matrix(self):
+            return numpy.diag(self.phases)
+
+    n = 14
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(n)
+    eng.flush()
+    assert all(sim.cheat()[0][qb.id] == i for i, qb in enumerate(qureg))
+    state = numpy.zeros(2 ** n, dtype=complex)
+    state[0] = 1.
+
+    def apply(gate, targets, ctrls=[]):
+        with Control(eng, [qureg[c] for c in ctrls]):
+            gate | [qureg[t] for t in targets]
+        return _apply_reference(state, gate.matrix, targets, ctrls)
+
+    for i in range(n):
+        state = apply(H, [i])
+    for r in range(2):
+        for i in range(n):
+            state = apply(Rz(0.3 * i + r), [i])
+        state = apply(S, [2])
+        state = apply(T, [5], [1])
+        state = apply(Ph(0.4), [3])
+        state = apply(R(0.7), [4], [9, 11])
+        state = apply(DiagonalGate(7), range(7), [13])
+        state = apply(DiagonalGate(7), range(6, 13))
+        state = apply(Rx(0.2 + r), [6])
+        state = apply(Z, [6], [5])
+        state = apply(DiagonalGate(2), [6, 5])
+        state = apply(X, [12], [0])
+    eng.flush()
+    assert numpy.allclose(sim.cheat()[1], state)
+    All(Measure) | qureg
+
+
+def test_simulator_permutation_gates(sim):
+    rng = numpy.random.RandomState(5)
+
+    class PermutationGate(BasicGate):
+        def __init__(self, num_qubits):
+            BasicGate.__init__(self)
+            self.perm = rng.permutation(2 ** num_qubits)
+
+        @property
+        def matrix(self):
+            m = numpy.zeros((len(self.perm), len(self.perm)))
+            m[self.perm, numpy.arange(len(self.perm))] = 1
+            return m
+
+    n = 9
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(n)
+    eng.flush()
+    state = numpy.zeros(2 ** n, dtype=complex)
+    state[0] = 1.
+
+    def apply(gate, targets, ctrls=[]):
+        with Control(eng, [qureg[c] for c in ctrls]):
+            gate | tuple(qureg[t] for t in targets)
+        return _apply_reference(state, gate.matrix, targets, ctrls)
+
+    for i in range(n):
+        state = apply(Ry(0.1 + 0.3 * i), [i])
+        state = apply(Rz(0.2 * i), [i])
+    for r in range(2):
+        state = apply(X, [r])
+        state = apply(X, [4], [r + 1])
+        state = apply(X, [0], [4, 7])
+        state = apply(X, [8], list(range(8)))
+        state = apply(Swap, [2, 6])
+        state = apply(Swap, [1, 7], [0, 3])
+        state = apply(Rx(0.3), [5])
+        state = apply(PermutationGate(3), [5, 2, 3], [8])
+        state = apply(PermutationGate(6), [0, 8, 1, 7, 4, 3])
+        state = apply(H, [3])
+    eng.flush()
+    assert numpy.allclose(sim.cheat()[1], state)
+    All(Measure) | qureg
+
+
 def test_simulator_kqubit_exception(sim):
     m1 = Rx(0.3).matrix
     m2 = Rx(0.8).matrix
@@ -330,6 +866,32 @@ def test_simulator_probability(sim, mapper):
     All(Measure) | qubits
 
 
+def test_simulator_sample(sim, mapper):
+    engine_list = [LocalOptimizer()]
+    if mapper is not None:
+        engine_list.append(mapper)
+    eng = MainEngine(sim, engine_list=engine_list)
+    qubits = eng.allocate_qureg(4)
+    Ry(2 * math.acos(math.sqrt(0.3))) | qubits[0]
+    X | qubits[2]
+    H | qubits[3]
+    eng.flush()
+    counts = eng.backend.sample(qubits[:3], 10000, seed=5)
+    assert sum(counts.values()) == 10000
+    assert set(counts) == set(['001', '101'])
+    assert counts['001'] == pytest.approx(3000, abs=300)
+    # the same seed gives the same samples and the state is not collapsed
+    assert eng.backend.sample(qubits[:3], 10000, seed=5) == counts
+    assert (eng.backend.get_probability('0', [qubits[0]]) ==
+            pytest.approx(0.3))
+    counts = eng.backend.sample([qubits[3], qubits[2]], 1000)
+    assert set(counts) <= set(['01', '11'])
+    assert sum(counts.values()) == 1000
+    with pytest.raises(RuntimeError):
+        eng.backend.sample(eng.allocate_qubit(), 1)
+    All(Measure) | qubits
+
+
 def test_simulator_amplitude(sim, mapper):
     engine_list = [LocalOptimizer()]
     if mapper is not None:
@@ -414,6 +976,75 @@ def test_simulator_expectation(sim, mapper):
     assert .4 == pytest.approx(expectation)
 
 
+def _random_operator(rng, num_qubits, num_terms):
+    op = QubitOperator((), rng.uniform(-1., 1.))
+    for _ in range(num_terms):
+        qubits = rng.sample(range(num_qubits), rng.randint(1, 4))
+        op += QubitOperator(tuple((k, rng.choice('XYZ')) for k in qubits),
+                            rng.uniform(-1., 1.))
+    return op
+
+
+def test_group_pauli_terms():
+    rng = random.Random(5)
+    terms = list(_random_operator(rng, 6, 100).terms)
+    groups = _group_pauli_terms(terms)
+    assert (sorted(term for _, group in groups for term in group) ==
+            sorted(terms))
+    assert all(p == 'Z' for term in groups[0][1] for _, p in term)
+    for basis, group in groups[1:]:
+        assert all(basis[k] == p for term in group for k, p in term)
+        assert any(p != 'Z' for p in basis.values())
+
+
+def test_simulator_expectation_values(sim, mapper):
+    engine_list = []
+    if mapper is not None:
+        engine_list.append(mapper)
+    eng = MainEngine(sim, engine_list=engine_list)
+    qureg = eng.allocate_qureg(6)
+    rng = random.Random(3)
+    for _ in range(3):
+        for qb in qureg:
+            Ry(rng.uniform(0., 6.)) | qb
+            Rz(rng.uniform(0., 6.)) | qb
+        for i in range(5):
+            CNOT | (qureg[i], qureg[i + 1])
+    ops = [_random_operator(rng, 6, 40) for _ in range(3)]
+    eng.flush()
+    _, state = sim.cheat()
+    state = numpy.copy(state)
+    ids = [qb.id for qb in sim._convert_logical_to_mapped_qureg(qureg)]
+    values = sim.get_expectation_values(ops, qureg)
+    for op, value in zip(ops, values):
+        expected = sum(coeff * sim._simulator.get_expectation_value(
+            [(list(term), 1.)], ids) for term, coeff in op.terms.items())
+        assert value == pytest.approx(expected)
+        assert sim.get_expectation_value(op, qureg) == pytest.approx(value)
+    # the state is restored
+    assert numpy.allclose(sim.cheat()[1], state)
+    assert sim.get_expectation_values([], qureg) == []
+    All(Measure) | qureg
+
+
+def test_simulator_expectation_values_group_order(sim):
+    # the back-end restores the state before each group, i.e., a group
+    # without basis rotation may follow a rotated one
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(2)
+    Ry(0.3) | qureg[0]
+    Rx(1.1) | qureg[1]
+    eng.flush()
+    ids = [qb.id for qb in qureg]
+    groups = [([(0, 'X'), (1, 'Y')], [[0], [1], [0, 1]]), ([], [[0], [1]])]
+    values = sim._simulator.get_expectation_values(groups, ids)
+    expected = [math.sin(0.3), -math.sin(1.1),
+                -math.sin(0.3) * math.sin(1.1), math.cos(0.3),
+                math.cos(1.1)]
+    assert numpy.allclose(values, expected)
+    All(Measure) | qureg
+
+
 def test_simulator_expectation_exception(sim):
     eng = MainEngine(sim, [])
     qureg = eng.allocate_qureg(3)
@@ -526,6 +1157,41 @@ def test_simulator_time_evolution(sim):
                           init_wavefunction)
 
 
+def test_simulator_time_evolution_krylov(sim):
+    rng = random.Random(4)
+    op = 3. * _random_operator(rng, 6, 25)
+    krylov_sim = Simulator(time_evolution='krylov', krylov_dim=20)
+    krylov_sim._simulator = type(sim._simulator)(1)
+    states = []
+    for backend in [sim, krylov_sim]:
+        eng = MainEngine(backend, [])
+        qureg = eng.allocate_qureg(7)
+        for qb in qureg:
+            Rx(0.3) | qb
+            Ry(0.4) | qb
+        TimeEvolution(2.1, op) | qureg[:6]
+        with Control(eng, qureg[6]):
+            TimeEvolution(-0.8, op) | qureg[:6]
+        eng.flush()
+        states.append(numpy.copy(backend.cheat()[1]))
+        All(Measure) | qureg
+    assert numpy.allclose(states[0], states[1], atol=1e-10)
+    assert sim.get_time_evolution_report()['gates'] == 0
+    report = krylov_sim.get_time_evolution_report(reset=True)
+    assert report['gates'] == 2
+    assert 2 <= report['steps'] < report['matvecs']
+    assert krylov_sim.get_time_evolution_report()['steps'] == 0
+
+
+def test_simulator_time_evolution_krylov_options():
+    with pytest.raises(ValueError):
+        Simulator(time_evolution='pade')
+    with pytest.raises(ValueError):
+        Simulator(krylov_tol=0.)
+    with pytest.raises(ValueError):
+        Simulator(krylov_dim=0)
+
+
 def test_simulator_set_wavefunction(sim, mapper):
     engine_list = [LocalOptimizer()]
     if mapper is not None:
@@ -595,6 +1261,43 @@ def test_simulator_no_uncompute_exception(sim):
     assert qubit[0].id == -1
 
 
+def test_simulator_tracks_classical_qubits(sim):
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(4)
+    H | qureg[0]
+    CNOT | (qureg[0], qureg[1])
+    Measure | qureg[0]
+    # permutation gates on known values and gates with a control which is
+    # known to be 0 keep the qubits classical
+    X | qureg[2]
+    Toffoli | (qureg[0], qureg[2], qureg[3])
+    CNOT | (qureg[0], qureg[3])
+    with Control(eng, qureg[3]):
+        H | qureg[2]
+    Rz(0.3) | qureg[2]
+    eng.flush()
+    outcome = int(qureg[0])
+    expected = {qureg[0]: outcome, qureg[1]: outcome, qureg[2]: 1,
+                qureg[3]: 0}
+    for qb, value in expected.items():
+        assert sim._simulator.is_classical(qb.id)
+        assert sim._simulator.get_classical_value(qb.id) == value
+        assert sim.get_probability([value], [qb]) == pytest.approx(1.)
+    # a dense gate may take the qubit out of its basis state, which is then
+    # checked by scanning the state vector
+    H | qureg[2]
+    eng.flush()
+    assert not sim._simulator.is_classical(qureg[2].id)
+    H | qureg[2]
+    eng.flush()
+    assert sim._simulator.get_classical_value(qureg[2].id)
+    sim.collapse_wavefunction(qureg[1:2], [outcome])
+    assert sim._simulator.get_classical_value(qureg[1].id) == outcome
+    del qureg, expected, qb
+    eng.flush()
+    assert len(sim.cheat()[0]) == 0
+
+
 class MockSimulatorBackend(object):
     def __init__(self):
         self.run_cnt = 0
@@ -674,6 +1377,53 @@ def test_simulator_functional_entangle(sim):
     All(Measure) | qubits
 
 
+@pytest.fixture(params=get_available_simulators())
+def single_sim(request):
+    if request.param == "cpp_simulator":
+        from projectq.backends._sim._cppsim import (SinglePrecisionSimulator
+                                                    as CppSim)
+        sim = Simulator(gate_fusion=True, precision='single')
+        sim._simulator = CppSim(1)
+        return sim
+    if request.param == "py_simulator":
+        from projectq.backends._sim._pysim import (SinglePrecisionSimulator
+                                                   as PySim)
+        sim = Simulator(precision='single')
+        sim._simulator = PySim(1)
+        return sim
+
+
+def test_simulator_single_precision(sim, single_sim):
+    states = []
+    expectations = []
+    for backend in [sim, single_sim]:
+        eng = MainEngine(backend, [])
+        qureg = eng.allocate_qureg(6)
+        All(H) | qureg
+        for i in range(5):
+            CNOT | (qureg[i], qureg[i + 1])
+            Rz(0.1 * (i + 1)) | qureg[i]
+            Rx(0.7) | qureg[i + 1]
+        Toffoli | (qureg[0], qureg[3], qureg[5])
+        with Control(eng, qureg[1]):
+            TimeEvolution(0.3, QubitOperator("X0 Z2")) | qureg[2:5]
+        eng.flush()
+        states.append(numpy.copy(backend.cheat()[1]))
+        op = QubitOperator("Z0 Z1", 0.5) + QubitOperator("X3 Y5", -1.2)
+        expectations.append(eng.backend.get_expectation_value(op, qureg))
+        All(Measure) | qureg
+    assert states[0].dtype == numpy.complex128
+    assert states[1].dtype == numpy.complex64
+    assert numpy.allclose(states[0], states[1], atol=1e-5)
+    assert isinstance(expectations[1], float)
+    assert expectations[1] == pytest.approx(expectations[0], abs=1e-5)
+
+
+def test_simulator_invalid_precision():
+    with pytest.raises(ValueError):
+        Simulator(precision='half')
+
+
 def test_simulator_convert_logical_to_mapped_qubits(sim):
     mapper = BasicMapperEngine()
 
@@ -688,3 +1438,99 @@ def test_simulator_convert_logical_to_mapped_qubits(sim):
                               qubit1[0].id: qubit0[0].id}
     assert (sim._convert_logical_to_mapped_qureg(qubit0 + qubit1) ==
             qubit1 + qubit0)
+
+
+@pytest.fixture(params=get_available_simulators())
+def factorized_sim(request):
+    if request.param == "cpp_simulator":
+        from projectq.backends._sim._cppsim import Simulator as CppSim
+        sim = Simulator(gate_fusion=True, factorize_qubits=True)
+        sim._simulator = CppSim(1)
+        return sim
+    if request.param == "py_simulator":
+        from projectq.backends._sim._pysim import Simulator as PySim
+        sim = Simulator(factorize_qubits=True)
+        sim._simulator = PySim(1)
+        return sim
+
+
+def test_simulator_factorize_qubits(sim, factorized_sim, mapper):
+    states = []
+    for backend in [sim, factorized_sim]:
+        engine_list = []
+        if mapper is not None:
+            engine_list.append(copy.deepcopy(mapper))
+        eng = MainEngine(backend, engine_list)
+        qureg = eng.allocate_qureg(4)
+        Ry(0.3) | qureg[0]
+        X | qureg[1]
+        # controls in a basis state do not entangle the qubits
+        CNOT | (qureg[1], qureg[2])
+        CNOT | (qureg[3], qureg[0])
+        Toffoli | (qureg[1], qureg[2], qureg[3])
+        H | qureg[2]
+        # ancillae which are uncomputed never enter the state vector
+        for _ in range(3):
+            ancilla = eng.allocate_qubit()
+            Rx(0.4) | ancilla
+            Rx(-0.4) | ancilla
+            del ancilla
+        eng.flush()
+        if backend is factorized_sim:
+            assert len(backend._factors) == 4
+        CNOT | (qureg[0], qureg[1])
+        eng.flush()
+        op = QubitOperator("Z0 Z1", 0.5) + QubitOperator("X2 Z3", -1.2)
+        states.append((backend.get_expectation_value(op, qureg),
+                       [backend.get_probability(bits, qureg) for bits in
+                        itertools.product([0, 1], repeat=4)]))
+        All(Measure) | qureg
+    assert states[0][0] == pytest.approx(states[1][0])
+    assert numpy.allclose(states[0][1], states[1][1])
+    assert sorted(factorized_sim.cheat()[0].values()) == list(range(4))
+
+
+def test_simulator_factorize_qubits_phases(sim, factorized_sim):
+    # factors in a basis state with a phase, e.g., e^{i phi}|0>, keep their
+    # phase when they are merged into the state vector
+    amplitudes = []
+    for backend in [sim, factorized_sim]:
+        eng = MainEngine(backend, [])
+        qureg = eng.allocate_qureg(3)
+        Ph(0.7) | qureg[0]
+        X | qureg[1]
+        R(0.4) | qureg[1]
+        X | qureg[1]
+        H | qureg[2]
+        eng.flush()
+        amplitudes.append([backend.get_amplitude(bits, qureg) for bits in
+                           itertools.product([0, 1], repeat=3)])
+        All(Measure) | qureg
+    assert numpy.allclose(amplitudes[0], amplitudes[1])
+
+
+def test_simulator_factorize_measured_qubits(factorized_sim):
+    eng = MainEngine(factorized_sim, [])
+    qureg = eng.allocate_qureg(3)
+    H | qureg[0]
+    CNOT | (qureg[0], qureg[1])
+    H | qureg[2]
+    Measure | qureg[0]
+    eng.flush()
+    # the measured qubit is removed from the state vector
+    assert qureg[0].id in factorized_sim._factors
+    outcome = int(qureg[0])
+    assert int(factorized_sim.get_probability([outcome], qureg[1:2]) + .5)
+    Measure | qureg[2]
+    eng.flush()
+    X | qureg[0]
+    eng.flush()
+    assert factorized_sim.get_probability([1 - outcome],
+                                          qureg[:1]) == pytest.approx(1.)
+    del qureg[0]
+    eng.flush()
+    qubit = eng.allocate_qubit()
+    H | qubit
+    with pytest.raises(RuntimeError):
+        qubit[0].__del__()
+    All(Measure) | qureg
@@ -0,0 +1,454 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+A simulator which stores only the nonzero amplitudes of the state, for
+(wide) circuits such as arithmetic and oracles which keep few basis states
+in superposition.
+"""
+
+import random
+
+import numpy
+
+from projectq.cengines import BasicEngine
+from projectq.meta import LogicalQubitIDTag
+from projectq.ops import (AllocateQubitGate,
+                          BasicMathGate,
+                          DeallocateQubitGate,
+                          FlushGate,
+                          MeasureGate)
+from projectq.types import WeakQubitRef
+from ._simulator import _get_permutation, _is_diagonal
+
+
+# action of the Pauli operators on a basis state: (flip the bit, phase if the
+# bit is 0, phase if the bit is 1)
+_PAULIS = {'X': (True, 1., 1.),
+           'Y': (True, 1j, -1j),
+           'Z': (False, 1., -1.)}
+
+
+def _get_local_index(index, locations):
+    """
+    Return the integer formed by the bits of `index` at `locations` (with
+    locations[0] as the least significant bit).
+    """
+    local = 0
+    for i, loc in enumerate(locations):
+        local |= ((index >> loc) & 1) << i
+    return local
+
+
+def _set_local_index(index, locations, local):
+    """
+    Return `index` with its bits at `locations` replaced by those of `local`.
+    """
+    for i, loc in enumerate(locations):
+        index = (index & ~(1 << loc)) | (((local >> i) & 1) << loc)
+    return index
+
+
+class SparseSimulator(BasicEngine):
+    """
+    Simulator which stores the state as a dictionary which maps the indices of
+    the basis states with nonzero amplitudes to their amplitudes (where the
+    i-th allocated qubit is the i-th bit of the index).
+
+    Diagonal gates are applied in place and permutation gates (e.g., X,
+    (multi-)controlled NOTs, Swap) and math gates (e.g., the adders and
+    multipliers of projectq.libs.math) relabel the basis states, such that
+    their cost is proportional to the number of nonzero amplitudes (and does
+    not depend on the number of qubits). Other gates on up to 5 qubits (e.g.,
+    H, Ry) may increase the number of nonzero amplitudes; amplitudes whose
+    absolute value falls below `cutoff` are discarded.
+
+    Hence, circuits on many qubits (far more than a dense state vector
+    allows) can be simulated, as long as few basis states are in
+    superposition.
+    """
+    def __init__(self, cutoff=1e-14, rnd_seed=None):
+        """
+        Construct the sparse simulator.
+
+        Args:
+            cutoff (float): Amplitudes whose absolute value is at most cutoff
+                are discarded after each gate.
+            rnd_seed (int): Random seed (uses random.randint(0, 4294967295) by
+                default).
+        """
+        BasicEngine.__init__(self)
+        if rnd_seed is None:
+            rnd_seed = random.randint(0, 4294967295)
+        self._rng = random.Random(rnd_seed)
+        self._cutoff = cutoff
+        self._amplitudes = {0: 1. + 0j}
+        self._map = dict()  # qubit ID -> bit location
+        self._free_locations = []
+
+    def is_available(self, cmd):
+        """
+        Return True if the command is a measurement, an allocation, a
+        deallocation, a math gate, or an (arbitrarily controlled) gate which
+        provides a gate-matrix and acts on at most 5 qubits (not counting the
+        control qubits) or is diagonal or a permutation.
+
+        Args:
+            cmd (Command): Command for which to check availability.
+        """
+        if isinstance(cmd.gate, (MeasureGate, AllocateQubitGate,
+                                 DeallocateQubitGate, FlushGate,
+                                 BasicMathGate)):
+            return True
+        try:
+            matrix = cmd.gate.matrix
+        except AttributeError:
+            return False
+        return (len(matrix) <= 2 ** 5 or _is_diagonal(matrix) or
+                _get_permutation(matrix) is not None)
+
+    def get_support_size(self):
+        """
+        Return the number of basis states with a nonzero amplitude.
+        """
+        return len(self._amplitudes)
+
+    def _convert_logical_to_mapped_qureg(self, qureg):
+        """
+        Converts a qureg from logical to mapped qubits if there is a mapper.
+
+        Args:
+            qureg (list[Qubit],Qureg): Logical quantum bits
+        """
+        mapper = self.main_engine.mapper
+        if mapper is not None:
+            mapped_qureg = []
+            for qubit in qureg:
+                if qubit.id not in mapper.current_mapping:
+                    raise RuntimeError("Unknown qubit id. "
+                                       "Please make sure you have called "
+                                       "eng.flush().")
+                new_qubit = WeakQubitRef(qubit.engine,
+                                         mapper.current_mapping[qubit.id])
+                mapped_qureg.append(new_qubit)
+            return mapped_qureg
+        else:
+            return qureg
+
+    def _get_locations(self, qureg):
+        try:
+            return [self._map[qb.id] for qb in qureg]
+        except KeyError:
+            raise RuntimeError("Unknown qubit id. Please make sure you have "
+                               "called eng.flush().")
+
+    def get_probability(self, bit_string, qureg):
+        """
+        Return the probability of the outcome `bit_string` when measuring
+        the quantum register `qureg`.
+
+        Args:
+            bit_string (list[bool|int]|string[0|1]): Measurement outcome.
+            qureg (Qureg|list[Qubit]): Quantum register.
+
+        Returns:
+            Probability of measuring the provided bit string.
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            automatically converts from logical qubits to mapped qubits for
+            the qureg argument.
+        """
+        qureg = self._convert_logical_to_mapped_qureg(qureg)
+        locations = self._get_locations(qureg)
+        value = sum(int(bit) << i for i, bit in enumerate(bit_string))
+        return sum(abs(a) ** 2 for index, a in self._amplitudes.items()
+                   if _get_local_index(index, locations) == value)
+
+    def get_amplitude(self, bit_string, qureg):
+        """
+        Return the amplitude of the basis state `bit_string` of the quantum
+        register `qureg`, which must contain all allocated qubits.
+
+        Args:
+            bit_string (list[bool|int]|string[0|1]): Computational basis
+                state.
+            qureg (Qureg|list[Qubit]): Quantum register (containing all
+                qubits).
+
+        Returns:
+            Amplitude of the provided bit string.
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            automatically converts from logical qubits to mapped qubits for
+            the qureg argument.
+
+        Raises:
+            RuntimeError: If qureg does not contain all allocated qubits.
+        """
+        qureg = self._convert_logical_to_mapped_qureg(qureg)
+        if sorted(qb.id for qb in qureg) != sorted(self._map):
+            raise RuntimeError("The second argument to get_amplitude() must "
+                               "be a permutation of all allocated qubits. "
+                               "Please make sure you have called "
+                               "eng.flush().")
+        index = _set_local_index(0, self._get_locations(qureg),
+                                 sum(int(bit) << i
+                                     for i, bit in enumerate(bit_string)))
+        return self._amplitudes.get(index, 0j)
+
+    def get_expectation_value(self, qubit_operator, qureg):
+        """
+        Get the expectation value of qubit_operator w.r.t. the current state
+        represented by the supplied quantum register.
+
+        Args:
+            qubit_operator (projectq.ops.QubitOperator): Operator to measure.
+            qureg (list[Qubit],Qureg): Quantum bits to measure.
+
+        Returns:
+            Expectation value
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            automatically converts from logical qubits to mapped qubits for
+            the qureg argument.
+
+        Raises:
+            Exception: If `qubit_operator` acts on more qubits than present in
+                the `qureg` argument.
+        """
+        qureg = self._convert_logical_to_mapped_qureg(qureg)
+        locations = self._get_locations(qureg)
+        expectation = 0.
+        for term, coefficient in qubit_operator.terms.items():
+            if not term == () and term[-1][0] >= len(qureg):
+                raise Exception("qubit_operator acts on more qubits than "
+                                "contained in the qureg.")
+            value = 0.
+            for index, a in self._amplitudes.items():
+                phase = 1.
+                for qubit, pauli in term:
+                    flip, phase0, phase1 = _PAULIS[pauli]
+                    bit = 1 << locations[qubit]
+                    phase *= phase1 if index & bit else phase0
+                    if flip:
+                        index ^= bit
+                other = self._amplitudes.get(index)
+                if other is not None:
+                    value += other.conjugate() * phase * a
+            expectation += coefficient * value
+        return expectation.real
+
+    def _prune(self):
+        self._amplitudes = {index: a for index, a in self._amplitudes.items()
+                            if abs(a) > self._cutoff}
+
+    def _apply_matrix(self, matrix, locations, mask):
+        """
+        Apply the gate `matrix` to the qubits at `locations` (of which the
+        first corresponds to the least significant bit of the matrix) to all
+        basis states whose bits in `mask` (controls) are set.
+        """
+        matrix = numpy.asarray(matrix, dtype=complex)
+        if _is_diagonal(matrix):
+            diagonal = numpy.diagonal(matrix)
+            for index in self._amplitudes:
+                if index & mask == mask:
+                    self._amplitudes[index] *= diagonal[
+                        _get_local_index(index, locations)]
+            self._prune()
+            return
+        perm = _get_permutation(matrix)
+        if perm is not None:
+            self._relabel(lambda local: perm[local], locations, mask)
+            return
+        # collect the amplitudes of the basis states which the gate mixes
+        target_mask = sum(1 << loc for loc in locations)
+        groups = dict()
+        amplitudes = dict()
+        for index, a in self._amplitudes.items():
+            if index & mask != mask:
+                amplitudes[index] = a
+                continue
+            base = index & ~target_mask
+            if base not in groups:
+                groups[base] = numpy.zeros(len(matrix), dtype=complex)
+            groups[base][_get_local_index(index, locations)] = a
+        for base, vector in groups.items():
+            for local, a in enumerate(matrix.dot(vector)):
+                if abs(a) > self._cutoff:
+                    amplitudes[_set_local_index(base, locations, local)] = a
+        self._amplitudes = amplitudes
+
+    def _relabel(self, function, locations, mask):
+        """
+        Map the basis states whose bits in `mask` (controls) are set, where
+        the (local) value x of the bits at `locations` becomes function(x).
+
+        If the function is not injective, the amplitudes of the basis states
+        which are mapped to the same one are added (like by Simulator).
+        """
+        amplitudes = dict()
+        collision = False
+        for index, a in self._amplitudes.items():
+            if index & mask == mask:
+                index = _set_local_index(
+                    index, locations,
+                    function(_get_local_index(index, locations)))
+            if index in amplitudes:
+                amplitudes[index] += a
+                collision = True
+            else:
+                amplitudes[index] = a
+        self._amplitudes = amplitudes
+        if collision:
+            self._prune()
+
+    def _apply_math(self, math_fun, qubit_locations, mask):
+        """
+        Apply the math function math_fun to the registers at the (lists of)
+        qubit locations, for all basis states whose bits in `mask` are set.
+        """
+        locations = [loc for qureg_locations in qubit_locations
+                     for loc in qureg_locations]
+
+        def function(x):
+            args = []
+            offset = 0
+            for qureg_locations in qubit_locations:
+                args.append((x >> offset) & ((1 << len(qureg_locations)) - 1))
+                offset += len(qureg_locations)
+            res = math_fun(args)
+            new_x = 0
+            offset = 0
+            for i, qureg_locations in enumerate(qubit_locations):
+                new_x |= ((res[i] & ((1 << len(qureg_locations)) - 1)) <<
+                          offset)
+                offset += len(qureg_locations)
+            return new_x
+
+        self._relabel(function, locations, mask)
+
+    def _allocate(self, qubit_id):
+        if qubit_id in self._map:
+            raise RuntimeError("AllocateQubit: ID already exists. Qubit IDs "
+                               "should be unique.")
+        if len(self._free_locations) > 0:
+            self._map[qubit_id] = self._free_locations.pop()
+        else:
+            self._map[qubit_id] = len(self._map)
+
+    def _measure(self, location):
+        """
+        Measure the qubit at `location` and return the outcome (0 or 1).
+        """
+        bit = 1 << location
+        p1 = sum(abs(a) ** 2 for index, a in self._amplitudes.items()
+                 if index & bit)
+        total = sum(abs(a) ** 2 for a in self._amplitudes.values())
+        outcome = int(self._rng.random() * total < p1)
+        norm = numpy.sqrt(p1 if outcome else total - p1)
+        self._amplitudes = {index: a / norm
+                            for index, a in self._amplitudes.items()
+                            if bool(index & bit) == bool(outcome)}
+        return outcome
+
+    def _deallocate(self, qubit_id):
+        """
+        Deallocate the qubit, which must be in a basis state.
+
+        Raises:
+            RuntimeError: If the qubit is in superposition.
+        """
+        location = self._map[qubit_id]
+        bit = 1 << location
+        values = set(bool(index & bit) for index in self._amplitudes)
+        if len(values) > 1:
+            raise RuntimeError("Qubit has not been measured / uncomputed. "
+                               "Cannot deallocate a qubit in "
+                               "superposition!")
+        # reset the bit, such that the location can be reused
+        self._amplitudes = {index & ~bit: a
+                            for index, a in self._amplitudes.items()}
+        del self._map[qubit_id]
+        self._free_locations.append(location)
+
+    def receive(self, command_list):
+        """
+        Receive a list of commands from the previous engine and handle them
+        prior to sending them on to the next engine.
+
+        Args:
+            command_list (list<Command>): List of commands to execute on the
+                simulator.
+        """
+        for cmd in command_list:
+            self._handle(cmd)
+        if not self.is_last_engine:
+            self.send(command_list)
+
+    def _handle(self, cmd):
+        """
+        Handle all commands.
+
+        Args:
+            cmd (Command): Command to handle.
+
+        Raises:
+            Exception: If the gate is not supported (see is_available).
+            RuntimeError: If a qubit in superposition is deallocated.
+        """
+        if isinstance(cmd.gate, FlushGate):
+            return
+        if isinstance(cmd.gate, AllocateQubitGate):
+            self._allocate(cmd.qubits[0][0].id)
+        elif isinstance(cmd.gate, DeallocateQubitGate):
+            self._deallocate(cmd.qubits[0][0].id)
+        elif isinstance(cmd.gate, MeasureGate):
+            # Check if a mapper assigned a different logical id
+            logical_id_tag = None
+            for tag in cmd.tags:
+                if isinstance(tag, LogicalQubitIDTag):
+                    logical_id_tag = tag
+            for qr in cmd.qubits:
+                for qb in qr:
+                    outcome = self._measure(self._map[qb.id])
+                    if logical_id_tag is not None:
+                        qb = WeakQubitRef(qb.engine,
+                                          logical_id_tag.logical_qubit_id)
+                    self.main_engine.set_measurement_result(qb, outcome)
+        else:
+            mask = sum(1 << self._map[qb.id] for qb in cmd.control_qubits)
+            if isinstance(cmd.gate, BasicMathGate):
+                self._apply_math(cmd.gate.get_math_function(cmd.qubits),
+                                 [[self._map[qb.id] for qb in qr]
+                                  for qr in cmd.qubits], mask)
+                return
+            if not self.is_available(cmd):
+                raise Exception("SparseSimulator: Only gates on up to 5 "
+                                "qubits (not counting controls) and diagonal "
+                                "and permutation gates are supported. Please "
+                                "add an auto-replacer engine to your list of "
+                                "compiler engines.")
+            locations = [self._map[qb.id] for qr in cmd.qubits for qb in qr]
+            matrix = cmd.gate.matrix
+            if len(matrix) != 2 ** len(locations):
+                raise Exception("SparseSimulator: Error applying {} gate: "
+                                "{}-qubit gate applied to {} qubits.".format(
+                                    str(cmd.gate),
+                                    int(numpy.log2(len(matrix))),
+                                    len(locations)))
+            self._apply_matrix(matrix, locations, mask)
@@ -0,0 +1,180 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import itertools
+import random
+
+import numpy
+import pytest
+
+from projectq import MainEngine
+from projectq.cengines import DummyEngine
+from projectq.libs.math import (AddConstant, AddConstantModN,
+                                MultiplyByConstantModN)
+from projectq.meta import Control
+from projectq.ops import (All, BasicGate, BasicMathGate, C, CNOT, Command, H,
+                          Measure, QFT, QubitOperator, Rx, Ry, Rz, S, Swap, T,
+                          Toffoli, X, Y)
+from projectq.types import WeakQubitRef
+from ._simulator_test import mapper
+
+from ._simulator import Simulator
+from ._sparse_simulator import SparseSimulator
+
+
+def test_sparse_simulator_is_available():
+    sim = SparseSimulator()
+    eng = MainEngine(DummyEngine(), [])
+    qb0 = WeakQubitRef(engine=eng, idx=0)
+    qb1 = WeakQubitRef(engine=eng, idx=1)
+    qb2 = WeakQubitRef(engine=eng, idx=2)
+    for gate in [H, T, Rx(0.3), Measure, AddConstant(3)]:
+        assert sim.is_available(Command(eng, gate, ([qb0],)))
+    assert sim.is_available(Command(eng, X, ([qb0],), controls=[qb1, qb2]))
+    assert not sim.is_available(Command(eng, QFT, ([qb0, qb1, qb2],)))
+    assert not sim.is_available(Command(eng, BasicGate(), ([qb0],)))
+    qureg = [WeakQubitRef(engine=eng, idx=i) for i in range(6)]
+    hadamard = numpy.array([[1., 1.], [1., -1.]]) / numpy.sqrt(2.)
+    dense_gate = BasicGate()
+    dense_gate.matrix = numpy.kron(hadamard, numpy.identity(2 ** 5))
+    permutation_gate = BasicGate()
+    permutation_gate.matrix = numpy.roll(numpy.identity(64), 1, axis=0)
+    assert sim.is_available(Command(eng, permutation_gate, (qureg,)))
+    assert not sim.is_available(Command(eng, dense_gate, (qureg,)))
+    dense_gate.matrix = numpy.kron(hadamard, numpy.identity(2 ** 2))
+    assert sim.is_available(Command(eng, dense_gate, (qureg[:3],)))
+
+
+def _random_circuit(qureg, rng, num_gates):
+    for _ in range(num_gates):
+        a, b, c = rng.sample(range(len(qureg)), 3)
+        kind = rng.randint(0, 5)
+        if kind == 0:
+            Ry(rng.random() * 6) | qureg[a]
+            Rz(rng.random() * 6) | qureg[b]
+        elif kind == 1:
+            CNOT | (qureg[a], qureg[b])
+        elif kind == 2:
+            C(Rx(rng.random() * 6)) | (qureg[a], qureg[b])
+        elif kind == 3:
+            Toffoli | (qureg[a], qureg[b], qureg[c])
+        elif kind == 4:
+            Swap | (qureg[a], qureg[b])
+            S | qureg[c]
+            Y | qureg[a]
+        elif c >= 3:
+            with Control(qureg.engine, qureg[c]):
+                AddConstantModN(3, 5) | qureg[:3]
+        else:
+            H | qureg[c]
+
+
+@pytest.mark.parametrize("circuit_seed", [1, 2, 3])
+def test_sparse_simulator_matches_simulator(mapper, circuit_seed):
+    engine_list = []
+    if mapper is not None:
+        engine_list.append(mapper)
+    sim = SparseSimulator(rnd_seed=circuit_seed)
+    eng = MainEngine(sim, engine_list)
+    ref_eng = MainEngine(Simulator(), [])
+    qureg = eng.allocate_qureg(6)
+    ref_qureg = ref_eng.allocate_qureg(6)
+    for engine, qubits in ((eng, qureg), (ref_eng, ref_qureg)):
+        _random_circuit(qubits, random.Random(circuit_seed), 30)
+        engine.flush()
+    for bits in itertools.product([0, 1], repeat=6):
+        assert (sim.get_probability(bits, qureg) == pytest.approx(
+            ref_eng.backend.get_probability(bits, ref_qureg), abs=1e-12))
+        assert (sim.get_amplitude(bits, qureg) == pytest.approx(
+            ref_eng.backend.get_amplitude(bits, ref_qureg), abs=1e-12))
+    assert (sim.get_probability('10', qureg[4:1:-2]) == pytest.approx(
+        ref_eng.backend.get_probability('10', ref_qureg[4:1:-2])))
+    op = (QubitOperator('X0 Z3', 0.5) + QubitOperator('Y1 Y5', -1.2) +
+          QubitOperator('Z2', 0.3) + QubitOperator((), 0.7))
+    assert (sim.get_expectation_value(op, qureg) == pytest.approx(
+        ref_eng.backend.get_expectation_value(op, ref_qureg)))
+    with pytest.raises(Exception):
+        sim.get_expectation_value(QubitOperator('Z6'), qureg)
+    with pytest.raises(RuntimeError):
+        sim.get_amplitude([0], qureg[:1])
+    All(Measure) | qureg
+    eng.flush()
+    bits = [int(qb) for qb in qureg]
+    assert ref_eng.backend.get_probability(bits, ref_qureg) > 1e-12
+    assert sim.get_support_size() == 1
+    All(Measure) | ref_qureg
+
+
+def test_sparse_simulator_wide_arithmetic():
+    sim = SparseSimulator()
+    eng = MainEngine(sim, [])
+    n = 60
+    qureg = eng.allocate_qureg(n)
+    ctrl = eng.allocate_qubit()
+    H | ctrl
+    X | qureg[n - 1]
+    with Control(eng, ctrl):
+        AddConstant(12345) | qureg
+    MultiplyByConstantModN(7, 2 ** 40 + 15) | qureg[:41]
+    BasicMathGate(lambda a, b: (a, a ^ b)) | (qureg[:20], qureg[20:40])
+    eng.flush()
+    assert sim.get_support_size() == 2
+    value = (2 ** (n - 1) + 12345)
+    low = (value % 2 ** 41) * 7 % (2 ** 40 + 15)
+    value = (value >> 41 << 41) + low
+    value ^= (value & (2 ** 20 - 1)) << 20
+    bits = [(value >> i) & 1 for i in range(n)]
+    assert sim.get_probability(bits + [1], qureg + ctrl) == pytest.approx(0.5)
+    assert sim.get_amplitude(bits + [1], qureg + ctrl) == pytest.approx(
+        2 ** -0.5)
+    All(Measure) | qureg + ctrl
+    eng.flush()
+    outcome = sum(int(qb) << i for i, qb in enumerate(qureg))
+    assert outcome == (value if int(ctrl) else 2 ** (n - 1))
+
+
+def test_sparse_simulator_prunes_amplitudes():
+    sim = SparseSimulator()
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(40)
+    All(H) | qureg[:10]
+    eng.flush()
+    assert sim.get_support_size() == 2 ** 10
+    All(H) | qureg[:10]
+    eng.flush()
+    assert sim.get_support_size() == 1
+    assert sim.get_probability([0] * 40, qureg) == pytest.approx(1.)
+
+
+def test_sparse_simulator_deallocate():
+    sim = SparseSimulator(rnd_seed=1)
+    eng = MainEngine(sim, [])
+    qubit = eng.allocate_qubit()
+    X | qubit
+    eng.flush()
+    del qubit
+    eng.flush()
+    # the location of the deallocated qubit is reused (in state 0)
+    qureg = eng.allocate_qureg(2)
+    eng.flush()
+    assert sorted(sim._map.values()) == [0, 1]
+    assert sim.get_probability([0, 0], qureg) == pytest.approx(1.)
+    H | qureg[0]
+    with pytest.raises(RuntimeError):
+        qureg[0].__del__()
+    with pytest.raises(RuntimeError):
+        sim.get_probability([0], [WeakQubitRef(eng, 10)])
+    with pytest.raises(Exception):
+        X | qureg
+        eng.flush()
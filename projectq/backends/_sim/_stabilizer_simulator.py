@@ -0,0 +1,413 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+A simulator for Clifford circuits, which uses the stabilizer tableau of
+Aaronson and Gottesman (Phys. Rev. A 70, 052328, 2004).
+"""
+
+import random
+
+import numpy
+
+from projectq.cengines import BasicEngine
+from projectq.meta import get_control_count, LogicalQubitIDTag
+from projectq.ops import (AllocateQubitGate,
+                          DaggeredGate,
+                          DeallocateQubitGate,
+                          FlushGate,
+                          HGate,
+                          MeasureGate,
+                          SGate,
+                          SwapGate,
+                          XGate,
+                          YGate,
+                          ZGate)
+from projectq.types import WeakQubitRef
+
+
+_ONE = numpy.uint64(1)
+
+
+def _popcount(words):
+    """
+    Return the number of set bits in each row of a 2D array of uint64 words.
+    """
+    if hasattr(numpy, 'bitwise_count'):  # NumPy >= 2.0
+        return numpy.bitwise_count(words).sum(axis=1, dtype=numpy.int64)
+    return numpy.unpackbits(words.view(numpy.uint8), axis=1).sum(axis=1)
+
+
+def _multiply_rows(x1, z1, r1, x2, z2, r2):
+    """
+    Multiply the Pauli operators (rows of the tableau) given by x1, z1, r1 and
+    by x2, z2, r2 (rowsum of Aaronson and Gottesman), where the product of
+    each pair is assumed to be Hermitian (i.e., the operators commute).
+
+    Args:
+        x1, z1 (ndarray): X and Z bits of the first operators as uint64 words
+            (one row per operator).
+        r1 (ndarray): Signs of the first operators (0 for +1, 1 for -1).
+        x2, z2, r2 (ndarray): Second operators (same format).
+
+    Returns:
+        Tuple (x, z, r) of the products (same format).
+    """
+    # exponent of i which results from multiplying the single-qubit Paulis
+    plus = ((x1 & z1 & z2 & ~x2) | (x1 & ~z1 & z2 & x2) |
+            (~x1 & z1 & x2 & ~z2))
+    minus = ((x1 & z1 & x2 & ~z2) | (x1 & ~z1 & z2 & ~x2) |
+             (~x1 & z1 & x2 & z2))
+    phase = (2 * r1.astype(numpy.int64) + 2 * r2 + _popcount(plus) -
+             _popcount(minus))
+    return x1 ^ x2, z1 ^ z2, ((phase % 4) // 2).astype(numpy.uint8)
+
+
+class StabilizerSimulator(BasicEngine):
+    """
+    Simulator for Clifford circuits, i.e., circuits consisting of H, S, S^dag,
+    X, Y, Z, Swap, singly-controlled X, Y, and Z gates (e.g., CNOT and CZ),
+    and measurements.
+
+    The state is represented by its stabilizer tableau (Aaronson and
+    Gottesman), of which the rows are stored as bit-packed NumPy arrays.
+    Applying a gate takes O(n) and measuring a qubit O(n^2) operations for n
+    qubits (instead of O(2^n) for the Simulator), such that circuits on
+    thousands of qubits can be simulated.
+
+    Deallocated qubits are reset to 0 and reused by the next allocation.
+    """
+    def __init__(self, rnd_seed=None):
+        """
+        Construct the stabilizer simulator.
+
+        Args:
+            rnd_seed (int): Random seed (uses random.randint(0, 4294967295) by
+                default).
+        """
+        BasicEngine.__init__(self)
+        if rnd_seed is None:
+            rnd_seed = random.randint(0, 4294967295)
+        self._rng = random.Random(rnd_seed)
+        self._capacity = 0
+        self._num_columns = 0  # number of qubits in the tableau
+        self._free_columns = []  # columns of deallocated qubits (in state 0)
+        self._columns = dict()  # qubit ID -> column
+        # rows 0 ... capacity - 1 are the destabilizers, rows capacity ...
+        # 2 * capacity - 1 the stabilizers (unused rows are zero)
+        self._x = numpy.zeros((0, 0), dtype=numpy.uint64)
+        self._z = numpy.zeros((0, 0), dtype=numpy.uint64)
+        self._r = numpy.zeros(0, dtype=numpy.uint8)
+
+    def is_available(self, cmd):
+        """
+        Return True if the command is a Clifford gate (see the class
+        documentation), a measurement, an allocation, or a deallocation.
+
+        Args:
+            cmd (Command): Command for which to check availability.
+        """
+        gate = cmd.gate
+        if isinstance(gate, (MeasureGate, AllocateQubitGate,
+                             DeallocateQubitGate, FlushGate)):
+            return True
+        num_controls = get_control_count(cmd)
+        if isinstance(gate, (XGate, YGate, ZGate)):
+            return num_controls <= 1
+        if isinstance(gate, (HGate, SGate, SwapGate)):
+            return num_controls == 0
+        return (isinstance(gate, DaggeredGate) and
+                isinstance(gate._gate, SGate) and num_controls == 0)
+
+    def _convert_logical_to_mapped_qubit(self, qubit):
+        """
+        Converts a qubit from a logical to a mapped qubit if there is a mapper.
+
+        Args:
+            qubit (projectq.types.Qubit): Logical quantum bit
+        """
+        mapper = self.main_engine.mapper
+        if mapper is not None:
+            if qubit.id not in mapper.current_mapping:
+                raise RuntimeError("Unknown qubit id. "
+                                   "Please make sure you have called "
+                                   "eng.flush().")
+            return WeakQubitRef(qubit.engine,
+                                mapper.current_mapping[qubit.id])
+        else:
+            return qubit
+
+    def get_probability(self, bit_string, qureg):
+        """
+        Return the probability of the outcome `bit_string` when measuring
+        the quantum register `qureg`.
+
+        Note:
+            If there is a mapper present in the compiler, this function
+            automatically converts from logical qubits to mapped qubits for
+            the qureg argument.
+
+        Args:
+            bit_string (list[bool|int]|string[0|1]): Measurement outcome.
+            qureg (Qureg|list[Qubit]): Quantum register.
+
+        Returns:
+            Probability of measuring the provided bit string.
+
+        Raises:
+            RuntimeError: If an unknown qubit id was provided.
+        """
+        qureg = [self._convert_logical_to_mapped_qubit(qb) for qb in qureg]
+        if any(qb.id not in self._columns for qb in qureg):
+            raise RuntimeError("get_probability(): Unknown qubit id. Please "
+                               "make sure you have called eng.flush().")
+        tableau = (self._x.copy(), self._z.copy(), self._r.copy())
+        probability = 1.
+        for bit, qb in zip(bit_string, qureg):
+            column = self._columns[qb.id]
+            if self._is_random(column):
+                probability /= 2.
+                self._measure(column, outcome=int(bit))
+            elif self._measure(column) != int(bit):
+                probability = 0.
+                break
+        self._x, self._z, self._r = tableau
+        return probability
+
+    def _get_column(self, bits, column):
+        """
+        Return the bits of a column of the tableau (as an array of bools).
+        """
+        shift = numpy.uint64(column & 63)
+        return ((bits[:, column >> 6] >> shift) & _ONE).astype(bool)
+
+    def _flip_column(self, bits, column, mask):
+        """
+        Flip the bits of a column of the tableau in the rows given by mask.
+        """
+        shift = numpy.uint64(column & 63)
+        bits[:, column >> 6] ^= mask.astype(numpy.uint64) << shift
+
+    def _allocate(self, qubit_id):
+        if len(self._free_columns) > 0:
+            self._columns[qubit_id] = self._free_columns.pop()
+            return
+        if self._num_columns == self._capacity:
+            self._grow(max(64, 2 * self._capacity))
+        column = self._num_columns
+        self._num_columns += 1
+        self._columns[qubit_id] = column
+        # destabilizer X and stabilizer Z on the new qubit
+        word, bit = column >> 6, _ONE << numpy.uint64(column & 63)
+        self._x[column, word] |= bit
+        self._z[self._capacity + column, word] |= bit
+
+    def _grow(self, capacity):
+        words = (capacity + 63) // 64
+        x = numpy.zeros((2 * capacity, words), dtype=numpy.uint64)
+        z = numpy.zeros((2 * capacity, words), dtype=numpy.uint64)
+        r = numpy.zeros(2 * capacity, dtype=numpy.uint8)
+        n, old_words = self._num_columns, self._x.shape[1]
+        for old, new in ((0, 0), (self._capacity, capacity)):
+            x[new:new + n, :old_words] = self._x[old:old + n]
+            z[new:new + n, :old_words] = self._z[old:old + n]
+            r[new:new + n] = self._r[old:old + n]
+        self._x, self._z, self._r = x, z, r
+        self._capacity = capacity
+
+    def _deallocate(self, qubit_id):
+        column = self._columns[qubit_id]
+        if self._measure(column, deterministic_only=True):
+            self._apply_x(column)
+        del self._columns[qubit_id]
+        self._free_columns.append(column)
+
+    def _is_random(self, a):
+        """
+        Return True if the outcome of measuring the qubit in column a is
+        random, i.e., if a stabilizer anticommutes with Z_a.
+        """
+        cap = self._capacity
+        return self._get_column(self._x[cap:cap + self._num_columns], a).any()
+
+    def _measure(self, a, outcome=None, deterministic_only=False):
+        """
+        Measure the qubit in column a and return the outcome (0 or 1).
+
+        Args:
+            a (int): Column of the qubit.
+            outcome (int): Outcome to use if it is random (drawn at random by
+                default).
+            deterministic_only (bool): If True, raise if the outcome is
+                random.
+
+        Raises:
+            RuntimeError: If deterministic_only is True and the outcome is
+                random.
+        """
+        n, cap = self._num_columns, self._capacity
+        x_a = self._get_column(self._x, a)
+        stabilizers = numpy.flatnonzero(x_a[cap:cap + n])
+        if len(stabilizers) == 0:
+            # deterministic outcome: the sign of the product of the
+            # stabilizers of which the destabilizer anticommutes with Z_a
+            rows = numpy.flatnonzero(x_a[:n]) + cap
+            x, z, r = self._x[rows], self._z[rows], self._r[rows]
+            while len(r) > 1:
+                if len(r) % 2 == 1:
+                    x = numpy.vstack([x, numpy.zeros_like(x[:1])])
+                    z = numpy.vstack([z, numpy.zeros_like(z[:1])])
+                    r = numpy.append(r, numpy.uint8(0))
+                x, z, r = _multiply_rows(x[0::2], z[0::2], r[0::2],
+                                         x[1::2], z[1::2], r[1::2])
+            return int(r[0]) if len(r) > 0 else 0
+        if deterministic_only:
+            raise RuntimeError("Qubit has not been measured / uncomputed. "
+                               "Cannot deallocate a qubit in "
+                               "superposition!")
+        p = cap + stabilizers[0]
+        rows = numpy.flatnonzero(x_a)
+        rows = rows[rows != p]
+        self._x[rows], self._z[rows], self._r[rows] = _multiply_rows(
+            self._x[rows], self._z[rows], self._r[rows],
+            self._x[p:p + 1], self._z[p:p + 1], self._r[p:p + 1])
+        d = p - cap
+        self._x[d], self._z[d], self._r[d] = self._x[p], self._z[p], self._r[p]
+        if outcome is None:
+            outcome = self._rng.randint(0, 1)
+        self._x[p] = 0
+        self._z[p] = 0
+        self._z[p, a >> 6] = _ONE << numpy.uint64(a & 63)
+        self._r[p] = outcome
+        return outcome
+
+    def _apply_h(self, a):
+        x_a, z_a = self._get_column(self._x, a), self._get_column(self._z, a)
+        self._r ^= x_a & z_a
+        self._flip_column(self._x, a, x_a ^ z_a)
+        self._flip_column(self._z, a, x_a ^ z_a)
+
+    def _apply_s(self, a):
+        x_a, z_a = self._get_column(self._x, a), self._get_column(self._z, a)
+        self._r ^= x_a & z_a
+        self._flip_column(self._z, a, x_a)
+
+    def _apply_x(self, a):
+        self._r ^= self._get_column(self._z, a)
+
+    def _apply_z(self, a):
+        self._r ^= self._get_column(self._x, a)
+
+    def _apply_cnot(self, c, t):
+        x_c, z_c = self._get_column(self._x, c), self._get_column(self._z, c)
+        x_t, z_t = self._get_column(self._x, t), self._get_column(self._z, t)
+        self._r ^= x_c & z_t & ~(x_t ^ z_c)
+        self._flip_column(self._x, t, x_c)
+        self._flip_column(self._z, c, z_t)
+
+    def _apply_gate(self, gate, targets, controls):
+        """
+        Apply a Clifford gate to the qubits in the given columns.
+        """
+        if isinstance(gate, SwapGate):
+            a, b = targets
+            self._apply_cnot(a, b)
+            self._apply_cnot(b, a)
+            self._apply_cnot(a, b)
+            return
+        a = targets[0]
+        if len(controls) == 1:
+            c = controls[0]
+            if isinstance(gate, XGate):
+                self._apply_cnot(c, a)
+            elif isinstance(gate, ZGate):
+                self._apply_h(a)
+                self._apply_cnot(c, a)
+                self._apply_h(a)
+            else:
+                # CY = S CNOT S^dag
+                self._apply_s(a)
+                self._apply_z(a)
+                self._apply_cnot(c, a)
+                self._apply_s(a)
+            return
+        if isinstance(gate, HGate):
+            self._apply_h(a)
+        elif isinstance(gate, SGate):
+            self._apply_s(a)
+        elif isinstance(gate, DaggeredGate):
+            self._apply_s(a)
+            self._apply_z(a)
+        elif isinstance(gate, XGate):
+            self._apply_x(a)
+        elif isinstance(gate, YGate):
+            self._apply_x(a)
+            self._apply_z(a)
+        else:
+            self._apply_z(a)
+
+    def receive(self, command_list):
+        """
+        Receive a list of commands from the previous engine and handle them
+        prior to sending them on to the next engine.
+
+        Args:
+            command_list (list<Command>): List of commands to execute on the
+                simulator.
+        """
+        for cmd in command_list:
+            self._handle(cmd)
+        if not self.is_last_engine:
+            self.send(command_list)
+
+    def _handle(self, cmd):
+        """
+        Handle all commands, i.e., call the member functions of the tableau.
+
+        Args:
+            cmd (Command): Command to handle.
+
+        Raises:
+            Exception: If the command is not a Clifford gate (see
+                is_available).
+            RuntimeError: If a qubit in superposition is deallocated.
+        """
+        if isinstance(cmd.gate, FlushGate):
+            return
+        if isinstance(cmd.gate, AllocateQubitGate):
+            self._allocate(cmd.qubits[0][0].id)
+        elif isinstance(cmd.gate, DeallocateQubitGate):
+            self._deallocate(cmd.qubits[0][0].id)
+        elif isinstance(cmd.gate, MeasureGate):
+            # Check if a mapper assigned a different logical id
+            logical_id_tag = None
+            for tag in cmd.tags:
+                if isinstance(tag, LogicalQubitIDTag):
+                    logical_id_tag = tag
+            for qr in cmd.qubits:
+                for qb in qr:
+                    outcome = self._measure(self._columns[qb.id])
+                    if logical_id_tag is not None:
+                        qb = WeakQubitRef(qb.engine,
+                                          logical_id_tag.logical_qubit_id)
+                    self.main_engine.set_measurement_result(qb, outcome)
+        elif self.is_available(cmd):
+            targets = [self._columns[qb.id] for qr in cmd.qubits for qb in qr]
+            controls = [self._columns[qb.id] for qb in cmd.control_qubits]
+            self._apply_gate(cmd.gate, targets, controls)
+        else:
+            raise Exception("StabilizerSimulator: {} is not a Clifford gate. "
+                            "Please make sure all gates are decomposed into "
+                            "H, S, CNOT, CZ, X, Y, Z, and Swap gates."
+                            .format(str(cmd.gate)))
@@ -0,0 +1,160 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import itertools
+import random
+
+import pytest
+
+from projectq import MainEngine
+from projectq.cengines import DummyEngine
+from projectq.ops import (All, C, CNOT, Command, CZ, H, Measure, Rx, S, Sdag,
+                          Swap, T, Toffoli, X, Y, Z)
+from projectq.types import WeakQubitRef
+from ._simulator_test import mapper
+
+from ._simulator import Simulator
+from ._stabilizer_simulator import StabilizerSimulator
+
+
+def test_stabilizer_simulator_is_available():
+    sim = StabilizerSimulator()
+    eng = MainEngine(DummyEngine(), [])
+    qb0 = WeakQubitRef(engine=eng, idx=0)
+    qb1 = WeakQubitRef(engine=eng, idx=1)
+    qb2 = WeakQubitRef(engine=eng, idx=2)
+    for gate in [H, S, Sdag, X, Y, Z, Measure]:
+        assert sim.is_available(Command(eng, gate, ([qb0],)))
+    assert sim.is_available(Command(eng, Swap, ([qb0], [qb1])))
+    for gate in [X, Y, Z]:
+        assert sim.is_available(Command(eng, gate, ([qb0],),
+                                        controls=[qb1]))
+    for gate in [T, Rx(0.3)]:
+        assert not sim.is_available(Command(eng, gate, ([qb0],)))
+    assert not sim.is_available(Command(eng, H, ([qb0],), controls=[qb1]))
+    assert not sim.is_available(Command(eng, X, ([qb0],),
+                                        controls=[qb1, qb2]))
+
+
+def _random_clifford_circuit(qureg, rng, num_gates):
+    single_qubit_gates = [H, S, Sdag, X, Y, Z]
+    for _ in range(num_gates):
+        a, b = rng.sample(range(len(qureg)), 2)
+        kind = rng.randint(0, 3)
+        if kind == 0:
+            rng.choice(single_qubit_gates) | qureg[a]
+        elif kind == 1:
+            C(rng.choice([X, Y, Z])) | (qureg[a], qureg[b])
+        elif kind == 2:
+            Swap | (qureg[a], qureg[b])
+        else:
+            H | qureg[a]
+            CNOT | (qureg[a], qureg[b])
+
+
+@pytest.mark.parametrize("circuit_seed", [1, 2, 3, 4])
+def test_stabilizer_simulator_probabilities(mapper, circuit_seed):
+    engine_list = []
+    if mapper is not None:
+        engine_list.append(mapper)
+    sim = StabilizerSimulator(rnd_seed=circuit_seed)
+    eng = MainEngine(sim, engine_list)
+    ref_eng = MainEngine(Simulator(), [])
+    qureg = eng.allocate_qureg(5)
+    ref_qureg = ref_eng.allocate_qureg(5)
+    for engine, qubits in ((eng, qureg), (ref_eng, ref_qureg)):
+        _random_clifford_circuit(qubits, random.Random(circuit_seed), 40)
+        engine.flush()
+    for bits in itertools.product([0, 1], repeat=5):
+        assert (sim.get_probability(bits, qureg) == pytest.approx(
+            ref_eng.backend.get_probability(bits, ref_qureg)))
+    for bits in itertools.product([0, 1], repeat=2):
+        assert (sim.get_probability(bits, qureg[3:1:-1]) == pytest.approx(
+            ref_eng.backend.get_probability(bits, ref_qureg[3:1:-1])))
+    # measurement outcomes have a nonzero probability
+    All(Measure) | qureg
+    eng.flush()
+    bits = [int(qb) for qb in qureg]
+    assert ref_eng.backend.get_probability(bits, ref_qureg) > 1e-9
+    assert sim.get_probability(bits, qureg) == 1.
+    All(Measure) | ref_qureg
+
+
+def test_stabilizer_simulator_ghz():
+    sim = StabilizerSimulator()
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(300)
+    H | qureg[0]
+    for i in range(299):
+        CNOT | (qureg[i], qureg[i + 1])
+    eng.flush()
+    assert sim.get_probability([0] * 300, qureg) == pytest.approx(0.5)
+    assert sim.get_probability([1] * 300, qureg) == pytest.approx(0.5)
+    assert sim.get_probability([0, 1], qureg[:2]) == 0.
+    All(Measure) | qureg
+    eng.flush()
+    assert len(set(int(qb) for qb in qureg)) == 1
+
+
+def test_stabilizer_simulator_deallocate():
+    sim = StabilizerSimulator()
+    eng = MainEngine(sim, [])
+    qubit = eng.allocate_qubit()
+    X | qubit
+    Measure | qubit
+    assert int(qubit) == 1
+    del qubit
+    # the column of the deallocated qubit is reused (in state 0)
+    qubit = eng.allocate_qubit()
+    assert len(sim._columns) == 1
+    Measure | qubit
+    assert int(qubit) == 0
+    H | qubit
+    with pytest.raises(RuntimeError):
+        qubit[0].__del__()
+
+
+def test_stabilizer_simulator_cz_and_sdag():
+    sim = StabilizerSimulator()
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(2)
+    All(H) | qureg
+    CZ | (qureg[0], qureg[1])
+    H | qureg[1]
+    # Bell state (|00> + |11>) / sqrt(2)
+    eng.flush()
+    assert sim.get_probability([0, 1], qureg) == 0.
+    assert sim.get_probability([1, 1], qureg) == pytest.approx(0.5)
+    S | qureg[0]
+    Sdag | qureg[0]
+    H | qureg[1]
+    CZ | (qureg[0], qureg[1])
+    H | qureg[1]
+    eng.flush()
+    assert sim.get_probability([1, 0], qureg) == pytest.approx(0.5)
+    All(Measure) | qureg
+
+
+def test_stabilizer_simulator_non_clifford():
+    sim = StabilizerSimulator()
+    eng = MainEngine(sim, [])
+    qureg = eng.allocate_qureg(3)
+    with pytest.raises(Exception):
+        T | qureg[0]
+        eng.flush()
+    with pytest.raises(Exception):
+        Toffoli | (qureg[0], qureg[1], qureg[2])
+        eng.flush()
+    with pytest.raises(RuntimeError):
+        sim.get_probability([0], [WeakQubitRef(eng, 10)])
@@ -0,0 +1,206 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Runs many trajectories of a (stochastically noisy) circuit in parallel and
+aggregates their measurement outcomes and expectation values.
+"""
+
+import collections
+import random
+
+import numpy
+
+from projectq.ops import All, Measure
+from ._simulator import Simulator
+
+
+class TrajectoryResult(object):
+    """
+    Aggregated result of run_trajectories.
+
+    Attributes:
+        num_trajectories (int): Number of trajectories.
+        histogram (collections.Counter): Number of occurrences of each
+            measurement outcome, given as a string of '0' and '1' where the
+            i-th character is the outcome of qureg[i].
+        expectation_values (numpy.ndarray): Mean of each observable over all
+            trajectories.
+        standard_errors (numpy.ndarray): Standard error of the mean of each
+            observable.
+    """
+    def __init__(self, num_trajectories, histogram, sums, sums_of_squares):
+        self.num_trajectories = num_trajectories
+        self.histogram = histogram
+        n = float(num_trajectories)
+        self.expectation_values = sums / n
+        if num_trajectories > 1:
+            variances = (sums_of_squares - sums ** 2 / n) / (n - 1.)
+            self.standard_errors = numpy.sqrt(numpy.maximum(variances, 0.) /
+                                              n)
+        else:
+            self.standard_errors = numpy.full(len(sums), numpy.inf)
+
+    def get_probability(self, bit_string):
+        """
+        Return the relative frequency of the measurement outcome `bit_string`.
+
+        Args:
+            bit_string (list[bool|int]|string[0|1]): Measurement outcome,
+                where the i-th bit belongs to qureg[i].
+        """
+        key = ''.join(str(int(bit)) for bit in bit_string)
+        return self.histogram[key] / float(self.num_trajectories)
+
+
+def _get_chunk_seeds(seed, num_chunks):
+    """
+    Return a pair of seeds (for the noise and the back-end) for each chunk,
+    derived from `seed` using numpy.random.SeedSequence, or a RandomState for
+    versions of numpy which predate it (< 1.17).
+    """
+    if hasattr(numpy.random, 'SeedSequence'):
+        return [tuple(int(s) for s in sequence.generate_state(2,
+                                                              numpy.uint32))
+                for sequence in
+                numpy.random.SeedSequence(seed).spawn(num_chunks)]
+    rng = numpy.random.RandomState(seed)
+    return [tuple(int(s) for s in rng.randint(0, 2 ** 32, size=2,
+                                              dtype=numpy.int64))
+            for _ in range(num_chunks)]
+
+
+def _run_chunk(args):
+    """
+    Run a chunk of trajectories on one engine and return the histogram and
+    the sums (of squares) of the expectation values.
+
+    The global random module (which samples the noise) and the back-end are
+    seeded from the seed of the chunk, such that the results do not depend
+    on the process in which the chunk is run.
+    """
+    from projectq.cengines import MainEngine
+
+    (circuit, num_trajectories, observables, (noise_seed, backend_seed),
+     backend, engine_list) = args
+    random_state = random.getstate()
+    random.seed(noise_seed)
+    try:
+        eng = MainEngine(backend(rnd_seed=backend_seed),
+                         engine_list() if engine_list is not None else None)
+        histogram = collections.Counter()
+        sums = numpy.zeros(len(observables))
+        sums_of_squares = numpy.zeros(len(observables))
+        for _ in range(num_trajectories):
+            qureg = circuit(eng)
+            if len(observables) > 0:
+                eng.flush()
+                values = numpy.array([eng.backend.get_expectation_value(
+                    op, qureg) for op in observables])
+                sums += values
+                sums_of_squares += values ** 2
+            All(Measure) | qureg
+            eng.flush()
+            histogram[''.join(str(int(qb)) for qb in qureg)] += 1
+            del qureg
+            eng.flush(deallocate_qubits=True)
+    finally:
+        random.setstate(random_state)
+    return histogram, sums, sums_of_squares
+
+
+def run_trajectories(circuit, num_trajectories, observables=(), seed=None,
+                     max_workers=None, chunk_size=256, backend=Simulator,
+                     engine_list=None):
+    """
+    Run num_trajectories trajectories of a circuit, e.g., one which contains
+    stochastic noise gates (see projectq.ops._noise), distributed over a pool
+    of processes, and aggregate the measurement outcomes and the expectation
+    values of the observables.
+
+    The trajectories are split into chunks of chunk_size trajectories, each
+    of which runs on one MainEngine (which is reused for its trajectories)
+    with its own random streams for the noise and the back-end, derived from
+    `seed` (using numpy.random.SeedSequence if available). Hence, the result
+    only depends on seed and chunk_size (and the version of numpy), but not
+    on the number of processes.
+
+    Example:
+        .. code-block:: python
+
+            def circuit(eng):
+                qureg = eng.allocate_qureg(2)
+                H | qureg[0]
+                CNOT | (qureg[0], qureg[1])
+                return qureg
+
+            result = run_trajectories(circuit, 10000,
+                                      [QubitOperator('Z0 Z1')], seed=1)
+            result.expectation_values, result.standard_errors
+
+    Args:
+        circuit (function): Function which applies the circuit to a
+            MainEngine (its only argument) and returns the quantum register
+            to evaluate and measure. It must be picklable (i.e., defined at
+            the top level of a module) if max_workers is not 1.
+        num_trajectories (int): Number of trajectories.
+        observables (list[QubitOperator]): Operators whose expectation values
+            (w.r.t. the returned quantum register) are evaluated before the
+            measurement of each trajectory.
+        seed (int): Seed of the random streams (uses fresh entropy by
+            default).
+        max_workers (int): Number of processes (uses the number of CPUs by
+            default). If 1, the trajectories are run in this process.
+        chunk_size (int): Number of trajectories per chunk.
+        backend: Back-end class (or function) which takes the keyword argument
+            rnd_seed, e.g., Simulator (default) or DensityMatrixSimulator.
+        engine_list (function): Function which returns the list of compiler
+            engines of each MainEngine (uses the default engine list of
+            MainEngine by default).
+
+    Returns:
+        A TrajectoryResult with the histogram of the measurement outcomes and
+        the means and standard errors of the expectation values.
+
+    Raises:
+        ValueError: If num_trajectories or chunk_size is not positive.
+    """
+    if num_trajectories < 1 or chunk_size < 1:
+        raise ValueError("run_trajectories: num_trajectories and chunk_size "
+                         "must be positive.")
+    observables = list(observables)
+    num_chunks = (num_trajectories + chunk_size - 1) // chunk_size
+    seeds = _get_chunk_seeds(seed, num_chunks)
+    chunks = [(circuit,
+               min(chunk_size, num_trajectories - i * chunk_size),
+               observables, seeds[i], backend, engine_list)
+              for i in range(num_chunks)]
+    if max_workers == 1 or num_chunks == 1:
+        results = [_run_chunk(chunk) for chunk in chunks]
+    else:
+        # (imported here, such that the module can be imported where
+        # concurrent.futures is not available, e.g., Python 2 without the
+        # futures package)
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_run_chunk, chunks))
+    histogram = collections.Counter()
+    sums = numpy.zeros(len(observables))
+    sums_of_squares = numpy.zeros(len(observables))
+    for chunk_histogram, chunk_sums, chunk_sums_of_squares in results:
+        histogram.update(chunk_histogram)
+        sums += chunk_sums
+        sums_of_squares += chunk_sums_of_squares
+    return TrajectoryResult(num_trajectories, histogram, sums,
+                            sums_of_squares)
@@ -0,0 +1,109 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import math
+import random
+
+import numpy
+import pytest
+
+from projectq.ops import CNOT, H, QubitOperator
+from projectq.ops._noise import XNoiseGate
+
+from ._density_matrix_simulator import DensityMatrixSimulator
+from ._trajectories import _get_chunk_seeds, run_trajectories
+
+
+def _noisy_bell_circuit(eng):
+    qureg = eng.allocate_qureg(2)
+    H | qureg[0]
+    CNOT | (qureg[0], qureg[1])
+    XNoiseGate(random.gauss, 0, 0.4, 0.3) | qureg[1]
+    return qureg
+
+
+def _no_engines():
+    return []
+
+
+def test_run_trajectories_statistics():
+    observables = [QubitOperator('Z0 Z1'), QubitOperator('X0')]
+    result = run_trajectories(_noisy_bell_circuit, 2000, observables,
+                              seed=1, max_workers=1, engine_list=_no_engines)
+    assert result.num_trajectories == 2000
+    assert sum(result.histogram.values()) == 2000
+    assert set(result.histogram) <= {'00', '01', '10', '11'}
+    assert (sum(result.get_probability(bits)
+                for bits in ('00', '01', '10', '11')) == pytest.approx(1.))
+    # E[cos(theta)] for theta ~ N(0.4, 0.3^2)
+    expected = math.cos(0.4) * math.exp(-0.3 ** 2 / 2.)
+    assert 0. < result.standard_errors[0] < 0.01
+    assert (abs(result.expectation_values[0] - expected) <
+            5 * result.standard_errors[0])
+    assert result.expectation_values[1] == pytest.approx(0., abs=1e-12)
+    assert result.standard_errors[1] == pytest.approx(0., abs=1e-12)
+    counts = result.histogram['00'] + result.histogram['11']
+    assert abs(counts / 2000. - (1. + expected) / 2.) < 0.05
+
+
+def test_run_trajectories_reproducible():
+    kwargs = dict(observables=[QubitOperator('Z1')], seed=7, chunk_size=50,
+                  engine_list=_no_engines)
+    serial = run_trajectories(_noisy_bell_circuit, 200, max_workers=1,
+                              **kwargs)
+    parallel = run_trajectories(_noisy_bell_circuit, 200, max_workers=2,
+                                **kwargs)
+    assert serial.histogram == parallel.histogram
+    assert (serial.expectation_values[0] ==
+            pytest.approx(parallel.expectation_values[0]))
+    state = random.getstate()
+    other = run_trajectories(_noisy_bell_circuit, 200, max_workers=1,
+                             observables=[QubitOperator('Z1')], seed=8,
+                             chunk_size=50, engine_list=_no_engines)
+    # the global random state of the caller is left untouched
+    assert random.getstate() == state
+    assert other.histogram != serial.histogram
+
+
+def test_run_trajectories_seeds_without_seed_sequence(monkeypatch):
+    if hasattr(numpy.random, 'SeedSequence'):
+        seeds = _get_chunk_seeds(3, 4)
+        assert len(set(seeds)) == 4
+        monkeypatch.delattr(numpy.random, 'SeedSequence')
+    # (numpy < 1.17)
+    seeds = _get_chunk_seeds(3, 4)
+    assert seeds == _get_chunk_seeds(3, 4)
+    assert len(set(seeds)) == 4
+    assert all(0 <= s < 2 ** 32 for pair in seeds for s in pair)
+    result = run_trajectories(_noisy_bell_circuit, 20, seed=3, chunk_size=5,
+                              max_workers=1, engine_list=_no_engines)
+    assert sum(result.histogram.values()) == 20
+
+
+def test_run_trajectories_backend():
+    # the density-matrix simulator averages the noise in each trajectory
+    result = run_trajectories(_noisy_bell_circuit, 3, [QubitOperator('Z0 Z1')],
+                              backend=DensityMatrixSimulator, max_workers=1)
+    expected = math.cos(0.4) * math.exp(-0.3 ** 2 / 2.)
+    assert result.expectation_values[0] == pytest.approx(expected)
+    assert result.standard_errors[0] == pytest.approx(0., abs=1e-7)
+    single = run_trajectories(_noisy_bell_circuit, 1, max_workers=1)
+    assert single.standard_errors.shape == (0,)
+
+
+def test_run_trajectories_invalid_arguments():
+    with pytest.raises(ValueError):
+        run_trajectories(_noisy_bell_circuit, 0)
+    with pytest.raises(ValueError):
+        run_trajectories(_noisy_bell_circuit, 10, chunk_size=0)
@@ -124,12 +124,20 @@ class BasicEngine(object):
         Allocate n qubits and return them as a quantum register, which is a
         list of qubit objects.
 
+        The AllocateQubit commands are sent down the pipeline in one list,
+        such that the backend can allocate the whole register at once.
+
         Args:
             n (int): Number of qubits to allocate
         Returns:
             Qureg of length n, a list of n newly allocated qubits.
         """
-        return Qureg([self.allocate_qubit()[0] for _ in range(n)])
+        qureg = Qureg([Qubit(self, self.main_engine.get_new_qubit_id())
+                       for _ in range(n)])
+        for qb in qureg:
+            self.main_engine.active_qubits.add(qb)
+        self.send([Command(self, Allocate, (Qureg([qb]),)) for qb in qureg])
+        return qureg
 
     def deallocate_qubit(self, qubit):
         """
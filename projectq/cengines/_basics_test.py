@@ -128,6 +128,21 @@ def test_basic_engine_allocate_and_deallocate_qubit_and_qureg():
     assert saving_backend.received_commands[7].tags == [DirtyQubitTag()]
 
 
+def test_basic_engine_allocate_qureg_sends_one_list():
+    backend = DummyEngine()
+    received = []
+
+    def receive(self, cmd_list): received.append(cmd_list)
+
+    backend.receive = types.MethodType(receive, backend)
+    main_engine = MainEngine(backend=backend, engine_list=[])
+    qureg = main_engine.allocate_qureg(3)
+    assert len(received) == 1
+    assert [cmd.gate for cmd in received[0]] == [AllocateQubitGate()] * 3
+    assert [cmd.qubits[0][0].id for cmd in received[0]] == [qb.id for qb in
+                                                            qureg]
+
+
 def test_deallocate_qubit_exception():
     eng = _basics.BasicEngine()
     qubit = Qubit(eng, -1)
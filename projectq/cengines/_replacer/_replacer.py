@@ -170,7 +170,6 @@ class AutoReplacer(BasicEngine):
                         break
 
             if len(decomp_list) == 0:
-                return
                 raise NoGateDecompositionError("\nNo replacement found for " +
                                                str(cmd) + "!")
 
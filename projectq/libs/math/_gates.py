@@ -37,7 +37,7 @@ class AddConstant(BasicMathGate):
         It also initializes its base class, BasicMathGate, with the
         corresponding function, so it can be emulated efficiently.
         """
-        BasicMathGate.__init__(self, lambda x: ((x + a),))
+        BasicMathGate.__init__(self, lambda x: ((x + a),), vectorized=True)
         self.a = a
 
     def get_inverse(self):
@@ -102,7 +102,8 @@ class AddConstantModN(BasicMathGate):
         It also initializes its base class, BasicMathGate, with the
         corresponding function, so it can be emulated efficiently.
         """
-        BasicMathGate.__init__(self, lambda x: ((x + a) % N,))
+        BasicMathGate.__init__(self, lambda x: ((x + a) % N,),
+                               vectorized=True)
         self.a = a
         self.N = N
 
@@ -175,7 +176,8 @@ class MultiplyByConstantModN(BasicMathGate):
         It also initializes its base class, BasicMathGate, with the
         corresponding function, so it can be emulated efficiently.
         """
-        BasicMathGate.__init__(self, lambda x: ((a * x) % N,))
+        BasicMathGate.__init__(self, lambda x: ((a * x) % N,),
+                               vectorized=True)
         self.a = a
         self.N = N
 
@@ -22,6 +22,7 @@ from ._basics import (NotMergeable,
                       BasicMathGate,
                       BasicPhaseGate)
 from ._command import apply_command, Command
+from ._parameter import Parameter, ParameterExpression
 from ._metagates import (DaggeredGate,
                          get_inverse,
                          ControlledGate,
@@ -38,6 +38,7 @@ import numpy as np
 
 from projectq.types import BasicQubit
 from ._command import Command, apply_command
+from ._parameter import ParameterExpression
 
 
 ANGLE_PRECISION = 12
@@ -46,6 +47,21 @@ RTOL = 1e-10
 ATOL = 1e-12
 
 
+def _normalize_angle(angle, period):
+    """
+    Return the angle modulo period, rounded to ANGLE_PRECISION digits and in
+    the interval [0, period). For a ParameterExpression, the constant part
+    is normalized.
+    """
+    if isinstance(angle, ParameterExpression):
+        return ParameterExpression(angle.terms,
+                                   _normalize_angle(angle.constant, period))
+    rounded_angle = round(float(angle) % period, ANGLE_PRECISION)
+    if rounded_angle > period - ANGLE_TOLERANCE:
+        rounded_angle = 0.
+    return rounded_angle
+
+
 class NotMergeable(Exception):
     """
     Exception thrown when trying to merge two gates which are not mergeable (or
@@ -215,7 +231,12 @@ class BasicGate(object):
 
                 gate = BasicGate()
                 gate.matrix = numpy.matrix([[1,0],[0, -1]])
+
+            A gate with a parameterized angle (which has no matrix until the
+            parameters are bound) is not equal to gates of other classes.
         """
+        if isinstance(getattr(other, 'angle', None), ParameterExpression):
+            return False
         if hasattr(self, 'matrix'):
             if not hasattr(other, 'matrix'):
                 return False
@@ -280,13 +301,12 @@ class BasicRotationGate(BasicGate):
         Initialize a basic rotation gate.
 
         Args:
-            angle (float): Angle of rotation (saved modulo 4 * pi)
+            angle (float|ParameterExpression): Angle of rotation (saved
+                modulo 4 * pi), or an expression of parameters which are
+                bound later (see bind).
         """
         BasicGate.__init__(self)
-        rounded_angle = round(float(angle) % (4. * math.pi), ANGLE_PRECISION)
-        if rounded_angle > 4 * math.pi - ANGLE_TOLERANCE:
-            rounded_angle = 0.
-        self.angle = rounded_angle
+        self.angle = _normalize_angle(angle, 4. * math.pi)
 
     def __str__(self):
         """
@@ -343,6 +363,23 @@ class BasicRotationGate(BasicGate):
             return self.__class__(self.angle + other.angle)
         raise NotMergeable("Can't merge different types of rotation gates.")
 
+    def is_parameterized(self):
+        """
+        Return True if the angle is an expression of (unbound) parameters.
+        """
+        return isinstance(self.angle, ParameterExpression)
+
+    def bind(self, values):
+        """
+        Return the gate with the parameters of its angle replaced by values.
+
+        Args:
+            values (dict): Value of each parameter (name -> float).
+        """
+        if not self.is_parameterized():
+            return self
+        return self.__class__(self.angle.evaluate(values))
+
     def __eq__(self, other):
         """ Return True if same class and same rotation angle. """
         if isinstance(other, self.__class__):
@@ -372,13 +409,12 @@ class BasicPhaseGate(BasicGate):
         Initialize a basic rotation gate.
 
         Args:
-            angle (float): Angle of rotation (saved modulo 2 * pi)
+            angle (float|ParameterExpression): Angle of rotation (saved
+                modulo 2 * pi), or an expression of parameters which are
+                bound later (see bind).
         """
         BasicGate.__init__(self)
-        rounded_angle = round(float(angle) % (2. * math.pi), ANGLE_PRECISION)
-        if rounded_angle > 2 * math.pi - ANGLE_TOLERANCE:
-            rounded_angle = 0.
-        self.angle = rounded_angle
+        self.angle = _normalize_angle(angle, 2. * math.pi)
 
     def __str__(self):
         """
@@ -435,6 +471,23 @@ class BasicPhaseGate(BasicGate):
             return self.__class__(self.angle + other.angle)
         raise NotMergeable("Can't merge different types of rotation gates.")
 
+    def is_parameterized(self):
+        """
+        Return True if the angle is an expression of (unbound) parameters.
+        """
+        return isinstance(self.angle, ParameterExpression)
+
+    def bind(self, values):
+        """
+        Return the gate with the parameters of its angle replaced by values.
+
+        Args:
+            values (dict): Value of each parameter (name -> float).
+        """
+        if not self.is_parameterized():
+            return self
+        return self.__class__(self.angle.evaluate(values))
+
     def __eq__(self, other):
         """ Return True if same class and same rotation angle. """
         if isinstance(other, self.__class__):
@@ -509,7 +562,7 @@ class BasicMathGate(BasicGate):
         def multiply(a,b,c)
             return (a,b,c+a*b)
     """
-    def __init__(self, math_fun):
+    def __init__(self, math_fun, vectorized=False):
         """
         Initialize a BasicMathGate by providing the mathematical function that
         it implements.
@@ -519,6 +572,11 @@ class BasicMathGate(BasicGate):
                 input, as the gate takes registers. For each of these values,
                 it then returns the output (i.e., it returns a list/tuple of
                 output values).
+            vectorized (bool): If True, math_fun also accepts numpy integer
+                arrays (with one entry per basis state) instead of ints and
+                acts on them elementwise, e.g., lambda x: (x + 3,). This
+                allows simulators to evaluate it for all basis states at once
+                (see get_vectorized_math_function).
 
         Example:
             .. code-block:: python
@@ -553,6 +611,7 @@ class BasicMathGate(BasicGate):
         def math_function(x):
             return list(math_fun(*x))
         self._math_function = math_function
+        self._vectorized = vectorized
 
     def __str__(self):
         return "MATH"
@@ -571,3 +630,25 @@ class BasicMathGate(BasicGate):
             gate. (See BasicMathGate.__init__ for an example).
         """
         return self._math_function
+
+    def get_vectorized_math_function(self, qubits):
+        """
+        Return a vectorized version of the math function, i.e., one which
+        takes a list of numpy integer arrays (one per quantum register, each
+        containing the register's value for many basis states) and returns
+        the list of output arrays, or None if the gate does not provide one.
+
+        Can be overwritten by the gate deriving from BasicMathGate (together
+        with get_math_function).
+
+        Args:
+            qubits (tuple<Qureg>): Qubits to which the math gate is being
+                applied.
+
+        Returns:
+            math_fun (function): Vectorized Python function describing the
+            action of this gate, or None.
+        """
+        if self._vectorized:
+            return self._math_function
+        return None
@@ -21,7 +21,7 @@ import numpy as np
 import pytest
 
 from projectq.types import Qubit, Qureg
-from projectq.ops import Command
+from projectq.ops import Command, Parameter
 from projectq import MainEngine
 from projectq.cengines import DummyEngine
 
@@ -282,6 +282,35 @@ def test_basic_phase_gate_comparison_and_hash():
     assert basic_phase_gate2 != _basics.BasicPhaseGate(0.5 + math.pi)
 
 
+@pytest.mark.parametrize("gate_class, period",
+                         [(_basics.BasicRotationGate, 4 * math.pi),
+                          (_basics.BasicPhaseGate, 2 * math.pi)])
+def test_parameterized_angle(gate_class, period):
+    theta = Parameter('theta')
+    gate = gate_class(2 * theta + period + 0.5)
+    assert gate.is_parameterized()
+    assert not gate_class(0.5).is_parameterized()
+    assert gate.angle == 2 * theta + 0.5
+    assert str(gate) == gate_class.__name__ + "(2.0*theta + 0.5)"
+    assert gate == gate_class(2 * theta + 0.5)
+    assert gate != gate_class(2 * theta)
+    assert gate != gate_class(0.5)
+    assert not _basics.BasicGate() == gate
+    inverse = gate.get_inverse()
+    assert inverse == gate_class(-2 * theta - 0.5)
+    # merging with the inverse leaves a concrete angle
+    merged = gate.get_merged(inverse)
+    assert not merged.is_parameterized()
+    assert merged == gate_class(0)
+    assert gate.get_merged(gate_class(1.)) == gate_class(2 * theta + 1.5)
+    bound = gate.bind({'theta': 0.25})
+    assert not bound.is_parameterized()
+    assert bound.angle == pytest.approx(1.)
+    assert gate_class(0.5).bind({}) == gate_class(0.5)
+    with pytest.raises(KeyError):
+        gate.bind({'phi': 0.})
+
+
 def test_basic_math_gate():
     def my_math_function(a, b, c):
         return (a, b, c + a * b)
@@ -295,3 +324,14 @@ def test_basic_math_gate():
     # Test a=2, b=3, and c=5 should give a=2, b=3, c=11
     math_fun = gate.get_math_function(("qreg1", "qreg2", "qreg3"))
     assert math_fun([2, 3, 5]) == [2, 3, 11]
+    assert gate.get_vectorized_math_function(("qreg1", "qreg2",
+                                              "qreg3")) is None
+
+
+def test_basic_math_gate_vectorized():
+    gate = _basics.BasicMathGate(lambda a, b: (a, a + b), vectorized=True)
+    math_fun = gate.get_vectorized_math_function(("qreg1", "qreg2"))
+    res = math_fun([np.array([1, 2]), np.array([3, 4])])
+    assert np.array_equal(res[0], [1, 2])
+    assert np.array_equal(res[1], [4, 6])
+    assert gate.get_math_function(("qreg1", "qreg2"))([2, 3]) == [2, 5]
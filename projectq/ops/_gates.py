@@ -148,7 +148,7 @@ SqrtX = SqrtXGate()
 class SwapGate(SelfInverseGate, BasicMathGate):
     """ Swap gate class (swaps 2 qubits) """
     def __init__(self):
-        BasicMathGate.__init__(self, lambda x, y: (y, x))
+        BasicMathGate.__init__(self, lambda x, y: (y, x), vectorized=True)
         SelfInverseGate.__init__(self)
         self.interchangeable_qubit_indices = [[0, 1]]
 
@@ -7,6 +7,11 @@ Contains meta gates that add noise.
 
 As well as the create function
 * inject_noise (Wrapps a gate with the specific noise creator for it)
+
+Besides sampling the noise on each application, the noisy gates describe their
+channel as a twirled distribution (see LocalNoiseBase.twirl) and as Kraus
+operators (see LocalNoiseBase.get_kraus_operators), such that a backend which
+simulates density matrices can evaluate the averaged result in a single run.
 """
 
 import copy, random
@@ -14,9 +19,35 @@ import numpy as np
 from math import sin, cos
 
 from ._basics import BasicGate, SelfInverseGate
+from ._command import apply_command
 from ._metagates import get_inverse
 
 
+def _twirl_angles(pdf, args, num_points, num_samples):
+    """
+    Return the probabilities and values of a discrete distribution which
+    replaces the sampling distribution pdf(*args).
+
+    Gaussian (random.gauss, random.normalvariate) and uniform (random.uniform)
+    distributions are replaced by Gauss-Hermite and Gauss-Legendre quadratures
+    with num_points nodes, respectively, which reproduce the averages of the
+    smooth noise matrices to machine precision. Any other distribution is
+    sampled num_samples times.
+    """
+    if pdf is None:
+        return [1.], [0.]
+    if pdf in (random.gauss, random.normalvariate):
+        mu, sigma = args
+        nodes, weights = np.polynomial.hermite_e.hermegauss(num_points)
+        return weights / weights.sum(), mu + sigma * nodes
+    if pdf == random.uniform:
+        a, b = args
+        nodes, weights = np.polynomial.legendre.leggauss(num_points)
+        return weights / weights.sum(), a + 0.5 * (b - a) * (nodes + 1.)
+    samples = [pdf(*args) for _ in range(num_samples)]
+    return [1. / num_samples] * num_samples, samples
+
+
 class IGate(SelfInverseGate):
     """ Identity gate class """
     def __str__(self):
@@ -47,7 +78,15 @@ class ModelMixin(object):
 class LocalNoiseBase(BasicGate, ModelMixin):
     """
     Helper to capture common structure of noisy gate implementations.
+
+    Attributes:
+        quadrature_points (int): Number of nodes of the quadrature which
+            replaces gaussian and uniform noise in twirl().
+        twirl_samples (int): Number of samples which replace any other
+            noise distribution in twirl().
     """
+    quadrature_points = 20
+    twirl_samples = 1000
 
     def __init__(self, pdf, frate, *args):
         """
@@ -69,6 +108,40 @@ class LocalNoiseBase(BasicGate, ModelMixin):
             return True
         return False
 
+    def _matrix(self, rnd):
+        """
+        Return the matrix of the gate for the noise value rnd.
+        """
+        raise NotImplementedError("The noisy gate {} does not define its "
+                                  "channel.".format(str(self)))
+
+    def twirl(self):
+        """
+        Return the channel of the gate as a twirled distribution, i.e., as a
+        list of (probability, matrix) pairs, where the matrices are the gate
+        matrices for the noise values of a quadrature (or of samples) of the
+        sampling distribution.
+
+        Raises:
+            NotImplementedError: If the gate does not define its channel.
+        """
+        probabilities, values = _twirl_angles(self._pdf, self._args,
+                                              self.quadrature_points,
+                                              self.twirl_samples)
+        return [(p, self._matrix(value))
+                for p, value in zip(probabilities, values)]
+
+    def get_kraus_operators(self):
+        """
+        Return the channel of the gate as a list of Kraus operators (derived
+        from twirl() by default).
+
+        Raises:
+            NotImplementedError: If the gate does not define its channel.
+        """
+        return [np.sqrt(p) * np.asarray(matrix, dtype=complex)
+                for p, matrix in self.twirl() if p > 0.]
+
     def __eq__(self, other):
         # BasicGate calls two gates equal if their matrices (if any) are
         # 'close', but if the matrix contains a small amount of noise,
@@ -91,8 +164,11 @@ class XNoiseGate(SelfInverseLocalNoiseBase):
 
     @property
     def matrix(self):
-        # effectively: Rx(self.noise())
-        rnd = self.noise()*0.5
+        return self._matrix(self.noise())
+
+    def _matrix(self, rnd):
+        # effectively: Rx(rnd)
+        rnd *= 0.5
         return np.matrix([[    cos(rnd), -1j*sin(rnd)],
                           [-1j*sin(rnd),     cos(rnd)]])
 
@@ -104,8 +180,11 @@ class NoisyNOTGate(SelfInverseLocalNoiseBase):
 
     @property
     def matrix(self):
-        # effectively Ry(self.noise())*X
-        rnd = self.noise()*0.5
+        return self._matrix(self.noise())
+
+    def _matrix(self, rnd):
+        # effectively Rx(rnd)*X
+        rnd *= 0.5
         return np.matrix([[-1j*sin(rnd),     cos(rnd)],
                           [    cos(rnd), -1j*sin(rnd)]])
 
@@ -148,8 +227,10 @@ class XYNoiseGate(LocalNoiseBase):
 
     @property
     def matrix(self):
+        return self._matrix(self.noise())
+
+    def _matrix(self, rnd):
         # X applied first, then Y
-        rnd = self.noise()
         return self._Ywobble(rnd)*self._Xwobble(rnd)
 
 class YXNoiseGate(XYNoiseGate):
@@ -161,10 +242,8 @@ class YXNoiseGate(XYNoiseGate):
     def get_inverse(self):
         return XYNoiseGate(self._ratio, self._pdf, self._frate, *self._args)
 
-    @property
-    def matrix(self):
+    def _matrix(self, rnd):
         # Y applied first, then X
-        rnd = self.noise()
         return self._Xwobble(rnd)*self._Ywobble(rnd)
 
 
@@ -220,6 +299,31 @@ class LocalNoiseGate(LocalNoiseBase):
         """
         return LocalNoiseGate(get_inverse(self._gate), self._pdf, self._frate, *self._args)
 
+    def _apply_channel(self, qubits):
+        """
+        Send the gate as a whole (i.e., as a channel) if the back-end applies
+        channels (i.e., has the attribute applies_noise_channels set to True,
+        as the DensityMatrixSimulator) and the engines support it, instead of
+        sampling the noise. Other back-ends (e.g., a ResourceCounter) receive
+        the sampled gates.
+
+        Returns:
+            True if the gate was sent.
+        """
+        from projectq.cengines import LastEngineException
+
+        cmd = self.generate_command(qubits)
+        backend = cmd.engine.main_engine.backend
+        if not getattr(backend, 'applies_noise_channels', False):
+            return False
+        try:
+            if not cmd.engine.is_available(cmd):
+                return False
+        except LastEngineException:
+            return False
+        apply_command(cmd)
+        return True
+
 
 class NoisyAngleGate(LocalNoiseGate):
     """
@@ -235,16 +339,22 @@ class NoisyAngleGate(LocalNoiseGate):
     will add stochastic noise using gaussian sampling to Rx.
     """
 
+    def _matrix(self, rnd):
+        return self._gate.__class__(self._gate.angle + rnd).matrix
+
     def __or__(self, qubits):
         """
         Apply the gate with noise to qubits according to the sampling
-        distribution given.
+        distribution given, or as a channel if the backend supports it (see
+        LocalNoiseBase.twirl).
 
         Args:
             qubits (tuple of lists of Qubit objects): qubits to which to apply
                 the gate.
         """
 
+        if self._apply_channel(qubits):
+            return
         gate = self._gate
         rnd_angle = self.noise()
         qubits = BasicGate.make_tuple_of_qureg(qubits)
@@ -310,10 +420,36 @@ class NoisyCNOTGate(LocalNoiseGate):
         self._control_noise.update_model(pdf, frate, args)
         self._gate._gate.update_model(pdf, frate, args)
 
+    def twirl(self):
+        """
+        Return the channel of the noisy CNOT on (control, target) as a list of
+        (probability, matrix) pairs, where the control qubit corresponds to
+        the least significant bit of the matrices.
+
+        The noise of the control and the target qubit is drawn from a joint
+        distribution, so it is always sampled.
+        """
+        probabilities, values = _twirl_angles(self._pdf, self._args,
+                                              self.quadrature_points,
+                                              self.twirl_samples)
+        not_gate = self._gate._gate
+        channel = []
+        for p, (rnd0, rnd1) in zip(probabilities, values):
+            controlled = np.identity(4, dtype=complex)
+            controlled[1::2, 1::2] = not_gate._matrix(rnd1)
+            wobble = np.kron(np.identity(2),
+                             np.asarray(self._control_noise._matrix(rnd0)))
+            channel.append(((1. - (self._frate or 0.)) * p,
+                            np.dot(wobble, controlled)))
+        if self._frate:
+            channel.append((self._frate, np.identity(4, dtype=complex)))
+        return channel
+
     def __or__(self, qubits):
         """
         Apply the gate with noise to qubits according to the sampling
-        distribution given.
+        distribution given, or as a channel if the backend supports it (see
+        twirl).
 
         Args:
             qubits (tuple of lists of Qubit objects): qubits to which to apply
@@ -321,6 +457,8 @@ class NoisyCNOTGate(LocalNoiseGate):
         """
 
         assert len(qubits) == 2
+        if self._apply_channel(qubits):
+            return
         if self.failure():
             # apply identity (i.e. total gate failure) to each qubit
             for qb in qubits:
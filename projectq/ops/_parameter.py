@@ -0,0 +1,180 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Contains placeholders for the angles of rotation and phase gates, which are
+bound to values after the circuit has been compiled, e.g.,
+
+.. code-block:: python
+
+    theta = Parameter('theta')
+    Rx(theta) | qubit
+    Rz(0.5 * theta - 1.) | qubit
+
+The angles are affine expressions of the parameters, such that decompositions
+(which scale angles) and the merging of gates (which adds angles) keep them
+symbolic.
+"""
+
+import numbers
+
+
+def _is_scalar(value):
+    return (isinstance(value, numbers.Real) and
+            not isinstance(value, ParameterExpression))
+
+
+class ParameterExpression(object):
+    """
+    Affine expression constant + sum_k terms[k] * k of parameters, where the
+    parameters are identified by their names.
+
+    Sums of expressions and products with (and quotients by) real numbers
+    are expressions, or floats if no parameter is left (e.g., theta - theta).
+    """
+    # make numpy scalars defer to the reflected operators (e.g., __rmul__)
+    __array_ufunc__ = None
+
+    def __init__(self, terms=None, constant=0.):
+        """
+        Initialize the expression.
+
+        Args:
+            terms (dict): Coefficient of each parameter (name -> float).
+            constant (float): Constant part of the expression.
+        """
+        self.terms = {name: float(coeff) for name, coeff in
+                      (terms or dict()).items() if coeff != 0}
+        self.constant = float(constant)
+
+    @property
+    def parameters(self):
+        """ Sorted list of the names of the parameters of the expression. """
+        return sorted(self.terms)
+
+    def evaluate(self, values):
+        """
+        Return the value of the expression.
+
+        Args:
+            values (dict): Value of each parameter (name -> value), where the
+                values may also be numpy arrays (e.g., one value per
+                parameter set).
+
+        Raises:
+            KeyError: If a parameter of the expression has no value.
+        """
+        result = self.constant
+        for name, coeff in self.terms.items():
+            if name not in values:
+                raise KeyError("No value for the parameter '{}'.".format(name))
+            result = result + coeff * values[name]
+        return result
+
+    def _new(self, terms, constant):
+        if all(coeff == 0 for coeff in terms.values()):
+            return float(constant)
+        return ParameterExpression(terms, constant)
+
+    def __add__(self, other):
+        if isinstance(other, ParameterExpression):
+            terms = dict(self.terms)
+            for name, coeff in other.terms.items():
+                terms[name] = terms.get(name, 0.) + coeff
+            return self._new(terms, self.constant + other.constant)
+        if _is_scalar(other):
+            return self._new(self.terms, self.constant + other)
+        return NotImplemented
+
+    def __radd__(self, other):
+        return self.__add__(other)
+
+    def __neg__(self):
+        return self * -1.
+
+    def __sub__(self, other):
+        if not (_is_scalar(other) or isinstance(other, ParameterExpression)):
+            return NotImplemented
+        return self + (-other)
+
+    def __rsub__(self, other):
+        if not _is_scalar(other):
+            return NotImplemented
+        return (-self) + other
+
+    def __mul__(self, other):
+        if not _is_scalar(other):
+            return NotImplemented
+        return self._new({name: coeff * other for name, coeff
+                          in self.terms.items()}, self.constant * other)
+
+    def __rmul__(self, other):
+        return self.__mul__(other)
+
+    def __truediv__(self, divisor):
+        if not _is_scalar(divisor):
+            return NotImplemented
+        return self * (1. / divisor)
+
+    def __div__(self, divisor):
+        """ For compatibility with Python 2. """
+        return self.__truediv__(divisor)
+
+    def __float__(self):
+        raise TypeError("The expression {} depends on unbound parameters "
+                        "(see ParameterExpression.evaluate).".format(self))
+
+    def __eq__(self, other):
+        if isinstance(other, ParameterExpression):
+            return (self.terms == other.terms and
+                    self.constant == other.constant)
+        return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((frozenset(self.terms.items()), self.constant))
+
+    def __str__(self):
+        parts = []
+        for name in self.parameters:
+            coeff = self.terms[name]
+            parts.append(name if coeff == 1 else
+                         "-" + name if coeff == -1 else
+                         "{}*{}".format(coeff, name))
+        if self.constant != 0:
+            parts.append(str(self.constant))
+        return " + ".join(parts).replace("+ -", "- ")
+
+    def __repr__(self):
+        return "ParameterExpression({!r}, {!r})".format(self.terms,
+                                                        self.constant)
+
+
+class Parameter(ParameterExpression):
+    """
+    Placeholder for a real number (e.g., the angle of a rotation gate),
+    which is bound to a value once the circuit is executed.
+    """
+    def __init__(self, name):
+        """
+        Initialize the parameter.
+
+        Args:
+            name (str): Name of the parameter (parameters with the same name
+                are the same parameter).
+        """
+        ParameterExpression.__init__(self, {name: 1.})
+        self.name = name
@@ -0,0 +1,76 @@
+#   Copyright 2017 ProjectQ-Framework (www.projectq.ch)
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Tests for projectq.ops._parameter."""
+
+import numpy
+import pytest
+
+from projectq.ops import _parameter
+
+
+def test_parameter_arithmetic():
+    theta = _parameter.Parameter('theta')
+    phi = _parameter.Parameter('phi')
+    assert theta.name == 'theta'
+    assert theta.parameters == ['theta']
+    expr = 2 * theta - phi / 4. + 1
+    assert isinstance(expr, _parameter.ParameterExpression)
+    assert expr.terms == {'theta': 2., 'phi': -0.25}
+    assert expr.constant == 1.
+    assert expr.parameters == ['phi', 'theta']
+    assert 1. - theta == -theta + 1.
+    assert theta * 0.5 == 0.5 * theta
+    assert theta.__div__(2.) == 0.5 * theta
+    assert numpy.float64(3.) * theta == 3 * theta
+    assert theta + _parameter.Parameter('theta') == 2 * theta
+    # expressions without parameters are floats
+    assert theta - theta == 0.
+    assert isinstance((theta + 1.) - theta, float)
+    assert sum([theta, phi]) == theta + phi
+    with pytest.raises(TypeError):
+        theta * phi
+    with pytest.raises(TypeError):
+        theta + "phi"
+    with pytest.raises(TypeError):
+        1. / theta
+    with pytest.raises(TypeError):
+        float(theta)
+
+
+def test_parameter_evaluate():
+    theta = _parameter.Parameter('theta')
+    phi = _parameter.Parameter('phi')
+    expr = 2 * theta - phi + 0.5
+    assert expr.evaluate({'theta': 1., 'phi': 0.5}) == pytest.approx(2.)
+    values = expr.evaluate({'theta': numpy.array([0., 1.]),
+                            'phi': numpy.array([1., 0.])})
+    assert numpy.allclose(values, [-0.5, 2.5])
+    with pytest.raises(KeyError):
+        expr.evaluate({'theta': 1.})
+
+
+def test_parameter_comparison_and_str():
+    theta = _parameter.Parameter('theta')
+    phi = _parameter.Parameter('phi')
+    assert theta == _parameter.Parameter('theta')
+    assert hash(theta) == hash(_parameter.Parameter('theta'))
+    assert theta != phi
+    assert theta != 0.
+    assert not 0. == theta
+    assert theta + 1. != theta
+    assert str(theta) == "theta"
+    assert str(2. * theta - phi - 1.) == "-phi + 2.0*theta - 1.0"
+    assert str(-theta) == "-theta"
+    assert "ParameterExpression" in repr(theta)
@@ -39,7 +39,17 @@ def _recognize_RxNoCtrl(cmd):
     return get_control_count(cmd) == 0
 
 
+def _recognize_RxParameterized(cmd):
+    """
+    Recognize the controlled Rx gate with a parameterized angle, which the
+    decomposition of arbitrary controlled single-qubit gates (which needs the
+    matrix of the gate) cannot handle.
+    """
+    return get_control_count(cmd) > 0 and cmd.gate.is_parameterized()
+
+
 #: Decomposition rules
 all_defined_decomposition_rules = [
-    DecompositionRule(Rx, _decompose_rx, _recognize_RxNoCtrl)
+    DecompositionRule(Rx, _decompose_rx, _recognize_RxNoCtrl),
+    DecompositionRule(Rx, _decompose_rx, _recognize_RxParameterized)
 ]
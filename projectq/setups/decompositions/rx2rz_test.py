@@ -23,7 +23,7 @@ from projectq.backends import Simulator
 from projectq.cengines import (AutoReplacer, DecompositionRuleSet,
                                DummyEngine, InstructionFilter, MainEngine)
 from projectq.meta import Control
-from projectq.ops import Measure, Ph, Rx
+from projectq.ops import Measure, Parameter, Ph, Rx
 
 from . import rx2rz
 
@@ -37,9 +37,15 @@ def test_recognize_correct_gates():
     Rx(0.3) | qubit
     with Control(eng, ctrl_qubit):
         Rx(0.4) | qubit
+    with Control(eng, qubit):
+        Rx(Parameter('theta')) | ctrl_qubit
     eng.flush(deallocate_qubits=True)
     assert rx2rz._recognize_RxNoCtrl(saving_backend.received_commands[3])
     assert not rx2rz._recognize_RxNoCtrl(saving_backend.received_commands[4])
+    assert not rx2rz._recognize_RxParameterized(
+        saving_backend.received_commands[4])
+    assert rx2rz._recognize_RxParameterized(
+        saving_backend.received_commands[5])
 
 
 def rx_decomp_gates(eng, cmd):
@@ -41,7 +41,17 @@ def _recognize_RyNoCtrl(cmd):
     return get_control_count(cmd) == 0
 
 
+def _recognize_RyParameterized(cmd):
+    """
+    Recognize the controlled Ry gate with a parameterized angle, which the
+    decomposition of arbitrary controlled single-qubit gates (which needs the
+    matrix of the gate) cannot handle.
+    """
+    return get_control_count(cmd) > 0 and cmd.gate.is_parameterized()
+
+
 #: Decomposition rules
 all_defined_decomposition_rules = [
-    DecompositionRule(Ry, _decompose_ry, _recognize_RyNoCtrl)
+    DecompositionRule(Ry, _decompose_ry, _recognize_RyNoCtrl),
+    DecompositionRule(Ry, _decompose_ry, _recognize_RyParameterized)
 ]
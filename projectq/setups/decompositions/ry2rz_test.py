@@ -23,7 +23,7 @@ from projectq.backends import Simulator
 from projectq.cengines import (AutoReplacer, DecompositionRuleSet,
                                DummyEngine, InstructionFilter, MainEngine)
 from projectq.meta import Control
-from projectq.ops import Measure, Ph, Ry
+from projectq.ops import Measure, Parameter, Ph, Ry
 
 from . import ry2rz
 
@@ -37,9 +37,15 @@ def test_recognize_correct_gates():
     Ry(0.3) | qubit
     with Control(eng, ctrl_qubit):
         Ry(0.4) | qubit
+    with Control(eng, qubit):
+        Ry(Parameter('theta')) | ctrl_qubit
     eng.flush(deallocate_qubits=True)
     assert ry2rz._recognize_RyNoCtrl(saving_backend.received_commands[3])
     assert not ry2rz._recognize_RyNoCtrl(saving_backend.received_commands[4])
+    assert not ry2rz._recognize_RyParameterized(
+        saving_backend.received_commands[4])
+    assert ry2rz._recognize_RyParameterized(
+        saving_backend.received_commands[5])
 
 
 def ry_decomp_gates(eng, cmd):
@@ -25,6 +25,62 @@ from projectq.ops import (StatePreparation, Ry, Rz, UniformlyControlledRy,
                           UniformlyControlledRz, Ph)
 
 
+def _get_rotation_angles(final_state):
+    """
+    Return the angles of the uniformly controlled rotations which map
+    final_state to |0> (up to a global phase), following
+    arXiv:quant-ph/0407010v1.
+
+    State preparation applies the inverse of these rotations.
+
+    Args:
+        final_state (list[complex]): Normalized wavefunction of n qubits.
+
+    Returns:
+        Tuple (rz_angles, phase, ry_angles), where rz_angles[t] (ry_angles[t])
+        are the angles of the UniformlyControlledRz (UniformlyControlledRy)
+        with target qubit t, controlled by the qubits t+1, ..., n-1, and
+        where phase is the remaining global phase. The Rz rotations are
+        applied first.
+    """
+    num_qubits = int(round(math.log(len(final_state), 2)))
+    # Cancel all the relative phases
+    rz_angles = []
+    phase_of_blocks = []
+    for amplitude in final_state:
+        phase_of_blocks.append(cmath.phase(amplitude))
+    for target_qubit in range(num_qubits):
+        angles = []
+        phase_of_next_blocks = []
+        for block in range(2**(num_qubits-target_qubit-1)):
+            phase0 = phase_of_blocks[2*block]
+            phase1 = phase_of_blocks[2*block+1]
+            angles.append(phase0 - phase1)
+            phase_of_next_blocks.append((phase0 + phase1)/2.)
+        rz_angles.append(angles)
+        phase_of_blocks = phase_of_next_blocks
+    # Remove amplitudes from states which contain a bit value 1:
+    ry_angles = []
+    abs_of_blocks = []
+    for amplitude in final_state:
+        abs_of_blocks.append(abs(amplitude))
+    for target_qubit in range(num_qubits):
+        angles = []
+        abs_of_next_blocks = []
+        for block in range(2**(num_qubits-target_qubit-1)):
+            a0 = abs_of_blocks[2*block]
+            a1 = abs_of_blocks[2*block+1]
+            if a0 == 0 and a1 == 0:
+                angles.append(0)
+            else:
+                angles.append(
+                    -2. * math.acos(a0 / math.sqrt(a0**2 + a1**2)))
+            abs_of_next_blocks.append(math.sqrt(a0**2 + a1**2))
+        ry_angles.append(angles)
+        abs_of_blocks = abs_of_next_blocks
+    return rz_angles, phase_of_blocks[0], ry_angles
+
+
 def _decompose_state_preparation(cmd):
     """
     Implements state preparation based on arXiv:quant-ph/0407010v1.
@@ -41,45 +97,20 @@ def _decompose_state_preparation(cmd):
         norm += abs(amplitude)**2
     if norm < 1 - 1e-10 or norm > 1 + 1e-10:
         raise ValueError("final_state is not normalized.")
+    rz_angles, phase, ry_angles = _get_rotation_angles(final_state)
     with Control(eng, cmd.control_qubits):
         # As in the paper reference, we implement the inverse:
         with Dagger(eng):
             # Cancel all the relative phases
-            phase_of_blocks = []
-            for amplitude in final_state:
-                phase_of_blocks.append(cmath.phase(amplitude))
             for target_qubit in range(len(qureg)):
-                angles = []
-                phase_of_next_blocks = []
-                for block in range(2**(len(qureg)-target_qubit-1)):
-                    phase0 = phase_of_blocks[2*block]
-                    phase1 = phase_of_blocks[2*block+1]
-                    angles.append(phase0 - phase1)
-                    phase_of_next_blocks.append((phase0 + phase1)/2.)
-                UniformlyControlledRz(angles) | (qureg[(target_qubit+1):],
-                                                 qureg[target_qubit])
-                phase_of_blocks = phase_of_next_blocks
+                UniformlyControlledRz(rz_angles[target_qubit]) | (
+                    qureg[(target_qubit+1):], qureg[target_qubit])
             # Cancel global phase
-            Ph(-phase_of_blocks[0]) | qureg[-1]
+            Ph(-phase) | qureg[-1]
             # Remove amplitudes from states which contain a bit value 1:
-            abs_of_blocks = []
-            for amplitude in final_state:
-                abs_of_blocks.append(abs(amplitude))
             for target_qubit in range(len(qureg)):
-                angles = []
-                abs_of_next_blocks = []
-                for block in range(2**(len(qureg)-target_qubit-1)):
-                    a0 = abs_of_blocks[2*block]
-                    a1 = abs_of_blocks[2*block+1]
-                    if a0 == 0 and a1 == 0:
-                        angles.append(0)
-                    else:
-                        angles.append(
-                            -2. * math.acos(a0 / math.sqrt(a0**2 + a1**2)))
-                    abs_of_next_blocks.append(math.sqrt(a0**2 + a1**2))
-                UniformlyControlledRy(angles) | (qureg[(target_qubit+1):],
-                                                 qureg[target_qubit])
-                abs_of_blocks = abs_of_next_blocks
+                UniformlyControlledRy(ry_angles[target_qubit]) | (
+                    qureg[(target_qubit+1):], qureg[target_qubit])
 
 
 #: Decomposition rules